@@ -8,8 +8,9 @@ from django.contrib.auth.models import User, Group
 from controle.serializers import UserSerializer
 from controle.models import RegistroOS
 import logging
-from django.db.models import Q
+from django.db.models import Q, Sum
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
 import csv
 from io import StringIO, BytesIO
 from django.http import HttpResponse
@@ -260,7 +261,7 @@ def listar_usuarios(request):
         return Response({
             'error': 'Acesso negado. Apenas administradores e superiores podem listar usuários.'
         }, status=status.HTTP_403_FORBIDDEN)
-    usuarios = User.objects.filter(is_active=True)
+    usuarios = User.objects.filter(is_active=True).prefetch_related('groups')
     serializer = UserSerializer(usuarios, many=True)
     
     return Response(serializer.data)
@@ -396,6 +397,23 @@ def relatorios_lista_registros(request):
     if status_os:
         registros = registros.filter(status_os__nome=status_os)
     
+    for parametro, lookup in (('valor_total_minimo', 'valor_total__gte'), ('valor_total_maximo', 'valor_total__lte')):
+        valor = request.GET.get(parametro)
+        if not valor:
+            continue
+        try:
+            valor = Decimal(valor)
+            if not valor.is_finite():
+                raise InvalidOperation(valor)
+            registros = registros.filter(**{lookup: valor})
+        except InvalidOperation:
+            logger.warning(f"Relatórios: Valor inválido em {parametro}: {valor}")
+    
+    # Ordenação (campos permitidos, com prefixo '-' para ordem decrescente)
+    ordenacao = request.GET.get('ordering')
+    if ordenacao and ordenacao.lstrip('-') in ['created_at', 'numero_os', 'valor_total']:
+        registros = registros.order_by(ordenacao)
+    
     # Paginação
     page = int(request.GET.get('page', 1))
     page_size = int(request.GET.get('page_size', 20))
@@ -403,6 +421,7 @@ def relatorios_lista_registros(request):
     end = start + page_size
     
     total = registros.count()
+    valor_total_geral = registros.aggregate(soma=Sum('valor_total'))['soma'] or 0
     registros_paginados = registros[start:end]
     
     logger.info(f"Relatórios: Total de registros encontrados: {total}")
@@ -418,13 +437,14 @@ def relatorios_lista_registros(request):
             'status': registro.status_os.nome if registro.status_os else '',
             'descricao': registro.descricao_resumida or '',
             'usuario_criacao': registro.usuario.username if registro.usuario else '',
-            'valor_total': float(registro.saldo_final) if registro.saldo_final and float(registro.saldo_final) > 0 else float(registro.soma_valores) if registro.soma_valores else 0,
+            'valor_total': float(registro.valor_total or 0),
             'created_at': registro.created_at.strftime('%d/%m/%Y %H:%M'),
         })
     
     response_data = {
         'registros': dados,
         'total': total,
+        'valor_total_geral': float(valor_total_geral),
         'page': page,
         'page_size': page_size,
         'total_pages': (total + page_size - 1) // page_size
@@ -943,11 +963,7 @@ def relatorios_exportar_pdf(request):
     
     # Estatísticas
     total_registros = registros.count()
-    valor_total = sum(
-        float(r.saldo_final) if r.saldo_final and float(r.saldo_final) > 0 
-        else float(r.soma_valores) if r.soma_valores else 0 
-        for r in registros
-    )
+    valor_total = float(registros.aggregate(soma=Sum('valor_total'))['soma'] or 0)
     usuarios_unicos = len(set(r.usuario.username for r in registros if r.usuario))
     
     story.append(Paragraph("Estatísticas:", subtitle_style))
@@ -1110,7 +1126,7 @@ def configuracoes_listar_usuarios(request):
             'error': 'Acesso negado. Apenas administradores e superiores podem acessar configurações.'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    usuarios = User.objects.all().order_by('username')
+    usuarios = User.objects.all().order_by('username').prefetch_related('groups')
     dados = []
     
     for usuario in usuarios:
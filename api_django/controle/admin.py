@@ -249,7 +249,7 @@ admin.site.register(RegimeOS)
 
 @admin.register(RegistroOS)
 class RegistroOSAdmin(admin.ModelAdmin):
-    list_display = ("numero_os", "nome_cliente", "status_os", "created_at", "usuario")
+    list_display = ("numero_os", "nome_cliente", "status_os", "valor_total", "created_at", "usuario")
     search_fields = ("numero_os", "nome_cliente__nome", "status_os")
     list_filter = ("status_os", "created_at", "nome_cliente")
     ordering = ("-created_at",)
@@ -306,7 +306,7 @@ class RegistroOSAdmin(admin.ModelAdmin):
         ('Controle de Documentos', {
             'fields': (
                 'opcoes_dms', 'opcoes_bms', 'opcoes_frs', 'opcoes_nf',
-                'soma_notas_fiscais', 'saldo_final'
+                'soma_notas_fiscais', 'saldo_final', 'valor_total'
             )
         }),
         ('Observações e Controle', {
@@ -337,7 +337,13 @@ class RegistroOSAdmin(admin.ModelAdmin):
         OrdemClienteInline,
     ]
     
-    readonly_fields = ('numero_os', 'soma_valores', 'soma_notas_fiscais', 'saldo_final', 'os_id', 'created_at', 'updated_at')
+    readonly_fields = ('numero_os', 'soma_valores', 'soma_notas_fiscais', 'saldo_final', 'valor_total', 'os_id', 'created_at', 'updated_at')
+    actions = ['recalcular_totais']
+    
+    @admin.action(description='Recalcular valores e saldo das OS selecionadas')
+    def recalcular_totais(self, request, queryset):
+        total = RegistroOS.recalcular_totais(queryset)
+        self.message_user(request, f'{total} OS recalculada(s) com sucesso.')
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related(
@@ -0,0 +1,196 @@
+"""
+Política de anexos: tipos aceitos e tamanho máximo, por modelo e campo.
+
+O tipo é conferido pela assinatura (magic bytes) do início do arquivo, não só
+pela extensão, e cada tipo tem seu limite de tamanho. Em uploads multipart o
+PoliticaAnexoUploadHandler aplica a política enquanto o corpo é lido: o
+primeiro bloco já decide o tipo e o upload é interrompido assim que passa do
+limite, sem ler o resto do corpo. O FlexibleFileField aplica a mesma política
+aos arquivos que chegam por outros caminhos (ex.: upload em partes).
+"""
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.core.validators import FileExtensionValidator
+from django.db import models
+from rest_framework import serializers
+from rest_framework.parsers import MultiPartParser
+
+MB = 1024 * 1024
+
+
+class TipoAnexo:
+    """Tipo de arquivo: assinaturas aceitas no início do conteúdo e tamanho máximo"""
+
+    def __init__(self, assinaturas, tamanho_max, busca=0):
+        self.assinaturas = assinaturas
+        self.tamanho_max = tamanho_max
+        # Alguns formatos toleram bytes antes da assinatura (ex.: PDF)
+        self.busca = busca
+
+    def confere(self, inicio):
+        trecho = inicio[:self.busca + max(len(assinatura) for assinatura in self.assinaturas)]
+        if self.busca:
+            return any(assinatura in trecho for assinatura in self.assinaturas)
+        return any(trecho.startswith(assinatura) for assinatura in self.assinaturas)
+
+
+OLE2 = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP = b'PK\x03\x04'
+
+TIPOS_ANEXO = {
+    'pdf': TipoAnexo([b'%PDF-'], 100 * MB, busca=1024),
+    'jpg': TipoAnexo([b'\xff\xd8\xff'], 20 * MB),
+    'jpeg': TipoAnexo([b'\xff\xd8\xff'], 20 * MB),
+    'png': TipoAnexo([b'\x89PNG\r\n\x1a\n'], 20 * MB),
+    'doc': TipoAnexo([OLE2], 50 * MB),
+    'docx': TipoAnexo([ZIP], 50 * MB),
+    'dwg': TipoAnexo([b'AC10', b'AC2.', b'AC1.'], 500 * MB),
+}
+
+# Bytes necessários para conferir qualquer assinatura
+TAMANHO_INICIO = 2048
+
+
+class PoliticaAnexo:
+    """Extensões aceitas em um campo e, opcionalmente, um teto menor que o do tipo"""
+
+    def __init__(self, extensoes, tamanho_max=None):
+        self.extensoes = [extensao.lower() for extensao in extensoes]
+        self.tamanho_max = tamanho_max
+
+    def validar_nome(self, nome):
+        """Retorna a extensão do arquivo se permitida"""
+        extensao = os.path.splitext(nome or '')[1][1:].lower()
+        if extensao not in self.extensoes:
+            raise ValidationError(
+                f"Extensão '{extensao}' não permitida. Use: {', '.join(self.extensoes)}."
+            )
+        return extensao
+
+    def limite(self, extensao):
+        limites = [TIPOS_ANEXO[extensao].tamanho_max, settings.ANEXO_TAMANHO_MAX]
+        if self.tamanho_max:
+            limites.append(self.tamanho_max)
+        return min(limites)
+
+    def validar_inicio(self, extensao, inicio):
+        if not TIPOS_ANEXO[extensao].confere(inicio):
+            raise ValidationError(f'O conteúdo do arquivo não corresponde a um arquivo {extensao.upper()}.')
+
+    def validar_tamanho(self, extensao, tamanho):
+        limite = self.limite(extensao)
+        if tamanho > limite:
+            raise ValidationError(f'Arquivo {extensao.upper()} maior que o limite de {limite // MB} MB.')
+
+    def validar(self, arquivo):
+        """Aplica a política a um arquivo completo (UploadedFile/File)"""
+        if not arquivo.size:
+            raise ValidationError('Arquivo vazio não é permitido.')
+        extensao = self.validar_nome(arquivo.name)
+        self.validar_tamanho(extensao, arquivo.size)
+
+        posicao = arquivo.tell() if hasattr(arquivo, 'tell') else 0
+        arquivo.seek(0)
+        inicio = arquivo.read(TAMANHO_INICIO)
+        arquivo.seek(posicao)
+        self.validar_inicio(extensao, inicio)
+
+
+# (app_label.modelo, campo) -> PoliticaAnexo
+POLITICAS = {}
+
+
+def registrar_politica(modelo, campo, politica):
+    POLITICAS[(modelo._meta.label_lower, campo)] = politica
+
+
+def politica_do_campo(modelo, campo):
+    """Política registrada ou, por padrão, as extensões do FileExtensionValidator do campo"""
+    chave = (modelo._meta.label_lower, campo)
+    if chave not in POLITICAS:
+        extensoes = []
+        for validador in modelo._meta.get_field(campo).validators:
+            if isinstance(validador, FileExtensionValidator):
+                extensoes = validador.allowed_extensions
+        POLITICAS[chave] = PoliticaAnexo([extensao for extensao in extensoes if extensao.lower() in TIPOS_ANEXO])
+    return POLITICAS[chave]
+
+
+def politica_por_nome(nome_campo):
+    """Política pelo nome do campo de formulário (ex.: 'gmis[0][arquivo_anexo_gmi]')"""
+    match = re.search(r'(\w+)\]?$', nome_campo or '')
+    if not match:
+        return None
+    for modelo in apps.get_app_config('controle').get_models():
+        for campo in modelo._meta.fields:
+            if isinstance(campo, models.FileField) and campo.name == match.group(1):
+                return politica_do_campo(modelo, campo.name)
+    return None
+
+
+class PoliticaAnexoUploadHandler(FileUploadHandler):
+    """
+    Primeiro upload handler das requisições lidas pelo MultiPartPoliticaParser:
+    confere a assinatura no primeiro bloco e o tamanho acumulado a cada bloco.
+    Ao violar a política registra o erro em request.anexos_rejeitados e
+    interrompe o upload sem ler o restante.
+    """
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.politica = politica_por_nome(field_name)
+        self.recebido = 0
+        if self.politica is not None:
+            self.extensao = self._aplicar(self.politica.validar_nome, file_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.politica is not None:
+            if start == 0:
+                self._aplicar(self.politica.validar_inicio, self.extensao, raw_data)
+            self.recebido += len(raw_data)
+            self._aplicar(self.politica.validar_tamanho, self.extensao, self.recebido)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def _aplicar(self, validacao, *args):
+        try:
+            return validacao(*args)
+        except ValidationError as e:
+            rejeitados = getattr(self.request, 'anexos_rejeitados', {})
+            rejeitados[self.field_name] = e.messages
+            self.request.anexos_rejeitados = rejeitados
+            raise StopUpload(connection_reset=True)
+
+
+class MultiPartPoliticaParser(MultiPartParser):
+    """
+    MultiPartParser que põe o PoliticaAnexoUploadHandler antes dos handlers
+    padrão da requisição e devolve 400 com os anexos barrados por ele
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        handlers = request._request.upload_handlers
+        if not any(isinstance(handler, PoliticaAnexoUploadHandler) for handler in handlers):
+            request._request.upload_handlers = [PoliticaAnexoUploadHandler(request._request), *handlers]
+        resultado = super().parse(stream, media_type, parser_context)
+        rejeitados = getattr(request._request, 'anexos_rejeitados', None)
+        if rejeitados:
+            raise serializers.ValidationError(rejeitados)
+        return resultado
+
+
+def registrar_politicas_padrao():
+    """Políticas que diferem do padrão derivado do modelo (chamado no ready do app)"""
+    from .models import NfSaida, NfVenda
+
+    # Notas fiscais são documentos pequenos: teto bem abaixo do limite do tipo
+    registrar_politica(NfSaida, 'arquivo_anexo_nota_fiscal_remessa_saida', PoliticaAnexo(['pdf', 'jpg', 'jpeg', 'png'], 20 * MB))
+    registrar_politica(NfVenda, 'arquivo_anexo_nota_fiscal_venda', PoliticaAnexo(['pdf', 'jpg', 'jpeg', 'png'], 20 * MB))
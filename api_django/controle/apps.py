@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class ControleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'controle'
+
+    def ready(self):
+        from django.conf import settings
+        from . import auditoria, indice_arquivos, instrumentacao, metricas, miniaturas
+        from .anexos import registrar_politicas_padrao
+        registrar_politicas_padrao()
+        miniaturas.conectar_sinais()
+        indice_arquivos.conectar_sinais()
+        auditoria.conectar_sinais()
+        if settings.INSTRUMENTACAO:
+            instrumentacao.instalar_medicao_serializers()
+        if settings.METRICAS:
+            metricas.instalar_medicao_cache()
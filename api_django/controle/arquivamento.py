@@ -0,0 +1,213 @@
+"""
+Arquivamento de OS concluídas e canceladas.
+
+As OS em status terminal (RegistroOS.STATUS_CONCLUIDA/STATUS_CANCELADA, as
+mesmas listas do dashboard) sem alteração há N meses saem das tabelas ativas
+junto com as tabelas filhas e passam a existir só em RegistroOSArquivado, com
+as representações da API já prontas. Assim listagens, contagens e relatórios
+percorrem apenas as OS ativas.
+
+A API continua servindo as arquivadas, somente leitura, quando a requisição
+traz include_archived=true. Os arquivos anexos não são movidos; o índice de
+arquivos (ArquivoArmazenado.arquivado) é o que os protege da limpeza de órfãos.
+"""
+import calendar
+import json
+import logging
+
+from django.core import serializers as django_serializers
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import auditoria
+from .filters import RegistroOSArquivadoFilter
+from .indice_arquivos import indexar_objeto
+from .miniaturas import campos_arquivo
+from .models import ArquivoArmazenado, AuditoriaOS, RegistroOS, RegistroOSArquivado
+from .serializers import RegistroOSListSerializer, RegistroOSSerializer
+
+logger = logging.getLogger(__name__)
+
+STATUS_TERMINAIS = RegistroOS.STATUS_CONCLUIDA + RegistroOS.STATUS_CANCELADA
+
+# Parâmetros da listagem que não são filtros
+PARAMETROS_LISTAGEM = {'page', 'page_size', 'ordering', 'include_archived'}
+# Ordenações possíveis quando a listagem mistura ativas e arquivadas
+ORDENACOES_ARQUIVADAS = ('created_at', 'valor_total')
+
+
+class ErroArquivamento(Exception):
+    """Falha ao arquivar ou desarquivar uma OS"""
+
+
+def incluir_arquivadas(request):
+    return request.query_params.get('include_archived', '').lower() in ('1', 'true', 'sim')
+
+
+def relacoes_os():
+    """Tabelas filhas da OS (ForeignKey com CASCADE para RegistroOS)"""
+    return [
+        relacao for relacao in RegistroOS._meta.related_objects
+        if relacao.on_delete is models.CASCADE
+    ]
+
+
+def data_limite(meses, agora=None):
+    """Mesma data/hora de <meses> meses atrás (dia ajustado ao fim do mês)"""
+    agora = agora or timezone.now()
+    mes = agora.month - 1 - meses
+    ano = agora.year + mes // 12
+    mes = mes % 12 + 1
+    dia = min(agora.day, calendar.monthrange(ano, mes)[1])
+    return agora.replace(year=ano, month=mes, day=dia)
+
+
+def os_para_arquivar(meses):
+    """OS em status terminal sem alteração há mais de <meses> meses"""
+    return RegistroOS.objects.filter(
+        status_os__nome__in=STATUS_TERMINAIS,
+        updated_at__lt=data_limite(meses),
+    )
+
+
+def arquivar_os(registro):
+    """Move a OS e as tabelas filhas para RegistroOSArquivado; retorna o arquivo criado"""
+    with transaction.atomic():
+        registro = (
+            RegistroOS.objects.select_for_update(of=('self',))
+            .select_related('nome_cliente', 'status_os', 'usuario')
+            .get(pk=registro.pk)
+        )
+        filhos = []
+        for relacao in relacoes_os():
+            filhos.extend(relacao.related_model.objects.filter(**{relacao.field.name: registro}).order_by('pk'))
+
+        arquivado = RegistroOSArquivado.objects.create(
+            id=registro.pk,
+            numero_os=registro.numero_os,
+            os_id=registro.os_id,
+            nome_cliente_id=registro.nome_cliente_id,
+            status_os_id=registro.status_os_id,
+            usuario_id=registro.usuario_id,
+            valor_total=registro.valor_total,
+            created_at=registro.created_at,
+            updated_at=registro.updated_at,
+            resumo=RegistroOSListSerializer(registro).data,
+            dados=RegistroOSSerializer(registro, context={}).data,
+            linhas=json.loads(django_serializers.serialize('json', [registro] + filhos)),
+        )
+
+        # Índice atualizado antes de apagar as linhas: depois disso ele é a única referência aos anexos
+        for filho in filhos:
+            if campos_arquivo(type(filho)):
+                indexar_objeto(type(filho), filho)
+        ArquivoArmazenado.objects.filter(registro=registro).update(arquivado=arquivado)
+
+        # Na auditoria o arquivamento é um único evento, não a exclusão da OS e das filhas
+        auditoria.registrar(registro, AuditoriaOS.ARQUIVADO)
+        with auditoria.desativada():
+            registro.delete()
+
+    logger.info(f"OS {arquivado.numero_os} arquivada com {len(filhos)} registro(s) relacionado(s)")
+    return arquivado
+
+
+def arquivar(meses, limite=None):
+    """Arquiva as OS elegíveis, uma transação por OS; itera as OS arquivadas"""
+    ids = os_para_arquivar(meses).order_by('updated_at').values_list('pk', flat=True)
+    if limite:
+        ids = ids[:limite]
+    for pk in list(ids):
+        try:
+            registro = RegistroOS.objects.get(pk=pk)
+        except RegistroOS.DoesNotExist:
+            continue
+        yield arquivar_os(registro)
+
+
+def desarquivar_os(arquivado):
+    """Devolve a OS e as tabelas filhas às tabelas ativas"""
+    with transaction.atomic():
+        if RegistroOS.objects.filter(Q(pk=arquivado.pk) | Q(numero_os=arquivado.numero_os)).exists():
+            raise ErroArquivamento(f'Já existe uma OS ativa com o id {arquivado.pk} ou o número {arquivado.numero_os}')
+        try:
+            for objeto in django_serializers.deserialize('python', arquivado.linhas):
+                objeto.save()
+                if isinstance(objeto.object, RegistroOS):
+                    auditoria.registrar(objeto.object, AuditoriaOS.DESARQUIVADO)
+        except IntegrityError as e:
+            raise ErroArquivamento(f'Não foi possível restaurar a OS {arquivado.numero_os}: {e}')
+
+        ArquivoArmazenado.objects.filter(arquivado=arquivado).update(arquivado=None, registro_id=arquivado.pk)
+        arquivado.delete()
+
+    logger.info(f"OS {arquivado.numero_os} desarquivada")
+
+
+def filtrar_arquivadas(queryset, parametros):
+    """
+    Aplica às arquivadas os filtros da listagem. Levanta ValueError se algum
+    filtro informado não existe para elas (o resultado ficaria incompleto).
+    """
+    suportados = set(RegistroOSArquivadoFilter.base_filters) | PARAMETROS_LISTAGEM
+    nao_suportados = sorted(
+        parametro for parametro in parametros
+        if parametro not in suportados and parametros.get(parametro) != ''
+    )
+    if nao_suportados:
+        raise ValueError(f"Filtros não disponíveis com include_archived: {', '.join(nao_suportados)}")
+
+    filterset = RegistroOSArquivadoFilter(data=parametros, queryset=queryset)
+    if not filterset.is_valid():
+        raise ValueError(f'Filtros inválidos: {dict(filterset.errors)}')
+    return filterset.qs
+
+
+def representar_arquivada(arquivado, detalhe=False):
+    return dict(arquivado.dados if detalhe else arquivado.resumo, arquivada=True)
+
+
+class ListaComArquivadas:
+    """
+    OS ativas e arquivadas em uma única sequência ordenada, paginável pelo
+    Paginator do Django. Cada página busca só as chaves de ordenação até o fim
+    da página nas duas tabelas, intercala e carrega os objetos da página.
+    """
+
+    def __init__(self, ativas, arquivadas, ordem='-created_at'):
+        self.campo = ordem.lstrip('-')
+        self.decrescente = ordem.startswith('-')
+        if self.decrescente:
+            ordenacao = [F(self.campo).desc(nulls_last=True), '-pk']
+        else:
+            ordenacao = [F(self.campo).asc(nulls_last=True), 'pk']
+        self.ativas = ativas.order_by(*ordenacao)
+        self.arquivadas = arquivadas.order_by(*ordenacao)
+
+    def count(self):
+        return self.ativas.count() + self.arquivadas.count()
+
+    def __len__(self):
+        return self.count()
+
+    def _chaves(self, queryset, origem, fim):
+        linhas = queryset.select_related(None).prefetch_related(None).values_list(self.campo, 'pk')[:fim]
+        # Sem valor vai para o fim, como NULLS LAST
+        return [((valor is not None, valor), pk, origem) for valor, pk in linhas]
+
+    def __getitem__(self, fatia):
+        if not isinstance(fatia, slice):
+            return self[fatia:fatia + 1][0]
+
+        fim = fatia.stop
+        chaves = self._chaves(self.ativas, 0, fim) + self._chaves(self.arquivadas, 1, fim)
+        if self.decrescente:
+            chaves.sort(key=lambda chave: chave[:2], reverse=True)
+        else:
+            chaves.sort(key=lambda chave: ((not chave[0][0], chave[0][1]), chave[1]))
+        pagina = chaves[fatia]
+
+        ativas = self.ativas.in_bulk([pk for _, pk, origem in pagina if origem == 0])
+        arquivadas = self.arquivadas.in_bulk([pk for _, pk, origem in pagina if origem == 1])
+        return [ativas[pk] if origem == 0 else arquivadas[pk] for _, pk, origem in pagina]
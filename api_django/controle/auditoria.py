@@ -0,0 +1,233 @@
+"""
+Trilha de auditoria das OS: diferenças campo a campo da OS e das tabelas filhas.
+
+- pre_save lê do banco, só nas alterações, os valores dos campos que serão
+  salvos (uma consulta por save; carregar OS e filhos não custa nada);
+  post_save compara com os valores salvos e gera uma entrada com
+  {campo: [antes, depois]} só dos campos alterados. Criação e exclusão
+  também geram entradas. Saves "raw" (loaddata, desarquivamento) e
+  bulk_create/update() por queryset não passam pelos sinais.
+- As entradas são gravadas no commit (transaction.on_commit); se o savepoint
+  ou a transação em que foram registradas for desfeito, vão junto. Dentro de
+  em_lote() as entradas do bloco são gravadas com um único bulk_create.
+- O usuário vem da requisição atual (AuditoriaMiddleware); o DRF copia o
+  usuário autenticado por JWT para o HttpRequest.
+- valor_anterior()/status_anterior() devolvem o valor antes da última
+  alteração da instância sem consultar o histórico (usados pelos webhooks).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import connections, router, transaction
+from django.db.models.fields.files import FieldFile
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import AuditoriaOS, RegistroOS
+
+CAMPOS_IGNORADOS = {'id', 'created_at', 'updated_at', 'derivados'}
+
+_requisicao_atual = ContextVar('auditoria_requisicao', default=None)
+_desativada = ContextVar('auditoria_desativada', default=False)
+_lote_atual = ContextVar('auditoria_lote', default=None)
+
+
+def modelos_auditados():
+    from .arquivamento import relacoes_os
+
+    return [RegistroOS] + [relacao.related_model for relacao in relacoes_os()]
+
+
+def _campos(modelo):
+    campos = getattr(modelo, '_auditoria_campos', None)
+    if campos is None:
+        campos = modelo._auditoria_campos = [
+            (campo.name, campo.attname) for campo in modelo._meta.concrete_fields
+            if campo.name not in CAMPOS_IGNORADOS
+        ]
+    return campos
+
+
+def _normalizar(valor):
+    if isinstance(valor, FieldFile):
+        return valor.name or None
+    return valor
+
+
+def _valores(instancia):
+    """Valores atuais dos campos auditados que estão carregados (campos adiados ficam de fora)"""
+    dados = instancia.__dict__
+    return {attname: _normalizar(dados[attname]) for _, attname in _campos(type(instancia)) if attname in dados}
+
+
+def _id_os(instancia):
+    return instancia.pk if isinstance(instancia, RegistroOS) else getattr(instancia, 'registro_id', None)
+
+
+def usuario_atual():
+    request = _requisicao_atual.get()
+    usuario = getattr(request, 'user', None)
+    return usuario if usuario is not None and usuario.is_authenticated else None
+
+
+@contextmanager
+def desativada():
+    """Não audita as alterações feitas dentro do bloco (ex.: exclusão ao arquivar)"""
+    token = _desativada.set(True)
+    try:
+        yield
+    finally:
+        _desativada.reset(token)
+
+
+def _gravar(entradas, using):
+    if entradas:
+        AuditoriaOS.objects.using(using).bulk_create(entradas)
+
+
+class _Lote:
+    def __init__(self, using):
+        self.using = using
+        self.registradas = 0
+        self.confirmadas = []
+
+
+@contextmanager
+def em_lote(using=None):
+    """
+    transaction.atomic() cujas entradas de auditoria são gravadas com um único
+    bulk_create no commit. Cada entrada é confirmada por um on_commit próprio,
+    que o Django descarta se o savepoint em que ela foi registrada for
+    desfeito; a gravação é agendada no fim do bloco, depois de todas elas.
+    """
+    using = using or router.db_for_write(AuditoriaOS)
+    externo = _lote_atual.get()
+    if externo is not None and externo.using == using:
+        with transaction.atomic(using=using):
+            yield
+        return
+    lote = _Lote(using)
+    token = _lote_atual.set(lote)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            if lote.registradas:
+                transaction.on_commit(lambda: _gravar(lote.confirmadas, using), using=using)
+    finally:
+        _lote_atual.reset(token)
+
+
+def registrar(instancia, acao, alteracoes=None, usuario=None):
+    """Enfileira uma entrada de auditoria; fora de transação ela é gravada na hora"""
+    if _desativada.get():
+        return
+    modelo = type(instancia)
+    entrada = AuditoriaOS(
+        os_id=_id_os(instancia),
+        modelo=modelo._meta.model_name,
+        objeto_id=instancia.pk,
+        acao=acao,
+        alteracoes=alteracoes or {},
+        usuario=usuario or usuario_atual(),
+    )
+    using = router.db_for_write(AuditoriaOS, instance=instancia)
+    if not connections[using].in_atomic_block:
+        _gravar([entrada], using)
+        return
+    lote = _lote_atual.get()
+    if lote is not None and lote.using == using:
+        lote.registradas += 1
+        transaction.on_commit(partial(lote.confirmadas.append, entrada), using=using)
+    else:
+        transaction.on_commit(partial(_gravar, [entrada], using), using=using)
+
+
+def instancia_sera_salva(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Valores no banco, antes da alteração, dos campos que o save vai gravar"""
+    instance.__dict__.pop('_auditoria_original', None)
+    if raw or _desativada.get() or instance._state.adding or instance.pk is None:
+        return
+    campos = [
+        attname for nome, attname in _campos(sender)
+        if attname in instance.__dict__ and (update_fields is None or nome in update_fields or attname in update_fields)
+    ]
+    if campos:
+        instance._auditoria_original = (
+            sender._base_manager.using(using).filter(pk=instance.pk).values(*campos).first()
+        )
+
+
+def instancia_salva(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    atuais = _valores(instance)
+    originais = instance.__dict__.pop('_auditoria_original', None)
+    if created or originais is None:
+        alteracoes = {
+            nome: [None, atuais[attname]] for nome, attname in _campos(sender)
+            if atuais.get(attname) not in (None, '')
+        }
+        acao = AuditoriaOS.CRIADO if created else AuditoriaOS.ALTERADO
+    else:
+        alteracoes = {
+            nome: [originais[attname], atuais[attname]] for nome, attname in _campos(sender)
+            if attname in originais and attname in atuais and originais[attname] != atuais[attname]
+        }
+        acao = AuditoriaOS.ALTERADO
+    # Mantém o valor mais antigo de cada campo entre saves seguidos da mesma instância
+    instance._auditoria_anterior = {**(originais or {}), **getattr(instance, '_auditoria_anterior', {})}
+    if alteracoes or created:
+        registrar(instance, acao, alteracoes)
+
+
+def instancia_excluida(sender, instance, origin=None, **kwargs):
+    # Filhos apagados em cascata pela exclusão da OS ficam representados pela entrada da OS
+    if sender is not RegistroOS and isinstance(origin, RegistroOS):
+        return
+    valores = _valores(instance)
+    registrar(instance, AuditoriaOS.EXCLUIDO, {
+        nome: [valores[attname], None] for nome, attname in _campos(sender)
+        if valores.get(attname) not in (None, '')
+    })
+
+
+def conectar_sinais():
+    for modelo in modelos_auditados():
+        nome = modelo.__name__
+        pre_save.connect(instancia_sera_salva, sender=modelo, dispatch_uid=f'auditoria_pre_save_{nome}')
+        post_save.connect(instancia_salva, sender=modelo, dispatch_uid=f'auditoria_save_{nome}')
+        post_delete.connect(instancia_excluida, sender=modelo, dispatch_uid=f'auditoria_del_{nome}')
+
+
+def valor_anterior(instancia, attname):
+    """
+    Valor do campo antes da última alteração salva desta instância ou, se ela
+    ainda não foi salva, o valor atual. Não faz consulta.
+    """
+    valores = getattr(instancia, '_auditoria_anterior', None)
+    if valores and attname in valores:
+        return valores[attname]
+    return _normalizar(instancia.__dict__.get(attname))
+
+
+def status_anterior(instancia, campo='status_os'):
+    """Nome do status (FK para uma tabela com 'nome') antes da alteração atual; None se não houver"""
+    status_id = valor_anterior(instancia, f'{campo}_id')
+    if status_id is None:
+        return None
+    modelo = instancia._meta.get_field(campo).related_model
+    return modelo.objects.filter(pk=status_id).values_list('nome', flat=True).first()
+
+
+class AuditoriaMiddleware:
+    """Guarda a requisição para identificar o usuário das alterações"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _requisicao_atual.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _requisicao_atual.reset(token)
@@ -0,0 +1,267 @@
+"""
+Backup incremental do banco e dos arquivos de mídia.
+
+Estrutura do destino:
+
+    <destino>/objetos/<aa>/<sha256>.gz      conteúdo dos arquivos, gravado uma única vez
+    <destino>/<AAAAMMDD-HHMMSS>/banco/      pg_dump em formato diretório (ou dumpdata)
+    <destino>/<AAAAMMDD-HHMMSS>/manifesto.json
+
+O manifesto lista cada arquivo do MEDIA_ROOT com tamanho, mtime e SHA-256.
+Arquivos com o mesmo tamanho e mtime do backup anterior reaproveitam o hash
+sem serem lidos; os demais são lidos, comprimidos em paralelo e só gravados
+se o conteúdo ainda não existir em objetos/. Assim cada execução custa o
+proporcional ao que mudou, e qualquer backup pode ser restaurado sozinho.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+
+from .indice_arquivos import percorrer_media
+
+TAMANHO_BLOCO = 1024 * 1024
+FORMATO_NOME = '%Y%m%d-%H%M%S'
+ARQUIVO_MANIFESTO = 'manifesto.json'
+ARQUIVO_DUMPDATA = 'dados.json.gz'
+EXCLUIR_DUMPDATA = ['contenttypes', 'auth.permission', 'admin.logentry', 'sessions']
+
+
+class ErroBackup(Exception):
+    """Falha ao gerar ou restaurar um backup"""
+
+
+def listar_backups(destino):
+    """Nomes dos backups completos (com manifesto), do mais antigo para o mais novo"""
+    if not os.path.isdir(destino):
+        return []
+    return sorted(
+        nome for nome in os.listdir(destino)
+        if os.path.isfile(os.path.join(destino, nome, ARQUIVO_MANIFESTO))
+    )
+
+
+def ler_manifesto(destino, nome):
+    with open(os.path.join(destino, nome, ARQUIVO_MANIFESTO), encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+
+def caminho_objeto(destino, digest):
+    return os.path.join(destino, 'objetos', digest[:2], f'{digest}.gz')
+
+
+def _parametros_postgres():
+    banco = settings.DATABASES['default']
+    argumentos = ['--dbname', banco['NAME']]
+    for opcao, chave in (('--host', 'HOST'), ('--port', 'PORT'), ('--username', 'USER')):
+        if banco.get(chave):
+            argumentos += [opcao, str(banco[chave])]
+    ambiente = dict(os.environ, PGPASSWORD=banco.get('PASSWORD') or '')
+    return argumentos, ambiente
+
+
+def backup_banco(pasta, workers):
+    """Dump do banco em <pasta>; retorna o formato usado"""
+    if connection.vendor == 'postgresql':
+        argumentos, ambiente = _parametros_postgres()
+        subprocess.run(
+            ['pg_dump', '--format=directory', f'--jobs={workers}', '--compress=6',
+             '--no-owner', '--file', pasta] + argumentos,
+            check=True, env=ambiente, capture_output=True,
+        )
+        return 'pg_dump-directory'
+
+    # Outros bancos (SQLite local): dumpdata comprimido, restaurável com loaddata
+    os.makedirs(pasta, exist_ok=True)
+    call_command(
+        'dumpdata', '--natural-foreign', '--output', os.path.join(pasta, ARQUIVO_DUMPDATA),
+        *[f'--exclude={app}' for app in EXCLUIR_DUMPDATA], verbosity=0,
+    )
+    return 'dumpdata'
+
+
+def restaurar_banco(pasta, formato, workers):
+    if formato == 'pg_dump-directory':
+        if connection.vendor != 'postgresql':
+            raise ErroBackup('Backup em formato pg_dump só pode ser restaurado em PostgreSQL')
+        argumentos, ambiente = _parametros_postgres()
+        subprocess.run(
+            ['pg_restore', '--format=directory', f'--jobs={workers}', '--clean', '--if-exists',
+             '--no-owner'] + argumentos + [pasta],
+            check=True, env=ambiente, capture_output=True,
+        )
+    elif formato == 'dumpdata':
+        call_command('loaddata', os.path.join(pasta, ARQUIVO_DUMPDATA), verbosity=0)
+    else:
+        raise ErroBackup(f'Formato de banco desconhecido: {formato}')
+
+
+def _armazenar_objeto(destino, caminho):
+    """Lê o arquivo uma vez calculando o SHA-256 e comprimindo; grava o objeto se for novo"""
+    hash_conteudo = hashlib.sha256()
+    pasta_temporaria = os.path.join(destino, 'objetos', 'tmp')
+    os.makedirs(pasta_temporaria, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(dir=pasta_temporaria)
+    try:
+        with open(caminho, 'rb') as origem, os.fdopen(descritor, 'wb') as bruto:
+            with gzip.GzipFile(fileobj=bruto, mode='wb', compresslevel=6, mtime=0) as comprimido:
+                for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                    hash_conteudo.update(bloco)
+                    comprimido.write(bloco)
+
+        digest = hash_conteudo.hexdigest()
+        objeto = caminho_objeto(destino, digest)
+        if os.path.exists(objeto):
+            os.remove(temporario)
+            return digest, False
+        os.makedirs(os.path.dirname(objeto), exist_ok=True)
+        os.replace(temporario, objeto)
+        return digest, True
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+def backup_media(destino, anterior, workers):
+    """
+    Manifesto dos arquivos do MEDIA_ROOT; só lê o que mudou desde o manifesto
+    anterior. Retorna (arquivos, estatísticas).
+    """
+    arquivos = {}
+    pendentes = []
+    estatisticas = {'arquivos': 0, 'reaproveitados': 0, 'lidos': 0, 'objetos_novos': 0, 'bytes_novos': 0}
+
+    for nome, caminho, info in percorrer_media():
+        estatisticas['arquivos'] += 1
+        entrada = {'tamanho': info.st_size, 'mtime_ns': info.st_mtime_ns}
+        previo = anterior.get(nome)
+        if (
+            previo and previo['tamanho'] == info.st_size and previo['mtime_ns'] == info.st_mtime_ns
+            and os.path.exists(caminho_objeto(destino, previo['sha256']))
+        ):
+            entrada['sha256'] = previo['sha256']
+            estatisticas['reaproveitados'] += 1
+        else:
+            pendentes.append((nome, caminho))
+        arquivos[nome] = entrada
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resultados = executor.map(lambda item: _armazenar_objeto(destino, item[1]), pendentes)
+        for (nome, _), (digest, novo) in zip(pendentes, resultados):
+            arquivos[nome]['sha256'] = digest
+            estatisticas['lidos'] += 1
+            if novo:
+                estatisticas['objetos_novos'] += 1
+                estatisticas['bytes_novos'] += os.path.getsize(caminho_objeto(destino, digest))
+
+    return arquivos, estatisticas
+
+
+def criar_backup(destino, workers=4, incluir_banco=True, incluir_media=True):
+    """Cria um backup em <destino>/<data-hora>; retorna (nome, estatísticas)"""
+    existentes = listar_backups(destino)
+    anterior = ler_manifesto(destino, existentes[-1])['media'] if existentes else {}
+
+    nome = base = datetime.now().strftime(FORMATO_NOME)
+    sequencia = 1
+    # Mais de um backup no mesmo segundo: sufixo mantém a ordem por nome
+    while os.path.exists(os.path.join(destino, nome)):
+        nome = f'{base}-{sequencia:02d}'
+        sequencia += 1
+    pasta = os.path.join(destino, nome)
+    os.makedirs(pasta)
+
+    try:
+        manifesto = {'criado_em': datetime.now().isoformat(), 'banco': None, 'media': {}}
+        # Banco antes da mídia: todo arquivo referenciado no dump já existe no disco
+        if incluir_banco:
+            manifesto['banco'] = backup_banco(os.path.join(pasta, 'banco'), workers)
+        estatisticas = {}
+        if incluir_media:
+            manifesto['media'], estatisticas = backup_media(destino, anterior, workers)
+
+        with open(os.path.join(pasta, ARQUIVO_MANIFESTO), 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo, indent=1, sort_keys=True)
+    except BaseException:
+        # Backup incompleto não pode servir de base para o próximo
+        shutil.rmtree(pasta, ignore_errors=True)
+        raise
+
+    return nome, estatisticas
+
+
+def verificar_backup(destino, nome, conferir_conteudo=True):
+    """
+    Confere se todos os objetos do manifesto existem e, com conferir_conteudo,
+    se têm o hash esperado; retorna os problemas
+    """
+    problemas = []
+    for arquivo, entrada in ler_manifesto(destino, nome)['media'].items():
+        objeto = caminho_objeto(destino, entrada['sha256'])
+        if not os.path.exists(objeto):
+            problemas.append(f'{arquivo}: objeto ausente')
+            continue
+        if not conferir_conteudo:
+            continue
+        hash_conteudo = hashlib.sha256()
+        with gzip.open(objeto, 'rb') as origem:
+            for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                hash_conteudo.update(bloco)
+        if hash_conteudo.hexdigest() != entrada['sha256']:
+            problemas.append(f'{arquivo}: conteúdo corrompido')
+    return problemas
+
+
+def restaurar_backup(destino, nome, workers=4, incluir_banco=True, incluir_media=True):
+    """Restaura banco e mídia de um backup; retorna a quantidade de arquivos restaurados"""
+    manifesto = ler_manifesto(destino, nome)
+    restaurados = 0
+
+    if incluir_media:
+        for arquivo, entrada in manifesto['media'].items():
+            caminho = os.path.join(settings.MEDIA_ROOT, arquivo)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            temporario = f'{caminho}.restaurando'
+            with gzip.open(caminho_objeto(destino, entrada['sha256']), 'rb') as origem, open(temporario, 'wb') as saida:
+                shutil.copyfileobj(origem, saida, TAMANHO_BLOCO)
+            os.replace(temporario, caminho)
+            os.utime(caminho, ns=(entrada['mtime_ns'], entrada['mtime_ns']))
+            restaurados += 1
+
+    if incluir_banco and manifesto['banco']:
+        restaurar_banco(os.path.join(destino, nome, 'banco'), manifesto['banco'], workers)
+
+    return restaurados
+
+
+def podar_backups(destino, manter):
+    """Mantém os <manter> backups mais novos e remove objetos que nenhum deles usa"""
+    existentes = listar_backups(destino)
+    removidos = existentes[:-manter] if manter > 0 else []
+    for nome in removidos:
+        shutil.rmtree(os.path.join(destino, nome))
+
+    usados = set()
+    for nome in existentes[len(removidos):]:
+        usados.update(entrada['sha256'] for entrada in ler_manifesto(destino, nome)['media'].values())
+
+    objetos_removidos = 0
+    raiz = os.path.join(destino, 'objetos')
+    for pasta, _, arquivos in os.walk(raiz):
+        if os.path.relpath(pasta, raiz).split(os.sep)[0] == 'tmp':
+            continue
+        for arquivo in arquivos:
+            if arquivo.endswith('.gz') and arquivo[:-3] not in usados:
+                os.remove(os.path.join(pasta, arquivo))
+                objetos_removidos += 1
+    return removidos, objetos_removidos
@@ -0,0 +1,18 @@
+"""
+Benchmarks de desempenho da API.
+
+- dados.py gera uma base sintética reproduzível (mesma semente, mesmos dados):
+  clientes com contratos, unidades, setores, aprovadores e solicitantes, OS e
+  linhas em todas as tabelas filhas. Comando: gerar_dados_benchmark.
+- cenarios.py executa cenários (listagem, detalhe, busca, filtros,
+  estatísticas, relatórios, exportação, criação e edição aninhadas) contra os
+  endpoints reais do DRF, no mesmo processo, e grava os resultados em JSON
+  para comparar execuções. Comando: benchmark (--comparar falha se houver
+  regressão, para uso em CI).
+- carga.py simula usuários concorrentes de cada grupo, por HTTP, contra um
+  servidor rodando (runserver ou gunicorn) e mede p50/p95/p99, vazão e taxa
+  de erro por endpoint. Comando: teste_carga.
+- serializacao.py mede os serializers de OS sem HTTP: construção e vazão em
+  OS por segundo, com e sem o cache do mapa de campos. Comando:
+  benchmark_serializacao.
+"""
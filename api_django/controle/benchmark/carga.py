@@ -0,0 +1,410 @@
+"""
+Teste de carga: usuários virtuais repetindo, por HTTP, o tráfego do frontend.
+
+Os cenários (cenarios.py) medem uma requisição por vez, no mesmo processo.
+Aqui cada usuário virtual é uma thread com a própria sessão HTTP contra um
+servidor de verdade (runserver ou gunicorn do compose de desenvolvimento), o
+que mede fila, workers e concorrência no banco. Cada usuário faz login, abre
+o painel (estatísticas, consultadas de novo a cada intervalo_painel segundos,
+como o dashboard) e percorre jornadas sorteadas pelos pesos do seu grupo:
+
+- consulta: listagem (página, filtros ou busca) e detalhe de uma OS da lista;
+- edicao: listagem, detalhe, opções do formulário e PATCH multipart com as
+  tabelas filhas;
+- nova_os: opções, clientes, dados do cliente e POST multipart com as tabelas
+  filhas e um anexo;
+- relatorios: relatório e exportação em Excel ou PDF (Administrador e Superior).
+
+Entre os passos há uma pausa sorteada (exponencial, média <pausa> segundos).
+Os usuários de carga (PREFIXO_USUARIO) são criados por preparar_usuarios; as
+OS criadas por eles saem com limpar_carga(). O resultado traz, por endpoint e
+por grupo, p50/p95/p99, vazão e taxa de erro.
+"""
+import copy
+import math
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import quote
+
+import requests
+from django.contrib.auth.models import Group, User
+from django.db import connection
+from django.utils import timezone
+from django.utils.text import slugify
+
+from ..models import ControleQualidade, RegistroOS
+from .cenarios import URL_OS, Contexto, _commit, _percentil
+from .dados import PALAVRAS
+
+PREFIXO_USUARIO = 'carga_'
+GRUPOS = ['Administrador', 'Superior', 'Qualidade', 'Tecnico', 'Básico']
+# Grupos que veem todas as OS (RegistroOSViewSet.ve_todas_os); os demais só as próprias
+GRUPOS_VEEM_TODAS = {'Administrador', 'Superior', 'Qualidade'}
+
+MIX_GRUPOS = {'Administrador': 1, 'Superior': 1, 'Qualidade': 1, 'Tecnico': 4, 'Básico': 3}
+JORNADAS_POR_GRUPO = {
+    'Administrador': {'consulta': 4, 'edicao': 2, 'nova_os': 1, 'relatorios': 2},
+    'Superior': {'consulta': 4, 'edicao': 2, 'nova_os': 1, 'relatorios': 3},
+    'Qualidade': {'consulta': 5, 'edicao': 3},
+    'Tecnico': {'consulta': 4, 'edicao': 3, 'nova_os': 2},
+    'Básico': {'consulta': 4, 'edicao': 1, 'nova_os': 2},
+}
+JORNADAS_ESCRITA = {'edicao', 'nova_os'}
+
+# Campos do formulário copiados de uma OS existente do cliente (o grupo Básico preenche todos)
+CAMPOS_FORMULARIO = [
+    'nome_cliente', 'numero_contrato', 'unidade_cliente', 'setor_unidade_cliente', 'status_regime_os',
+    'nome_diligenciador_os', 'nome_solicitante_cliente', 'nome_responsavel_aprovacao_os_cliente',
+    'nome_responsavel_execucao_servico', 'id_demanda', 'status_os', 'status_levantamento', 'status_producao',
+]
+CAMPOS_SIM_NAO = ['existe_orcamento', 'opcoes_dms', 'opcoes_bms', 'opcoes_frs']
+CAMPOS_CONTROLE_QUALIDADE = [
+    'tipo_cq', 'opcoes_espec_cq', 'nivel_inspecao_cq', 'tipo_ensaio_cq', 'percentual_cq', 'quantidade_cq',
+    'tamanho_cq', 'texto_tamanho_cq',
+]
+
+# Anexo pequeno com assinatura de PDF válida para a política de anexos
+ANEXO_PDF = b'%PDF-1.4\n%carga\n' + b'0' * 4096 + b'\n%%EOF\n'
+
+
+class FimDaCarga(Exception):
+    """Tempo da execução esgotado: o usuário virtual para no passo atual"""
+
+
+class Execucao:
+    """Parâmetros compartilhados pelos usuários virtuais de uma execução"""
+
+    def __init__(self, url, contexto, senha, fim, pausa=1.0, escrita=True, intervalo_painel=30, timeout=120):
+        self.url = url.rstrip('/')
+        self.contexto = contexto
+        self.senha = senha
+        self.fim = fim
+        self.pausa = pausa
+        self.escrita = escrita
+        self.intervalo_painel = intervalo_painel
+        self.timeout = timeout
+        self.parar = threading.Event()
+        self.campos_os = self._campos_os()
+        self.controle_qualidade = ControleQualidade.objects.filter(
+            registro__nome_cliente=contexto.cliente
+        ).values(*CAMPOS_CONTROLE_QUALIDADE).first()
+
+    def _campos_os(self):
+        """Campos da OS que não dependem do sorteio, a partir de uma OS do cliente do contexto"""
+        modelo = RegistroOS.objects.filter(nome_cliente=self.contexto.cliente).values(*CAMPOS_FORMULARIO).first()
+        if modelo is None:
+            return {chave: valor for chave, valor in self.contexto.nova_os().items() if not isinstance(valor, list)}
+        agora = timezone.now()
+        return {
+            **modelo,
+            # "Não" dispensa as tabelas e campos que cada opção SIM exige
+            **{campo: 'NAO' for campo in CAMPOS_SIM_NAO},
+            'data_solicitacao_os': agora.strftime('%Y-%m-%dT%H:%M:%S'),
+            'data_emissao_os': agora.strftime('%Y-%m-%dT%H:%M:%S'),
+            'prazo_execucao_servico': (agora + timedelta(days=30)).strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+
+class UsuarioVirtual(threading.Thread):
+    """Uma sessão do frontend: login, painel e jornadas até o fim da execução"""
+
+    def __init__(self, execucao, grupo, username, inicio, semente):
+        super().__init__(name=f'carga-{username}', daemon=True)
+        self.execucao = execucao
+        self.grupo = grupo
+        self.username = username
+        self.inicio = inicio
+        self.rng = random.Random(semente)
+        # Cópia do contexto com o sorteio deste usuário (o random do contexto não é compartilhado entre threads)
+        self.contexto = copy.copy(execucao.contexto)
+        self.contexto.rng = self.rng
+        self.amostras = []
+        self.vistas = []
+        self.proximo_painel = None
+        self.sessao = requests.Session()
+
+    def encerrar(self):
+        return self.execucao.parar.is_set() or time.monotonic() >= self.execucao.fim
+
+    def run(self):
+        espera = self.inicio - time.monotonic()
+        if espera > 0 and self.execucao.parar.wait(espera):
+            return
+        jornadas = {
+            nome: peso for nome, peso in JORNADAS_POR_GRUPO[self.grupo].items()
+            if self.execucao.escrita or nome not in JORNADAS_ESCRITA
+        }
+        try:
+            if not self.login():
+                return
+            self.painel()
+            while not self.encerrar():
+                nome = self.rng.choices(list(jornadas), weights=list(jornadas.values()))[0]
+                JORNADAS[nome](self)
+                self.pausar()
+        except FimDaCarga:
+            pass
+        finally:
+            self.sessao.close()
+
+    def requisicao(self, endpoint, metodo, caminho, **kwargs):
+        """Faz a requisição e registra a amostra; retorna a resposta se o status for 2xx"""
+        if self.encerrar():
+            raise FimDaCarga()
+        erro = None
+        inicio = time.perf_counter()
+        try:
+            resposta = self.sessao.request(metodo, self.execucao.url + caminho, timeout=self.execucao.timeout, **kwargs)
+            situacao = resposta.status_code
+        except requests.RequestException as e:
+            resposta, situacao, erro = None, 0, type(e).__name__
+        self.amostras.append({
+            'endpoint': endpoint, 'grupo': self.grupo, 'ms': (time.perf_counter() - inicio) * 1000,
+            'status': situacao, 'erro': erro or (f'HTTP {situacao}' if situacao >= 400 else None),
+        })
+        return resposta if resposta is not None and resposta.ok else None
+
+    def json(self, resposta):
+        try:
+            return resposta.json() if resposta is not None else None
+        except ValueError:
+            return None
+
+    def pausar(self):
+        """Tempo de leitura entre os passos; o painel é atualizado quando vence o intervalo"""
+        if self.execucao.pausa > 0 and self.execucao.parar.wait(self.rng.expovariate(1 / self.execucao.pausa)):
+            raise FimDaCarga()
+        if self.proximo_painel is not None and time.monotonic() >= self.proximo_painel:
+            self.painel()
+
+    def login(self):
+        dados = self.json(self.requisicao('login', 'post', '/api/auth/login/', json={
+            'username': self.username, 'password': self.execucao.senha,
+        }))
+        if not dados or 'access' not in dados:
+            return False
+        self.sessao.headers['Authorization'] = f"Bearer {dados['access']}"
+        return True
+
+    def painel(self):
+        self.requisicao('estatisticas', 'get', '/api/estatisticas/')
+        self.proximo_painel = time.monotonic() + self.execucao.intervalo_painel
+
+    def listagem(self):
+        contexto = self.contexto
+        tipo = self.rng.choice(['pagina', 'filtros', 'busca'])
+        if tipo == 'filtros':
+            endpoint, parametros = 'os_filtros', {
+                'nome_cliente': contexto.cliente.pk, 'status_os': contexto.status_andamento, 'ordering': '-valor_total',
+            }
+        elif tipo == 'busca':
+            endpoint, parametros = 'os_busca', {'search': self.rng.choice(PALAVRAS)}
+        else:
+            pagina = self.rng.randint(1, contexto.paginas) if self.grupo in GRUPOS_VEEM_TODAS else 1
+            endpoint, parametros = 'os_listagem', {'page': pagina}
+        dados = self.json(self.requisicao(endpoint, 'get', URL_OS, params=parametros))
+        if dados and dados.get('results'):
+            self.vistas = [item['id'] for item in dados['results']]
+
+    def detalhe(self):
+        if not self.vistas:
+            return None
+        return self.json(self.requisicao('os_detalhe', 'get', f'{URL_OS}{self.rng.choice(self.vistas)}/'))
+
+    def dados_os(self, descricao, anexo=False):
+        """Campos no formato multipart do formulário (tabela[indice][campo]) e os arquivos"""
+        campos = []
+        filhos = self.contexto.filhos_os()
+        if self.execucao.controle_qualidade:
+            filhos['controles_qualidade'] = [self.execucao.controle_qualidade]
+        for chave, valor in filhos.items():
+            for indice, item in enumerate(valor):
+                campos.extend(
+                    (f'{chave}[{indice}][{campo}]', str(dado)) for campo, dado in item.items() if dado is not None
+                )
+        campos.append(('descricao_resumida', descricao))
+        arquivos = {}
+        if anexo:
+            data = timezone.now().strftime('%Y-%m-%dT%H:%M:%S')
+            campos.extend([
+                ('levantamentos[0][data_levantamento]', data),
+                ('levantamentos[0][descricao_levantamento]', 'Levantamento de carga'),
+            ])
+            arquivos['levantamentos[0][arquivo_anexo_levantamento]'] = ('levantamento.pdf', ANEXO_PDF, 'application/pdf')
+        return campos, arquivos
+
+
+def _consulta(usuario):
+    usuario.listagem()
+    usuario.pausar()
+    usuario.detalhe()
+
+
+def _edicao(usuario):
+    usuario.listagem()
+    usuario.pausar()
+    os_dados = usuario.detalhe()
+    if not os_dados:
+        return
+    usuario.requisicao('opcoes', 'get', '/api/opcoes/')
+    usuario.pausar()
+    campos, arquivos = usuario.dados_os('OS de carga (editada)')
+    usuario.requisicao('os_atualizacao', 'patch', f"{URL_OS}{os_dados['id']}/", data=campos, files=arquivos or None)
+
+
+def _nova_os(usuario):
+    usuario.requisicao('opcoes', 'get', '/api/opcoes/')
+    usuario.requisicao('clientes_nomes', 'get', '/api/clientes-nomes/')
+    usuario.requisicao('dados_cliente', 'get', f'/api/dados-cliente/{quote(usuario.contexto.cliente.nome)}/')
+    usuario.pausar()
+    campos, arquivos = usuario.dados_os('OS de carga', anexo=True)
+    campos.extend((chave, str(valor)) for chave, valor in usuario.execucao.campos_os.items()
+                  if valor is not None and chave != 'descricao_resumida')
+    criada = usuario.json(usuario.requisicao('os_criacao', 'post', URL_OS, data=campos, files=arquivos))
+    if criada and 'id' in criada:
+        usuario.vistas.append(criada['id'])
+
+
+def _relatorios(usuario):
+    hoje = timezone.localdate()
+    usuario.requisicao('relatorio', 'get', '/api/auth/relatorios/registros/', params={
+        'data_inicio': (hoje - timedelta(days=90)).isoformat(), 'ordering': '-valor_total',
+    })
+    usuario.pausar()
+    formato = usuario.rng.choice(['excel', 'pdf'])
+    usuario.requisicao(f'exportacao_{formato}', 'get', f'/api/auth/relatorios/exportar-{formato}/', params={
+        'data_inicio': (hoje - timedelta(days=90)).isoformat(),
+    })
+
+
+JORNADAS = {'consulta': _consulta, 'edicao': _edicao, 'nova_os': _nova_os, 'relatorios': _relatorios}
+
+
+def distribuir(total, mix):
+    """Usuários virtuais por grupo proporcionais aos pesos (maiores restos)"""
+    pesos = {grupo: peso for grupo, peso in mix.items() if peso > 0}
+    soma = sum(pesos.values())
+    if total < 1 or not soma:
+        return {}
+    cotas = {grupo: total * peso / soma for grupo, peso in pesos.items()}
+    quantidades = {grupo: math.floor(cota) for grupo, cota in cotas.items()}
+    restantes = total - sum(quantidades.values())
+    for grupo in sorted(cotas, key=lambda grupo: cotas[grupo] - quantidades[grupo], reverse=True)[:restantes]:
+        quantidades[grupo] += 1
+    return {grupo: quantidade for grupo, quantidade in quantidades.items() if quantidade}
+
+
+def nome_usuario(grupo, indice):
+    return f'{PREFIXO_USUARIO}{slugify(grupo)}_{indice}'
+
+
+def preparar_usuarios(quantidades, senha):
+    """Cria (se preciso) os usuários de carga de cada grupo com a senha informada; retorna {grupo: [usernames]}"""
+    nomes = {}
+    for grupo, quantidade in quantidades.items():
+        objeto_grupo = Group.objects.get_or_create(name=grupo)[0]
+        nomes[grupo] = []
+        for indice in range(1, quantidade + 1):
+            usuario, criado = User.objects.get_or_create(username=nome_usuario(grupo, indice))
+            if criado or not usuario.check_password(senha):
+                usuario.set_password(senha)
+                usuario.save(update_fields=['password'])
+            usuario.groups.set([objeto_grupo])
+            nomes[grupo].append(usuario.username)
+    return nomes
+
+
+def limpar_carga():
+    """Remove as OS criadas pelos usuários de carga; retorna a quantidade"""
+    return RegistroOS.objects.filter(usuario__username__startswith=PREFIXO_USUARIO).delete()[1].get(
+        RegistroOS._meta.label, 0
+    )
+
+
+def resumir(amostras, segundos):
+    tempos = [amostra['ms'] for amostra in amostras]
+    erros = [amostra['erro'] for amostra in amostras if amostra['erro']]
+    return {
+        'requisicoes': len(amostras),
+        'vazao_rps': round(len(amostras) / segundos, 3) if segundos else None,
+        'erros': len(erros),
+        'taxa_erro': round(len(erros) / len(amostras), 4),
+        'p50_ms': round(_percentil(tempos, 50), 3),
+        'p95_ms': round(_percentil(tempos, 95), 3),
+        'p99_ms': round(_percentil(tempos, 99), 3),
+        'max_ms': round(max(tempos), 3),
+        'media_ms': round(statistics.fmean(tempos), 3),
+        'status': {str(situacao): vezes for situacao, vezes in sorted(Counter(a['status'] for a in amostras).items())},
+        'falhas': dict(Counter(erros).most_common()),
+    }
+
+
+def _agrupar(amostras, chave, segundos):
+    grupos = {}
+    for amostra in amostras:
+        grupos.setdefault(amostra[chave], []).append(amostra)
+    return {nome: resumir(grupo, segundos) for nome, grupo in sorted(grupos.items())}
+
+
+def executar(url, usuarios=10, duracao=60, rampa=10, mix=None, pausa=1.0, escrita=True, senha='carga-local',
+             semente=42, intervalo_painel=30, timeout=120, progresso=None, intervalo_progresso=10):
+    """
+    Roda <usuarios> usuários virtuais contra <url> por <duracao> segundos (a
+    rampa de entrada conta dentro da duração); retorna metadados e os resumos
+    por endpoint, por grupo e geral
+    """
+    mix = mix or MIX_GRUPOS
+    desconhecidos = set(mix) - set(GRUPOS)
+    if desconhecidos:
+        raise ValueError(f"Grupos desconhecidos: {', '.join(sorted(desconhecidos))}")
+    quantidades = distribuir(usuarios, mix)
+    if not quantidades:
+        raise ValueError('Informe ao menos um usuário virtual e um grupo com peso positivo')
+
+    contexto = Contexto(semente)
+    nomes = preparar_usuarios(quantidades, senha)
+    # As threads não usam o banco; a conexão do preparo não precisa ficar aberta durante a carga
+    connection.close()
+
+    inicio = time.monotonic()
+    execucao = Execucao(url, contexto, senha, inicio + duracao, pausa, escrita, intervalo_painel, timeout)
+    ordem = [(grupo, username) for grupo in nomes for username in nomes[grupo]]
+    random.Random(semente).shuffle(ordem)
+    virtuais = [
+        UsuarioVirtual(execucao, grupo, username, inicio + rampa * indice / len(ordem), semente + indice)
+        for indice, (grupo, username) in enumerate(ordem)
+    ]
+    for virtual in virtuais:
+        virtual.start()
+    try:
+        while any(virtual.is_alive() for virtual in virtuais):
+            for virtual in virtuais:
+                virtual.join(timeout=intervalo_progresso / len(virtuais))
+            if progresso:
+                progresso(time.monotonic() - inicio, sum(len(virtual.amostras) for virtual in virtuais))
+    except KeyboardInterrupt:
+        execucao.parar.set()
+        for virtual in virtuais:
+            virtual.join(timeout)
+    segundos = time.monotonic() - inicio
+
+    amostras = [amostra for virtual in virtuais for amostra in virtual.amostras]
+    return {
+        'gerado_em': timezone.now().isoformat(),
+        'commit': _commit(),
+        'url': execucao.url,
+        'usuarios': usuarios,
+        'grupos': quantidades,
+        'duracao_s': round(segundos, 3),
+        'rampa_s': rampa,
+        'pausa_s': pausa,
+        'escrita': escrita,
+        'semente': semente,
+        'total': resumir(amostras, segundos) if amostras else None,
+        'endpoints': _agrupar(amostras, 'endpoint', segundos),
+        'por_grupo': _agrupar(amostras, 'grupo', segundos),
+    }
@@ -0,0 +1,257 @@
+"""
+Cenários de benchmark executados contra os endpoints reais do DRF.
+
+Cada cenário faz requisições pelo APIClient no mesmo processo (middlewares,
+autenticação forçada, permissões, filtros e serializers de verdade). Por
+iteração são medidos o tempo, a quantidade de consultas (execute_wrapper, como
+no InstrumentacaoMiddleware) e o tamanho da resposta. Os cenários que alteram
+dados rodam dentro de uma transação desfeita ao fim da iteração, então a base
+continua igual entre execuções.
+
+As OS, páginas e filtros usados são sorteados com a semente: a mesma base e a
+mesma semente repetem as mesmas requisições. O resultado (executar) é um dict
+serializável em JSON; comparar() aponta as regressões em relação a uma
+execução anterior.
+"""
+import math
+import platform
+import random
+import statistics
+import subprocess
+import time
+from contextlib import ExitStack
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import Max, Min
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from ..instrumentacao import Medicao
+from ..models import (
+    Cliente, Contrato, RegistroOS, StatusDMS, StatusMaterial, StatusOS, TipoCQ, TipoMaterial, UnidadeCliente,
+)
+from .dados import PALAVRAS, PREFIXO_CLIENTE, garantir_cadastros, garantir_usuarios
+
+URL_OS = '/api/ordens-servico/'
+TAMANHO_AMOSTRA = 50
+MAXIMO_PAGINAS = 100
+
+
+class Contexto:
+    """Usuários, OS sorteadas e cadastros usados pelos cenários de uma execução"""
+
+    def __init__(self, semente=42):
+        self.rng = random.Random(semente)
+        admin, tecnicos = garantir_usuarios()
+        self.usuarios = {'admin': admin, 'tecnico': User.objects.get(pk=tecnicos[0])}
+        self.cadastros = garantir_cadastros()
+        self.hoje = timezone.localdate()
+
+        intervalo = RegistroOS.objects.aggregate(menor=Min('pk'), maior=Max('pk'))
+        if intervalo['menor'] is None:
+            raise ValueError('Nenhuma OS na base. Gere os dados com o comando gerar_dados_benchmark')
+        self.ids = sorted({
+            RegistroOS.objects.filter(pk__gte=self.rng.randint(intervalo['menor'], intervalo['maior']))
+            .order_by('pk').values_list('pk', flat=True).first()
+            for _ in range(TAMANHO_AMOSTRA)
+        })
+        self.total_os = RegistroOS.objects.count()
+        self.paginas = max(min(self.total_os // settings.REST_FRAMEWORK['PAGE_SIZE'], MAXIMO_PAGINAS), 1)
+
+        self.cliente = (
+            Cliente.objects.filter(nome__startswith=f'{PREFIXO_CLIENTE} ').order_by('pk').first()
+            or Cliente.objects.order_by('pk').first()
+        )
+        self.status_andamento = StatusOS.objects.get(nome='EM ANDAMENTO').pk
+
+    def id_os(self):
+        return self.rng.choice(self.ids)
+
+    def opcao(self, modelo):
+        return self.rng.choice(self.cadastros[modelo])
+
+    def filhos_os(self):
+        """Tabelas filhas sem anexo, como o formulário de OS envia"""
+        data = (timezone.now() + timedelta(days=15)).strftime('%Y-%m-%dT%H:%M:%S')
+        return {
+            'datas_previstas': [{'data_prevista_entrega': data, 'descricao': 'Entrega parcial'}],
+            'ordens_cliente': [
+                {'numero_ordem': f'OC-{self.rng.randint(1000, 9999)}', 'descricao': 'Ordem do cliente'}
+                for _ in range(3)
+            ],
+            'materiais': [
+                {'tipo_material': self.opcao(TipoMaterial), 'status_material': self.opcao(StatusMaterial)}
+                for _ in range(5)
+            ],
+            'controles_qualidade': [{'tipo_cq': self.opcao(TipoCQ), 'quantidade_cq': 2, 'texto_tamanho_cq': '2"'}],
+            'dms': [{'status_dms': self.opcao(StatusDMS), 'numero_dms': 'DMS-1', 'data_aprovacao_dms': data}],
+        }
+
+    def nova_os(self):
+        dados = {
+            'nome_cliente': self.cliente.pk,
+            'numero_contrato': Contrato.objects.filter(cliente=self.cliente).values_list('pk', flat=True).first(),
+            'unidade_cliente': UnidadeCliente.objects.filter(cliente=self.cliente).values_list('pk', flat=True).first(),
+            'status_os': self.status_andamento,
+            'descricao_resumida': 'OS de benchmark',
+            'havera_valor_fabricacao': 'SIM',
+            'valor_fabricacao': '1500.00',
+        }
+        dados.update(self.filhos_os())
+        return dados
+
+
+class Cenario:
+    """Uma requisição repetida a cada iteração; requisicao(contexto) retorna (caminho, dados)"""
+
+    def __init__(self, nome, metodo, requisicao, usuario='admin', altera=False):
+        self.nome = nome
+        self.metodo = metodo
+        self.requisicao = requisicao
+        self.usuario = usuario
+        self.altera = altera
+
+
+CENARIOS = [
+    Cenario('listagem', 'get', lambda ctx: (URL_OS, {'page': ctx.rng.randint(1, ctx.paginas)})),
+    Cenario('listagem_tecnico', 'get', lambda ctx: (URL_OS, {}), usuario='tecnico'),
+    Cenario('detalhe', 'get', lambda ctx: (f'{URL_OS}{ctx.id_os()}/', {})),
+    Cenario('busca', 'get', lambda ctx: (URL_OS, {'search': ctx.rng.choice(PALAVRAS)})),
+    Cenario('filtros', 'get', lambda ctx: (URL_OS, {
+        'nome_cliente': ctx.cliente.pk, 'status_os': ctx.status_andamento, 'ordering': '-valor_total',
+    })),
+    Cenario('estatisticas', 'get', lambda ctx: ('/api/estatisticas/', {})),
+    Cenario('relatorio', 'get', lambda ctx: ('/api/auth/relatorios/registros/', {
+        'data_inicio': (ctx.hoje - timedelta(days=90)).isoformat(), 'ordering': '-valor_total',
+    })),
+    Cenario('exportacao_excel', 'get', lambda ctx: ('/api/auth/relatorios/exportar-excel/', {
+        'data_inicio': (ctx.hoje - timedelta(days=7)).isoformat(),
+    })),
+    Cenario('criacao_aninhada', 'post', lambda ctx: (URL_OS, ctx.nova_os()), altera=True),
+    Cenario('atualizacao_aninhada', 'patch', lambda ctx: (
+        f'{URL_OS}{ctx.id_os()}/', dict(ctx.filhos_os(), descricao_resumida='OS de benchmark (editada)')
+    ), altera=True),
+]
+
+
+def _tamanho(response):
+    if getattr(response, 'streaming', False):
+        return sum(len(parte) for parte in response.streaming_content)
+    return len(response.content)
+
+
+def _executar_uma(cliente, cenario, contexto):
+    medicao = Medicao()
+    caminho, dados = cenario.requisicao(contexto)
+    with ExitStack() as pilha:
+        for conexao in connections.all():
+            pilha.enter_context(conexao.execute_wrapper(medicao.registrar_consulta))
+        if cenario.altera:
+            pilha.enter_context(transaction.atomic())
+
+        inicio = time.perf_counter()
+        if cenario.metodo == 'get':
+            response = cliente.get(caminho, dados)
+        else:
+            response = getattr(cliente, cenario.metodo)(caminho, dados, format='json')
+        tamanho = _tamanho(response)
+        duracao = time.perf_counter() - inicio
+
+        if cenario.altera:
+            transaction.set_rollback(True)
+    return {'ms': duracao * 1000, 'consultas': medicao.consultas, 'bytes': tamanho, 'status': response.status_code}
+
+
+def _percentil(valores, percentual):
+    ordenados = sorted(valores)
+    return ordenados[max(math.ceil(percentual / 100 * len(ordenados)) - 1, 0)]
+
+
+def resumir(amostras):
+    tempos = [amostra['ms'] for amostra in amostras]
+    return {
+        'iteracoes': len(amostras),
+        'min_ms': round(min(tempos), 3),
+        'mediana_ms': round(statistics.median(tempos), 3),
+        'p95_ms': round(_percentil(tempos, 95), 3),
+        'max_ms': round(max(tempos), 3),
+        'media_ms': round(statistics.fmean(tempos), 3),
+        'consultas': max(amostra['consultas'] for amostra in amostras),
+        'bytes': int(statistics.median(amostra['bytes'] for amostra in amostras)),
+        'status': sorted({amostra['status'] for amostra in amostras}),
+        'erros': sum(1 for amostra in amostras if amostra['status'] >= 400),
+    }
+
+
+def _commit():
+    try:
+        resultado = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return resultado.stdout.strip() or None
+
+
+def executar(nomes=None, iteracoes=20, aquecimento=2, semente=42, progresso=None):
+    """Executa os cenários (todos ou os de <nomes>); retorna metadados e o resumo por cenário"""
+    desconhecidos = set(nomes or []) - {cenario.nome for cenario in CENARIOS}
+    if desconhecidos:
+        raise ValueError(f"Cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    contexto = Contexto(semente)
+    cenarios = [cenario for cenario in CENARIOS if not nomes or cenario.nome in nomes]
+    resultados = {}
+    # Sem cache de página: cada iteração mede o custo real da view
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], CACHE_MIDDLEWARE_SECONDS=0):
+        for cenario in cenarios:
+            cliente = APIClient()
+            cliente.force_authenticate(contexto.usuarios[cenario.usuario])
+            amostras = []
+            for iteracao in range(aquecimento + iteracoes):
+                amostra = _executar_uma(cliente, cenario, contexto)
+                if iteracao >= aquecimento:
+                    amostras.append(amostra)
+            resultados[cenario.nome] = resumir(amostras)
+            if progresso:
+                progresso(cenario.nome, resultados[cenario.nome])
+
+    return {
+        'gerado_em': timezone.now().isoformat(),
+        'commit': _commit(),
+        'banco': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'registros_os': contexto.total_os,
+        'iteracoes': iteracoes,
+        'aquecimento': aquecimento,
+        'semente': semente,
+        'cenarios': resultados,
+    }
+
+
+def comparar(atual, base, tolerancia=0.2, folga_ms=2.0):
+    """
+    Regressões de <atual> em relação a <base>: mediana acima de
+    (1 + tolerancia) x a anterior (e mais de folga_ms), mais consultas ou novos erros
+    """
+    regressoes = []
+    for nome, resultado in atual['cenarios'].items():
+        anterior = base['cenarios'].get(nome)
+        if not anterior:
+            continue
+        limite = max(anterior['mediana_ms'] * (1 + tolerancia), anterior['mediana_ms'] + folga_ms)
+        if resultado['mediana_ms'] > limite:
+            regressoes.append(
+                f"{nome}: mediana {anterior['mediana_ms']:.1f} ms -> {resultado['mediana_ms']:.1f} ms"
+            )
+        if resultado['consultas'] > anterior['consultas']:
+            regressoes.append(f"{nome}: consultas {anterior['consultas']} -> {resultado['consultas']}")
+        if resultado['erros'] > anterior['erros']:
+            regressoes.append(f"{nome}: erros {anterior['erros']} -> {resultado['erros']} (status {resultado['status']})")
+    return regressoes
@@ -0,0 +1,301 @@
+"""
+Geração da base sintética dos benchmarks.
+
+Tudo sai de um random.Random(semente): a mesma semente com os mesmos
+parâmetros gera as mesmas OS, valores, status, datas (relativas à data de
+referência) e linhas filhas. As linhas são gravadas com bulk_create em lotes,
+sem save() nem sinais; os totais das OS são recalculados no banco ao fim de
+cada lote (RegistroOS.recalcular_totais).
+
+Os clientes sintéticos têm o prefixo PREFIXO_CLIENTE, o que permite remover a
+base com limpar_dados(). Os anexos apontam para arquivos que não existem no
+MEDIA_ROOT: os cenários não baixam anexos.
+"""
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import Group, User
+from django.db import models, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from ..arquivamento import relacoes_os
+from ..models import (
+    AprovadorCliente, Cliente, Contrato, OpcaoEspecCQ, RegistroOS, RegistroOSArquivado,
+    SetorUnidadeCliente, SolicitanteCliente, StatusOS, UnidadeCliente,
+)
+
+PREFIXO_CLIENTE = 'BENCH'
+USUARIO_ADMIN = 'benchmark_admin'
+PREFIXO_TECNICO = 'benchmark_tecnico'
+TECNICOS = 5
+
+# Cadastros de cada cliente sintético
+ESTRUTURA_CLIENTE = {Contrato: 3, UnidadeCliente: 3, AprovadorCliente: 2, SolicitanteCliente: 3, OpcaoEspecCQ: 2}
+SETORES_POR_UNIDADE = 2
+
+# Status das OS e o peso de cada um
+STATUS_OS = [('ABERTA', 15), ('APROVADA', 10), ('EM ANDAMENTO', 25), ('CONCLUIDO', 40), ('CANCELADA', 10)]
+OPCOES_CADASTRO = 5
+VALORES_CADASTRO = {'PercentualCQ': ['5%', '10%', '20%', '50%', '100%']}
+PROPORCAO_HAVERA_VALOR = 0.4
+
+PALAVRAS = [
+    'tubulação', 'válvula', 'pintura', 'inspeção', 'montagem', 'caldeiraria', 'flange', 'suporte',
+    'revestimento', 'soldagem', 'manutenção', 'estrutura', 'tanque', 'bomba', 'linha', 'reparo',
+    'fabricação', 'isolamento', 'andaime', 'medição', 'unidade', 'área', 'troca', 'ensaio',
+]
+
+
+def _texto(rng, palavras, limite=None):
+    texto = ' '.join(rng.choice(PALAVRAS) for _ in range(palavras)).capitalize()
+    return texto[:limite] if limite else texto
+
+
+def _campo_texto(modelo):
+    """Campo que identifica o cadastro (nome, numero, status, descricao...)"""
+    return next(campo for campo in modelo._meta.fields if isinstance(campo, models.CharField))
+
+
+def _obter_ou_criar(modelo, **campos):
+    # Alguns cadastros não têm nome único: get_or_create poderia achar mais de um
+    return modelo.objects.filter(**campos).order_by('pk').first() or modelo.objects.create(**campos)
+
+
+def modelos_filhos():
+    """As tabelas filhas da OS, na ordem das relações do modelo"""
+    return [relacao.related_model for relacao in relacoes_os()]
+
+
+def modelos_cadastro():
+    """Tabelas de opções (sem ForeignKey) referenciadas pela OS e pelas tabelas filhas"""
+    encontrados = []
+    for modelo in [RegistroOS] + modelos_filhos():
+        for campo in modelo._meta.fields:
+            alvo = campo.related_model
+            if (
+                isinstance(campo, models.ForeignKey) and alvo not in encontrados and alvo not in (Cliente, User)
+                and not any(isinstance(campo_alvo, models.ForeignKey) for campo_alvo in alvo._meta.fields)
+            ):
+                encontrados.append(alvo)
+    return encontrados
+
+
+def garantir_cadastros():
+    """Cria (se preciso) as opções usadas pela base; retorna {modelo: [pks]}"""
+    cadastros = {}
+    for modelo in modelos_cadastro():
+        campo = _campo_texto(modelo)
+        if modelo is StatusOS:
+            valores = [nome for nome, _ in STATUS_OS]
+        else:
+            valores = VALORES_CADASTRO.get(modelo.__name__) or [
+                f'{PREFIXO_CLIENTE} {modelo._meta.verbose_name} {indice}'.upper()[:campo.max_length]
+                for indice in range(1, OPCOES_CADASTRO + 1)
+            ]
+        cadastros[modelo] = [_obter_ou_criar(modelo, **{campo.name: valor}).pk for valor in valores]
+    return cadastros
+
+
+def _criar_estrutura(cliente):
+    for modelo, quantidade in ESTRUTURA_CLIENTE.items():
+        campo = _campo_texto(modelo).name
+        modelo.objects.bulk_create([
+            modelo(cliente=cliente, **{campo: f'{modelo._meta.verbose_name} {indice}'.upper()})
+            for indice in range(1, quantidade + 1)
+        ])
+    SetorUnidadeCliente.objects.bulk_create([
+        SetorUnidadeCliente(unidade=unidade, nome=f'SETOR {indice}')
+        for unidade in UnidadeCliente.objects.filter(cliente=cliente)
+        for indice in range(1, SETORES_POR_UNIDADE + 1)
+    ])
+
+
+def garantir_clientes(quantidade):
+    """Clientes sintéticos com seus cadastros; retorna {cliente_pk: {modelo: [pks], 'setores': {...}}}"""
+    estruturas = {}
+    for indice in range(1, quantidade + 1):
+        cliente, criado = Cliente.objects.get_or_create(nome=f'{PREFIXO_CLIENTE} CLIENTE {indice:04d}')
+        if criado:
+            _criar_estrutura(cliente)
+
+        estrutura = {
+            modelo: list(modelo.objects.filter(cliente=cliente).order_by('pk').values_list('pk', flat=True))
+            for modelo in ESTRUTURA_CLIENTE
+        }
+        estrutura['setores'] = {unidade: [] for unidade in estrutura[UnidadeCliente]}
+        setores = SetorUnidadeCliente.objects.filter(unidade__cliente=cliente).order_by('pk')
+        for setor, unidade in setores.values_list('pk', 'unidade_id'):
+            estrutura['setores'][unidade].append(setor)
+        estruturas[cliente.pk] = estrutura
+    return estruturas
+
+
+def garantir_usuarios():
+    """Administrador usado pelos cenários e técnicos donos das OS; retorna (admin, [pks dos técnicos])"""
+    def usuario(nome, grupo):
+        objeto, criado = User.objects.get_or_create(username=nome)
+        if criado:
+            objeto.set_unusable_password()
+            objeto.save(update_fields=['password'])
+        objeto.groups.add(Group.objects.get_or_create(name=grupo)[0])
+        return objeto
+
+    admin = usuario(USUARIO_ADMIN, 'Administrador')
+    tecnicos = [usuario(f'{PREFIXO_TECNICO}{indice}', 'Tecnico').pk for indice in range(1, TECNICOS + 1)]
+    return admin, tecnicos
+
+
+def _proximo_numero_os():
+    # Números sequenciais acima dos gerados pelo sistema (6 dígitos): não colidem e não se esgotam
+    maiores = [
+        RegistroOS.objects.aggregate(maior=Max('numero_os'))['maior'] or 0,
+        RegistroOSArquivado.objects.aggregate(maior=Max('numero_os'))['maior'] or 0,
+        999999,
+    ]
+    return max(maiores) + 1
+
+
+@contextmanager
+def _datas_manuais(modelos):
+    """Desliga auto_now/auto_now_add durante a geração para gravar as datas sorteadas"""
+    campos = [
+        (campo, campo.auto_now, campo.auto_now_add)
+        for modelo in modelos for campo in modelo._meta.fields
+        if isinstance(campo, models.DateField) and (campo.auto_now or campo.auto_now_add)
+    ]
+    for campo, _, _ in campos:
+        campo.auto_now = campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, auto_now, auto_now_add in campos:
+            campo.auto_now, campo.auto_now_add = auto_now, auto_now_add
+
+
+def _preencher_cadastros(dados, modelo, cadastros, estrutura, rng):
+    """Sorteia as ForeignKeys para cadastros e para a estrutura do cliente"""
+    for campo in modelo._meta.fields:
+        if isinstance(campo, models.ForeignKey) and campo.attname not in dados:
+            opcoes = estrutura.get(campo.related_model) or cadastros.get(campo.related_model)
+            if opcoes:
+                dados[campo.attname] = rng.choice(opcoes)
+
+
+def _nova_os(numero, referencia, dias, cadastros, estruturas, tecnicos, status_os, rng):
+    cliente = rng.choice(list(estruturas))
+    estrutura = estruturas[cliente]
+    unidade = rng.choice(estrutura[UnidadeCliente])
+    criado = referencia - timedelta(seconds=rng.randrange(dias * 86400))
+
+    dados = {
+        'numero_os': numero,
+        'os_id': uuid.UUID(int=rng.getrandbits(128), version=4),
+        'nome_cliente_id': cliente,
+        'unidade_cliente_id': unidade,
+        'setor_unidade_cliente_id': rng.choice(estrutura['setores'][unidade]),
+        'status_os_id': rng.choices(status_os, weights=[peso for _, peso in STATUS_OS])[0],
+        'usuario_id': rng.choice(tecnicos),
+        'data_solicitacao_os': criado,
+        'data_emissao_os': criado + timedelta(days=rng.randint(0, 5)),
+        'prazo_execucao_servico': criado + timedelta(days=rng.randint(7, 90)),
+        'descricao_resumida': _texto(rng, 6),
+        'descricao_detalhada': _texto(rng, 40),
+        'observacao': _texto(rng, 10) if rng.random() < 0.3 else '',
+        'peso_fabricacao': Decimal(rng.randint(0, 500000)) / 100,
+        'metro_quadrado_pintura_revestimento': Decimal(rng.randint(0, 200000)) / 100,
+        'created_at': criado,
+        'updated_at': min(criado + timedelta(days=rng.randint(0, 60)), referencia),
+    }
+    for campo_havera, campo_valor in RegistroOS.CAMPOS_VALOR:
+        dados[campo_havera] = 'SIM' if rng.random() < PROPORCAO_HAVERA_VALOR else 'NAO'
+        dados[campo_valor] = Decimal(rng.randint(10000, 5000000)) / 100
+    _preencher_cadastros(dados, RegistroOS, cadastros, estrutura, rng)
+
+    registro = RegistroOS(**dados)
+    registro.calcular_soma_valores()
+    return registro
+
+
+def _novo_filho(modelo, registro, referencia, cadastros, estrutura, rng):
+    dados = {
+        'registro_id': registro.pk,
+        'created_at': min(registro.created_at + timedelta(days=rng.randint(0, 30)), referencia),
+    }
+    for campo in modelo._meta.fields:
+        if campo.primary_key or campo.attname in dados or isinstance(campo, models.ForeignKey):
+            continue
+        if isinstance(campo, models.FileField):
+            valor = f'{campo.upload_to}bench-{rng.getrandbits(48):012x}.pdf'
+        elif isinstance(campo, models.DateTimeField):
+            valor = registro.created_at + timedelta(days=rng.randint(0, 120))
+        elif isinstance(campo, models.DecimalField):
+            valor = Decimal(rng.randint(1000, 5000000)) / 100
+        elif isinstance(campo, models.IntegerField):
+            valor = rng.randint(1, 50)
+        elif isinstance(campo, (models.CharField, models.TextField)):
+            valor = _texto(rng, 4, campo.max_length)
+        else:
+            continue
+        dados[campo.attname] = valor
+    _preencher_cadastros(dados, modelo, cadastros, estrutura, rng)
+    return modelo(**dados)
+
+
+def gerar_dados(quantidade_os, clientes=20, filhos=2, anos=3, semente=42, tamanho_lote=1000,
+                referencia=None, progresso=None):
+    """
+    Gera <quantidade_os> OS distribuídas entre <clientes> clientes, com média de
+    <filhos> linhas por tabela filha e created_at nos últimos <anos> anos.
+    Retorna {'registros_os': n, 'filhos': {modelo: n}}.
+    """
+    rng = random.Random(semente)
+    referencia = referencia or timezone.make_aware(datetime.combine(timezone.localdate(), time()))
+    dias = max(int(anos * 365), 1)
+
+    cadastros = garantir_cadastros()
+    estruturas = garantir_clientes(clientes)
+    _, tecnicos = garantir_usuarios()
+    status_os = [cadastros[StatusOS][indice] for indice in range(len(STATUS_OS))]
+    numero = _proximo_numero_os()
+    modelos = modelos_filhos()
+    criados = {'registros_os': 0, 'filhos': {modelo._meta.model_name: 0 for modelo in modelos}}
+
+    with _datas_manuais([RegistroOS] + modelos):
+        for inicio in range(0, quantidade_os, tamanho_lote):
+            quantidade = min(tamanho_lote, quantidade_os - inicio)
+            with transaction.atomic():
+                registros = [
+                    _nova_os(numero + inicio + indice, referencia, dias, cadastros, estruturas, tecnicos, status_os, rng)
+                    for indice in range(quantidade)
+                ]
+                RegistroOS.objects.bulk_create(registros)
+
+                for modelo in modelos:
+                    linhas = [
+                        _novo_filho(modelo, registro, referencia, cadastros, estruturas[registro.nome_cliente_id], rng)
+                        for registro in registros
+                        for _ in range(rng.randint(0, 2 * filhos))
+                    ]
+                    modelo.objects.bulk_create(linhas, batch_size=tamanho_lote)
+                    criados['filhos'][modelo._meta.model_name] += len(linhas)
+
+                RegistroOS.recalcular_totais(RegistroOS.objects.filter(pk__in=[registro.pk for registro in registros]))
+            criados['registros_os'] += quantidade
+            if progresso:
+                progresso(criados['registros_os'], quantidade_os)
+    return criados
+
+
+def limpar_dados():
+    """Remove as OS dos clientes sintéticos (com as tabelas filhas) e os próprios clientes"""
+    registros = RegistroOS.objects.filter(nome_cliente__nome__startswith=f'{PREFIXO_CLIENTE} ')
+    for modelo in modelos_filhos():
+        modelo.objects.filter(registro__in=registros).delete()
+    total = registros.count()
+    registros.delete()
+    Cliente.objects.filter(nome__startswith=f'{PREFIXO_CLIENTE} ').delete()
+    return total
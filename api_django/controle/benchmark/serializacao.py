@@ -0,0 +1,121 @@
+"""
+Vazão dos serializers de OS, fora do HTTP e do banco.
+
+As OS são carregadas uma vez, com os mesmos select_related/prefetch da view;
+as medidas cobrem só os serializers:
+
+- construcao_<perfil>: RegistroOSSerializer com o contexto de uma requisição
+  nova (grupos do usuário e regras de obrigatoriedade) e o mapa de campos de
+  todos os serializers aninhados, em ms;
+- detalhe e listagem: serializer(many=True).data sobre as OS carregadas com
+  RegistroOSSerializer (todas as tabelas filhas, como no detalhe e na
+  exportação) e RegistroOSListSerializer, em OS por segundo.
+
+Tudo é medido com o cache do mapa de campos (CamposEmCacheMixin) desligado e
+ligado; 'ganho' é a razão entre as medianas.
+"""
+import platform
+import statistics
+import time
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from ..serializers import CamposEmCacheMixin, RegistroOSListSerializer, RegistroOSSerializer
+from .cenarios import URL_OS, _commit, _percentil
+from .dados import garantir_usuarios
+
+SERIALIZERS = {'detalhe': RegistroOSSerializer, 'listagem': RegistroOSListSerializer}
+
+
+def _request(usuario):
+    request = Request(APIRequestFactory().get(URL_OS))
+    request.user = usuario
+    return request
+
+
+def _contexto(usuario):
+    return {'request': _request(usuario), 'user': usuario}
+
+
+def _carregar(usuario, quantidade):
+    """OS com as relações que a view carrega (o queryset do RegistroOSViewSet)"""
+    from ..views import RegistroOSViewSet
+
+    viewset = RegistroOSViewSet(request=_request(usuario), action='list', format_kwarg=None)
+    return list(viewset.get_queryset().order_by('pk')[:quantidade])
+
+
+def construir(usuario):
+    """Serializer de detalhe com os campos de todos os aninhados montados"""
+    serializer = RegistroOSSerializer(context=_contexto(usuario))
+    for campo in serializer.fields.values():
+        filho = getattr(campo, 'child', None)
+        if isinstance(filho, serializers.Serializer):
+            filho.fields
+    return serializer
+
+
+def _medir(funcao, iteracoes, aquecimento):
+    tempos = []
+    for iteracao in range(aquecimento + iteracoes):
+        inicio = time.perf_counter()
+        funcao()
+        if iteracao >= aquecimento:
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    return {
+        'mediana_ms': round(statistics.median(tempos), 3),
+        'p95_ms': round(_percentil(tempos, 95), 3),
+        'min_ms': round(min(tempos), 3),
+    }
+
+
+def _medidas(usuarios, registros, iteracoes, aquecimento):
+    medidas = {}
+    for perfil, usuario in usuarios.items():
+        medidas[f'construcao_{perfil}'] = _medir(lambda: construir(usuario), iteracoes * 10, aquecimento)
+    admin = usuarios['admin']
+    for nome, classe in SERIALIZERS.items():
+        resumo = _medir(lambda: classe(registros, many=True, context=_contexto(admin)).data, iteracoes, aquecimento)
+        resumo['os_por_segundo'] = round(len(registros) / (resumo['mediana_ms'] / 1000), 1)
+        medidas[nome] = resumo
+    return medidas
+
+
+def executar(quantidade=100, iteracoes=10, aquecimento=2):
+    """Mede construção e representação com o cache de campos desligado e ligado; retorna um dict serializável em JSON"""
+    admin, tecnicos = garantir_usuarios()
+    usuarios = {'admin': admin, 'tecnico': User.objects.get(pk=tecnicos[0])}
+    registros = _carregar(admin, quantidade)
+    if not registros:
+        raise ValueError('Nenhuma OS na base. Gere os dados com o comando gerar_dados_benchmark')
+
+    original = CamposEmCacheMixin.cache_campos
+    resultados = {}
+    try:
+        for chave, ligado in (('sem_cache', False), ('com_cache', True)):
+            CamposEmCacheMixin.cache_campos = ligado
+            resultados[chave] = _medidas(usuarios, registros, iteracoes, aquecimento)
+    finally:
+        CamposEmCacheMixin.cache_campos = original
+
+    return {
+        'gerado_em': timezone.now().isoformat(),
+        'commit': _commit(),
+        'banco': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'registros_os': len(registros),
+        'iteracoes': iteracoes,
+        'aquecimento': aquecimento,
+        **resultados,
+        'ganho': {
+            nome: round(resultados['sem_cache'][nome]['mediana_ms'] / resultados['com_cache'][nome]['mediana_ms'], 2)
+            for nome in resultados['com_cache'] if resultados['com_cache'][nome]['mediana_ms']
+        },
+    }
@@ -0,0 +1,23 @@
+"""
+Cache de página (UpdateCacheMiddleware, só em produção) separado por usuário.
+
+As rotas da API respondem conforme o usuário do token JWT (OS visíveis,
+perfil, estatísticas, relatórios), mas o cabeçalho Authorization não entra na
+chave do cache de página: sem o Vary, um usuário recebia por até
+CACHE_MIDDLEWARE_SECONDS a resposta guardada para outro. Fica no fim de
+MIDDLEWARE_BASE, dentro do UpdateCacheMiddleware, para o Vary já estar na
+resposta quando ela for guardada.
+"""
+from django.utils.cache import patch_vary_headers
+
+
+class CachePorUsuarioMiddleware:
+    """Acrescenta Vary: Authorization às respostas"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -0,0 +1,194 @@
+"""
+Log de consultas lentas, com o plano de execução de cada consulta nova.
+
+O ConsultasLentasMiddleware envolve as conexões (execute_wrapper) durante a
+requisição. Toda consulta acima de CONSULTAS_LENTAS_LIMITE_MS é sorteada com
+CONSULTAS_LENTAS_AMOSTRAGEM e gravada como uma linha JSON no logger
+controle.consultas_lentas (arquivo rotativo CONSULTAS_LENTAS_ARQUIVO) com:
+
+- impressao: hash da SQL normalizada (a mesma de instrumentacao.assinatura);
+- sql normalizada e o formato dos parâmetros (tipos, nunca os valores);
+- duração, rota (método + nome da URL) e alias do banco;
+- plano: na primeira vez que a impressão aparece no processo, com
+  CONSULTAS_LENTAS_EXPLAIN, o EXPLAIN (ANALYZE off) da consulta. O plano é
+  estimado, a consulta não é executada de novo.
+
+O comando consultas_lentas resume o arquivo (piores consultas por tempo total,
+máximo, média ou quantidade).
+"""
+import glob
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from .instrumentacao import assinatura, nome_rota
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_MAXIMO_SQL = 4000
+COMANDOS_EXPLICAVEIS = ('SELECT', 'WITH')
+SAVEPOINT = 'consultas_lentas_explain'
+
+_explicadas = set()
+_trava_explicadas = threading.Lock()
+
+
+def impressao(sql):
+    return hashlib.sha1(assinatura(sql).encode('utf-8')).hexdigest()[:16]
+
+
+def formato_parametros(params, many=False):
+    """Tipos dos parâmetros; em executemany, a quantidade de linhas e o formato da primeira"""
+    if many:
+        linhas = list(params or [])
+        return {'linhas': len(linhas), 'formato': formato_parametros(linhas[0]) if linhas else []}
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {chave: type(valor).__name__ for chave, valor in params.items()}
+    return [type(valor).__name__ for valor in params]
+
+
+def _primeira_vez(chave):
+    with _trava_explicadas:
+        if chave in _explicadas:
+            return False
+        _explicadas.add(chave)
+        return True
+
+
+def explicar(conexao, sql, params):
+    """Plano estimado da consulta, ou None se o banco não suportar ou o EXPLAIN falhar"""
+    if conexao.vendor == 'postgresql':
+        prefixo = 'EXPLAIN (ANALYZE off, FORMAT JSON) '
+    elif conexao.vendor == 'sqlite':
+        prefixo = 'EXPLAIN QUERY PLAN '
+    else:
+        return None
+    # Cursor cru, fora dos execute_wrappers, para não contar nem registrar o próprio EXPLAIN.
+    # Dentro de transação, savepoint: um EXPLAIN com erro não pode abortar a transação da requisição
+    savepoint = conexao.in_atomic_block
+    with conexao.cursor() as cursor:
+        cru = cursor.cursor
+        try:
+            if savepoint:
+                cru.execute(f'SAVEPOINT {SAVEPOINT}')
+            if params is None:
+                cru.execute(prefixo + sql)
+            else:
+                cru.execute(prefixo + sql, params)
+            linhas = cru.fetchall()
+        except (DatabaseError, conexao.Database.Error):
+            logger.debug('EXPLAIN falhou para %s', sql[:200], exc_info=True)
+            if savepoint:
+                cru.execute(f'ROLLBACK TO SAVEPOINT {SAVEPOINT}')
+            return None
+        if savepoint:
+            cru.execute(f'RELEASE SAVEPOINT {SAVEPOINT}')
+    if conexao.vendor == 'postgresql':
+        plano = linhas[0][0]
+        return json.loads(plano) if isinstance(plano, str) else plano
+    return [' | '.join(str(coluna) for coluna in linha) for linha in linhas]
+
+
+class Coletor:
+    """execute_wrapper de uma requisição"""
+
+    def __init__(self, request):
+        self.request = request
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        resultado = execute(sql, params, many, context)
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        if duracao_ms >= settings.CONSULTAS_LENTAS_LIMITE_MS and random.random() < settings.CONSULTAS_LENTAS_AMOSTRAGEM:
+            self.registrar(context['connection'], sql, params, many, duracao_ms)
+        return resultado
+
+    def registrar(self, conexao, sql, params, many, duracao_ms):
+        normalizada = assinatura(sql)
+        chave = impressao(sql)
+        registro = {
+            'em': timezone.now().isoformat(),
+            'impressao': chave,
+            'ms': round(duracao_ms, 3),
+            'rota': nome_rota(self.request),
+            'banco': conexao.alias,
+            'sql': normalizada[:TAMANHO_MAXIMO_SQL],
+            'parametros': formato_parametros(params, many),
+        }
+        explicavel = not many and normalizada.upper().startswith(COMANDOS_EXPLICAVEIS)
+        if settings.CONSULTAS_LENTAS_EXPLAIN and explicavel and _primeira_vez((conexao.alias, chave)):
+            registro['plano'] = explicar(conexao, sql, params)
+        logger.info(json.dumps(registro, ensure_ascii=False, default=str))
+
+
+class ConsultasLentasMiddleware:
+    def __init__(self, get_response):
+        if not settings.CONSULTAS_LENTAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        coletor = Coletor(request)
+        with ExitStack() as pilha:
+            for conexao in connections.all():
+                pilha.enter_context(conexao.execute_wrapper(coletor))
+            return self.get_response(request)
+
+
+def arquivos_log(arquivo=None):
+    """Arquivo do log e os rotacionados (.1, .2, ...), dos mais antigos para o atual"""
+    arquivo = arquivo or settings.CONSULTAS_LENTAS_ARQUIVO
+    rotacionados = [nome for nome in glob.glob(f'{glob.escape(arquivo)}.*') if nome.rsplit('.', 1)[-1].isdigit()]
+    rotacionados.sort(key=lambda nome: int(nome.rsplit('.', 1)[-1]), reverse=True)
+    return rotacionados + [arquivo]
+
+
+def ler_registros(arquivos):
+    for caminho in arquivos:
+        try:
+            entrada = open(caminho, encoding='utf-8')
+        except FileNotFoundError:
+            continue
+        with entrada:
+            for linha in entrada:
+                try:
+                    yield json.loads(linha)
+                except ValueError:
+                    continue
+
+
+def resumir(registros, desde=None, rota=None):
+    """Agrupa por impressão: quantidade, tempos, rotas, SQL e o último plano registrado"""
+    grupos = {}
+    for registro in registros:
+        if desde and registro.get('em', '') < desde:
+            continue
+        if rota and rota not in (registro.get('rota') or ''):
+            continue
+        grupo = grupos.get(registro['impressao'])
+        if grupo is None:
+            grupo = grupos[registro['impressao']] = {
+                'impressao': registro['impressao'], 'sql': registro['sql'], 'quantidade': 0,
+                'total_ms': 0.0, 'max_ms': 0.0, 'rotas': {}, 'plano': None, 'ultima': None,
+            }
+        grupo['quantidade'] += 1
+        grupo['total_ms'] += registro['ms']
+        grupo['max_ms'] = max(grupo['max_ms'], registro['ms'])
+        grupo['rotas'][registro.get('rota')] = grupo['rotas'].get(registro.get('rota'), 0) + 1
+        grupo['ultima'] = max(grupo['ultima'] or '', registro.get('em', ''))
+        if registro.get('plano') is not None:
+            grupo['plano'] = registro['plano']
+    for grupo in grupos.values():
+        grupo['media_ms'] = grupo['total_ms'] / grupo['quantidade']
+    return list(grupos.values())
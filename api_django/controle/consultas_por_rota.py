@@ -0,0 +1,138 @@
+"""
+Contagem de consultas por rota da API, para os testes de regressão de N+1.
+
+rotas_api() percorre as URLs de controle.urls e authentication.urls (rotas
+dos routers e views de função) e medir_rotas() faz um GET autenticado em cada
+rota que aceita GET, com página grande o bastante para trazer todas as linhas,
+contando as consultas. O teste mede com bases de dois tamanhos: a contagem não
+pode crescer com o número de linhas nem passar da baseline gravada em
+consultas_baseline.json (versionada junto com o código).
+
+Para regravar a baseline depois de uma mudança intencional:
+
+    ATUALIZAR_BASELINE_CONSULTAS=1 python manage.py test controle.tests.ConsultasPorRotaTestCase
+"""
+import json
+import os
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from rest_framework.pagination import PageNumberPagination
+
+MODULOS = ('controle.urls', 'authentication.urls')
+ARQUIVO_BASELINE = os.path.join(os.path.dirname(__file__), 'consultas_baseline.json')
+TAMANHO_PAGINA = 1000
+
+
+class Rota:
+    def __init__(self, nome, parametros, view):
+        self.nome = nome
+        self.parametros = parametros
+        self.view = view
+
+    def aceita_get(self):
+        acoes = getattr(self.view, 'actions', None)
+        if acoes is not None:
+            return 'get' in acoes
+        classe = getattr(self.view, 'cls', None) or getattr(self.view, 'view_class', None)
+        return classe is None or hasattr(classe, 'get')
+
+    def modelo(self):
+        """Modelo do serializer/queryset da view (rotas de router)"""
+        classe = getattr(self.view, 'cls', None)
+        queryset = getattr(classe, 'queryset', None)
+        if queryset is not None:
+            return queryset.model
+        meta = getattr(getattr(classe, 'serializer_class', None), 'Meta', None)
+        return getattr(meta, 'model', None)
+
+
+def _percorrer(padroes, namespace='', incluir=False):
+    for padrao in padroes:
+        if isinstance(padrao, URLResolver):
+            modulo = getattr(padrao.urlconf_name, '__name__', padrao.urlconf_name)
+            prefixo = f'{namespace}{padrao.namespace}:' if padrao.namespace else namespace
+            yield from _percorrer(padrao.url_patterns, prefixo, incluir or modulo in MODULOS)
+        elif incluir and padrao.name:
+            yield Rota(namespace + padrao.name, set(padrao.pattern.regex.groupindex), padrao.callback)
+
+
+def rotas_api():
+    """Rotas nomeadas da API, sem as variações com sufixo de formato (.json)"""
+    rotas = {}
+    for rota in _percorrer(get_resolver().url_patterns):
+        if 'format' not in rota.parametros:
+            rotas.setdefault(rota.nome, rota)
+    return [rotas[nome] for nome in sorted(rotas)]
+
+
+def parametros_padrao(rota):
+    """Parâmetros de rotas de router (pk, registro_pk) a partir do primeiro objeto do modelo"""
+    modelo = rota.modelo()
+    if modelo is None or not rota.parametros <= {'pk', 'registro_pk'}:
+        return None
+    objeto = modelo.objects.order_by('pk').first()
+    if objeto is None:
+        return None
+    valores = {'pk': objeto.pk, 'registro_pk': getattr(objeto, 'registro_id', None)}
+    return {nome: valores[nome] for nome in rota.parametros}
+
+
+def contar_consultas(cliente, caminho):
+    """(consultas, status) de um GET; respostas em streaming são consumidas dentro da contagem"""
+    cache.clear()
+    with CaptureQueriesContext(connection) as consultas:
+        response = cliente.get(caminho, {'page_size': TAMANHO_PAGINA})
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+    return len(consultas), response.status_code
+
+
+def medir_rotas(cliente, parametros=None):
+    """
+    Mede todas as rotas com GET. Retorna (medições, rotas sem parâmetros):
+    medições é {rota: {'consultas': n, 'status': código}}; parametros
+    ({rota: kwargs}) tem precedência sobre parametros_padrao.
+    """
+    parametros = parametros or {}
+    medicoes, sem_parametros = {}, []
+    with patch.object(PageNumberPagination, 'page_size', TAMANHO_PAGINA):
+        for rota in rotas_api():
+            if not rota.aceita_get():
+                continue
+            kwargs = {}
+            if rota.parametros:
+                kwargs = parametros.get(rota.nome) or parametros_padrao(rota)
+                if not kwargs:
+                    sem_parametros.append(rota.nome)
+                    continue
+            quantidade, status = contar_consultas(cliente, reverse(rota.nome, kwargs=kwargs))
+            medicoes[rota.nome] = {'consultas': quantidade, 'status': status}
+    return medicoes, sem_parametros
+
+
+def ler_baseline(arquivo=ARQUIVO_BASELINE):
+    with open(arquivo, encoding='utf-8') as entrada:
+        return json.load(entrada)
+
+
+def gravar_baseline(medicoes, arquivo=ARQUIVO_BASELINE):
+    with open(arquivo, 'w', encoding='utf-8') as saida:
+        json.dump(medicoes, saida, indent=2, sort_keys=True, ensure_ascii=False)
+        saida.write('\n')
+
+
+def comparar_baseline(medicoes, baseline):
+    """Rotas com mais consultas que a baseline, rotas novas e rotas que deixaram de existir"""
+    problemas = []
+    for nome, medicao in sorted(medicoes.items()):
+        anterior = baseline.get(nome)
+        if anterior is None:
+            problemas.append(f'{nome}: rota nova, sem baseline ({medicao["consultas"]} consultas)')
+        elif medicao['consultas'] > anterior['consultas']:
+            problemas.append(f'{nome}: {anterior["consultas"]} -> {medicao["consultas"]} consultas')
+    problemas.extend(f'{nome}: rota da baseline não existe mais' for nome in sorted(set(baseline) - set(medicoes)))
+    return problemas
@@ -0,0 +1,267 @@
+"""
+Download de anexos com checagem de permissão.
+
+Com settings.DOWNLOAD_X_ACCEL o Django só autoriza e devolve um
+X-Accel-Redirect; o nginx envia o arquivo (sendfile) e trata Range e
+requisições condicionais sem ocupar um worker do gunicorn. Sem nginx
+(desenvolvimento/testes) o próprio Django serve o arquivo, com suporte a
+Range de um intervalo, If-Range, ETag e Last-Modified.
+
+Também gera pacotes ZIP com os anexos de várias OS em streaming: o arquivo é
+montado sob demanda, bloco a bloco, sem arquivo temporário nem o ZIP inteiro
+em memória.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+import zipfile
+from datetime import datetime
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.text import get_valid_filename
+
+from .models import DocumentoSolicitacao, DocumentoEntrada, Levantamento, Gmi, Gme, Rtip, Rtm, NfSaida, NfVenda
+from .miniaturas import campos_arquivo, derivados_atuais
+
+TAMANHO_BLOCO = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CACHE_CONTROL = 'private, no-cache'
+LOTE_PACOTE = 500
+
+# Tipos de anexo: segmento da URL / pasta no ZIP -> modelo
+MODELOS_ANEXO = {
+    'documentos-solicitacao': DocumentoSolicitacao,
+    'documentos-entrada': DocumentoEntrada,
+    'levantamentos': Levantamento,
+    'gmis': Gmi,
+    'gmes': Gme,
+    'rtips': Rtip,
+    'rtms': Rtm,
+    'notas-fiscais-saida': NfSaida,
+    'notas-fiscais-venda': NfVenda,
+}
+TIPOS_ANEXO = {modelo: tipo for tipo, modelo in MODELOS_ANEXO.items()}
+DERIVADOS = ('miniatura', 'preview')
+
+
+def etag_arquivo(info):
+    """ETag no mesmo formato do nginx (mtime-tamanho em hexa), válido nos dois modos"""
+    return f'"{int(info.st_mtime):x}-{info.st_size:x}"'
+
+
+def content_disposition(nome, inline=False):
+    tipo = 'inline' if inline else 'attachment'
+    nome = os.path.basename(nome)
+    return f"{tipo}; filename*=UTF-8''{quote(nome)}"
+
+
+def intervalo_solicitado(request, tamanho, etag, last_modified):
+    """
+    Retorna (inicio, fim) do Range pedido, None para o arquivo inteiro ou
+    False se o intervalo não pode ser atendido (416).
+    Múltiplos intervalos são ignorados e o arquivo inteiro é enviado (RFC 9110).
+    """
+    cabecalho = request.META.get('HTTP_RANGE', '').strip()
+    if not cabecalho:
+        return None
+
+    if_range = request.META.get('HTTP_IF_RANGE', '').strip()
+    if if_range:
+        data_if_range = parse_http_date_safe(if_range)
+        if if_range != etag and (data_if_range is None or data_if_range < int(last_modified)):
+            return None
+
+    match = RANGE_RE.match(cabecalho.replace(' ', ''))
+    if not match:
+        return None
+
+    inicio, fim = match.groups()
+    if not inicio and not fim:
+        return None
+    if not inicio:
+        # Sufixo: os últimos N bytes
+        sufixo = int(fim)
+        if sufixo == 0:
+            return False
+        return max(tamanho - sufixo, 0), tamanho - 1
+
+    inicio = int(inicio)
+    fim = min(int(fim), tamanho - 1) if fim else tamanho - 1
+    if inicio >= tamanho or inicio > fim:
+        return False
+    return inicio, fim
+
+
+def ler_intervalo(caminho, inicio, quantidade):
+    with open(caminho, 'rb') as arquivo:
+        arquivo.seek(inicio)
+        while quantidade > 0:
+            bloco = arquivo.read(min(TAMANHO_BLOCO, quantidade))
+            if not bloco:
+                break
+            quantidade -= len(bloco)
+            yield bloco
+
+
+def urls_anexo(instancia, campo):
+    """
+    Campos <campo>_url, <campo>_miniatura e <campo>_preview para o
+    to_representation. Todos apontam para a rota protegida de download: o
+    /media/ não é servido publicamente.
+    """
+    arquivo = getattr(instancia, campo)
+    url = reverse('download_anexo', args=[TIPOS_ANEXO[type(instancia)], instancia.pk]) if arquivo and instancia.pk else None
+    resultado = {f'{campo}_url': url}
+    derivados = derivados_atuais(instancia, campo)
+    for derivado in DERIVADOS:
+        resultado[f'{campo}_{derivado}'] = f'{url}?derivado={derivado}&inline=1' if url and derivado in derivados else None
+    return resultado
+
+
+def servir_anexo(request, nome, inline=False):
+    """Resposta de download do arquivo do storage (acesso já autorizado)"""
+    try:
+        caminho = default_storage.path(nome)
+        info = os.stat(caminho)
+    except (FileNotFoundError, NotImplementedError):
+        return None
+
+    etag = etag_arquivo(info)
+    last_modified = info.st_mtime
+    tipo = mimetypes.guess_type(nome)[0]
+
+    # 304/412 antes de tocar no arquivo (vale também com X-Accel).
+    # "private" também impede o UpdateCacheMiddleware de guardar a resposta.
+    nao_modificado = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if nao_modificado is not None:
+        nao_modificado['Cache-Control'] = CACHE_CONTROL
+        return nao_modificado
+
+    if settings.DOWNLOAD_X_ACCEL:
+        # ETag, Last-Modified e Range ficam a cargo do nginx
+        response = HttpResponse(content_type=tipo or 'application/octet-stream')
+        response['X-Accel-Redirect'] = settings.DOWNLOAD_X_ACCEL_PREFIX + quote(nome)
+    else:
+        intervalo = intervalo_solicitado(request, info.st_size, etag, last_modified)
+        if intervalo is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{info.st_size}'
+            return response
+
+        inicio, fim = intervalo or (0, info.st_size - 1)
+        quantidade = max(fim - inicio + 1, 0)
+        conteudo = ler_intervalo(caminho, inicio, quantidade) if request.method != 'HEAD' else []
+        response = StreamingHttpResponse(conteudo, content_type=tipo or 'application/octet-stream')
+        response['Content-Length'] = str(quantidade)
+        if intervalo:
+            response.status_code = 206
+            response['Content-Range'] = f'bytes {inicio}-{fim}/{info.st_size}'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+    response['Cache-Control'] = CACHE_CONTROL
+    response['Content-Disposition'] = content_disposition(nome, inline)
+    return response
+
+
+def pasta_os(pk, numero_os):
+    return get_valid_filename(f'OS-{numero_os}') if numero_os else f'OS-id{pk}'
+
+
+def anexos_das_os(registros):
+    """
+    Itera (nome no ZIP, FieldFile) dos anexos das OS informadas como pares
+    (pk, numero_os), na ordem recebida. Layout: OS-<numero>/<tipo>/<id>-<arquivo>.
+    As consultas são feitas em lotes de OS (uma por tipo de anexo).
+    """
+    registros = list(registros)
+    for inicio in range(0, len(registros), LOTE_PACOTE):
+        lote = registros[inicio:inicio + LOTE_PACOTE]
+        ordem = {pk: posicao for posicao, (pk, numero_os) in enumerate(lote)}
+        pastas = {pk: pasta_os(pk, numero_os) for pk, numero_os in lote}
+
+        anexos = []
+        for posicao_tipo, (tipo, modelo) in enumerate(MODELOS_ANEXO.items()):
+            campo = campos_arquivo(modelo)[0]
+            for anexo in modelo.objects.filter(registro_id__in=ordem).exclude(**{campo: ''}).only('pk', 'registro_id', campo):
+                anexos.append((ordem[anexo.registro_id], posicao_tipo, anexo.pk, tipo, anexo, campo))
+
+        for _, _, pk, tipo, anexo, campo in sorted(anexos, key=lambda item: item[:3]):
+            arquivo = getattr(anexo, campo)
+            nome = posixpath.join(pastas[anexo.registro_id], tipo, f'{pk}-{os.path.basename(arquivo.name)}')
+            yield nome, arquivo
+
+
+class SaidaZip:
+    """Destino do ZipFile sem seek: acumula o que foi escrito até ser drenado"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def zip_em_streaming(anexos):
+    """
+    Gera os bytes de um ZIP com os anexos (nome no ZIP, FieldFile) em blocos.
+    Os arquivos são armazenados sem compressão (PDF/JPG/DWG já são
+    comprimidos) e com ZIP64, então o tamanho do pacote não tem limite.
+    Anexos ausentes no disco são listados em arquivos_ausentes.txt.
+    """
+    saida = SaidaZip()
+    ausentes = []
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as pacote:
+        for nome, arquivo in anexos:
+            try:
+                caminho = default_storage.path(arquivo.name)
+                info = os.stat(caminho)
+            except (FileNotFoundError, NotImplementedError):
+                ausentes.append(nome)
+                continue
+
+            data = datetime.fromtimestamp(max(info.st_mtime, 315532800))  # ZIP não aceita datas antes de 1980
+            zinfo = zipfile.ZipInfo(nome, date_time=data.timetuple()[:6])
+            zinfo.file_size = info.st_size
+            with open(caminho, 'rb') as origem, pacote.open(zinfo, 'w', force_zip64=True) as destino:
+                for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                    destino.write(bloco)
+                    yield saida.drenar()
+            # Descritor de dados (CRC/tamanhos) escrito ao fechar a entrada
+            yield saida.drenar()
+
+        if ausentes:
+            pacote.writestr('arquivos_ausentes.txt', '\n'.join(ausentes) + '\n')
+    yield saida.drenar()
+
+
+def resposta_pacote(registros, nome_arquivo):
+    """StreamingHttpResponse com o ZIP dos anexos das OS (pares pk, numero_os)"""
+    response = StreamingHttpResponse(zip_em_streaming(anexos_das_os(registros)), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition(nome_arquivo)
+    response['Cache-Control'] = CACHE_CONTROL
+    # O nginx repassa os blocos direto ao cliente, sem bufferizar em disco
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -1,6 +1,7 @@
 import django_filters
 from django.db.models import Q
-from .models import RegistroOS, StatusOS, StatusLevantamento, StatusProducao, RegimeOS
+from django.http import QueryDict
+from .models import AuditoriaOS, RegistroOS, RegistroOSArquivado, StatusOS, StatusLevantamento, StatusProducao, RegimeOS
 
 
 class RegistroOSFilter(django_filters.FilterSet):
@@ -45,6 +46,8 @@ class RegistroOSFilter(django_filters.FilterSet):
     # Filtros por valores
     valor_minimo = django_filters.NumberFilter(field_name='soma_valores', lookup_expr='gte')
     valor_maximo = django_filters.NumberFilter(field_name='soma_valores', lookup_expr='lte')
+    valor_total_minimo = django_filters.NumberFilter(field_name='valor_total', lookup_expr='gte')
+    valor_total_maximo = django_filters.NumberFilter(field_name='valor_total', lookup_expr='lte')
     
     # Filtro por usuário responsável
     usuario = django_filters.ModelChoiceFilter(
@@ -147,6 +150,58 @@ class RegistroOSFilter(django_filters.FilterSet):
         ).distinct()
 
 
+
+class RegistroOSArquivadoFilter(django_filters.FilterSet):
+    """
+    Filtros da listagem de OS que também valem para as OS arquivadas
+    (as colunas copiadas para RegistroOSArquivado)
+    """
+    
+    data_criacao_inicio = django_filters.DateFilter(field_name='created_at', lookup_expr='gte')
+    data_criacao_fim = django_filters.DateFilter(field_name='created_at', lookup_expr='lte')
+    status_os = django_filters.ModelMultipleChoiceFilter(queryset=StatusOS.objects.all(), field_name='status_os')
+    nome_cliente = django_filters.ModelMultipleChoiceFilter(
+        queryset=RegistroOS._meta.get_field('nome_cliente').remote_field.model.objects.all(),
+        field_name='nome_cliente'
+    )
+    valor_total_minimo = django_filters.NumberFilter(field_name='valor_total', lookup_expr='gte')
+    valor_total_maximo = django_filters.NumberFilter(field_name='valor_total', lookup_expr='lte')
+    numero_os = django_filters.NumberFilter(field_name='numero_os')
+    
+    class Meta:
+        model = RegistroOSArquivado
+        fields = ['usuario']
+
+
+class AuditoriaOSFilter(django_filters.FilterSet):
+    """Histórico de alterações por OS, usuário, tabela e período (desde/ate em data ou data e hora)"""
+    
+    os = django_filters.NumberFilter(field_name='os_id')
+    desde = django_filters.DateTimeFilter(field_name='criado_em', lookup_expr='gte')
+    ate = django_filters.DateTimeFilter(field_name='criado_em', lookup_expr='lte')
+    
+    class Meta:
+        model = AuditoriaOS
+        fields = ['usuario', 'modelo', 'acao']
+
+
+def filtrar_por_argumentos(queryset, filtros):
+    """
+    Aplica filtros no formato CAMPO=VALOR (ex.: opções --filtro dos comandos)
+    com o mesmo RegistroOSFilter da API. Levanta ValueError se inválidos.
+    """
+    dados = QueryDict(mutable=True)
+    for filtro in filtros:
+        if '=' not in filtro:
+            raise ValueError(f'Filtro inválido "{filtro}". Use CAMPO=VALOR')
+        campo, valor = filtro.split('=', 1)
+        dados.appendlist(campo, valor)
+
+    filterset = RegistroOSFilter(data=dados, queryset=queryset)
+    if not filterset.is_valid():
+        raise ValueError(f'Filtros inválidos: {dict(filterset.errors)}')
+    return filterset.qs
+
 class DateRangeFilter(django_filters.FilterSet):
     """
     Filtro genérico para intervalos de data
@@ -0,0 +1,335 @@
+"""
+Importação em lote de OS a partir de planilhas CSV/XLSX.
+
+Os cabeçalhos seguem os nomes dos campos de RegistroOS. Campos relacionais
+aceitam o nome do cadastro (ex.: nome_cliente=BRASKEM), resolvido por um
+mapa carregado uma única vez por tabela. As colunas ordens_cliente,
+datas_previstas e acoes_solicitacao aceitam vários valores separados por '|'.
+"""
+import csv
+import io
+import logging
+import random
+import unicodedata
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+from .models import (
+    RegistroOS, OrdemCliente, DataPrevistaEntrega, AcaoSolicitacao, AcaoSolicitacaoOption,
+    Cliente, Contrato, UnidadeCliente, SetorUnidadeCliente, AprovadorCliente, SolicitanteCliente,
+    RegimeOS, NomeDiligenciadorOS, NomeResponsavelExecucaoServico, Demanda,
+    StatusOS, StatusOSManual, StatusOSEletronica, StatusLevantamento, StatusProducao,
+)
+
+logger = logging.getLogger(__name__)
+
+# Campo da OS: (modelo do cadastro, campo com o nome, (campo de escopo no cadastro, campo da OS))
+# Cadastros com escopo (ex.: contrato do cliente) vêm depois do campo que os delimita
+CAMPOS_RELACIONAIS = {
+    'nome_cliente': (Cliente, 'nome', None),
+    'status_regime_os': (RegimeOS, 'nome', None),
+    'nome_diligenciador_os': (NomeDiligenciadorOS, 'nome', None),
+    'nome_responsavel_execucao_servico': (NomeResponsavelExecucaoServico, 'nome', None),
+    'id_demanda': (Demanda, 'nome', None),
+    'status_os': (StatusOS, 'nome', None),
+    'status_os_manual': (StatusOSManual, 'nome', None),
+    'status_os_eletronica': (StatusOSEletronica, 'nome', None),
+    'status_levantamento': (StatusLevantamento, 'nome', None),
+    'status_producao': (StatusProducao, 'nome', None),
+    'numero_contrato': (Contrato, 'numero', ('cliente_id', 'nome_cliente')),
+    'unidade_cliente': (UnidadeCliente, 'nome', ('cliente_id', 'nome_cliente')),
+    'setor_unidade_cliente': (SetorUnidadeCliente, 'nome', ('unidade_id', 'unidade_cliente')),
+    'nome_solicitante_cliente': (SolicitanteCliente, 'nome', ('cliente_id', 'nome_cliente')),
+    'nome_responsavel_aprovacao_os_cliente': (AprovadorCliente, 'nome', ('cliente_id', 'nome_cliente')),
+}
+
+# Coluna: (modelo filho, campo preenchido com cada valor)
+CAMPOS_FILHOS = {
+    'ordens_cliente': (OrdemCliente, 'numero_ordem'),
+    'datas_previstas': (DataPrevistaEntrega, 'data_prevista_entrega'),
+    'acoes_solicitacao': (AcaoSolicitacao, 'acao_solicitacao'),
+}
+
+# Campos calculados ou de controle que não são importados
+CAMPOS_IGNORADOS = {
+    'id', 'os_id', 'usuario', 'created_at', 'updated_at',
+    'soma_valores', 'soma_notas_fiscais', 'saldo_final', 'valor_total',
+}
+
+SEPARADOR_FILHOS = '|'
+FORMATOS_DATA = ['%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+
+
+def normalizar(valor):
+    """Normaliza nomes para comparação (sem acentos, caixa alta)"""
+    texto = unicodedata.normalize('NFKD', str(valor).strip())
+    return ''.join(c for c in texto if not unicodedata.combining(c)).upper()
+
+
+class PlanilhaInvalida(Exception):
+    """Arquivo que não pôde ser lido como CSV/XLSX (inclusive no meio da leitura)"""
+
+
+def ler_planilha(arquivo, nome_arquivo):
+    """Lê um arquivo CSV/XLSX linha a linha, retornando (número da linha, dicionário)"""
+    try:
+        yield from _ler_planilha(arquivo, nome_arquivo)
+    except (csv.Error, UnicodeDecodeError, zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+        raise PlanilhaInvalida(str(e) or type(e).__name__) from e
+
+
+def _ler_planilha(arquivo, nome_arquivo):
+    if nome_arquivo.lower().endswith('.xlsx'):
+        planilha = load_workbook(arquivo, read_only=True, data_only=True)
+        linhas = planilha.active.iter_rows(values_only=True)
+        cabecalho = [str(c).strip().lower() if c is not None else '' for c in next(linhas, [])]
+        for numero, valores in enumerate(linhas, start=2):
+            if any(v not in (None, '') for v in valores):
+                yield numero, dict(zip(cabecalho, valores))
+        planilha.close()
+        return
+
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    amostra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=';,\t')
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.reader(texto, dialeto)
+    cabecalho = [c.strip().lower() for c in next(leitor, [])]
+    for numero, valores in enumerate(leitor, start=2):
+        if any(v.strip() for v in valores):
+            yield numero, dict(zip(cabecalho, valores))
+    texto.detach()
+
+
+class ImportadorOS:
+    """Importa OS em lotes: valida em memória e grava com bulk_create por transação"""
+
+    def __init__(self, usuario=None, tamanho_lote=500, validar_apenas=False):
+        self.usuario = usuario
+        self.tamanho_lote = tamanho_lote
+        self.validar_apenas = validar_apenas
+        self.campos = {
+            campo.name: campo for campo in RegistroOS._meta.concrete_fields
+            if campo.name not in CAMPOS_IGNORADOS
+        }
+        self.mapas = {}
+        self.acoes = None
+        # Números de OS já usados neste arquivo (informados ou gerados)
+        self.numeros_usados = set()
+        # Relatório parcial: os lotes já gravados continuam valendo se a leitura falhar depois
+        self.resultado = {'total_linhas': 0, 'importados': 0, 'erros': []}
+
+    def importar(self, linhas):
+        """Processa as linhas (iterável de (número, dicionário)) e retorna o relatório"""
+        resultado = self.resultado
+        lote = []
+        try:
+            for numero, dados in linhas:
+                resultado['total_linhas'] += 1
+                lote.append((numero, dados))
+                if len(lote) >= self.tamanho_lote:
+                    self._processar_lote(lote, resultado)
+                    lote = []
+            if lote:
+                self._processar_lote(lote, resultado)
+        finally:
+            resultado['erros'].sort(key=lambda erro: erro['linha'])
+        return resultado
+
+    def _processar_lote(self, lote, resultado):
+        validos = []
+        for numero, dados in lote:
+            registro, filhos, erros = self._converter_linha(dados)
+            if erros:
+                resultado['erros'].append({'linha': numero, 'erros': erros})
+            else:
+                validos.append((numero, registro, filhos))
+
+        validos = self._validar_numeros_os(validos, resultado)
+        if not validos:
+            return
+
+        for _, registro, _ in validos:
+            registro.calcular_soma_valores()
+            registro.calcular_saldo_final(recalcular_notas=False)
+
+        if self.validar_apenas:
+            resultado['importados'] += len(validos)
+            return
+
+        with transaction.atomic():
+            registros = RegistroOS.objects.bulk_create([registro for _, registro, _ in validos])
+            filhos_por_modelo = {}
+            for (_, _, filhos), registro in zip(validos, registros):
+                for filho in filhos:
+                    filho.registro = registro
+                    filhos_por_modelo.setdefault(type(filho), []).append(filho)
+            for modelo, objetos in filhos_por_modelo.items():
+                modelo.objects.bulk_create(objetos)
+
+        resultado['importados'] += len(registros)
+        logger.info(f"Importação: lote de {len(registros)} OS gravado")
+
+    def _validar_numeros_os(self, validos, resultado):
+        """Verifica duplicidade de numero_os no arquivo e no banco e gera os que faltam"""
+        informados = [registro.numero_os for _, registro, _ in validos if registro.numero_os]
+        existentes = set(
+            RegistroOS.objects.filter(numero_os__in=informados).values_list('numero_os', flat=True)
+        )
+        existentes |= self.numeros_usados
+
+        aprovados = []
+        for numero, registro, filhos in validos:
+            if registro.numero_os and registro.numero_os in existentes:
+                resultado['erros'].append(
+                    {'linha': numero, 'erros': {'numero_os': ['Número de OS já existe']}}
+                )
+                continue
+            if registro.numero_os:
+                existentes.add(registro.numero_os)
+            aprovados.append((numero, registro, filhos))
+
+        sem_numero = [registro for _, registro, _ in aprovados if not registro.numero_os]
+        while sem_numero:
+            candidatos = {random.randint(100000, 999999) for _ in sem_numero} - existentes
+            ocupados = set(
+                RegistroOS.objects.filter(numero_os__in=candidatos).values_list('numero_os', flat=True)
+            )
+            for candidato in candidatos - ocupados:
+                if not sem_numero:
+                    break
+                sem_numero.pop().numero_os = candidato
+                existentes.add(candidato)
+            existentes |= ocupados
+
+        self.numeros_usados = existentes
+        return aprovados
+
+    def _converter_linha(self, dados):
+        """Converte uma linha em RegistroOS e filhos não salvos, acumulando erros por campo"""
+        erros = {}
+        valores = {}
+        informados = set()
+
+        for coluna, bruto in dados.items():
+            if coluna in self.campos and coluna not in CAMPOS_RELACIONAIS and not self._vazio(bruto):
+                try:
+                    valores[coluna] = self._converter_valor(self.campos[coluna], bruto)
+                    informados.add(coluna)
+                except (ValueError, InvalidOperation):
+                    erros[coluna] = [f'Valor inválido: {bruto}']
+
+        for campo, (modelo, campo_nome, escopo) in CAMPOS_RELACIONAIS.items():
+            bruto = dados.get(campo)
+            if self._vazio(bruto):
+                continue
+            escopo_id = valores.get(f'{escopo[1]}_id') if escopo else None
+            relacionado_id = self._mapa(campo).get((escopo_id, normalizar(bruto)))
+            if relacionado_id is None:
+                erros[campo] = [f'{modelo._meta.verbose_name} não encontrado: {bruto}']
+            else:
+                valores[f'{campo}_id'] = relacionado_id
+
+        registro = RegistroOS(usuario=self.usuario, **valores)
+        excluir = set(self.campos) - informados | set(CAMPOS_RELACIONAIS) | {'numero_os'}
+        try:
+            registro.clean_fields(exclude=excluir | CAMPOS_IGNORADOS)
+        except ValidationError as e:
+            erros.update(e.message_dict)
+
+        filhos = []
+        for coluna, (modelo, campo) in CAMPOS_FILHOS.items():
+            bruto = dados.get(coluna)
+            if self._vazio(bruto):
+                continue
+            for item in str(bruto).split(SEPARADOR_FILHOS):
+                item = item.strip()
+                if not item:
+                    continue
+                try:
+                    filhos.append(modelo(**{campo: self._converter_filho(coluna, item)}))
+                except (ValueError, KeyError):
+                    erros.setdefault(coluna, []).append(f'Valor inválido: {item}')
+
+        return registro, filhos, erros
+
+    def _converter_valor(self, campo, bruto):
+        if isinstance(campo, models.DecimalField):
+            return self._decimal(bruto)
+        if isinstance(campo, models.DateTimeField):
+            return self._data(bruto)
+        if isinstance(campo, models.IntegerField):
+            return int(self._decimal(bruto))
+        if campo.choices:
+            return normalizar(bruto)
+        return str(bruto).strip()
+
+    def _converter_filho(self, coluna, item):
+        if coluna == 'datas_previstas':
+            return self._data(item)
+        if coluna == 'acoes_solicitacao':
+            if self.acoes is None:
+                self.acoes = {
+                    normalizar(descricao): pk
+                    for pk, descricao in AcaoSolicitacaoOption.objects.values_list('id', 'descricao')
+                }
+            return AcaoSolicitacaoOption(pk=self.acoes[normalizar(item)])
+        return item
+
+    def _mapa(self, campo):
+        """Carrega (uma vez) o mapa (escopo, nome normalizado) -> id do cadastro"""
+        if campo not in self.mapas:
+            modelo, campo_nome, escopo = CAMPOS_RELACIONAIS[campo]
+            colunas = ['id', campo_nome] + ([escopo[0]] if escopo else [])
+            self.mapas[campo] = {
+                (linha[2] if escopo else None, normalizar(linha[1])): linha[0]
+                for linha in modelo.objects.values_list(*colunas)
+            }
+        return self.mapas[campo]
+
+    @staticmethod
+    def _vazio(valor):
+        return valor is None or (isinstance(valor, str) and not valor.strip())
+
+    @staticmethod
+    def _decimal(valor):
+        if isinstance(valor, (int, float, Decimal)):
+            return Decimal(str(valor))
+        texto = str(valor).strip().replace('R$', '').replace(' ', '')
+        if ',' in texto:
+            # Formato brasileiro: 1.234,56
+            texto = texto.replace('.', '').replace(',', '.')
+        numero = Decimal(texto)
+        if not numero.is_finite():
+            raise ValueError(valor)
+        return numero
+
+    @staticmethod
+    def _data(valor):
+        if isinstance(valor, datetime):
+            data = valor
+        elif isinstance(valor, date):
+            data = datetime(valor.year, valor.month, valor.day)
+        else:
+            texto = str(valor).strip()
+            for formato in FORMATOS_DATA:
+                try:
+                    data = datetime.strptime(texto, formato)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(valor)
+        if timezone.is_naive(data):
+            data = timezone.make_aware(data)
+        return data
@@ -0,0 +1,234 @@
+"""
+Índice de arquivos armazenados e limpeza de arquivos órfãos.
+
+O ArquivoArmazenado guarda, para cada FileField preenchido, o nome do arquivo,
+o tamanho e a OS dona. Ele é mantido pelos sinais post_save/post_delete dos
+modelos com anexos (inclusive nas exclusões em cascata e nas feitas por
+_update_related_objects) e pode ser reconstruído com indexar_arquivos().
+
+A limpeza percorre o MEDIA_ROOT em streaming e compara os arquivos, em lotes,
+com o índice. Antes de remover, cada candidato é conferido direto nas tabelas
+dos modelos, então um índice desatualizado nunca causa perda de arquivo. Os
+anexos de OS arquivadas só existem no índice (campo arquivado), que para eles
+não é reconstruído nem apagado pelos sinais.
+"""
+import logging
+import os
+import posixpath
+import re
+import shutil
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
+
+from .miniaturas import PASTA_DERIVADOS, campos_arquivo
+
+logger = logging.getLogger(__name__)
+
+# Pastas do MEDIA_ROOT que não guardam anexos (blobs do armazenamento deduplicado)
+PASTAS_IGNORADAS = {'_blobs'}
+DERIVADO_RE = re.compile(r'^(?P<base>.+)\.[0-9a-f]{12}\.(thumb|preview)\.jpg$')
+
+
+def modelos_com_arquivo():
+    """Modelos do app controle com FileField e seus campos"""
+    for modelo in apps.get_app_config('controle').get_models():
+        campos = campos_arquivo(modelo)
+        if campos:
+            yield modelo, campos
+
+
+def _tamanho(nome):
+    try:
+        return default_storage.size(nome)
+    except (FileNotFoundError, OSError):
+        return 0
+
+
+def indexar_objeto(modelo, instance):
+    """Atualiza o índice com os arquivos atuais de um objeto"""
+    from .models import ArquivoArmazenado
+
+    for campo in campos_arquivo(modelo):
+        arquivo = getattr(instance, campo)
+        filtros = {'modelo': modelo._meta.label_lower, 'objeto_id': instance.pk, 'campo': campo}
+        if not arquivo:
+            ArquivoArmazenado.objects.filter(**filtros).delete()
+            continue
+        ArquivoArmazenado.objects.update_or_create(
+            **filtros,
+            defaults={
+                'nome': arquivo.name,
+                'tamanho': _tamanho(arquivo.name),
+                'registro_id': getattr(instance, 'registro_id', None),
+            },
+        )
+
+
+def arquivo_salvo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        indexar_objeto(sender, instance)
+
+
+def arquivo_excluido(sender, instance, **kwargs):
+    from .models import ArquivoArmazenado
+
+    ArquivoArmazenado.objects.filter(
+        modelo=sender._meta.label_lower, objeto_id=instance.pk, arquivado__isnull=True
+    ).delete()
+
+
+def conectar_sinais():
+    for modelo, campos in modelos_com_arquivo():
+        post_save.connect(arquivo_salvo, sender=modelo, dispatch_uid=f'indice_arquivos_{modelo.__name__}')
+        post_delete.connect(arquivo_excluido, sender=modelo, dispatch_uid=f'indice_arquivos_del_{modelo.__name__}')
+
+
+def indexar_arquivos(tamanho_lote=1000):
+    """
+    Reconstrói o índice a partir dos FileFields; retorna a quantidade indexada.
+    As entradas de OS arquivadas são mantidas: não há mais FileField que as recrie.
+    """
+    from .models import ArquivoArmazenado
+
+    ArquivoArmazenado.objects.filter(arquivado__isnull=True).delete()
+    total = 0
+    for modelo, campos in modelos_com_arquivo():
+        possui_registro = any(campo.name == 'registro' for campo in modelo._meta.fields)
+        colunas = ['pk'] + campos + (['registro_id'] if possui_registro else [])
+        lote = []
+        for linha in modelo.objects.values_list(*colunas).order_by('pk').iterator(chunk_size=tamanho_lote):
+            dados = dict(zip(colunas, linha))
+            for campo in campos:
+                if dados[campo]:
+                    lote.append(ArquivoArmazenado(
+                        nome=dados[campo], tamanho=_tamanho(dados[campo]), modelo=modelo._meta.label_lower,
+                        campo=campo, objeto_id=dados['pk'], registro_id=dados.get('registro_id'),
+                    ))
+            if len(lote) >= tamanho_lote:
+                ArquivoArmazenado.objects.bulk_create(lote)
+                total += len(lote)
+                lote = []
+        ArquivoArmazenado.objects.bulk_create(lote)
+        total += len(lote)
+    return total
+
+
+def percorrer_media(raiz=None):
+    """Itera (nome relativo, caminho, stat) dos arquivos do MEDIA_ROOT sem montar listas"""
+    raiz = raiz or settings.MEDIA_ROOT
+    pilha = [raiz]
+    while pilha:
+        pasta = pilha.pop()
+        try:
+            entradas = os.scandir(pasta)
+        except FileNotFoundError:
+            continue
+        with entradas:
+            for entrada in entradas:
+                if entrada.is_dir(follow_symlinks=False):
+                    if pasta != raiz or entrada.name not in PASTAS_IGNORADAS:
+                        pilha.append(entrada.path)
+                elif entrada.is_file(follow_symlinks=False):
+                    nome = os.path.relpath(entrada.path, raiz).replace(os.sep, '/')
+                    yield nome, entrada.path, entrada.stat(follow_symlinks=False)
+
+
+def nome_original(nome):
+    """Para miniaturas/previews, o anexo de origem; para os demais, o próprio nome"""
+    pasta, base = posixpath.split(nome)
+    if posixpath.basename(pasta) != PASTA_DERIVADOS:
+        return nome
+    match = DERIVADO_RE.match(base)
+    return posixpath.join(posixpath.dirname(pasta), match.group('base')) if match else nome
+
+
+def _referenciados(nomes):
+    """Nomes (entre os informados) referenciados pelo índice ou, na conferência, pelos modelos"""
+    from .models import ArquivoArmazenado
+
+    encontrados = set(ArquivoArmazenado.objects.filter(nome__in=nomes).values_list('nome', flat=True))
+    restantes = set(nomes) - encontrados
+    for modelo, campos in modelos_com_arquivo():
+        if not restantes:
+            break
+        filtro = Q()
+        for campo in campos:
+            filtro |= Q(**{f'{campo}__in': restantes})
+        for linha in modelo.objects.filter(filtro).values_list(*campos):
+            encontrados.update(nome for nome in linha if nome in restantes)
+        restantes -= encontrados
+    return encontrados
+
+
+def arquivos_orfaos(idade_minima=24 * 3600, tamanho_lote=1000):
+    """
+    Itera (nome, caminho, tamanho) dos arquivos sem referência, em lotes.
+    Arquivos mais novos que idade_minima (segundos) são ignorados para não
+    pegar anexos cujo objeto ainda não foi gravado.
+    """
+    limite = time.time() - idade_minima
+    lote = []
+
+    def conferir(lote):
+        referenciados = _referenciados({nome_original(nome) for nome, _, _ in lote})
+        return [item for item in lote if nome_original(item[0]) not in referenciados]
+
+    for nome, caminho, info in percorrer_media():
+        # ctime também conta: no armazenamento deduplicado um link novo herda o mtime do blob
+        if max(info.st_mtime, info.st_ctime) > limite:
+            continue
+        lote.append((nome, caminho, info.st_size))
+        if len(lote) >= tamanho_lote:
+            yield from conferir(lote)
+            lote = []
+    if lote:
+        yield from conferir(lote)
+
+
+def remover_orfao(nome, caminho, quarentena=None):
+    """Remove o arquivo ou o move para a quarentena mantendo o caminho relativo"""
+    if quarentena:
+        destino = os.path.join(quarentena, nome)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        shutil.move(caminho, destino)
+    else:
+        os.remove(caminho)
+
+
+def uso_armazenamento(agrupar='cliente', limite=None):
+    """Uso de armazenamento por cliente ou por OS, do maior para o menor"""
+    from .models import ArquivoArmazenado
+
+    # Arquivos de OS arquivadas contam para a OS/cliente de origem
+    grupos = {
+        'cliente_id': Coalesce('registro__nome_cliente_id', 'arquivado__nome_cliente_id'),
+        'cliente': Coalesce('registro__nome_cliente__nome', 'arquivado__nome_cliente__nome'),
+    }
+    if agrupar == 'os':
+        grupos = {
+            'os': Coalesce('registro_id', 'arquivado_id'),
+            'numero_os': Coalesce('registro__numero_os', 'arquivado__numero_os'),
+            'cliente': grupos['cliente'],
+        }
+
+    linhas = (
+        ArquivoArmazenado.objects.values(**grupos)
+        .annotate(arquivos=Count('id'), bytes=Sum('tamanho'))
+        .order_by('-bytes')
+    )
+    if limite:
+        linhas = linhas[:limite]
+    return list(linhas)
+
+
+def tamanho_legivel(tamanho):
+    for unidade in ('B', 'KB', 'MB', 'GB'):
+        if tamanho < 1024 or unidade == 'GB':
+            return f'{tamanho:.1f} {unidade}' if unidade != 'B' else f'{tamanho} B'
+        tamanho /= 1024
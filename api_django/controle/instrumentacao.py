@@ -0,0 +1,303 @@
+"""
+Instrumentação das requisições: consultas SQL, tempos e tamanho da resposta.
+
+O InstrumentacaoMiddleware mede, por requisição, a quantidade de consultas e
+o tempo gasto nelas (execute_wrapper em todas as conexões), as consultas
+repetidas (mesma SQL com parâmetros diferentes, a assinatura de um N+1), o
+tempo dentro de serializer.data e o tamanho da resposta. O tempo dos
+serializers é separado em construção (__init__ e montagem do mapa de campos,
+inclusive a dos filhos aninhados feita durante o .data) e representação
+(o restante do .data: to_representation).
+
+- Em desenvolvimento (INSTRUMENTACAO_SERVER_TIMING) os números vão no
+  cabeçalho Server-Timing e aparecem na aba Network do navegador.
+- Em produção são agregados em histogramas por rota (método + nome da URL),
+  por processo, consultados em /api/instrumentacao/.
+- INSTRUMENTACAO_ORCAMENTOS define o máximo de consultas por rota. Ao passar,
+  a requisição é registrada no log com as consultas mais repetidas ou, com
+  INSTRUMENTACAO_ORCAMENTO_ACAO = 'erro' (usado pelo BaseTestCase), levanta
+  OrcamentoConsultasExcedido.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+LIMITES_TEMPO_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+LIMITES_CONSULTAS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+LISTA_IN_RE = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+ESPACOS_RE = re.compile(r'\s+')
+
+_medicao_atual = ContextVar('medicao_requisicao', default=None)
+
+
+class OrcamentoConsultasExcedido(Exception):
+    """Rota passou do orçamento de consultas (INSTRUMENTACAO_ORCAMENTO_ACAO = 'erro')"""
+
+
+def assinatura(sql):
+    """SQL sem variações de parâmetros: listas IN(...) colapsadas e espaços normalizados"""
+    return ESPACOS_RE.sub(' ', LISTA_IN_RE.sub('(...)', sql)).strip()
+
+
+class Medicao:
+    """Números de uma requisição"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_sql = 0.0
+        self.tempo_serializacao = 0.0
+        self.tempo_construcao = 0.0
+        self.tempo_representacao = 0.0
+        self.tempo_total = 0.0
+        self.bytes = None
+        self.assinaturas = Counter()
+        self.serializando = False
+        self.construindo = False
+
+    def registrar_consulta(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo_sql += time.perf_counter() - inicio
+            self.consultas += 1
+            self.assinaturas[assinatura(sql)] += 1
+
+    def repetidas(self, limite=None):
+        """(assinatura, vezes) das consultas executadas mais de uma vez, das mais repetidas"""
+        return [(sql, vezes) for sql, vezes in self.assinaturas.most_common(limite) if vezes > 1]
+
+    def server_timing(self):
+        repetidas = sum(vezes - 1 for _, vezes in self.repetidas())
+        return ', '.join([
+            f'db;dur={self.tempo_sql * 1000:.1f};desc="{self.consultas} consultas, {repetidas} repetidas"',
+            f'ser;dur={self.tempo_serializacao * 1000:.1f};desc="serializacao"',
+            f'ser_construcao;dur={self.tempo_construcao * 1000:.1f};desc="construcao dos serializers"',
+            f'ser_representacao;dur={self.tempo_representacao * 1000:.1f};desc="to_representation"',
+            f'total;dur={self.tempo_total * 1000:.1f}',
+        ])
+
+
+def medicao_atual():
+    return _medicao_atual.get()
+
+
+class Histograma:
+    """Contagens cumulativas por limite superior (como os histogramas do Prometheus)"""
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for posicao, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.contagens[posicao] += 1
+                break
+        else:
+            self.contagens[-1] += 1
+        self.soma += valor
+        self.total += 1
+
+    def resumo(self):
+        acumulado = 0
+        faixas = {}
+        for limite, contagem in zip(list(self.limites) + ['+Inf'], self.contagens):
+            acumulado += contagem
+            faixas[str(limite)] = acumulado
+        return {'faixas': faixas, 'soma': round(self.soma, 3), 'total': self.total}
+
+
+class EstatisticasRota:
+    def __init__(self):
+        self.tempo_ms = Histograma(LIMITES_TEMPO_MS)
+        self.consultas = Histograma(LIMITES_CONSULTAS)
+        self.tempo_sql_ms = 0.0
+        self.tempo_serializacao_ms = 0.0
+        self.tempo_construcao_ms = 0.0
+        self.tempo_representacao_ms = 0.0
+        self.bytes = 0
+        self.orcamento_excedido = 0
+
+    def resumo(self):
+        return {
+            'requisicoes': self.tempo_ms.total,
+            'tempo_ms': self.tempo_ms.resumo(),
+            'consultas': self.consultas.resumo(),
+            'tempo_sql_ms': round(self.tempo_sql_ms, 3),
+            'tempo_serializacao_ms': round(self.tempo_serializacao_ms, 3),
+            'tempo_construcao_ms': round(self.tempo_construcao_ms, 3),
+            'tempo_representacao_ms': round(self.tempo_representacao_ms, 3),
+            'bytes': self.bytes,
+            'orcamento_excedido': self.orcamento_excedido,
+        }
+
+
+_rotas = {}
+_trava_rotas = threading.Lock()
+
+
+def registrar_requisicao(rota, medicao, excedeu=False):
+    with _trava_rotas:
+        estatisticas = _rotas.get(rota)
+        if estatisticas is None:
+            estatisticas = _rotas[rota] = EstatisticasRota()
+        estatisticas.tempo_ms.observar(medicao.tempo_total * 1000)
+        estatisticas.consultas.observar(medicao.consultas)
+        estatisticas.tempo_sql_ms += medicao.tempo_sql * 1000
+        estatisticas.tempo_serializacao_ms += medicao.tempo_serializacao * 1000
+        estatisticas.tempo_construcao_ms += medicao.tempo_construcao * 1000
+        estatisticas.tempo_representacao_ms += medicao.tempo_representacao * 1000
+        estatisticas.bytes += medicao.bytes or 0
+        estatisticas.orcamento_excedido += int(excedeu)
+
+
+def resumo_rotas():
+    """Histogramas por rota deste processo"""
+    with _trava_rotas:
+        return {rota: estatisticas.resumo() for rota, estatisticas in sorted(_rotas.items())}
+
+
+def zerar_rotas():
+    with _trava_rotas:
+        _rotas.clear()
+
+
+def nome_url(request):
+    """Nome da URL da requisição; respostas vindas do cache não passam pelo resolver"""
+    correspondencia = getattr(request, 'resolver_match', None)
+    if correspondencia is None:
+        try:
+            correspondencia = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return correspondencia.view_name or None
+
+
+def nome_rota(request):
+    return f'{request.method} {nome_url(request) or "(sem rota)"}'
+
+
+def orcamento(request):
+    """Orçamento de consultas da rota: chave 'MÉTODO nome', depois 'nome', depois o padrão"""
+    orcamentos = settings.INSTRUMENTACAO_ORCAMENTOS
+    nome = nome_url(request)
+    for chave in (f'{request.method} {nome}', nome):
+        if chave in orcamentos:
+            return orcamentos[chave]
+    return settings.INSTRUMENTACAO_ORCAMENTO_PADRAO
+
+
+def _tamanho_resposta(response):
+    if getattr(response, 'streaming', False):
+        tamanho = response.get('Content-Length')
+        return int(tamanho) if tamanho else None
+    return len(response.content)
+
+
+def _medir_serializacao(fget):
+    """Envolve BaseSerializer.data: conta só o serializer mais externo de cada chamada"""
+    @functools.wraps(fget)
+    def data(serializer):
+        medicao = _medicao_atual.get()
+        if medicao is None or medicao.serializando:
+            return fget(serializer)
+        medicao.serializando = True
+        construcao = medicao.tempo_construcao
+        inicio = time.perf_counter()
+        try:
+            return fget(serializer)
+        finally:
+            duracao = time.perf_counter() - inicio
+            medicao.tempo_serializacao += duracao
+            medicao.tempo_representacao += duracao - (medicao.tempo_construcao - construcao)
+            medicao.serializando = False
+    data.instrumentado = True
+    return data
+
+
+def _medir_construcao(funcao):
+    """Envolve BaseSerializer.__init__ e a montagem de Serializer.fields: conta só a chamada mais externa"""
+    @functools.wraps(funcao)
+    def construir(*args, **kwargs):
+        medicao = _medicao_atual.get()
+        if medicao is None or medicao.construindo:
+            return funcao(*args, **kwargs)
+        medicao.construindo = True
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            medicao.tempo_construcao += time.perf_counter() - inicio
+            medicao.construindo = False
+    construir.instrumentado = True
+    return construir
+
+
+def instalar_medicao_serializers():
+    """Chamado no ready do app quando INSTRUMENTACAO está ligada"""
+    from django.utils.functional import cached_property
+    from rest_framework.serializers import BaseSerializer, Serializer
+
+    if not getattr(BaseSerializer.data.fget, 'instrumentado', False):
+        BaseSerializer.data = property(_medir_serializacao(BaseSerializer.data.fget))
+    if not getattr(BaseSerializer.__init__, 'instrumentado', False):
+        BaseSerializer.__init__ = _medir_construcao(BaseSerializer.__init__)
+    if not getattr(Serializer.fields.func, 'instrumentado', False):
+        campos = cached_property(_medir_construcao(Serializer.fields.func))
+        campos.__set_name__(Serializer, 'fields')
+        Serializer.fields = campos
+
+
+class InstrumentacaoMiddleware:
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTACAO:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        medicao = Medicao()
+        token = _medicao_atual.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(medicao.registrar_consulta))
+                response = self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        medicao.tempo_total = time.perf_counter() - inicio
+        medicao.bytes = _tamanho_resposta(response)
+
+        rota = nome_rota(request)
+        limite = orcamento(request)
+        excedeu = limite is not None and medicao.consultas > limite
+        registrar_requisicao(rota, medicao, excedeu)
+
+        if settings.INSTRUMENTACAO_SERVER_TIMING:
+            response['Server-Timing'] = medicao.server_timing()
+
+        if excedeu:
+            repetidas = '; '.join(f'{vezes}x {sql[:200]}' for sql, vezes in medicao.repetidas(3))
+            mensagem = (
+                f'{rota} ({request.path}) executou {medicao.consultas} consultas, '
+                f'orçamento {limite}. Mais repetidas: {repetidas or "nenhuma"}'
+            )
+            if settings.INSTRUMENTACAO_ORCAMENTO_ACAO == 'erro':
+                raise OrcamentoConsultasExcedido(mensagem)
+            logger.warning(mensagem)
+        return response
@@ -0,0 +1,137 @@
+"""
+Logging assíncrono e estruturado, configurado a partir de settings.LOGGING.
+
+settings.LOGGING_CONFIG aponta para configurar_logging: o dicionário passa
+pelo dictConfig normal e, em seguida, os loggers listados em LOGGING['fila']
+têm os handlers trocados por um único FilaHandler (QueueHandler). Um
+QueueListener por processo (cada worker do gunicorn) grava nos handlers
+originais numa thread própria, então a requisição só enfileira o registro:
+formatação JSON, tracebacks e escrita em disco saem do caminho da requisição.
+
+- FormatadorJSON: uma linha JSON por registro, com os campos de extra=.
+- FiltroAmostragem: deixa passar só uma fração dos registros INFO/DEBUG de
+  um logger (WARNING para cima passam sempre).
+- Mensagens com argumentos (logger.info('OS %s', pk)) só são montadas se o
+  registro passar pelos níveis e filtros.
+
+Com a fila cheia (LOGGING['fila']['tamanho']) o registro é descartado em vez
+de bloquear a requisição; os descartes são contados em descartados().
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.config
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Atributos do LogRecord; o restante veio de extra=
+ATRIBUTOS_PADRAO = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+_listeners = []
+_descartados = {'total': 0}
+_trava = threading.Lock()
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro: horário, nível, logger, mensagem, origem, extras e exceção"""
+
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensagem': record.getMessage(),
+            'modulo': record.module,
+            'linha': record.lineno,
+            'processo': record.process,
+            'thread': record.threadName,
+        }
+        for chave, valor in vars(record).items():
+            if chave not in ATRIBUTOS_PADRAO and not chave.startswith('_'):
+                dados[chave] = valor
+        if record.exc_info:
+            dados['excecao'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            dados['pilha'] = self.formatStack(record.stack_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class FiltroAmostragem(logging.Filter):
+    """Deixa passar a fração <taxa> dos registros até <nivel>; os acima passam sempre"""
+
+    def __init__(self, taxa=1.0, nivel='INFO'):
+        super().__init__()
+        self.taxa = float(taxa)
+        self.nivel = logging.getLevelName(nivel) if isinstance(nivel, str) else nivel
+
+    def filter(self, record):
+        return record.levelno > self.nivel or self.taxa >= 1 or random.random() < self.taxa
+
+
+class FilaHandler(QueueHandler):
+    """
+    Enfileira sem bloquear. A mensagem é montada aqui (os argumentos podem
+    mudar depois da chamada), mas a exceção segue como exc_info para o
+    traceback ser formatado na thread do listener.
+    """
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _trava:
+                _descartados['total'] += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def descartados():
+    return _descartados['total']
+
+
+def instalar_filas(loggers, tamanho=10000):
+    """Troca os handlers de cada logger por um FilaHandler com o próprio QueueListener"""
+    iniciados = []
+    for nome in loggers:
+        registrador = logging.getLogger(nome or None)
+        handlers = [handler for handler in registrador.handlers if not isinstance(handler, FilaHandler)]
+        if not handlers:
+            continue
+        fila = queue.Queue(tamanho)
+        listener = QueueListener(fila, *handlers, respect_handler_level=True)
+        for handler in handlers:
+            registrador.removeHandler(handler)
+        registrador.addHandler(FilaHandler(fila))
+        listener.start()
+        _listeners.append(listener)
+        iniciados.append(listener)
+    return iniciados
+
+
+def parar_filas():
+    """Esvazia as filas (grava o que falta) e encerra as threads"""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+atexit.register(parar_filas)
+
+
+def configurar_logging(config):
+    """LOGGING_CONFIG: dictConfig e, com LOGGING['fila'], os handlers dos loggers listados atrás de filas"""
+    if not config:
+        return
+    config = dict(config)
+    fila = config.pop('fila', None)
+    parar_filas()
+    logging.config.dictConfig(config)
+    if fila and fila.get('ativa', True):
+        instalar_filas(fila['loggers'], fila.get('tamanho', 10000))
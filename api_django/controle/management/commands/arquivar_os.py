@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.arquivamento import ErroArquivamento, arquivar, desarquivar_os, os_para_arquivar
+from controle.models import RegistroOSArquivado
+
+
+class Command(BaseCommand):
+    help = 'Move OS concluídas/canceladas antigas (e suas tabelas filhas) para o arquivo somente leitura'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--meses',
+            type=int,
+            default=None,
+            help='Idade mínima, em meses sem alteração (padrão: ARQUIVAMENTO_MESES)'
+        )
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de OS arquivadas nesta execução')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas conta as OS elegíveis')
+        parser.add_argument(
+            '--desarquivar',
+            nargs='+',
+            type=int,
+            metavar='NUMERO_OS',
+            help='Devolve as OS informadas (número da OS) às tabelas ativas'
+        )
+
+    def handle(self, *args, **options):
+        if options['desarquivar']:
+            self._desarquivar(options['desarquivar'])
+            return
+
+        meses = settings.ARQUIVAMENTO_MESES if options['meses'] is None else options['meses']
+        if meses < 1:
+            raise CommandError('--meses deve ser maior que zero')
+
+        if options['dry_run']:
+            total = os_para_arquivar(meses).count()
+            self.stdout.write(f'{total} OS seriam arquivadas (sem alteração há mais de {meses} meses)')
+            return
+
+        total = 0
+        for arquivado in arquivar(meses, options['limite']):
+            total += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'OS {arquivado.numero_os} arquivada')
+        if total:
+            cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'{total} OS arquivada(s)'))
+
+    def _desarquivar(self, numeros):
+        arquivados = {arquivado.numero_os: arquivado for arquivado in RegistroOSArquivado.objects.filter(numero_os__in=numeros)}
+        ausentes = [str(numero) for numero in numeros if numero not in arquivados]
+        if ausentes:
+            raise CommandError(f"OS não encontradas no arquivo: {', '.join(ausentes)}")
+
+        for numero in numeros:
+            try:
+                desarquivar_os(arquivados[numero])
+            except ErroArquivamento as e:
+                raise CommandError(str(e))
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(f'{len(numeros)} OS desarquivada(s)'))
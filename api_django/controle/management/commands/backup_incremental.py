@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.backup import ErroBackup, criar_backup, podar_backups
+from controle.indice_arquivos import tamanho_legivel
+
+
+class Command(BaseCommand):
+    help = 'Backup do banco (pg_dump paralelo em formato diretório) e backup incremental da mídia'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--destino', default=None, help='Diretório dos backups (padrão: BACKUP_DIR)')
+        parser.add_argument('--workers', type=int, default=4, help='Processos do pg_dump e threads de compressão (padrão: 4)')
+        parser.add_argument('--manter', type=int, default=7, help='Quantidade de backups mantidos (padrão: 7; 0 = todos)')
+        parser.add_argument('--sem-banco', action='store_true', help='Não inclui o banco de dados')
+        parser.add_argument('--sem-media', action='store_true', help='Não inclui os arquivos de mídia')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers deve ser maior que zero')
+        destino = options['destino'] or settings.BACKUP_DIR
+
+        try:
+            nome, estatisticas = criar_backup(
+                destino, workers=options['workers'],
+                incluir_banco=not options['sem_banco'], incluir_media=not options['sem_media'],
+            )
+        except ErroBackup as e:
+            raise CommandError(str(e))
+        except Exception as e:
+            raise CommandError(f'Erro ao gerar o backup: {e}')
+
+        if estatisticas:
+            self.stdout.write(
+                f"Mídia: {estatisticas['arquivos']} arquivo(s), {estatisticas['reaproveitados']} sem alteração, "
+                f"{estatisticas['lidos']} lido(s), {estatisticas['objetos_novos']} objeto(s) novo(s) "
+                f"({tamanho_legivel(estatisticas['bytes_novos'])})"
+            )
+
+        if options['manter']:
+            removidos, objetos = podar_backups(destino, options['manter'])
+            if removidos:
+                self.stdout.write(f'{len(removidos)} backup(s) antigo(s) e {objetos} objeto(s) removido(s)')
+
+        self.stdout.write(self.style.SUCCESS(f'Backup {nome} criado em {destino}'))
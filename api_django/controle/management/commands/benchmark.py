@@ -0,0 +1,70 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from controle.benchmark.cenarios import CENARIOS, comparar, executar
+
+
+class Command(BaseCommand):
+    help = 'Executa os cenários de benchmark nos endpoints da API e grava o resultado em JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cenarios', nargs='+', metavar='CENARIO',
+            help=f"Cenários a executar (padrão: todos): {', '.join(cenario.nome for cenario in CENARIOS)}"
+        )
+        parser.add_argument('--iteracoes', type=int, default=20, help='Iterações medidas por cenário (padrão: 20)')
+        parser.add_argument('--aquecimento', type=int, default=2, help='Iterações descartadas antes da medição (padrão: 2)')
+        parser.add_argument('--semente', type=int, default=42, help='Semente do sorteio de OS, páginas e filtros (padrão: 42)')
+        parser.add_argument('--saida', default=None, help='Arquivo JSON do resultado (padrão: benchmark-<data-hora>.json)')
+        parser.add_argument('--comparar', metavar='JSON', help='Resultado anterior; falha se houver regressão')
+        parser.add_argument(
+            '--tolerancia', type=float, default=0.2,
+            help='Aumento aceito na mediana de cada cenário, em fração (padrão: 0.2 = 20%%)'
+        )
+
+    def handle(self, *args, **options):
+        if options['iteracoes'] < 1 or options['aquecimento'] < 0:
+            raise CommandError('--iteracoes deve ser maior que zero e --aquecimento não pode ser negativo')
+
+        base = None
+        if options['comparar']:
+            try:
+                with open(options['comparar'], encoding='utf-8') as arquivo:
+                    base = json.load(arquivo)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Não foi possível ler {options['comparar']}: {e}")
+
+        def progresso(nome, resumo):
+            self.stdout.write(
+                f"{nome:<22} mediana {resumo['mediana_ms']:>9.1f} ms  p95 {resumo['p95_ms']:>9.1f} ms  "
+                f"{resumo['consultas']:>4} consultas  {resumo['bytes']:>9} bytes"
+                + (self.style.ERROR(f"  {resumo['erros']} erro(s) {resumo['status']}") if resumo['erros'] else '')
+            )
+
+        try:
+            resultado = executar(
+                options['cenarios'], iteracoes=options['iteracoes'], aquecimento=options['aquecimento'],
+                semente=options['semente'], progresso=progresso,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        saida = options['saida'] or f"benchmark-{timezone.now():%Y%m%d-%H%M%S}.json"
+        if os.path.dirname(saida):
+            os.makedirs(os.path.dirname(saida), exist_ok=True)
+        with open(saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(f'Resultado gravado em {saida}'))
+
+        if base is not None:
+            if base.get('registros_os') != resultado['registros_os']:
+                self.stdout.write(self.style.WARNING(
+                    f"A base comparada tinha {base.get('registros_os')} OS; esta execução, {resultado['registros_os']}"
+                ))
+            regressoes = comparar(resultado, base, options['tolerancia'])
+            if regressoes:
+                raise CommandError('Regressões em relação a {}:\n  {}'.format(options['comparar'], '\n  '.join(regressoes)))
+            self.stdout.write(self.style.SUCCESS('Sem regressões'))
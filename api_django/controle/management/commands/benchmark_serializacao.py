@@ -0,0 +1,41 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.benchmark.serializacao import executar
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede os serializers de OS fora do HTTP: construção por perfil de usuário e vazão (OS/s) do detalhe e da '
+        'listagem, com o cache do mapa de campos desligado e ligado'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantidade', type=int, default=100, help='OS serializadas por iteração (padrão: 100)')
+        parser.add_argument('--iteracoes', type=int, default=10, help='Iterações medidas (padrão: 10; x10 na construção)')
+        parser.add_argument('--aquecimento', type=int, default=2, help='Iterações descartadas antes da medição (padrão: 2)')
+        parser.add_argument('--saida', default=None, help='Arquivo JSON do resultado (padrão: só a tabela)')
+
+    def handle(self, *args, **options):
+        if options['quantidade'] < 1 or options['iteracoes'] < 1 or options['aquecimento'] < 0:
+            raise CommandError('--quantidade e --iteracoes devem ser maiores que zero e --aquecimento não pode ser negativo')
+        try:
+            resultado = executar(options['quantidade'], options['iteracoes'], options['aquecimento'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{resultado['registros_os']} OS, {resultado['banco']}"))
+        self.stdout.write(f"{'medida':<22} {'sem cache ms':>13} {'com cache ms':>13} {'ganho':>7} {'OS/s':>10}")
+        for nome, ganho in resultado['ganho'].items():
+            sem, com = resultado['sem_cache'][nome], resultado['com_cache'][nome]
+            vazao = f"{com['os_por_segundo']:>10.1f}" if 'os_por_segundo' in com else f"{'':>10}"
+            self.stdout.write(f"{nome:<22} {sem['mediana_ms']:>13.3f} {com['mediana_ms']:>13.3f} {ganho:>6.2f}x {vazao}")
+
+        if options['saida']:
+            if os.path.dirname(options['saida']):
+                os.makedirs(os.path.dirname(options['saida']), exist_ok=True)
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump(resultado, arquivo, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Resultado gravado em {options['saida']}"))
@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from controle.consultas_lentas import arquivos_log, ler_registros, resumir
+
+ORDENACOES = {
+    'total': 'total_ms',
+    'max': 'max_ms',
+    'media': 'media_ms',
+    'quantidade': 'quantidade',
+}
+
+
+class Command(BaseCommand):
+    help = 'Resumo do log de consultas lentas: as piores consultas por tempo total, máximo, média ou quantidade'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Quantidade de consultas (padrão: 10; 0 = todas)')
+        parser.add_argument('--ordenar', choices=sorted(ORDENACOES), default='total', help='Critério (padrão: total)')
+        parser.add_argument('--desde', help='Só registros a partir desta data/hora ISO (ex.: 2024-05-01)')
+        parser.add_argument('--rota', help='Só registros cuja rota contém este texto (ex.: registroos-list)')
+        parser.add_argument('--arquivo', help='Arquivo do log (padrão: CONSULTAS_LENTAS_ARQUIVO, com os rotacionados)')
+        parser.add_argument('--planos', action='store_true', help='Mostra o plano registrado de cada consulta')
+        parser.add_argument('--json', action='store_true', help='Saída em JSON')
+
+    def handle(self, *args, **options):
+        grupos = resumir(ler_registros(arquivos_log(options['arquivo'])), options['desde'], options['rota'])
+        grupos.sort(key=lambda grupo: grupo[ORDENACOES[options['ordenar']]], reverse=True)
+        if options['top']:
+            grupos = grupos[:options['top']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(grupos, indent=2, ensure_ascii=False))
+            return
+
+        for posicao, grupo in enumerate(grupos, 1):
+            rotas = ', '.join(
+                f'{rota} ({vezes}x)' for rota, vezes in sorted(grupo['rotas'].items(), key=lambda item: -item[1])
+            )
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{posicao}. {grupo['impressao']}: {grupo['quantidade']}x, total {grupo['total_ms']:.1f} ms, "
+                f"média {grupo['media_ms']:.1f} ms, máx {grupo['max_ms']:.1f} ms"
+            ))
+            self.stdout.write(f'   rotas: {rotas}')
+            self.stdout.write(f"   {grupo['sql'][:500]}")
+            if options['planos'] and grupo['plano'] is not None:
+                plano = grupo['plano']
+                if isinstance(plano, list) and all(isinstance(linha, str) for linha in plano):
+                    self.stdout.write('\n'.join(f'   | {linha}' for linha in plano))
+                else:
+                    self.stdout.write(json.dumps(plano, indent=2, ensure_ascii=False))
+
+        self.stdout.write(self.style.SUCCESS(f'{len(grupos)} consulta(s)'))
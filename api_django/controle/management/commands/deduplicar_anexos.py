@@ -0,0 +1,44 @@
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+
+from controle.storage import ArmazenamentoDeduplicado
+
+
+class Command(BaseCommand):
+    help = 'Deduplica anexos já existentes e remove blobs sem referência'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Apenas calcula a economia, sem alterar arquivos')
+        parser.add_argument('--sem-coleta', action='store_true', help='Não remove blobs sem referência')
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ArmazenamentoDeduplicado):
+            raise CommandError('O storage padrão não é o ArmazenamentoDeduplicado (ARMAZENAMENTO_DEDUPLICADO=False)')
+
+        dry_run = options['dry_run']
+        arquivos = economia = 0
+
+        # Todos os FileFields do app controle
+        for modelo in apps.get_app_config('controle').get_models():
+            campos = [campo.name for campo in modelo._meta.fields if isinstance(campo, models.FileField)]
+            for campo in campos:
+                nomes = (
+                    modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+                    .values_list(campo, flat=True).distinct().iterator()
+                )
+                for nome in nomes:
+                    economia += default_storage.deduplicar(nome, dry_run=dry_run)
+                    arquivos += 1
+
+        self.stdout.write(f'{arquivos} arquivo(s) verificado(s), {economia} bytes economizados')
+
+        if not options['sem_coleta']:
+            quantidade, liberados = default_storage.coletar_blobs(dry_run=dry_run)
+            self.stdout.write(f'{quantidade} blob(s) sem referência removido(s), {liberados} bytes liberados')
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING('Dry-run: nenhum arquivo foi alterado'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Deduplicação concluída'))
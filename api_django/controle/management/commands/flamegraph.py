@@ -0,0 +1,39 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.perfilamento import funcoes_mais_quentes, gravar, juntar, perfis_por_rota, svg_flamegraph
+
+
+class Command(BaseCommand):
+    help = 'Junta os perfis por amostragem (collapsed stacks) de cada rota e gera o .folded somado e o flamegraph em SVG'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--diretorio', help='Diretório dos perfis (padrão: PERFILAMENTO_DIRETORIO)')
+        parser.add_argument('--saida', default='flamegraphs', help='Diretório dos arquivos gerados (padrão: flamegraphs)')
+        parser.add_argument('--rota', help='Só as rotas que contêm este texto (ex.: registroos-list)')
+        parser.add_argument('--desde', help='Só perfis a partir desta data/hora (AAAAMMDD ou AAAAMMDDTHHMMSS)')
+        parser.add_argument('--juntas', action='store_true', help='Um único flamegraph com todas as rotas')
+        parser.add_argument('--top', type=int, default=10, help='Funções com mais tempo próprio por rota (padrão: 10)')
+        parser.add_argument('--largura', type=int, default=1200, help='Largura do SVG em pixels (padrão: 1200)')
+
+    def handle(self, *args, **options):
+        rotas = perfis_por_rota(options['diretorio'], options['rota'], options['desde'])
+        if not rotas:
+            raise CommandError('Nenhum perfil encontrado')
+        if options['juntas']:
+            rotas = {'todas': [arquivo for arquivos in rotas.values() for arquivo in arquivos]}
+
+        os.makedirs(options['saida'], exist_ok=True)
+        for rota, arquivos in rotas.items():
+            pilhas = juntar(arquivos)
+            total = sum(pilhas.values())
+            gravar(pilhas, os.path.join(options['saida'], f'{rota}.folded'))
+            with open(os.path.join(options['saida'], f'{rota}.svg'), 'w', encoding='utf-8') as arquivo:
+                arquivo.write(svg_flamegraph(pilhas, f'{rota}: {len(arquivos)} perfil(is)', options['largura']))
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{rota}: {len(arquivos)} perfil(is), {total} amostras'))
+            for quadro, proprio, inclusivo in funcoes_mais_quentes(pilhas, options['top']):
+                self.stdout.write(f'   {proprio / total:>6.1%} próprio  {inclusivo / total:>6.1%} total  {quadro}')
+
+        self.stdout.write(self.style.SUCCESS(f"{len(rotas)} flamegraph(s) em {options['saida']}"))
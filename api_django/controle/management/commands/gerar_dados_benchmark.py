@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.benchmark.dados import gerar_dados, limpar_dados
+
+
+class Command(BaseCommand):
+    help = 'Gera a base sintética dos benchmarks (clientes, OS e todas as tabelas filhas), reproduzível pela semente'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--os', type=int, default=10000, help='Quantidade de OS (padrão: 10000)')
+        parser.add_argument('--clientes', type=int, default=20, help='Quantidade de clientes (padrão: 20)')
+        parser.add_argument('--filhos', type=int, default=2, help='Média de linhas por tabela filha em cada OS (padrão: 2)')
+        parser.add_argument('--anos', type=float, default=3, help='Período de created_at, em anos até hoje (padrão: 3)')
+        parser.add_argument('--semente', type=int, default=42, help='Semente do gerador (padrão: 42)')
+        parser.add_argument('--lote', type=int, default=1000, help='OS gravadas por transação (padrão: 1000)')
+        parser.add_argument('--limpar', action='store_true', help='Remove a base sintética antes (ou apenas, com --os 0)')
+        parser.add_argument('--forcar', action='store_true', help='Permite gerar dados com DEBUG desligado')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['forcar']:
+            raise CommandError('DEBUG está desligado: use um banco de benchmark e confirme com --forcar')
+        if options['os'] < 0 or options['clientes'] < 1 or options['lote'] < 1 or options['filhos'] < 0:
+            raise CommandError('--os, --filhos devem ser >= 0 e --clientes, --lote maiores que zero')
+
+        if options['limpar']:
+            removidas = limpar_dados()
+            self.stdout.write(f'{removidas} OS sintética(s) removida(s)')
+
+        if options['os']:
+            def progresso(feitas, total):
+                if options['verbosity'] > 1 or feitas == total:
+                    self.stdout.write(f'{feitas}/{total} OS')
+
+            criados = gerar_dados(
+                options['os'], clientes=options['clientes'], filhos=options['filhos'], anos=options['anos'],
+                semente=options['semente'], tamanho_lote=options['lote'], progresso=progresso,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"{criados['registros_os']} OS e {sum(criados['filhos'].values())} linha(s) filha(s) geradas"
+            ))
+        cache.clear()
@@ -0,0 +1,28 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from controle.miniaturas import campos_arquivo, registrar_derivados
+
+
+class Command(BaseCommand):
+    help = 'Gera miniaturas e previews faltantes para os anexos existentes'
+
+    def handle(self, *args, **options):
+        gerados = ignorados = erros = 0
+
+        for modelo in apps.get_app_config('controle').get_models():
+            for campo in campos_arquivo(modelo):
+                anexos = modelo.objects.exclude(**{campo: ''}).values_list('pk', campo).iterator()
+                for pk, nome in anexos:
+                    try:
+                        if registrar_derivados(modelo, pk, campo, nome):
+                            gerados += 1
+                        else:
+                            ignorados += 1
+                    except Exception as e:
+                        erros += 1
+                        self.stdout.write(self.style.ERROR(f'{nome}: {e}'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{gerados} anexo(s) com derivados, {ignorados} ignorado(s), {erros} erro(s)'
+        ))
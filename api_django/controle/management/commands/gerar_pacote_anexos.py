@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.downloads import anexos_das_os, zip_em_streaming
+from controle.filters import filtrar_por_argumentos
+from controle.models import RegistroOS
+
+
+class Command(BaseCommand):
+    help = 'Gera um ZIP com os anexos de OS selecionadas (para seleções grandes demais para a API)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('saida', help='Caminho do arquivo ZIP a gerar')
+        parser.add_argument(
+            '--os',
+            nargs='+',
+            type=int,
+            dest='ids',
+            help='IDs das OS (padrão: todas)'
+        )
+        parser.add_argument(
+            '--filtro',
+            action='append',
+            default=[],
+            metavar='CAMPO=VALOR',
+            help='Filtro da API de OS (ex.: --filtro status_os=1 --filtro data_criacao_inicio=2024-01-01)'
+        )
+
+    def handle(self, *args, **options):
+        queryset = RegistroOS.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        if options['filtro']:
+            try:
+                queryset = filtrar_por_argumentos(queryset, options['filtro'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        registros = list(queryset.order_by('pk').values_list('pk', 'numero_os'))
+        if not registros:
+            raise CommandError('Nenhuma OS encontrada')
+
+        tamanho = 0
+        with open(options['saida'], 'wb') as destino:
+            for bloco in zip_em_streaming(anexos_das_os(registros)):
+                destino.write(bloco)
+                tamanho += len(bloco)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Pacote com {len(registros)} OS gerado em {options['saida']} ({tamanho} bytes)")
+        )
@@ -0,0 +1,55 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.importacao import ImportadorOS, PlanilhaInvalida, ler_planilha
+
+
+class Command(BaseCommand):
+    help = 'Importa OS em lote a partir de uma planilha CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do arquivo .csv ou .xlsx')
+        parser.add_argument('--usuario', help='Username definido como responsável pelas OS importadas')
+        parser.add_argument('--lote', type=int, default=500, help='Linhas por transação (padrão: 500)')
+        parser.add_argument('--validar-apenas', action='store_true', help='Valida sem gravar')
+        parser.add_argument('--relatorio', help='Grava o relatório de erros em JSON neste caminho')
+
+    def handle(self, *args, **options):
+        usuario = None
+        if options['usuario']:
+            try:
+                usuario = User.objects.get(username=options['usuario'])
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário "{options["usuario"]}" não encontrado')
+
+        importador = ImportadorOS(
+            usuario=usuario,
+            tamanho_lote=options['lote'],
+            validar_apenas=options['validar_apenas'],
+        )
+        try:
+            with open(options['arquivo'], 'rb') as arquivo:
+                resultado = importador.importar(ler_planilha(arquivo, options['arquivo']))
+        except OSError as e:
+            raise CommandError(f'Erro ao abrir arquivo: {e}')
+        except PlanilhaInvalida as e:
+            raise CommandError(
+                f"Erro ao ler o arquivo após {importador.resultado['total_linhas']} linha(s) "
+                f"({importador.resultado['importados']} OS já importada(s)): {e}"
+            )
+
+        for erro in resultado['erros']:
+            detalhes = '; '.join(f'{campo}: {", ".join(map(str, msgs))}' for campo, msgs in erro['erros'].items())
+            self.stdout.write(self.style.ERROR(f"Linha {erro['linha']}: {detalhes}"))
+
+        if options['relatorio']:
+            with open(options['relatorio'], 'w', encoding='utf-8') as saida:
+                json.dump(resultado, saida, ensure_ascii=False, indent=2)
+
+        acao = 'validada(s)' if options['validar_apenas'] else 'importada(s)'
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado['importados']} de {resultado['total_linhas']} OS {acao}, "
+            f"{len(resultado['erros'])} linha(s) com erro"
+        ))
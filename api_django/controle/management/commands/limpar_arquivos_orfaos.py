@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.indice_arquivos import arquivos_orfaos, remover_orfao, tamanho_legivel
+from controle.storage import ArmazenamentoDeduplicado
+
+
+class Command(BaseCommand):
+    help = 'Remove (ou move para quarentena) arquivos do MEDIA_ROOT que não são referenciados por nenhum anexo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Apenas lista os órfãos, sem alterar arquivos')
+        parser.add_argument(
+            '--quarentena',
+            action='store_true',
+            help='Move os órfãos para ARQUIVOS_QUARENTENA_DIR em vez de excluir'
+        )
+        parser.add_argument(
+            '--idade-minima',
+            type=float,
+            default=24,
+            help='Ignora arquivos modificados há menos de N horas (padrão: 24)'
+        )
+        parser.add_argument('--lote', type=int, default=1000, help='Arquivos conferidos por consulta (padrão: 1000)')
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote deve ser maior que zero')
+
+        dry_run = options['dry_run']
+        quarentena = settings.ARQUIVOS_QUARENTENA_DIR if options['quarentena'] else None
+        quantidade = liberados = 0
+
+        for nome, caminho, tamanho in arquivos_orfaos(
+            idade_minima=options['idade_minima'] * 3600, tamanho_lote=options['lote']
+        ):
+            quantidade += 1
+            liberados += tamanho
+            if dry_run:
+                self.stdout.write(f'{nome} ({tamanho_legivel(tamanho)})')
+                continue
+            try:
+                remover_orfao(nome, caminho, quarentena)
+            except OSError as e:
+                self.stderr.write(f'Erro ao remover {nome}: {e}')
+
+        acao = 'movido(s) para a quarentena' if quarentena else 'removido(s)'
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f'{quantidade} arquivo(s) órfão(s), {tamanho_legivel(liberados)} (nada foi alterado)'
+            ))
+            return
+
+        if isinstance(default_storage, ArmazenamentoDeduplicado):
+            blobs, _ = default_storage.coletar_blobs()
+            self.stdout.write(f'{blobs} blob(s) sem referência removido(s)')
+
+        self.stdout.write(self.style.SUCCESS(f'{quantidade} arquivo(s) órfão(s) {acao}, {tamanho_legivel(liberados)}'))
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from controle.models import UploadSessao
+
+
+class Command(BaseCommand):
+    help = 'Remove sessões de upload (anexadas ou abandonadas) sem atividade há mais de N horas e seus arquivos parciais'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horas',
+            type=int,
+            default=24,
+            help='Remove sessões sem atividade há mais de N horas (padrão: 24)'
+        )
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(hours=options['horas'])
+        # O limite vale também para as ANEXADO: uma sessão recente pode ser de uma escrita em andamento
+        sessoes = UploadSessao.objects.filter(updated_at__lt=limite)
+
+        total = 0
+        for sessao in sessoes.iterator():
+            sessao.remover_arquivo()
+            sessao.delete()
+            total += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{total} sessão(ões) de upload removida(s)')
+        )
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from controle.particionamento import (
+    PERIODOS, TABELAS_PARTICIONAVEIS, ErroParticionamento, desparticionar, listar_particoes, manter_particoes,
+    particionar,
+)
+
+
+class Command(BaseCommand):
+    help = 'Manutenção das partições por created_at (PostgreSQL): cria as dos próximos períodos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--antecedencia',
+            type=int,
+            default=None,
+            help='Períodos à frente com partição criada (padrão: PARTICIONAMENTO_ANTECEDENCIA)'
+        )
+        parser.add_argument('--listar', action='store_true', help='Lista as partições de cada tabela')
+        parser.add_argument(
+            '--converter',
+            choices=PERIODOS,
+            help='Converte as tabelas ainda não particionadas (particionamento por ano ou por mês)'
+        )
+        parser.add_argument('--reverter', action='store_true', help='Volta as tabelas particionadas a tabelas comuns')
+        parser.add_argument(
+            '--confirmar',
+            action='store_true',
+            help='Obrigatório com --converter/--reverter, que recriam as tabelas (faça backup e teste numa cópia antes)'
+        )
+
+    def handle(self, *args, **options):
+        if (options['converter'] or options['reverter']) and not options['confirmar']:
+            raise CommandError(
+                '--converter/--reverter recriam as tabelas com os dados. Teste numa cópia do banco, '
+                'faça backup e repita com --confirmar'
+            )
+        if connection.vendor != 'postgresql':
+            raise CommandError('Particionamento disponível apenas no PostgreSQL')
+        antecedencia = (
+            settings.PARTICIONAMENTO_ANTECEDENCIA if options['antecedencia'] is None else options['antecedencia']
+        )
+
+        try:
+            with transaction.atomic():
+                for tabela in TABELAS_PARTICIONAVEIS:
+                    if options['reverter']:
+                        if desparticionar(connection, tabela):
+                            self.stdout.write(f'{tabela}: revertida para tabela comum')
+                        continue
+                    if options['converter'] and particionar(connection, tabela, options['converter'], antecedencia):
+                        self.stdout.write(f'{tabela}: convertida (por {options["converter"]})')
+                    for nome in manter_particoes(connection, tabela, antecedencia):
+                        self.stdout.write(f'{tabela}: partição {nome} criada')
+        except ErroParticionamento as e:
+            raise CommandError(str(e))
+
+        if options['listar']:
+            with connection.cursor() as cursor:
+                for tabela in TABELAS_PARTICIONAVEIS:
+                    particoes = listar_particoes(cursor, tabela)
+                    self.stdout.write(f'{tabela}: {len(particoes) or "não particionada"}')
+                    for nome, limites, linhas in particoes:
+                        self.stdout.write(f'  {nome}: {limites} (~{max(linhas, 0)} linhas)')
+
+        self.stdout.write(self.style.SUCCESS('Partições em dia'))
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from controle.filters import filtrar_por_argumentos
+from controle.models import RegistroOS
+
+
+class Command(BaseCommand):
+    help = 'Recalcula soma_valores, soma_notas_fiscais, saldo_final e valor_total das OS com UPDATEs em lote'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--os',
+            nargs='+',
+            type=int,
+            dest='ids',
+            help='IDs das OS a recalcular (padrão: todas)'
+        )
+        parser.add_argument(
+            '--filtro',
+            action='append',
+            default=[],
+            metavar='CAMPO=VALOR',
+            help='Filtro da API de OS (ex.: --filtro status_os=1 --filtro data_criacao_inicio=2024-01-01)'
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Quantidade de OS por UPDATE (padrão: 1000)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas lista as OS com totais divergentes, sem gravar'
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError('--lote deve ser maior que zero')
+
+        queryset = self.filtrar(options)
+
+        if options['dry_run']:
+            diferencas = RegistroOS.diferencas_totais(queryset, tamanho_lote=options['lote'])
+            for diferenca in diferencas:
+                campos = ', '.join(
+                    f'{campo}: {atual:.2f} -> {novo:.2f}'
+                    for campo, (atual, novo) in diferenca['campos'].items()
+                )
+                self.stdout.write(f"OS {diferenca['numero_os']} (id {diferenca['id']}): {campos}")
+            self.stdout.write(
+                self.style.WARNING(f'{len(diferencas)} OS com totais divergentes (nada foi gravado)')
+            )
+            return
+
+        with transaction.atomic():
+            total = RegistroOS.recalcular_totais(queryset, tamanho_lote=options['lote'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'{total} OS recalculada(s) com sucesso!')
+        )
+
+    def filtrar(self, options):
+        """Aplica --os e --filtro usando o mesmo RegistroOSFilter da API"""
+        queryset = RegistroOS.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+
+        if options['filtro']:
+            try:
+                queryset = filtrar_por_argumentos(queryset, options['filtro'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        return queryset
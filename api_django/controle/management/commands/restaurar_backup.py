@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from controle.backup import ErroBackup, listar_backups, restaurar_backup, verificar_backup
+
+
+class Command(BaseCommand):
+    help = 'Restaura (ou apenas verifica) um backup gerado pelo backup_incremental'
+
+    def add_arguments(self, parser):
+        parser.add_argument('nome', nargs='?', help='Backup a restaurar (padrão: o mais recente)')
+        parser.add_argument('--destino', default=None, help='Diretório dos backups (padrão: BACKUP_DIR)')
+        parser.add_argument('--workers', type=int, default=4, help='Processos do pg_restore (padrão: 4)')
+        parser.add_argument('--verificar', action='store_true', help='Apenas confere a integridade, sem restaurar')
+        parser.add_argument('--sem-banco', action='store_true', help='Não restaura o banco de dados')
+        parser.add_argument('--sem-media', action='store_true', help='Não restaura os arquivos de mídia')
+
+    def handle(self, *args, **options):
+        destino = options['destino'] or settings.BACKUP_DIR
+        backups = listar_backups(destino)
+        if not backups:
+            raise CommandError(f'Nenhum backup encontrado em {destino}')
+        nome = options['nome'] or backups[-1]
+        if nome not in backups:
+            raise CommandError(f'Backup {nome} não encontrado. Disponíveis: {", ".join(backups)}')
+
+        # Antes de restaurar basta saber que os objetos existem; a leitura completa fica para --verificar
+        problemas = verificar_backup(destino, nome, conferir_conteudo=options['verificar'])
+        for problema in problemas:
+            self.stderr.write(problema)
+        if problemas:
+            raise CommandError(f'Backup {nome} com {len(problemas)} problema(s); nada foi restaurado')
+        if options['verificar']:
+            self.stdout.write(self.style.SUCCESS(f'Backup {nome} íntegro'))
+            return
+
+        try:
+            restaurados = restaurar_backup(
+                destino, nome, workers=options['workers'],
+                incluir_banco=not options['sem_banco'], incluir_media=not options['sem_media'],
+            )
+        except ErroBackup as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'Backup {nome} restaurado ({restaurados} arquivo(s) de mídia)'))
@@ -0,0 +1,101 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from controle.benchmark.carga import GRUPOS, MIX_GRUPOS, executar, limpar_carga
+
+
+def _mix(valores):
+    mix = {}
+    for valor in valores:
+        grupo, _, peso = valor.partition('=')
+        try:
+            mix[grupo] = float(peso)
+        except ValueError:
+            raise CommandError(f'Mix inválido "{valor}". Use GRUPO=PESO (ex.: Tecnico=4)')
+        if mix[grupo] < 0:
+            raise CommandError(f'Peso negativo em "{valor}"')
+    return mix
+
+
+class Command(BaseCommand):
+    help = (
+        'Teste de carga por HTTP: usuários virtuais por grupo repetem as jornadas do frontend '
+        '(login, painel, listagem, detalhe, criação/edição multipart, relatórios e exportações)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Servidor testado (padrão: http://localhost:8000)')
+        parser.add_argument('--usuarios', type=int, default=10, help='Usuários virtuais simultâneos (padrão: 10)')
+        parser.add_argument('--duracao', type=float, default=60, help='Duração em segundos, com a rampa (padrão: 60)')
+        parser.add_argument('--rampa', type=float, default=10, help='Segundos até todos os usuários entrarem (padrão: 10)')
+        parser.add_argument(
+            '--mix', nargs='+', metavar='GRUPO=PESO',
+            help='Peso de cada grupo na divisão dos usuários (padrão: {})'.format(
+                ' '.join(f'{grupo}={peso}' for grupo, peso in MIX_GRUPOS.items())
+            )
+        )
+        parser.add_argument('--pausa', type=float, default=1.0, help='Pausa média entre os passos, em segundos (padrão: 1)')
+        parser.add_argument(
+            '--intervalo-painel', type=float, default=30, help='Atualização do painel, em segundos (padrão: 30, como o frontend)'
+        )
+        parser.add_argument('--sem-escrita', action='store_true', help='Só leitura: sem criar nem editar OS')
+        parser.add_argument('--senha', default='carga-local', help='Senha dos usuários de carga (padrão: carga-local)')
+        parser.add_argument('--timeout', type=float, default=120, help='Timeout por requisição, em segundos (padrão: 120)')
+        parser.add_argument('--semente', type=int, default=42, help='Semente dos sorteios (padrão: 42)')
+        parser.add_argument('--saida', default=None, help='Arquivo JSON do resultado (padrão: carga-<data-hora>.json)')
+        parser.add_argument('--limpar', action='store_true', help='Só remove as OS criadas pelos usuários de carga')
+        parser.add_argument('--forcar', action='store_true', help='Permite rodar com DEBUG desligado')
+
+    def handle(self, *args, **options):
+        # Cria usuários com senha conhecida e grava OS: só em ambiente local
+        if not settings.DEBUG and not options['forcar']:
+            raise CommandError('DEBUG está desligado: rode contra o ambiente de desenvolvimento ou confirme com --forcar')
+
+        if options['limpar']:
+            self.stdout.write(self.style.SUCCESS(f'{limpar_carga()} OS de carga removida(s)'))
+            return
+
+        if options['usuarios'] < 1 or options['duracao'] <= 0 or options['rampa'] < 0 or options['pausa'] < 0:
+            raise CommandError('--usuarios e --duracao devem ser maiores que zero; --rampa e --pausa não podem ser negativos')
+        mix = _mix(options['mix']) if options['mix'] else None
+
+        def progresso(segundos, requisicoes):
+            self.stdout.write(f'{segundos:>6.0f} s  {requisicoes} requisições')
+
+        try:
+            resultado = executar(
+                options['url'], usuarios=options['usuarios'], duracao=options['duracao'], rampa=options['rampa'],
+                mix=mix, pausa=options['pausa'], escrita=not options['sem_escrita'], senha=options['senha'],
+                semente=options['semente'], intervalo_painel=options['intervalo_painel'],
+                timeout=options['timeout'], progresso=progresso,
+            )
+        except ValueError as e:
+            raise CommandError(f"{e}. Grupos: {', '.join(GRUPOS)}")
+
+        grupos = ', '.join(f'{grupo}: {quantidade}' for grupo, quantidade in resultado['grupos'].items())
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{resultado['usuarios']} usuários ({grupos}) em {resultado['duracao_s']:.0f} s"))
+        self.stdout.write(
+            f"{'endpoint':<18} {'req':>6} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'erros':>7}"
+        )
+        linhas = list(resultado['endpoints'].items())
+        if resultado['total']:
+            linhas.append(('TOTAL', resultado['total']))
+        for nome, resumo in linhas:
+            linha = (
+                f"{nome:<18} {resumo['requisicoes']:>6} {resumo['vazao_rps']:>7.2f} {resumo['p50_ms']:>9.1f} "
+                f"{resumo['p95_ms']:>9.1f} {resumo['p99_ms']:>9.1f} {resumo['taxa_erro']:>7.1%}"
+            )
+            self.stdout.write(self.style.ERROR(linha) if resumo['erros'] else linha)
+            if resumo['falhas']:
+                self.stdout.write('    ' + ', '.join(f'{falha} ({vezes}x)' for falha, vezes in resumo['falhas'].items()))
+
+        saida = options['saida'] or f"carga-{timezone.now():%Y%m%d-%H%M%S}.json"
+        if os.path.dirname(saida):
+            os.makedirs(os.path.dirname(saida), exist_ok=True)
+        with open(saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, indent=2, sort_keys=True, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f'Resultado gravado em {saida}'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from controle.indice_arquivos import indexar_arquivos, tamanho_legivel, uso_armazenamento
+
+
+class Command(BaseCommand):
+    help = 'Relatório de uso de armazenamento dos anexos por cliente ou por OS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--por', choices=['cliente', 'os'], default='cliente', help='Agrupamento (padrão: cliente)')
+        parser.add_argument('--limite', type=int, default=20, help='Quantidade de linhas (padrão: 20; 0 = todas)')
+        parser.add_argument(
+            '--reindexar',
+            action='store_true',
+            help='Reconstrói o índice de arquivos a partir dos anexos antes do relatório'
+        )
+
+    def handle(self, *args, **options):
+        if options['reindexar']:
+            total = indexar_arquivos()
+            self.stdout.write(f'{total} arquivo(s) indexado(s)')
+
+        linhas = uso_armazenamento(options['por'], options['limite'] or None)
+        for linha in linhas:
+            cliente = linha['cliente'] or '(sem cliente)'
+            if options['por'] == 'os':
+                descricao = f"OS {linha['numero_os'] or linha['os'] or '-'} - {cliente}"
+            else:
+                descricao = cliente
+            self.stdout.write(f"{descricao}: {tamanho_legivel(linha['bytes'] or 0)} em {linha['arquivos']} arquivo(s)")
+
+        self.stdout.write(self.style.SUCCESS(f'{len(linhas)} linha(s)'))
@@ -0,0 +1,367 @@
+"""
+Métricas no formato texto do Prometheus (/metrics), agregadas entre os workers.
+
+- Requisições: os histogramas por rota do InstrumentacaoMiddleware (tempo e
+  quantidade de consultas), tempo em SQL, bytes e orçamentos excedidos.
+- Cache: acertos e faltas por família de chave (get dos backends de
+  settings.CACHES; as chaves do cache de página viram 'pagina' e
+  'pagina_cabecalho').
+- Exportações: duração de relatórios e pacotes ZIP (rotas de
+  METRICAS_EXPORTACOES), até o último byte nas respostas em streaming.
+- Webhooks: disparos e duração por evento. Os webhooks são síncronos (não há
+  fila de saída), então não existe profundidade de fila para medir.
+
+Cada worker do gunicorn guarda as métricas em memória e grava um retrato em
+METRICAS_DIRETORIO/<pid>-<início>.json no máximo a cada
+METRICAS_INTERVALO_GRAVACAO segundos; /metrics soma os retratos de todos os
+workers com o estado atual do processo que atende. Os retratos de workers que
+já saíram (--max-requests) são somados em encerrados.json, para os contadores
+não voltarem. Sem METRICAS_DIRETORIO vale só o processo. O diretório é limpo
+antes de subir o gunicorn (docker-entrypoint.sh).
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.module_loading import import_string
+
+from .instrumentacao import Histograma, nome_url, resumo_rotas
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LIMITES_EXPORTACAO_S = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LIMITES_WEBHOOK_S = (0.01, 0.05, 0.1, 0.5, 1, 5)
+ENCERRADOS = 'encerrados.json'
+
+_contadores = defaultdict(float)
+_histogramas = {}
+_trava = threading.Lock()
+_processo = {'pid': None, 'identificador': None, 'gravado_em': 0.0}
+_AUSENTE = object()
+
+
+def _rotulos(rotulos):
+    return tuple(sorted(rotulos.items()))
+
+
+def incrementar(nome, valor=1, **rotulos):
+    with _trava:
+        _contadores[(nome, _rotulos(rotulos))] += valor
+
+
+def observar(nome, valor, limites, **rotulos):
+    chave = (nome, _rotulos(rotulos))
+    with _trava:
+        histograma = _histogramas.get(chave)
+        if histograma is None:
+            histograma = _histogramas[chave] = Histograma(limites)
+        histograma.observar(valor)
+
+
+def zerar():
+    with _trava:
+        _contadores.clear()
+        _histogramas.clear()
+
+
+def estado_processo():
+    """Retrato serializável das métricas deste processo"""
+    with _trava:
+        contadores = [[nome, dict(rotulos), valor] for (nome, rotulos), valor in _contadores.items()]
+        histogramas = [[nome, dict(rotulos), h.resumo()] for (nome, rotulos), h in _histogramas.items()]
+    return {'rotas': resumo_rotas(), 'contadores': contadores, 'histogramas': histogramas}
+
+
+def _identificador():
+    """pid + instante do primeiro uso: um pid reaproveitado não sobrescreve o retrato de outro worker"""
+    pid = os.getpid()
+    if _processo['pid'] != pid:
+        _processo.update(pid=pid, identificador=f'{pid}-{int(time.time() * 1000)}', gravado_em=0.0)
+    return _processo['identificador']
+
+
+def gravar_estado(forcar=False):
+    diretorio = settings.METRICAS_DIRETORIO
+    if not diretorio:
+        return
+    identificador = _identificador()
+    agora = time.monotonic()
+    if not forcar and agora - _processo['gravado_em'] < settings.METRICAS_INTERVALO_GRAVACAO:
+        return
+    _processo['gravado_em'] = agora
+    os.makedirs(diretorio, exist_ok=True)
+    _gravar_json(os.path.join(diretorio, f'{identificador}.json'), estado_processo())
+
+
+def _somar_resumo(total, resumo):
+    if total is None:
+        return {'faixas': dict(resumo['faixas']), 'soma': resumo['soma'], 'total': resumo['total']}
+    for limite, contagem in resumo['faixas'].items():
+        total['faixas'][limite] = total['faixas'].get(limite, 0) + contagem
+    total['soma'] += resumo['soma']
+    total['total'] += resumo['total']
+    return total
+
+
+def _somar_estado(agregado, estado):
+    for rota, resumo in estado['rotas'].items():
+        atual = agregado['rotas'].setdefault(rota, {})
+        for campo, valor in resumo.items():
+            if isinstance(valor, dict):
+                atual[campo] = _somar_resumo(atual.get(campo), valor)
+            else:
+                atual[campo] = atual.get(campo, 0) + valor
+    for nome, rotulos, valor in estado['contadores']:
+        agregado['contadores'][(nome, _rotulos(rotulos))] += valor
+    for nome, rotulos, resumo in estado['histogramas']:
+        chave = (nome, _rotulos(rotulos))
+        agregado['histogramas'][chave] = _somar_resumo(agregado['histogramas'].get(chave), resumo)
+
+
+def _ler_estado(caminho):
+    try:
+        with open(caminho, encoding='utf-8') as entrada:
+            return json.load(entrada)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_json(caminho, dados):
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w', encoding='utf-8') as saida:
+        json.dump(dados, saida)
+    os.replace(temporario, caminho)
+
+
+def _processo_encerrado(nome):
+    try:
+        os.kill(int(nome.split('-', 1)[0]), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, OSError):
+        return False
+    return False
+
+
+def _compactar_encerrados(diretorio, nomes):
+    """Soma os retratos de workers que já saíram em encerrados.json e apaga os arquivos deles"""
+    encerrados = [nome for nome in nomes if nome != ENCERRADOS and _processo_encerrado(nome)]
+    if not encerrados:
+        return
+    caminho = os.path.join(diretorio, ENCERRADOS)
+    agregado = {'rotas': {}, 'contadores': defaultdict(float), 'histogramas': {}}
+    for nome in [ENCERRADOS, *encerrados]:
+        estado = _ler_estado(os.path.join(diretorio, nome))
+        if estado is not None:
+            _somar_estado(agregado, estado)
+    _gravar_json(caminho, {
+        'rotas': agregado['rotas'],
+        'contadores': [[nome, dict(rotulos), valor] for (nome, rotulos), valor in agregado['contadores'].items()],
+        'histogramas': [[nome, dict(rotulos), resumo] for (nome, rotulos), resumo in agregado['histogramas'].items()],
+    })
+    for nome in encerrados:
+        os.remove(os.path.join(diretorio, nome))
+
+
+def estado_agregado():
+    """Soma do estado atual deste processo com os retratos gravados pelos outros workers"""
+    agregado = {'rotas': {}, 'contadores': defaultdict(float), 'histogramas': {}, 'processos': 1}
+    _somar_estado(agregado, estado_processo())
+    diretorio = settings.METRICAS_DIRETORIO
+    if not diretorio or not os.path.isdir(diretorio):
+        return agregado
+
+    proprio = f'{_identificador()}.json'
+    with ExitStack() as pilha:
+        if fcntl is not None:
+            # Um worker por vez compacta os retratos (sem fcntl, no Windows, os arquivos só se acumulam)
+            trava = pilha.enter_context(open(os.path.join(diretorio, '.trava'), 'w'))
+            fcntl.flock(trava, fcntl.LOCK_EX)
+            _compactar_encerrados(diretorio, [
+                nome for nome in os.listdir(diretorio) if nome.endswith('.json') and nome != proprio
+            ])
+        for nome in sorted(os.listdir(diretorio)):
+            if not nome.endswith('.json') or nome == proprio:
+                continue
+            estado = _ler_estado(os.path.join(diretorio, nome))
+            if estado is None:
+                continue
+            _somar_estado(agregado, estado)
+            agregado['processos'] += nome != ENCERRADOS
+    return agregado
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _numero(valor):
+    return str(int(valor)) if float(valor).is_integer() else repr(round(float(valor), 6))
+
+
+def _serie(nome, rotulos=(), valor=0):
+    texto = ','.join(f'{chave}="{_escapar(conteudo)}"' for chave, conteudo in rotulos)
+    return f'{nome}{{{texto}}} {_numero(valor)}' if texto else f'{nome} {_numero(valor)}'
+
+
+def _linhas_histograma(nome, rotulos, resumo, escala=1):
+    linhas = []
+    for limite, contagem in resumo['faixas'].items():
+        le = limite if limite == '+Inf' else _numero(float(limite) * escala)
+        linhas.append(_serie(f'{nome}_bucket', (*rotulos, ('le', le)), contagem))
+    linhas.append(_serie(f'{nome}_sum', rotulos, resumo['soma'] * escala))
+    linhas.append(_serie(f'{nome}_count', rotulos, resumo['total']))
+    return linhas
+
+
+# nome -> (tipo, ajuda); a ordem é a da saída
+METRICAS = {
+    'controle_requisicao_duracao_segundos': ('histogram', 'Tempo de resposta por rota'),
+    'controle_requisicao_consultas': ('histogram', 'Consultas SQL por requisição, por rota'),
+    'controle_requisicao_sql_segundos_total': ('counter', 'Tempo gasto em SQL por rota'),
+    'controle_requisicao_serializacao_segundos_total': ('counter', 'Tempo gasto em serializer.data por rota'),
+    'controle_requisicao_serializer_construcao_segundos_total': (
+        'counter', 'Tempo montando serializers (__init__ e mapa de campos) por rota'
+    ),
+    'controle_requisicao_serializer_representacao_segundos_total': (
+        'counter', 'Tempo em to_representation (serializer.data sem a construção) por rota'
+    ),
+    'controle_resposta_bytes_total': ('counter', 'Bytes das respostas (não streaming) por rota'),
+    'controle_orcamento_consultas_excedido_total': ('counter', 'Requisições acima do orçamento de consultas'),
+    'controle_cache_consultas_total': ('counter', 'Leituras do cache por família de chave e resultado'),
+    'controle_exportacao_duracao_segundos': ('histogram', 'Duração das exportações até o último byte'),
+    'controle_webhooks_total': ('counter', 'Webhooks disparados por evento e resultado'),
+    'controle_webhook_duracao_segundos': ('histogram', 'Duração dos webhooks por evento'),
+    'controle_metricas_processos': ('gauge', 'Processos com métricas agregadas nesta resposta'),
+}
+
+
+def texto_prometheus(agregado=None):
+    agregado = agregado or estado_agregado()
+    series = defaultdict(list)
+    for rota, resumo in sorted(agregado['rotas'].items()):
+        rotulos = (('rota', rota),)
+        series['controle_requisicao_duracao_segundos'] += _linhas_histograma(
+            'controle_requisicao_duracao_segundos', rotulos, resumo['tempo_ms'], escala=0.001
+        )
+        series['controle_requisicao_consultas'] += _linhas_histograma(
+            'controle_requisicao_consultas', rotulos, resumo['consultas']
+        )
+        series['controle_requisicao_sql_segundos_total'].append(
+            _serie('controle_requisicao_sql_segundos_total', rotulos, resumo['tempo_sql_ms'] / 1000)
+        )
+        series['controle_requisicao_serializacao_segundos_total'].append(
+            _serie('controle_requisicao_serializacao_segundos_total', rotulos, resumo['tempo_serializacao_ms'] / 1000)
+        )
+        for nome, campo in (
+            ('controle_requisicao_serializer_construcao_segundos_total', 'tempo_construcao_ms'),
+            ('controle_requisicao_serializer_representacao_segundos_total', 'tempo_representacao_ms'),
+        ):
+            # Retratos gravados antes destes campos existirem não os têm
+            series[nome].append(_serie(nome, rotulos, resumo.get(campo, 0) / 1000))
+        series['controle_resposta_bytes_total'].append(_serie('controle_resposta_bytes_total', rotulos, resumo['bytes']))
+        series['controle_orcamento_consultas_excedido_total'].append(
+            _serie('controle_orcamento_consultas_excedido_total', rotulos, resumo['orcamento_excedido'])
+        )
+    for (nome, rotulos), valor in sorted(agregado['contadores'].items()):
+        series[nome].append(_serie(nome, rotulos, valor))
+    for (nome, rotulos), resumo in sorted(agregado['histogramas'].items()):
+        series[nome] += _linhas_histograma(nome, rotulos, resumo)
+    series['controle_metricas_processos'].append(_serie('controle_metricas_processos', valor=agregado['processos']))
+
+    linhas = []
+    for nome, (tipo, ajuda) in METRICAS.items():
+        if series[nome]:
+            linhas += [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}', *series[nome]]
+    return '\n'.join(linhas) + '\n'
+
+
+def familia_chave(chave):
+    """Família de uma chave de cache: o prefixo antes de ':' (cache de página tem nomes próprios)"""
+    chave = str(chave)
+    if chave.startswith('views.decorators.cache.cache_header.'):
+        return 'pagina_cabecalho'
+    if chave.startswith('views.decorators.cache.cache_page.'):
+        return 'pagina'
+    return chave.split(':', 1)[0] if ':' in chave else 'outras'
+
+
+def _medir_get(get):
+    @functools.wraps(get)
+    def get_medido(cache, key, default=None, *args, **kwargs):
+        valor = get(cache, key, _AUSENTE, *args, **kwargs)
+        acertou = valor is not _AUSENTE
+        incrementar('controle_cache_consultas_total', familia=familia_chave(key), resultado='hit' if acertou else 'miss')
+        return valor if acertou else default
+    get_medido.instrumentado = True
+    return get_medido
+
+
+def instalar_medicao_cache():
+    """Chamado no ready do app: mede o get dos backends configurados em CACHES"""
+    for configuracao in settings.CACHES.values():
+        classe = import_string(configuracao['BACKEND'])
+        if not getattr(classe.get, 'instrumentado', False):
+            classe.get = _medir_get(classe.get)
+
+
+def medir_webhook(evento):
+    """Decorator dos disparos de webhook: conta por resultado e mede a duração"""
+    def decorator(funcao):
+        @functools.wraps(funcao)
+        def disparar(*args, **kwargs):
+            inicio = time.perf_counter()
+            resultado = 'erro'
+            try:
+                retorno = funcao(*args, **kwargs)
+                resultado = 'ok'
+                return retorno
+            finally:
+                incrementar('controle_webhooks_total', evento=evento, resultado=resultado)
+                observar('controle_webhook_duracao_segundos', time.perf_counter() - inicio, LIMITES_WEBHOOK_S, evento=evento)
+        return disparar
+    return decorator
+
+
+def _fim_do_streaming(conteudo, ao_terminar):
+    try:
+        yield from conteudo
+    finally:
+        ao_terminar()
+
+
+class MetricasMiddleware:
+    """Duração das exportações e gravação periódica do retrato do processo"""
+
+    def __init__(self, get_response):
+        if not settings.METRICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        # Retrato final do worker (gunicorn --max-requests encerra com sys.exit)
+        if not _processo.get('atexit'):
+            _processo['atexit'] = True
+            atexit.register(gravar_estado, True)
+
+    def __call__(self, request):
+        inicio = time.perf_counter()
+        response = self.get_response(request)
+        tipo = settings.METRICAS_EXPORTACOES.get(nome_url(request))
+        if tipo and response.status_code < 400:
+            def registrar():
+                observar('controle_exportacao_duracao_segundos', time.perf_counter() - inicio, LIMITES_EXPORTACAO_S, tipo=tipo)
+            if getattr(response, 'streaming', False):
+                response.streaming_content = _fim_do_streaming(response.streaming_content, registrar)
+            else:
+                registrar()
+        gravar_estado()
+        return response
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-19 03:46
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, F, When, Value
+from django.db.models.functions import Coalesce
+
+
+def preencher_valor_total(apps, schema_editor):
+    """Preenche valor_total das OS existentes com um único UPDATE"""
+    RegistroOS = apps.get_model('controle', 'RegistroOS')
+    RegistroOS.objects.update(
+        valor_total=Case(
+            When(saldo_final__gt=0, then=F('saldo_final')),
+            default=Coalesce(F('soma_valores'), Value(Decimal('0'))),
+            output_field=models.DecimalField(max_digits=15, decimal_places=2),
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registroos',
+            name='valor_total',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, default=0, editable=False, max_digits=15, null=True),
+        ),
+        migrations.RunPython(preencher_valor_total, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.1 on 2026-10-19 04:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle', '0003_uploadsessao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoArmazenado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(db_index=True, max_length=255)),
+                ('tamanho', models.BigIntegerField(default=0)),
+                ('modelo', models.CharField(max_length=100)),
+                ('campo', models.CharField(max_length=100)),
+                ('objeto_id', models.BigIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('registro', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='arquivos_armazenados', to='controle.registroos')),
+            ],
+            options={
+                'verbose_name': 'Arquivo Armazenado',
+                'verbose_name_plural': 'Arquivos Armazenados',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='arquivoarmazenado',
+            constraint=models.UniqueConstraint(fields=('modelo', 'objeto_id', 'campo'), name='arquivo_armazenado_unico'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-19 04:53
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle', '0004_arquivoarmazenado'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroOSArquivado',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('numero_os', models.PositiveIntegerField(unique=True)),
+                ('os_id', models.UUIDField(unique=True)),
+                ('valor_total', models.DecimalField(blank=True, decimal_places=2, default=0, max_digits=15, null=True)),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField()),
+                ('arquivado_em', models.DateTimeField(auto_now_add=True)),
+                ('resumo', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('dados', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('linhas', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('nome_cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='controle.cliente')),
+                ('status_os', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='controle.statusos')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordens_servico_arquivadas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Ordem de Serviço Arquivada',
+                'verbose_name_plural': 'Ordens de Serviço Arquivadas',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='arquivoarmazenado',
+            name='arquivado',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='arquivos_armazenados', to='controle.registroosarquivado'),
+        ),
+    ]
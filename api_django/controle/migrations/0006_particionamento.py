@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-19 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle', '0005_registroosarquivado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='registroos',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        # A conversão das tabelas não roda em migrate: só pelo comando
+        # particoes --converter <ano|mes> --confirmar (ver controle/particionamento.py)
+    ]
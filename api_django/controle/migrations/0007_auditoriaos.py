@@ -0,0 +1,37 @@
+# Generated by Django 5.0.1 on 2026-10-19 06:02
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('controle', '0006_particionamento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditoriaOS',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('os_id', models.BigIntegerField(blank=True, null=True)),
+                ('modelo', models.CharField(max_length=100)),
+                ('objeto_id', models.BigIntegerField(blank=True, null=True)),
+                ('acao', models.CharField(choices=[('criado', 'Criado'), ('alterado', 'Alterado'), ('excluido', 'Excluído'), ('arquivado', 'Arquivado'), ('desarquivado', 'Desarquivado')], max_length=20)),
+                ('alteracoes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('criado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='auditorias_os', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Auditoria de OS',
+                'verbose_name_plural': 'Auditoria de OS',
+                'ordering': ['-criado_em', '-id'],
+                'indexes': [models.Index(fields=['os_id', 'criado_em'], name='auditoria_os_criado'), models.Index(fields=['usuario', 'criado_em'], name='auditoria_usuario_criado')],
+            },
+        ),
+    ]
@@ -0,0 +1,173 @@
+"""
+Miniaturas e previews de anexos (imagens e PDFs).
+
+Depois que um anexo é salvo, a geração roda em segundo plano, grava os
+derivados ao lado do original, em <pasta>/_previews/, e guarda os nomes no
+campo derivados do anexo: a representação não toca no disco. O nome do
+derivado inclui um hash do original (nome, tamanho e data de modificação),
+então um derivado antigo nunca é confundido com o do arquivo atual. Assim
+como o anexo, os derivados só são servidos pela rota protegida de download.
+"""
+import hashlib
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, models, transaction
+from django.db.models.signals import post_save
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PASTA_DERIVADOS = '_previews'
+TAMANHO_MINIATURA = (200, 200)
+TAMANHO_PREVIEW = (1024, 1024)
+EXTENSOES_IMAGEM = {'.jpg', '.jpeg', '.png'}
+EXTENSOES_PDF = {'.pdf'}
+
+_executor = None
+
+
+def campos_arquivo(modelo):
+    """Nomes dos FileFields de um modelo"""
+    return [campo.name for campo in modelo._meta.fields if isinstance(campo, models.FileField)]
+
+
+def nomes_derivados(nome):
+    """Nomes da miniatura e do preview de um anexo, ou None se não suportado/inexistente"""
+    extensao = os.path.splitext(nome)[1].lower()
+    if extensao not in EXTENSOES_IMAGEM | EXTENSOES_PDF:
+        return None
+
+    try:
+        info = os.stat(default_storage.path(nome))
+    except (FileNotFoundError, NotImplementedError):
+        return None
+
+    chave = hashlib.sha1(f'{nome}:{info.st_size}:{info.st_mtime_ns}'.encode()).hexdigest()[:12]
+    pasta, base = posixpath.split(nome)
+    prefixo = posixpath.join(pasta, PASTA_DERIVADOS, f'{base}.{chave}')
+    return {'miniatura': f'{prefixo}.thumb.jpg', 'preview': f'{prefixo}.preview.jpg'}
+
+
+def derivados_atuais(instancia, campo):
+    """Nomes persistidos da miniatura e do preview, se gerados para o arquivo atual do anexo"""
+    arquivo = getattr(instancia, campo)
+    derivados = instancia.derivados or {}
+    if not arquivo or derivados.get('original') != arquivo.name:
+        return {}
+    return derivados
+
+
+def gerar_derivados(nome):
+    """Gera miniatura e preview de um anexo; retorna os nomes ou None se não suportado"""
+    nomes = nomes_derivados(nome)
+    if not nomes:
+        return None
+    if all(default_storage.exists(derivado) for derivado in nomes.values()):
+        return nomes
+
+    if os.path.splitext(nome)[1].lower() in EXTENSOES_PDF:
+        imagem = _primeira_pagina_pdf(default_storage.path(nome))
+        if imagem is None:
+            return None
+    else:
+        with default_storage.open(nome, 'rb') as arquivo:
+            imagem = Image.open(arquivo)
+            imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+
+    for tipo, tamanho in (('preview', TAMANHO_PREVIEW), ('miniatura', TAMANHO_MINIATURA)):
+        derivado = imagem.copy()
+        derivado.thumbnail(tamanho)
+        _salvar(nomes[tipo], derivado)
+    return nomes
+
+
+def registrar_derivados(modelo, pk, campo, nome):
+    """Gera os derivados e grava os nomes no anexo, se ele ainda aponta para o mesmo arquivo"""
+    nomes = gerar_derivados(nome)
+    if nomes:
+        # update() não dispara o post_save (nem a auditoria)
+        modelo.objects.filter(pk=pk, **{campo: nome}).update(derivados={'original': nome, **nomes})
+    return nomes
+
+
+def _salvar(nome, imagem):
+    buffer = BytesIO()
+    imagem.save(buffer, 'JPEG', quality=80, optimize=True)
+    if default_storage.exists(nome):
+        default_storage.delete(nome)
+    default_storage.save(nome, ContentFile(buffer.getvalue()))
+
+
+def _primeira_pagina_pdf(caminho):
+    """Renderiza a primeira página do PDF com o pdftoppm (poppler-utils), se instalado"""
+    executavel = shutil.which('pdftoppm')
+    if not executavel:
+        logger.debug('pdftoppm não encontrado; preview de PDF desativado')
+        return None
+
+    with tempfile.TemporaryDirectory() as pasta:
+        saida = os.path.join(pasta, 'pagina')
+        subprocess.run(
+            [executavel, '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+             '-scale-to', str(max(TAMANHO_PREVIEW)), caminho, saida],
+            check=True, capture_output=True, timeout=60,
+        )
+        imagem = Image.open(f'{saida}.jpg')
+        imagem.load()
+        return imagem.convert('RGB')
+
+
+def _gerar_com_log(modelo, pk, campo, nome):
+    try:
+        registrar_derivados(modelo, pk, campo, nome)
+    except Exception as e:
+        logger.error(f"Erro ao gerar miniatura de {nome}: {str(e)}")
+
+
+def _gerar_em_segundo_plano(*args):
+    try:
+        _gerar_com_log(*args)
+    finally:
+        # A thread do pool tem a própria conexão com o banco
+        connection.close()
+
+
+def agendar_derivados(modelo, pk, campo, nome):
+    """Envia a geração para o pool em segundo plano (ou executa direto se desativado)"""
+    global _executor
+    if not settings.MINIATURAS_ASSINCRONO:
+        _gerar_com_log(modelo, pk, campo, nome)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.MINIATURAS_WORKERS, thread_name_prefix='miniaturas')
+    _executor.submit(_gerar_em_segundo_plano, modelo, pk, campo, nome)
+
+
+def anexo_salvo(sender, instance, **kwargs):
+    """post_save dos modelos com anexos: agenda os derivados após o commit, se ainda não gerados"""
+    for campo in campos_arquivo(sender):
+        arquivo = getattr(instance, campo)
+        if not arquivo or derivados_atuais(instance, campo):
+            continue
+        if os.path.splitext(arquivo.name)[1].lower() in EXTENSOES_IMAGEM | EXTENSOES_PDF:
+            transaction.on_commit(
+                lambda campo=campo, nome=arquivo.name: agendar_derivados(sender, instance.pk, campo, nome)
+            )
+
+
+def conectar_sinais():
+    """Conecta o post_save de todos os modelos do app que têm FileField"""
+    for modelo in apps.get_app_config('controle').get_models():
+        if campos_arquivo(modelo):
+            post_save.connect(anexo_salvo, sender=modelo, dispatch_uid=f'miniaturas_{modelo.__name__}')
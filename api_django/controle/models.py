@@ -1,7 +1,17 @@
 from datetime import datetime, timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
+import hashlib
+import os
 import uuid
 import random
 
@@ -89,16 +99,55 @@ class RegistroOS(models.Model):
     opcoes_nf = models.CharField(max_length=100, choices=OPCOES_NOTAS_FISCAIS, default='', null=True, blank=True)      
     soma_notas_fiscais = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False, null=True, blank=True)
     saldo_final = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False, null=True, blank=True)
+    # Valor exibido em listagens/relatórios: saldo_final se positivo, senão soma_valores
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, editable=False, null=True, blank=True, db_index=True)
     
     # Campos de controle
     observacao = models.TextField(max_length=1000, blank=True, null=True, default='')
     usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="ordens_servico")
     os_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     
-    # Timestamps
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Timestamps (relatórios e estatísticas filtram por intervalo de created_at)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Pares (flag 'havera_valor', valor) que compõem soma_valores
+    CAMPOS_VALOR = [
+        ('havera_valor_fabricacao', 'valor_fabricacao'),
+        ('havera_valor_levantamento', 'valor_levantamento'),
+        ('havera_valor_material_fabricacao', 'valor_material_fabricacao'),
+        ('havera_valor_material_pintura', 'valor_material_pintura'),
+        ('havera_valor_servico_pintura_revestimento', 'valor_servico_pintura_revestimento'),
+        ('havera_valor_montagem', 'valor_montagem'),
+        ('havera_valor_material_montagem', 'valor_material_montagem'),
+        ('havera_valor_inspecao', 'valor_inspecao'),
+        ('havera_valor_hh', 'valor_hh'),
+        ('havera_valor_manutencao_valvula', 'valor_manutencao_valvula'),
+        ('havera_valor_servico_terceiros', 'valor_servico_terceiros'),
+    ]
+    
+    # Campos derivados das notas fiscais de venda
+    CAMPOS_TOTAIS_NF = ['soma_notas_fiscais', 'saldo_final', 'valor_total']
+    CAMPOS_TOTAIS = ['soma_valores'] + CAMPOS_TOTAIS_NF
+    
+    # Nomes de status_os por situação (com as variações cadastradas)
+    STATUS_CONCLUIDA = [
+        'CONCLUIDO', 'CONCLUÍDO', 'CONCLUIDA', 'CONCLUÍDA',
+        'FINALIZADO', 'FINALIZADA', 'FINALIZADO', 'FINALIZADA',
+        'concluido', 'concluído', 'concluida', 'concluída',
+        'finalizado', 'finalizada', 'finalizado', 'finalizada'
+    ]
+    STATUS_EM_ANDAMENTO = [
+        'APROVADA', 'APROVADO', 'APROVADA', 'APROVADO', 'Aprovada', 'Aprovado',
+        'EM ANDAMENTO', 'EM_ANDAMENTO', 'EMANDAMENTO', 'Em Andamento',
+        'aprovada', 'aprovado', 'aprovada', 'aprovado',
+        'em andamento', 'em_andamento', 'emandamento'
+    ]
+    STATUS_CANCELADA = [
+        'CANCELADA', 'CANCELADO', 'Cancelada', 'Cancelado',
+        'cancelada', 'cancelado'
+    ]
+    
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Ordem de Serviço'
@@ -111,8 +160,9 @@ class RegistroOS(models.Model):
         if not self.numero_os:
             self.numero_os = self.gerar_numero_os()
         
-        # Calcular soma de valores
+        # Calcular soma de valores e saldo com o total de NFs já armazenado
         self.calcular_soma_valores()
+        self.calcular_saldo_final(recalcular_notas=False)
         
         super().save(*args, **kwargs)
         
@@ -120,51 +170,154 @@ class RegistroOS(models.Model):
         """Gera um número único para a OS"""
         while True:
             numero = random.randint(100000, 999999)
-            if not RegistroOS.objects.filter(numero_os=numero).exists():
+            # Números de OS arquivadas continuam reservados
+            if (
+                not RegistroOS.objects.filter(numero_os=numero).exists()
+                and not RegistroOSArquivado.objects.filter(numero_os=numero).exists()
+            ):
                 return numero
     
     def calcular_soma_valores(self):
         """Calcula a soma dos valores baseado nos campos 'havera_valor'"""
-        total = 0
-        
-        campos_valor = [
-            ('havera_valor_fabricacao', 'valor_fabricacao'),
-            ('havera_valor_levantamento', 'valor_levantamento'),
-            ('havera_valor_material_fabricacao', 'valor_material_fabricacao'),
-            ('havera_valor_material_pintura', 'valor_material_pintura'),
-            ('havera_valor_servico_pintura_revestimento', 'valor_servico_pintura_revestimento'),
-            ('havera_valor_montagem', 'valor_montagem'),
-            ('havera_valor_material_montagem', 'valor_material_montagem'),
-            ('havera_valor_inspecao', 'valor_inspecao'),
-            ('havera_valor_hh', 'valor_hh'),
-            ('havera_valor_manutencao_valvula', 'valor_manutencao_valvula'),
-            ('havera_valor_servico_terceiros', 'valor_servico_terceiros'),
-        ]
-        
-        for campo_havera, campo_valor in campos_valor:
-            if getattr(self, campo_havera) == 'SIM':
-                total += getattr(self, campo_valor, 0) or 0
-        
-        self.soma_valores = total
+        self.soma_valores = self.somar_valores(lambda campo: getattr(self, campo, None))
+    
+    @classmethod
+    def somar_valores(cls, obter):
+        """Soma os valores com 'havera_valor' = SIM; obter(campo) retorna o valor do campo"""
+        total = Decimal('0')
+        for campo_havera, campo_valor in cls.CAMPOS_VALOR:
+            if obter(campo_havera) == 'SIM':
+                total += Decimal(str(obter(campo_valor) or 0))
+        return total
+    
+    @staticmethod
+    def calcular_saldo_e_valor_total(soma_valores, soma_notas_fiscais):
+        """Regra única de saldo_final e valor_total, compartilhada com o preview de valores"""
+        soma_valores = Decimal(str(soma_valores or 0))
+        soma_notas_fiscais = Decimal(str(soma_notas_fiscais or 0))
+        saldo_final = soma_notas_fiscais - soma_valores
+        valor_total = saldo_final if saldo_final > 0 else soma_valores
+        return saldo_final, valor_total
     
     def calcular_soma_notas_fiscais(self):
-        """Calcula a soma das notas fiscais de venda"""
-        total = sum(nf.preco_nota_fiscal_venda for nf in self.notas_fiscais_venda.all())
+        """Calcula a soma das notas fiscais de venda via agregação no banco"""
+        total = self.notas_fiscais_venda.aggregate(
+            soma=Coalesce(Sum('preco_nota_fiscal_venda'), Value(Decimal('0')))
+        )['soma']
         self.soma_notas_fiscais = total
         return total
     
-    def calcular_saldo_final(self):
+    def calcular_saldo_final(self, recalcular_notas=True):
         """Calcula o saldo final (soma_notas_fiscais - soma_valores)"""
-        from decimal import Decimal
+        if recalcular_notas:
+            self.calcular_soma_notas_fiscais()
+        
+        self.saldo_final, self.valor_total = self.calcular_saldo_e_valor_total(
+            self.soma_valores, self.soma_notas_fiscais
+        )
+        return self.saldo_final
+    
+    @classmethod
+    def expressoes_totais(cls, recalcular_soma_valores=False):
+        """Expressões SQL dos campos totais, na mesma regra dos métodos calcular_*"""
+        decimal_field = models.DecimalField(max_digits=15, decimal_places=2)
+        zero = Value(Decimal('0'))
         
-        self.calcular_soma_notas_fiscais()
+        if recalcular_soma_valores:
+            parcelas = [
+                Case(
+                    When(**{campo_havera: 'SIM'}, then=Coalesce(F(campo_valor), zero)),
+                    default=zero,
+                    output_field=decimal_field,
+                )
+                for campo_havera, campo_valor in cls.CAMPOS_VALOR
+            ]
+            soma_valores = parcelas[0]
+            for parcela in parcelas[1:]:
+                soma_valores = soma_valores + parcela
+        else:
+            soma_valores = Coalesce(F('soma_valores'), zero, output_field=decimal_field)
         
-        # Converter para Decimal para evitar erro de tipo
-        soma_valores = Decimal(str(self.soma_valores or 0))
-        soma_notas_fiscais = Decimal(str(self.soma_notas_fiscais or 0))
+        soma_nf = Coalesce(
+            Subquery(
+                NfVenda.objects.filter(registro=OuterRef('pk'))
+                .order_by()
+                .values('registro')
+                .annotate(soma=Sum('preco_nota_fiscal_venda'))
+                .values('soma')[:1],
+                output_field=decimal_field,
+            ),
+            zero,
+            output_field=decimal_field,
+        )
+        saldo = soma_nf - soma_valores
         
-        self.saldo_final = soma_notas_fiscais - soma_valores
-        return self.saldo_final
+        # No UPDATE todas as colunas leem os valores antigos; por isso as
+        # expressões são repetidas em vez de referenciar o campo atualizado
+        expressoes = {
+            'soma_notas_fiscais': soma_nf,
+            'saldo_final': saldo,
+            'valor_total': Case(
+                When(GreaterThan(saldo, zero), then=saldo),
+                default=soma_valores,
+                output_field=decimal_field,
+            ),
+        }
+        if recalcular_soma_valores:
+            expressoes['soma_valores'] = soma_valores
+        return expressoes
+    
+    @classmethod
+    def atualizar_totais_notas_fiscais(cls, queryset=None):
+        """Recalcula soma_notas_fiscais, saldo_final e valor_total em um único UPDATE"""
+        if queryset is None:
+            queryset = cls.objects.all()
+        return queryset.order_by().update(**cls.expressoes_totais())
+    
+    @classmethod
+    def recalcular_totais(cls, queryset=None, tamanho_lote=1000):
+        """Recalcula todos os totais em UPDATEs por lote, sem passar por save()"""
+        if queryset is None:
+            queryset = cls.objects.all()
+        
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True).distinct())
+        expressoes = cls.expressoes_totais(recalcular_soma_valores=True)
+        
+        total = 0
+        for inicio in range(0, len(ids), tamanho_lote):
+            lote = ids[inicio:inicio + tamanho_lote]
+            total += cls.objects.filter(pk__in=lote).update(**expressoes)
+        return total
+    
+    @classmethod
+    def diferencas_totais(cls, queryset=None, tamanho_lote=1000):
+        """Lista as OS cujos totais armazenados divergem do recálculo (dry-run)"""
+        if queryset is None:
+            queryset = cls.objects.all()
+        
+        ids = queryset.order_by('pk').values_list('pk', flat=True).distinct()
+        anotacoes = {
+            f'novo_{campo}': expressao
+            for campo, expressao in cls.expressoes_totais(recalcular_soma_valores=True).items()
+        }
+        
+        calculados = (
+            cls.objects.filter(pk__in=ids)
+            .order_by('pk')
+            .annotate(**anotacoes)
+            .values('pk', 'numero_os', *cls.CAMPOS_TOTAIS, *anotacoes.keys())
+        )
+        
+        diferencas = []
+        for linha in calculados.iterator(chunk_size=tamanho_lote):
+            campos = {
+                campo: (linha[campo] or Decimal('0'), linha[f'novo_{campo}'] or Decimal('0'))
+                for campo in cls.CAMPOS_TOTAIS
+            }
+            campos = {campo: par for campo, par in campos.items() if par[0] != par[1]}
+            if campos:
+                diferencas.append({'id': linha['pk'], 'numero_os': linha['numero_os'], 'campos': campos})
+        return diferencas
 
 
 class DocumentoSolicitacao(models.Model):
@@ -178,6 +331,8 @@ class DocumentoSolicitacao(models.Model):
         upload_to='documentos_solicitacao/',
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])]
     )
+    # Miniatura e preview já gerados (controle.miniaturas), válidos enquanto 'original' for o arquivo atual
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -271,6 +426,7 @@ class DocumentoEntrada(models.Model):
     )
     numero_documento_entrada = models.CharField(max_length=100)
     data_documento_entrada = models.DateTimeField()
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -291,6 +447,7 @@ class Levantamento(models.Model):
         upload_to="anexos_levantamento/",
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png', 'dwg'])]
     )
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -335,6 +492,7 @@ class Gmi(models.Model):
         upload_to="anexos_gmi/",
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])]
     )
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -355,6 +513,7 @@ class Gme(models.Model):
         upload_to="anexos_gme/",
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])]
     )
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -375,6 +534,7 @@ class Rtip(models.Model):
         upload_to="anexos_rtip/",
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])]
     )
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -395,6 +555,7 @@ class Rtm(models.Model):
         upload_to="anexos_rtm/",
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png'])]
     )
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -466,6 +627,7 @@ class NfSaida(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png'])]
     )
     data_nota_fiscal_remessa_saida = models.DateTimeField()
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -487,6 +649,7 @@ class NfVenda(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=['pdf', 'jpg', 'jpeg', 'png'])]
     )
     data_nota_fiscal_venda = models.DateTimeField()
+    derivados = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -495,6 +658,17 @@ class NfVenda(models.Model):
     
     def __str__(self):
         return f"NF Venda {self.numero_nota_fiscal_venda} - OS {self.registro.numero_os}"
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Manter totais da OS sincronizados sem recarregar a OS
+        RegistroOS.atualizar_totais_notas_fiscais(RegistroOS.objects.filter(pk=self.registro_id))
+    
+    def delete(self, *args, **kwargs):
+        registro_id = self.registro_id
+        resultado = super().delete(*args, **kwargs)
+        RegistroOS.atualizar_totais_notas_fiscais(RegistroOS.objects.filter(pk=registro_id))
+        return resultado
 
 class Cliente(models.Model):
     nome = models.CharField(max_length=100, unique=True)
@@ -788,3 +962,205 @@ class TipoDocumentoSolicitacao(models.Model):
     class Meta:
         verbose_name = 'Tipo de Documento de Solicitação'
         verbose_name_plural = 'Tipos de Documento de Solicitação'
+
+
+class UploadSessao(models.Model):
+    """Sessão de upload em partes (retomável) para anexos grandes"""
+    
+    STATUS_CHOICES = [
+        ('PENDENTE', 'Pendente'),
+        ('CONCLUIDO', 'Concluído'),
+        ('ANEXADO', 'Anexado'),
+    ]
+    # Prefixo usado nos campos de arquivo para referenciar um upload concluído
+    PREFIXO_REFERENCIA = 'upload:'
+    TAMANHO_BLOCO = 64 * 1024
+    
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessoes')
+    nome_arquivo = models.CharField(max_length=255)
+    tamanho_total = models.BigIntegerField()
+    recebido = models.BigIntegerField(default=0)
+    checksum_sha256 = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDENTE')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Sessão de Upload'
+        verbose_name_plural = 'Sessões de Upload'
+    
+    def __str__(self):
+        return f"Upload {self.nome_arquivo} ({self.recebido}/{self.tamanho_total})"
+    
+    @property
+    def caminho(self):
+        """Arquivo parcial em disco, fora do MEDIA_ROOT"""
+        return os.path.join(settings.UPLOAD_PARCIAL_DIR, f'{self.token}.part')
+    
+    def criar_arquivo(self):
+        """Cria o arquivo parcial vazio"""
+        os.makedirs(settings.UPLOAD_PARCIAL_DIR, exist_ok=True)
+        open(self.caminho, 'wb').close()
+    
+    def gravar_parte(self, offset, stream, tamanho_max, checksum=None):
+        """Grava uma parte a partir de offset lendo o stream em blocos, sem bufferizar em memória"""
+        hash_parte = hashlib.sha256()
+        escritos = 0
+        
+        with open(self.caminho, 'r+b') as destino:
+            destino.seek(offset)
+            while True:
+                bloco = stream.read(self.TAMANHO_BLOCO)
+                if not bloco:
+                    break
+                escritos += len(bloco)
+                if escritos > tamanho_max or offset + escritos > self.tamanho_total:
+                    destino.truncate(offset)
+                    raise ValueError('Parte maior que o permitido')
+                hash_parte.update(bloco)
+                destino.write(bloco)
+            
+            if checksum and hash_parte.hexdigest() != checksum.strip().lower():
+                destino.truncate(offset)
+                raise ValueError('Checksum da parte não confere')
+        
+        self.recebido = offset + escritos
+        if self.recebido == self.tamanho_total:
+            if self.checksum_sha256 and self.calcular_checksum() != self.checksum_sha256.lower():
+                # Arquivo corrompido: recomeçar do zero
+                open(self.caminho, 'wb').close()
+                self.recebido = 0
+                self.save(update_fields=['recebido', 'updated_at'])
+                raise ValueError('Checksum do arquivo não confere; reenvie o arquivo')
+            self.status = 'CONCLUIDO'
+        self.save(update_fields=['recebido', 'status', 'updated_at'])
+    
+    def calcular_checksum(self):
+        """SHA-256 do arquivo montado, lido em blocos"""
+        hash_arquivo = hashlib.sha256()
+        with open(self.caminho, 'rb') as arquivo:
+            for bloco in iter(lambda: arquivo.read(self.TAMANHO_BLOCO), b''):
+                hash_arquivo.update(bloco)
+        return hash_arquivo.hexdigest()
+    
+    def como_arquivo(self):
+        """Arquivo montado pronto para ser atribuído a um FileField"""
+        return ArquivoUploadSessao(open(self.caminho, 'rb'), name=self.nome_arquivo, caminho=self.caminho)
+    
+    def remover_arquivo(self):
+        """Remove o arquivo parcial, se ainda existir"""
+        if os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+
+class ArquivoUploadSessao(File):
+    """Arquivo de uma sessão de upload; o storage cria um link para o arquivo em vez de copiá-lo"""
+    
+    def __init__(self, file, name, caminho):
+        super().__init__(file, name=name)
+        self.caminho = caminho
+    
+    def temporary_file_path(self):
+        return self.caminho
+
+
+class ArquivoArmazenado(models.Model):
+    """Índice dos arquivos referenciados pelos FileFields (uso de armazenamento e limpeza de órfãos)"""
+    
+    nome = models.CharField(max_length=255, db_index=True)
+    tamanho = models.BigIntegerField(default=0)
+    modelo = models.CharField(max_length=100)
+    campo = models.CharField(max_length=100)
+    objeto_id = models.BigIntegerField()
+    registro = models.ForeignKey(
+        RegistroOS, on_delete=models.SET_NULL, null=True, blank=True, related_name='arquivos_armazenados'
+    )
+    # Arquivos de OS arquivadas: o índice é a única referência a eles
+    arquivado = models.ForeignKey(
+        'RegistroOSArquivado', on_delete=models.SET_NULL, null=True, blank=True, related_name='arquivos_armazenados'
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Arquivo Armazenado'
+        verbose_name_plural = 'Arquivos Armazenados'
+        constraints = [
+            models.UniqueConstraint(fields=['modelo', 'objeto_id', 'campo'], name='arquivo_armazenado_unico'),
+        ]
+    
+    def __str__(self):
+        return f"{self.nome} ({self.tamanho} bytes)"
+
+
+class RegistroOSArquivado(models.Model):
+    """
+    OS concluída/cancelada retirada das tabelas ativas junto com as tabelas filhas.
+    Guarda as representações da API (somente leitura) e as linhas originais para desarquivar.
+    """
+    
+    # Mesmo id da OS original, para as URLs continuarem válidas
+    id = models.BigIntegerField(primary_key=True)
+    numero_os = models.PositiveIntegerField(unique=True)
+    os_id = models.UUIDField(unique=True)
+    nome_cliente = models.ForeignKey('Cliente', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    status_os = models.ForeignKey('StatusOS', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='ordens_servico_arquivadas')
+    valor_total = models.DecimalField(max_digits=15, decimal_places=2, default=0, null=True, blank=True)
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    arquivado_em = models.DateTimeField(auto_now_add=True)
+    
+    # Representações de listagem e de detalhe no momento do arquivamento
+    resumo = models.JSONField(encoder=DjangoJSONEncoder)
+    dados = models.JSONField(encoder=DjangoJSONEncoder)
+    # Linhas da OS e das tabelas filhas (formato do django.core.serializers)
+    linhas = models.JSONField(encoder=DjangoJSONEncoder)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Ordem de Serviço Arquivada'
+        verbose_name_plural = 'Ordens de Serviço Arquivadas'
+    
+    def __str__(self):
+        return f"OS {self.numero_os} (arquivada)"
+
+
+class AuditoriaOS(models.Model):
+    """
+    Alteração campo a campo de uma OS ou de uma tabela filha ({campo: [antes, depois]}).
+    os_id não é chave estrangeira: o histórico sobrevive à exclusão e ao arquivamento da OS.
+    """
+    
+    CRIADO = 'criado'
+    ALTERADO = 'alterado'
+    EXCLUIDO = 'excluido'
+    ARQUIVADO = 'arquivado'
+    DESARQUIVADO = 'desarquivado'
+    ACOES = [
+        (CRIADO, 'Criado'),
+        (ALTERADO, 'Alterado'),
+        (EXCLUIDO, 'Excluído'),
+        (ARQUIVADO, 'Arquivado'),
+        (DESARQUIVADO, 'Desarquivado'),
+    ]
+    
+    os_id = models.BigIntegerField(null=True, blank=True)
+    modelo = models.CharField(max_length=100)
+    objeto_id = models.BigIntegerField(null=True, blank=True)
+    acao = models.CharField(max_length=20, choices=ACOES)
+    alteracoes = models.JSONField(encoder=DjangoJSONEncoder, default=dict)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='auditorias_os')
+    criado_em = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-criado_em', '-id']
+        verbose_name = 'Auditoria de OS'
+        verbose_name_plural = 'Auditoria de OS'
+        indexes = [
+            models.Index(fields=['os_id', 'criado_em'], name='auditoria_os_criado'),
+            models.Index(fields=['usuario', 'criado_em'], name='auditoria_usuario_criado'),
+        ]
+    
+    def __str__(self):
+        return f"OS {self.os_id}: {self.modelo} {self.objeto_id} {self.acao}"
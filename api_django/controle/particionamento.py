@@ -0,0 +1,230 @@
+"""
+Particionamento por intervalo de created_at (PostgreSQL).
+
+As tabelas filhas de maior volume passam a ser tabelas particionadas por ano
+ou por mês, com uma partição padrão para datas fora das partições criadas.
+Consultas com created_at limitado só leem as partições do intervalo.
+
+A RegistroOS não é particionada: no PostgreSQL toda chave única de uma tabela
+particionada precisa incluir a coluna de partição, o que impediria as
+ForeignKeys das tabelas filhas e os campos únicos numero_os/os_id. Para ela
+basta o índice em created_at.
+
+Após a conversão a chave primária passa a ser (id, created_at); o id continua
+único na prática (vem de uma única sequência) e o ORM não muda. O módulo só
+usa nomes de tabela.
+
+A conversão troca as tabelas de produção (CREATE TABLE ... LIKE, cópia dos
+dados e DROP TABLE ... CASCADE da antiga), por isso não roda em migrate: é
+feita pelo comando particoes --converter <ano|mes> --confirmar, depois de
+testada numa cópia do banco (ParticionamentoTestCase roda as consultas de
+verificação quando a suíte usa PostgreSQL).
+"""
+from datetime import datetime
+
+from django.utils import timezone
+
+PERIODOS = ('ano', 'mes')
+TABELAS_PARTICIONAVEIS = ['controle_material', 'controle_controlequalidade', 'controle_nfvenda']
+COLUNA = 'created_at'
+
+
+class ErroParticionamento(Exception):
+    """Tabela que não pode ser particionada/revertida"""
+
+
+def inicio_periodo(data, periodo):
+    data = timezone.localtime(data) if timezone.is_aware(data) else data
+    return timezone.make_aware(datetime(data.year, 1 if periodo == 'ano' else data.month, 1))
+
+
+def proximo_periodo(inicio, periodo):
+    if periodo == 'ano' or inicio.month == 12:
+        return timezone.make_aware(datetime(inicio.year + 1, 1, 1))
+    return timezone.make_aware(datetime(inicio.year, inicio.month + 1, 1))
+
+
+def periodos(inicio, fim, periodo):
+    """Inícios dos períodos que cobrem [inicio, fim]"""
+    atual = inicio_periodo(inicio, periodo)
+    while atual <= fim:
+        yield atual
+        atual = proximo_periodo(atual, periodo)
+
+
+def nome_particao(tabela, inicio, periodo):
+    return f"{tabela}_p{inicio:%Y}" if periodo == 'ano' else f"{tabela}_p{inicio:%Y%m}"
+
+
+def _q(connection, nome):
+    return connection.ops.quote_name(nome)
+
+
+def _literal(data):
+    return f"'{data.isoformat()}'"
+
+
+def tabela_particionada(cursor, tabela):
+    cursor.execute(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = %s AND n.nspname = current_schema()",
+        [tabela],
+    )
+    linha = cursor.fetchone()
+    return bool(linha) and linha[0] == 'p'
+
+
+def periodo_da_tabela(cursor, tabela):
+    """Período gravado no comentário da tabela na conversão ('ano'/'mes') ou None"""
+    cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", [tabela])
+    comentario = (cursor.fetchone() or [None])[0] or ''
+    return comentario.split(':', 1)[1] if comentario.startswith('particionamento:') else None
+
+
+def listar_particoes(cursor, tabela):
+    """(nome, limites, linhas estimadas) das partições da tabela"""
+    cursor.execute(
+        "SELECT filha.relname, pg_get_expr(filha.relpartbound, filha.oid), filha.reltuples::bigint "
+        "FROM pg_inherits h JOIN pg_class mae ON mae.oid = h.inhparent JOIN pg_class filha ON filha.oid = h.inhrelid "
+        "WHERE mae.relname = %s ORDER BY filha.relname",
+        [tabela],
+    )
+    return cursor.fetchall()
+
+
+def _definicoes(cursor, tabela):
+    """Índices (exceto a chave primária) e ForeignKeys da tabela, para recriar após a troca"""
+    cursor.execute(
+        "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f') ORDER BY conname",
+        [tabela],
+    )
+    restricoes = cursor.fetchall()
+    if any(tipo == 'u' for _, tipo, _ in restricoes):
+        raise ErroParticionamento(f'{tabela} tem restrição UNIQUE sem {COLUNA}')
+
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+        [tabela],
+    )
+    nomes_restricoes = {nome for nome, _, _ in restricoes}
+    indices = [definicao for nome, definicao in cursor.fetchall() if nome not in nomes_restricoes]
+    chaves = [(nome, definicao) for nome, tipo, definicao in restricoes if tipo == 'f']
+    return indices, chaves
+
+
+def _recriar(connection, cursor, tabela, nova_definicao, chave_primaria, antes_de_copiar=None):
+    """Troca a tabela por uma nova (mesmas colunas), copia os dados e recria índices e FKs"""
+    indices, chaves = _definicoes(cursor, tabela)
+    antiga = f'{tabela}_antiga'
+    cursor.execute(f'ALTER TABLE {_q(connection, tabela)} RENAME TO {_q(connection, antiga)}')
+    cursor.execute(
+        f'CREATE TABLE {_q(connection, tabela)} (LIKE {_q(connection, antiga)} '
+        f'INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS) {nova_definicao}'
+    )
+    if antes_de_copiar:
+        antes_de_copiar(antiga)
+
+    cursor.execute(f'INSERT INTO {_q(connection, tabela)} SELECT * FROM {_q(connection, antiga)}')
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+        f"(SELECT coalesce(max(id), 0) + 1 FROM {_q(connection, tabela)}), false)",
+        [tabela],
+    )
+    cursor.execute(f'DROP TABLE {_q(connection, antiga)} CASCADE')
+
+    cursor.execute(f'ALTER TABLE {_q(connection, tabela)} ADD PRIMARY KEY ({chave_primaria})')
+    for definicao in indices:
+        cursor.execute(definicao)
+    for nome, definicao in chaves:
+        cursor.execute(f'ALTER TABLE {_q(connection, tabela)} ADD CONSTRAINT {_q(connection, nome)} {definicao}')
+
+
+def _criar_particao(connection, cursor, tabela, inicio, periodo):
+    """Cria a partição do período, movendo para ela as linhas que estavam na partição padrão"""
+    nome = nome_particao(tabela, inicio, periodo)
+    cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s", [nome])
+    if cursor.fetchone():
+        return None
+
+    fim = proximo_periodo(inicio, periodo)
+    padrao = f'{tabela}_padrao'
+    cursor.execute("SELECT 1 FROM pg_class WHERE relname = %s", [padrao])
+    mover = cursor.fetchone() is not None
+    if mover:
+        # A partição padrão não pode ter linhas do intervalo da nova partição
+        cursor.execute(f'CREATE TEMP TABLE particao_movidas (LIKE {_q(connection, tabela)}) ON COMMIT DROP')
+        cursor.execute(
+            f'WITH movidas AS (DELETE FROM {_q(connection, padrao)} '
+            f'WHERE {COLUNA} >= %s AND {COLUNA} < %s RETURNING *) '
+            f'INSERT INTO particao_movidas SELECT * FROM movidas',
+            [inicio, fim],
+        )
+
+    cursor.execute(
+        f'CREATE TABLE {_q(connection, nome)} PARTITION OF {_q(connection, tabela)} '
+        f'FOR VALUES FROM ({_literal(inicio)}) TO ({_literal(fim)})'
+    )
+    if mover:
+        cursor.execute(f'INSERT INTO {_q(connection, tabela)} SELECT * FROM particao_movidas')
+        cursor.execute('DROP TABLE particao_movidas')
+    return nome
+
+
+def particionar(connection, tabela, periodo, antecedencia=3):
+    """Converte a tabela em particionada por created_at; retorna False se já era"""
+    if periodo not in PERIODOS:
+        raise ErroParticionamento(f'Período inválido: {periodo}. Use {" ou ".join(PERIODOS)}')
+
+    with connection.cursor() as cursor:
+        if tabela_particionada(cursor, tabela):
+            return False
+
+        cursor.execute(f'SELECT min({COLUNA}) FROM {_q(connection, tabela)}')
+        primeira = cursor.fetchone()[0] or timezone.now()
+
+        def criar_particoes(antiga):
+            cursor.execute(
+                f'CREATE TABLE {_q(connection, tabela + "_padrao")} PARTITION OF {_q(connection, tabela)} DEFAULT'
+            )
+            for inicio in periodos(primeira, _horizonte(periodo, antecedencia), periodo):
+                _criar_particao(connection, cursor, tabela, inicio, periodo)
+
+        _recriar(
+            connection, cursor, tabela, f'PARTITION BY RANGE ({COLUNA})', f'id, {COLUNA}',
+            antes_de_copiar=criar_particoes,
+        )
+        cursor.execute(f"COMMENT ON TABLE {_q(connection, tabela)} IS 'particionamento:{periodo}'")
+    return True
+
+
+def desparticionar(connection, tabela):
+    """Volta a tabela particionada a uma tabela comum; retorna False se não era particionada"""
+    with connection.cursor() as cursor:
+        if not tabela_particionada(cursor, tabela):
+            return False
+        _recriar(connection, cursor, tabela, '', 'id')
+    return True
+
+
+def _horizonte(periodo, antecedencia, agora=None):
+    """Início do último período que deve existir (o atual + antecedencia)"""
+    fim = inicio_periodo(agora or timezone.now(), periodo)
+    for _ in range(antecedencia):
+        fim = proximo_periodo(fim, periodo)
+    return fim
+
+
+def manter_particoes(connection, tabela, antecedencia=3, agora=None):
+    """Cria as partições do período atual até <antecedencia> períodos à frente; retorna as criadas"""
+    with connection.cursor() as cursor:
+        if not tabela_particionada(cursor, tabela):
+            return []
+        periodo = periodo_da_tabela(cursor, tabela) or 'ano'
+        agora = agora or timezone.now()
+        criadas = []
+        for inicio in periodos(agora, _horizonte(periodo, antecedencia, agora), periodo):
+            nome = _criar_particao(connection, cursor, tabela, inicio, periodo)
+            if nome:
+                criadas.append(nome)
+    return criadas
@@ -0,0 +1,306 @@
+"""
+Perfilamento estatístico (por amostragem) de requisições e exportações.
+
+Enquanto a requisição roda, uma thread lê a pilha da thread que a atende a
+cada PERFILAMENTO_INTERVALO_MS (sys._current_frames) e conta as pilhas. Não
+há instrumentação por chamada: o custo é o da thread amostradora, e só nas
+requisições perfiladas. Uma requisição é perfilada quando:
+
+- traz o cabeçalho X-Perfilar: 1 e o usuário (sessão ou JWT) é do grupo
+  Administrador; a resposta volta com X-Perfil apontando o arquivo gravado;
+- cai na fração PERFILAMENTO_AMOSTRAGEM do tráfego (qualquer usuário).
+
+Em respostas em streaming (exportações, ZIP) a amostragem segue até o último
+byte. Fora de requisições (comandos, rotinas de exportação), use
+`with perfilar('nome'):`.
+
+Cada perfil é gravado no formato "collapsed stacks" (uma linha por pilha:
+quadros separados por ';' e a quantidade de amostras) em
+PERFILAMENTO_DIRETORIO/<rota>/<data-hora>-<pid>-<n>.folded, uma pasta por
+rota (método + nome da URL). O comando flamegraph junta os arquivos por rota
+e gera o .folded somado e o flamegraph em SVG, sem dependências externas (o
+.folded também serve para flamegraph.pl e speedscope).
+"""
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .instrumentacao import nome_rota
+
+CABECALHO = 'HTTP_X_PERFILAR'
+EXTENSAO = '.folded'
+
+_sequencia = itertools.count(1)
+_rotulos = {}
+
+
+def _rotulo(frame):
+    """'modulo:Classe.funcao' do quadro, guardado por objeto de código"""
+    codigo = frame.f_code
+    rotulo = _rotulos.get(codigo)
+    if rotulo is None:
+        modulo = frame.f_globals.get('__name__') or os.path.basename(codigo.co_filename)
+        rotulo = _rotulos[codigo] = f'{modulo}:{codigo.co_qualname}'.replace(';', ',').replace(' ', '_')
+    return rotulo
+
+
+def pilha(frame):
+    """Quadros da raiz até o quadro atual, separados por ';'"""
+    quadros = []
+    while frame is not None:
+        quadros.append(_rotulo(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(quadros))
+
+
+class Amostrador:
+    """Conta as pilhas de uma thread, amostradas a cada <intervalo> segundos por uma thread própria"""
+
+    def __init__(self, thread_id=None, intervalo=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.intervalo = intervalo if intervalo is not None else settings.PERFILAMENTO_INTERVALO_MS / 1000
+        self.pilhas = Counter()
+        self.duracao = 0.0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, name='perfilamento', daemon=True)
+        self._inicio = None
+
+    def iniciar(self):
+        self._inicio = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def parar(self):
+        if not self._parar.is_set():
+            self._parar.set()
+            self._thread.join()
+            self.duracao = time.perf_counter() - self._inicio
+        return self.pilhas
+
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.pilhas[pilha(frame)] += 1
+            del frame
+
+    @property
+    def amostras(self):
+        return sum(self.pilhas.values())
+
+
+def nome_pasta(rota):
+    """Nome de pasta seguro para a rota ('GET registroos-list' -> 'GET_registroos-list')"""
+    return re.sub(r'[^\w.-]+', '_', rota).strip('_') or 'sem_rota'
+
+
+def caminho_perfil(rota, diretorio=None):
+    diretorio = diretorio or settings.PERFILAMENTO_DIRETORIO
+    nome = f"{timezone.now():%Y%m%dT%H%M%S}-{os.getpid()}-{next(_sequencia)}{EXTENSAO}"
+    return os.path.join(diretorio, nome_pasta(rota), nome)
+
+
+def gravar(pilhas, caminho):
+    """Grava as pilhas em collapsed stacks; sem amostras não grava nada"""
+    if not pilhas:
+        return None
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        for linha, quantidade in sorted(pilhas.items()):
+            arquivo.write(f'{linha} {quantidade}\n')
+    os.replace(temporario, caminho)
+    return caminho
+
+
+@contextmanager
+def perfilar(nome, diretorio=None):
+    """Perfila o bloco (ex.: uma exportação fora de requisição) e grava em <diretorio>/<nome>/"""
+    amostrador = Amostrador().iniciar()
+    try:
+        yield amostrador
+    finally:
+        gravar(amostrador.parar(), caminho_perfil(nome, diretorio))
+
+
+def ler_perfil(caminho):
+    pilhas = Counter()
+    with open(caminho, encoding='utf-8') as arquivo:
+        for linha in arquivo:
+            quadros, _, quantidade = linha.rstrip('\n').rpartition(' ')
+            if quadros and quantidade.isdigit():
+                pilhas[quadros] += int(quantidade)
+    return pilhas
+
+
+def perfis_por_rota(diretorio=None, rota=None, desde=None):
+    """{pasta da rota: [arquivos]} do diretório, filtrando por trecho da rota e data-hora mínima (AAAAMMDDTHHMMSS)"""
+    diretorio = diretorio or settings.PERFILAMENTO_DIRETORIO
+    resultado = {}
+    if not os.path.isdir(diretorio):
+        return resultado
+    for pasta in sorted(os.listdir(diretorio)):
+        caminho = os.path.join(diretorio, pasta)
+        if not os.path.isdir(caminho) or (rota and nome_pasta(rota) not in pasta):
+            continue
+        arquivos = [
+            os.path.join(caminho, nome) for nome in sorted(os.listdir(caminho))
+            if nome.endswith(EXTENSAO) and (not desde or nome >= desde)
+        ]
+        if arquivos:
+            resultado[pasta] = arquivos
+    return resultado
+
+
+def juntar(arquivos):
+    total = Counter()
+    for caminho in arquivos:
+        total.update(ler_perfil(caminho))
+    return total
+
+
+def funcoes_mais_quentes(pilhas, top=10):
+    """[(quadro, amostras no topo da pilha, amostras em que aparece)] ordenado pelo tempo próprio"""
+    proprio, inclusivo = Counter(), Counter()
+    for linha, quantidade in pilhas.items():
+        quadros = linha.split(';')
+        proprio[quadros[-1]] += quantidade
+        for quadro in set(quadros):
+            inclusivo[quadro] += quantidade
+    return [(quadro, amostras, inclusivo[quadro]) for quadro, amostras in proprio.most_common(top)]
+
+
+def _arvore(pilhas):
+    raiz = {'total': 0, 'filhos': {}}
+    for linha, quantidade in pilhas.items():
+        no = raiz
+        no['total'] += quantidade
+        for quadro in linha.split(';'):
+            no = no['filhos'].setdefault(quadro, {'total': 0, 'filhos': {}})
+            no['total'] += quantidade
+    return raiz
+
+
+def _profundidade(no):
+    return 1 + max((_profundidade(filho) for filho in no['filhos'].values()), default=0)
+
+
+def _cor(nome):
+    semente = sum(ord(letra) for letra in nome.split(':', 1)[0])
+    return f'rgb({205 + semente % 50},{(semente * 7) % 180 + 40},{(semente * 13) % 55})'
+
+
+def svg_flamegraph(pilhas, titulo='', largura=1200, altura_quadro=16):
+    """Flamegraph estático (raiz embaixo); o texto de cada quadro completo fica no <title>"""
+    raiz = _arvore(pilhas)
+    total = raiz['total'] or 1
+    niveis = _profundidade(raiz) - 1
+    topo = 30
+    altura = topo + niveis * altura_quadro + 10
+    escala = (largura - 20) / total
+    partes = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{largura}" height="{altura}" '
+        f'font-family="Verdana,sans-serif" font-size="11">',
+        '<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{largura / 2}" y="18" text-anchor="middle" font-size="14">'
+        f'{escape(titulo)} ({raiz["total"]} amostras)</text>',
+    ]
+
+    def desenhar(no, x, nivel):
+        for nome, filho in sorted(no['filhos'].items()):
+            largura_quadro = filho['total'] * escala
+            if largura_quadro >= 0.5:
+                y = topo + (niveis - nivel - 1) * altura_quadro
+                percentual = 100 * filho['total'] / total
+                partes.append(
+                    f'<g><title>{escape(nome)} ({filho["total"]} amostras, {percentual:.2f}%)</title>'
+                    f'<rect x="{x:.2f}" y="{y}" width="{largura_quadro:.2f}" height="{altura_quadro - 1}" '
+                    f'fill="{_cor(nome)}" rx="2"/>'
+                )
+                caracteres = int(largura_quadro / 7)
+                if caracteres >= 3:
+                    texto = nome if len(nome) <= caracteres else nome[:caracteres - 2] + '..'
+                    partes.append(f'<text x="{x + 3:.2f}" y="{y + altura_quadro - 4}">{escape(texto)}</text>')
+                partes.append('</g>')
+                desenhar(filho, x, nivel + 1)
+            x += largura_quadro
+
+    desenhar(raiz, 10, 0)
+    partes.append('</svg>')
+    return '\n'.join(partes)
+
+
+def _usuario_admin(request):
+    """Usuário da sessão ou do token JWT, se for do grupo Administrador (o DRF só autentica na view)"""
+    usuario = getattr(request, 'user', None)
+    if usuario is None or not usuario.is_authenticated:
+        try:
+            autenticado = JWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return False
+        usuario = autenticado[0] if autenticado else None
+    return bool(usuario and usuario.is_authenticated and usuario.groups.filter(name='Administrador').exists())
+
+
+def _fim_do_streaming(conteudo, amostrador, ao_terminar):
+    try:
+        for indice, parte in enumerate(conteudo):
+            if indice == 0:
+                # O servidor pode iterar a resposta em outra thread
+                amostrador.thread_id = threading.get_ident()
+            yield parte
+    finally:
+        ao_terminar()
+
+
+class PerfilamentoMiddleware:
+    """Perfila as requisições pedidas por administradores (X-Perfilar) e a fração PERFILAMENTO_AMOSTRAGEM"""
+
+    def __init__(self, get_response):
+        if not settings.PERFILAMENTO:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def motivo(self, request):
+        if request.META.get(CABECALHO) == '1' and _usuario_admin(request):
+            return 'cabecalho'
+        if random.random() < settings.PERFILAMENTO_AMOSTRAGEM:
+            return 'amostragem'
+        return None
+
+    def __call__(self, request):
+        motivo = self.motivo(request)
+        if motivo is None:
+            return self.get_response(request)
+
+        amostrador = Amostrador().iniciar()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            amostrador.parar()
+            raise
+        caminho = caminho_perfil(nome_rota(request))
+        relativo = os.path.relpath(caminho, settings.PERFILAMENTO_DIRETORIO)
+
+        if getattr(response, 'streaming', False):
+            response.streaming_content = _fim_do_streaming(
+                response.streaming_content, amostrador, lambda: gravar(amostrador.parar(), caminho)
+            )
+            if motivo == 'cabecalho':
+                response['X-Perfil'] = relativo
+        elif gravar(amostrador.parar(), caminho) and motivo == 'cabecalho':
+            response['X-Perfil'] = relativo
+        return response
@@ -34,7 +34,7 @@ class RegistroOSPermission(permissions.BasePermission):
         
         # Usuários do grupo Básico e usuários sem grupo específico
         # só podem acessar suas próprias OS
-        if view.action in permissions.SAFE_METHODS:
+        if request.method in permissions.SAFE_METHODS:
             # Leitura: apenas suas próprias OS
             return obj.usuario == user
         elif view.action in ['update', 'partial_update']:
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User, Group
 from django.db import transaction, models
+from django.utils import timezone
 
 from django.core.exceptions import ValidationError
 from .models import (
@@ -14,8 +15,13 @@ from .models import (
     AcaoSolicitacaoOption, PercentualCQ, TipoMaterial, StatusDMS, StatusBMS, StatusFRS,
     ResponsavelMaterial, RegimeOS, StatusOS, StatusOSManual, StatusOSEletronica,
     StatusLevantamento, StatusProducao, StatusMaterial, TipoDocumentoSolicitacao,
+    UploadSessao, AuditoriaOS,
 )
+from .anexos import politica_do_campo
+from .downloads import urls_anexo
 import logging
+import os
+import uuid
 
 logger = logging.getLogger(__name__)
 
@@ -27,14 +33,20 @@ class FlexibleFileField(serializers.FileField):
         if data is None:
             return None
         
+        # Referência a um upload em partes já concluído ('upload:<token>')
+        if isinstance(data, str) and data.startswith(UploadSessao.PREFIXO_REFERENCIA):
+            return self._arquivo_do_upload(data[len(UploadSessao.PREFIXO_REFERENCIA):])
+        
         # Se é uma string, tratar como URL de arquivo existente
         if isinstance(data, str):
             # Retornar a string para que o Django mantenha o arquivo atual
             return data
         
-        # Se é um arquivo, processar normalmente
+        # Se é um arquivo, processar normalmente e aplicar a política de anexos
         if hasattr(data, 'size'):
-            return super().to_internal_value(data)
+            arquivo = super().to_internal_value(data)
+            self._aplicar_politica(arquivo)
+            return arquivo
         
         # Se chegou aqui, é um tipo inválido
         raise serializers.ValidationError(f'Arquivo inválido. Tipo recebido: {type(data)}')
@@ -44,6 +56,86 @@ class FlexibleFileField(serializers.FileField):
         if value:
             return normalize_file_url(str(value))
         return value
+    
+    def _arquivo_do_upload(self, token):
+        """Resolve o token de um upload concluído do próprio usuário em um arquivo"""
+        request = self.context.get('request')
+        filtros = {'token': token, 'status__in': ['CONCLUIDO', 'ANEXADO']}
+        if request is not None:
+            filtros['usuario'] = request.user
+        
+        sessao = UploadSessao.objects.filter(**filtros).first() if self._token_valido(token) else None
+        if sessao is None or not os.path.exists(sessao.caminho):
+            raise serializers.ValidationError('Upload não encontrado ou não concluído.')
+        
+        arquivo = sessao.como_arquivo()
+        try:
+            self._aplicar_politica(arquivo)
+        except serializers.ValidationError:
+            arquivo.close()
+            raise
+        
+        # O storage cria um link para o arquivo ao salvar o objeto; a sessão só
+        # passa a ANEXADO (e o parcial é removido) depois do commit
+        # (UploadsAnexadosMixin.save)
+        registrar = getattr(self.root, 'registrar_upload', None)
+        if registrar is not None:
+            registrar(sessao, arquivo)
+        return arquivo
+    
+    def _aplicar_politica(self, arquivo):
+        """Tipo (assinatura), extensão e tamanho conforme a política do campo do modelo"""
+        modelo = getattr(getattr(self.parent, 'Meta', None), 'model', None)
+        if modelo is None:
+            return
+        try:
+            politica_do_campo(modelo, self.source).validar(arquivo)
+        except ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+    
+    @staticmethod
+    def _token_valido(token):
+        try:
+            uuid.UUID(token)
+            return True
+        except ValueError:
+            return False
+
+class UploadsAnexadosMixin:
+    """
+    Marca como ANEXADO as sessões de upload referenciadas pelos campos
+    FlexibleFileField (inclusive os aninhados) e remove o arquivo parcial só
+    depois que a escrita for confirmada: se a validação ou o save falhar, a
+    sessão continua CONCLUIDO, com o arquivo, e pode ser usada de novo até
+    expirar (limpar_uploads).
+    """
+
+    def registrar_upload(self, sessao, arquivo):
+        if not hasattr(self, '_uploads'):
+            self._uploads = {}
+        self._uploads.setdefault(sessao.pk, (sessao, []))[1].append(arquivo)
+
+    def save(self, **kwargs):
+        uploads = getattr(self, '_uploads', {})
+        try:
+            instance = super().save(**kwargs)
+        finally:
+            for _, arquivos in uploads.values():
+                for arquivo in arquivos:
+                    arquivo.close()
+        if uploads:
+            sessoes = [sessao for sessao, _ in uploads.values()]
+            transaction.on_commit(lambda: self._anexar(sessoes))
+        return instance
+
+    @staticmethod
+    def _anexar(sessoes):
+        UploadSessao.objects.filter(pk__in=[sessao.pk for sessao in sessoes]).update(
+            status='ANEXADO', updated_at=timezone.now()
+        )
+        for sessao in sessoes:
+            sessao.remover_arquivo()
+
 
 class FlexibleDateTimeField(serializers.DateTimeField):
     """Campo de data/hora que aceita múltiplos formatos"""
@@ -103,28 +195,40 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'groups']
 
 
-# Serializers aninhados para criação/edição
-# Função auxiliar para validação de arquivos
-def validate_file_field(value, field_name):
-    """Validação padronizada para campos de arquivo"""
-    if value is None:
-        return None
-    
-    # Se é uma string (URL de arquivo existente), tratar como "sem alteração"
-    if isinstance(value, str):
-        # Para strings, retornar a string em vez de None para que o Django mantenha o arquivo atual
-        # Isso é necessário porque o Django espera um valor válido ou None para limpar o campo
-        return value
-    
-    # Se é um arquivo, validar
-    if hasattr(value, 'size'):
-        if value.size == 0:
-            raise serializers.ValidationError('Arquivo vazio não é permitido.')
-        return value
-    
-    # Se chegou aqui, é um tipo inválido
-    raise serializers.ValidationError(f'Arquivo inválido. Tipo recebido: {type(value)}')
+def _instanciar_campo(prototipo):
+    """Campo novo com os argumentos do protótipo; campos passados como argumento (child) também são novos"""
+    args = [_instanciar_campo(arg) if isinstance(arg, serializers.Field) else arg for arg in prototipo._args]
+    kwargs = {
+        chave: _instanciar_campo(valor) if isinstance(valor, serializers.Field) else valor
+        for chave, valor in prototipo._kwargs.items()
+    }
+    return type(prototipo)(*args, **kwargs)
+
+
+class CamposEmCacheMixin:
+    """
+    Guarda, por classe, o mapa de campos resolvido pelo ModelSerializer
+    (introspecção do model, build_field e cópia profunda dos campos
+    declarados). Cada serializer só instancia os campos a partir dos
+    protótipos; a instância continua com campos próprios, que podem ser
+    alterados (required, allow_null) sem afetar as outras.
+    """
+    cache_campos = True
+
+    def get_fields(self):
+        classe = type(self)
+        prototipos = classe.__dict__.get('_prototipos_campos')
+        if prototipos is None or not self.cache_campos:
+            campos = super().get_fields()
+            if self.cache_campos:
+                classe._prototipos_campos = campos
+                return {nome: _instanciar_campo(campo) for nome, campo in campos.items()}
+            return campos
+        return {nome: _instanciar_campo(campo) for nome, campo in prototipos.items()}
+
 
+# Serializers aninhados para criação/edição
+# Função auxiliar para URLs de arquivos
 def normalize_file_url(file_path):
     """Normaliza URLs de arquivo para caminho relativo"""
     if not file_path:
@@ -141,7 +245,7 @@ def normalize_file_url(file_path):
     
     return file_path
 
-class DocumentoSolicitacaoNestedSerializer(serializers.ModelSerializer):
+class DocumentoSolicitacaoNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para documentos de solicitação"""
     
     # Campo ForeignKey para tipo de documento
@@ -160,20 +264,17 @@ class DocumentoSolicitacaoNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('documento_solicitacao'):
             data['documento_solicitacao'] = normalize_file_url(data['documento_solicitacao'])
+        data.update(urls_anexo(instance, 'documento_solicitacao'))
         
         return data
     
-    def validate_documento_solicitacao(self, value):
-        """Validação customizada para o campo documento_solicitacao"""
-        return validate_file_field(value, 'documento_solicitacao')
-    
     class Meta:
         model = DocumentoSolicitacao
         fields = ['id', 'tipo_documento_solicitacao', 'documento_solicitacao']
         read_only_fields = ['id']
 
 
-class DataPrevistaEntregaNestedSerializer(serializers.ModelSerializer):
+class DataPrevistaEntregaNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para datas previstas de entrega"""
     
     data_prevista_entrega = FlexibleDateTimeField(
@@ -187,7 +288,7 @@ class DataPrevistaEntregaNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class AcaoSolicitacaoNestedSerializer(serializers.ModelSerializer):
+class AcaoSolicitacaoNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para ações de solicitação"""
     
     # Campo ForeignKey para ação de solicitação
@@ -199,7 +300,7 @@ class AcaoSolicitacaoNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ControleQualidadeNestedSerializer(serializers.ModelSerializer):
+class ControleQualidadeNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para controle de qualidade"""
     tipo_cq = serializers.PrimaryKeyRelatedField(queryset=TipoCQ.objects.all(), required=False, allow_null=True)
     opcoes_espec_cq = serializers.PrimaryKeyRelatedField(queryset=OpcaoEspecCQ.objects.all(), required=False, allow_null=True)
@@ -217,7 +318,7 @@ class ControleQualidadeNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class OrdemClienteNestedSerializer(serializers.ModelSerializer):
+class OrdemClienteNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para ordens do cliente"""
     
     class Meta:
@@ -226,7 +327,7 @@ class OrdemClienteNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class DocumentoEntradaNestedSerializer(serializers.ModelSerializer):
+class DocumentoEntradaNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para documentos de entrada"""
     
     documento_entrada = FlexibleFileField(
@@ -242,20 +343,17 @@ class DocumentoEntradaNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('documento_entrada'):
             data['documento_entrada'] = normalize_file_url(data['documento_entrada'])
+        data.update(urls_anexo(instance, 'documento_entrada'))
         
         return data
     
-    def validate_documento_entrada(self, value):
-        """Validação customizada para o campo documento_entrada"""
-        return validate_file_field(value, 'documento_entrada')
-    
     class Meta:
         model = DocumentoEntrada
         fields = ['id', 'documento_entrada', 'numero_documento_entrada', 'data_documento_entrada']
         read_only_fields = ['id']
 
 
-class LevantamentoNestedSerializer(serializers.ModelSerializer):
+class LevantamentoNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para levantamentos"""
     
     arquivo_anexo_levantamento = FlexibleFileField(
@@ -271,20 +369,17 @@ class LevantamentoNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_levantamento'):
             data['arquivo_anexo_levantamento'] = normalize_file_url(data['arquivo_anexo_levantamento'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_levantamento'))
         
         return data
     
-    def validate_arquivo_anexo_levantamento(self, value):
-        """Validação customizada para o campo arquivo_anexo_levantamento"""
-        return validate_file_field(value, 'arquivo_anexo_levantamento')
-    
     class Meta:
         model = Levantamento
         fields = ['id', 'data_levantamento', 'descricao_levantamento', 'arquivo_anexo_levantamento']
         read_only_fields = ['id']
 
 
-class MaterialNestedSerializer(serializers.ModelSerializer):
+class MaterialNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para materiais"""
     
     # Campos ForeignKey para materiais
@@ -300,7 +395,7 @@ class MaterialNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class GmiNestedSerializer(serializers.ModelSerializer):
+class GmiNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para GMI"""
     data_gmi = serializers.DateTimeField(
         error_messages={
@@ -327,20 +422,17 @@ class GmiNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_gmi'):
             data['arquivo_anexo_gmi'] = normalize_file_url(data['arquivo_anexo_gmi'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_gmi'))
         
         return data
     
-    def validate_arquivo_anexo_gmi(self, value):
-        """Validação customizada para o campo arquivo_anexo_gmi"""
-        return validate_file_field(value, 'arquivo_anexo_gmi')
-    
     class Meta:
         model = Gmi
         fields = ['id', 'data_gmi', 'descricao_gmi', 'arquivo_anexo_gmi']
         read_only_fields = ['id']
 
 
-class GmeNestedSerializer(serializers.ModelSerializer):
+class GmeNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para GME"""
     
     arquivo_anexo_gme = FlexibleFileField(
@@ -356,20 +448,17 @@ class GmeNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_gme'):
             data['arquivo_anexo_gme'] = normalize_file_url(data['arquivo_anexo_gme'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_gme'))
         
         return data
     
-    def validate_arquivo_anexo_gme(self, value):
-        """Validação customizada para o campo arquivo_anexo_gme"""
-        return validate_file_field(value, 'arquivo_anexo_gme')
-    
     class Meta:
         model = Gme
         fields = ['id', 'data_gme', 'descricao_gme', 'arquivo_anexo_gme']
         read_only_fields = ['id']
 
 
-class RtipNestedSerializer(serializers.ModelSerializer):
+class RtipNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para RTIP"""
     data_rtip = serializers.DateTimeField(
         error_messages={
@@ -396,20 +485,17 @@ class RtipNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_rtip'):
             data['arquivo_anexo_rtip'] = normalize_file_url(data['arquivo_anexo_rtip'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_rtip'))
         
         return data
     
-    def validate_arquivo_anexo_rtip(self, value):
-        """Validação customizada para o campo arquivo_anexo_rtip"""
-        return validate_file_field(value, 'arquivo_anexo_rtip')
-    
     class Meta:
         model = Rtip
         fields = ['id', 'data_rtip', 'descricao_rtip', 'arquivo_anexo_rtip']
         read_only_fields = ['id']
 
 
-class RtmNestedSerializer(serializers.ModelSerializer):
+class RtmNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para RTM"""
     
     arquivo_anexo_rtm = FlexibleFileField(
@@ -425,20 +511,17 @@ class RtmNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_rtm'):
             data['arquivo_anexo_rtm'] = normalize_file_url(data['arquivo_anexo_rtm'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_rtm'))
         
         return data
     
-    def validate_arquivo_anexo_rtm(self, value):
-        """Validação customizada para o campo arquivo_anexo_rtm"""
-        return validate_file_field(value, 'arquivo_anexo_rtm')
-    
     class Meta:
         model = Rtm
         fields = ['id', 'data_rtm', 'descricao_rtm', 'arquivo_anexo_rtm']
         read_only_fields = ['id']
 
 
-class DmsNestedSerializer(serializers.ModelSerializer):
+class DmsNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para DMS"""
     
     # Campo ForeignKey para status DMS
@@ -450,7 +533,7 @@ class DmsNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class BmsNestedSerializer(serializers.ModelSerializer):
+class BmsNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para BMS"""
     
     # Campo ForeignKey para status BMS
@@ -462,7 +545,7 @@ class BmsNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class FrsNestedSerializer(serializers.ModelSerializer):
+class FrsNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para FRS"""
     
     # Campo ForeignKey para status FRS
@@ -474,7 +557,7 @@ class FrsNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class NfSaidaNestedSerializer(serializers.ModelSerializer):
+class NfSaidaNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para notas fiscais de saída"""
     
     arquivo_anexo_nota_fiscal_remessa_saida = FlexibleFileField(
@@ -490,13 +573,10 @@ class NfSaidaNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_nota_fiscal_remessa_saida'):
             data['arquivo_anexo_nota_fiscal_remessa_saida'] = normalize_file_url(data['arquivo_anexo_nota_fiscal_remessa_saida'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_nota_fiscal_remessa_saida'))
         
         return data
     
-    def validate_arquivo_anexo_nota_fiscal_remessa_saida(self, value):
-        """Validação customizada para o campo arquivo_anexo_nota_fiscal_remessa_saida"""
-        return validate_file_field(value, 'arquivo_anexo_nota_fiscal_remessa_saida')
-    
     class Meta:
         model = NfSaida
         fields = [
@@ -507,7 +587,7 @@ class NfSaidaNestedSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class NfVendaNestedSerializer(serializers.ModelSerializer):
+class NfVendaNestedSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer aninhado para notas fiscais de venda"""
     
     arquivo_anexo_nota_fiscal_venda = FlexibleFileField(
@@ -523,13 +603,10 @@ class NfVendaNestedSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_nota_fiscal_venda'):
             data['arquivo_anexo_nota_fiscal_venda'] = normalize_file_url(data['arquivo_anexo_nota_fiscal_venda'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_nota_fiscal_venda'))
         
         return data
     
-    def validate_arquivo_anexo_nota_fiscal_venda(self, value):
-        """Validação customizada para o campo arquivo_anexo_nota_fiscal_venda"""
-        return validate_file_field(value, 'arquivo_anexo_nota_fiscal_venda')
-    
     class Meta:
         model = NfVenda
         fields = [
@@ -573,7 +650,7 @@ DocumentoSolicitacaoNestedSerializer.Meta.list_serializer_class = DocumentoSolic
 
 
 # Serializers completos para endpoints individuais
-class DocumentoSolicitacaoSerializer(serializers.ModelSerializer):
+class DocumentoSolicitacaoSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para documentos de solicitação"""
     
     # Campo ForeignKey para tipo de documento
@@ -592,16 +669,13 @@ class DocumentoSolicitacaoSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('documento_solicitacao'):
             data['documento_solicitacao'] = normalize_file_url(data['documento_solicitacao'])
+        data.update(urls_anexo(instance, 'documento_solicitacao'))
         
         return data
     
-    def validate_documento_solicitacao(self, value):
-        """Validação customizada para o campo documento_solicitacao"""
-        return validate_file_field(value, 'documento_solicitacao')
-    
     class Meta:
         model = DocumentoSolicitacao
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
@@ -644,7 +718,7 @@ class OrdemClienteSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class DocumentoEntradaSerializer(serializers.ModelSerializer):
+class DocumentoEntradaSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para documentos de entrada"""
     
     documento_entrada = FlexibleFileField(
@@ -660,20 +734,17 @@ class DocumentoEntradaSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('documento_entrada'):
             data['documento_entrada'] = normalize_file_url(data['documento_entrada'])
+        data.update(urls_anexo(instance, 'documento_entrada'))
         
         return data
     
-    def validate_documento_entrada(self, value):
-        """Validação customizada para o campo documento_entrada"""
-        return validate_file_field(value, 'documento_entrada')
-    
     class Meta:
         model = DocumentoEntrada
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class LevantamentoSerializer(serializers.ModelSerializer):
+class LevantamentoSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para levantamentos"""
     
     arquivo_anexo_levantamento = FlexibleFileField(
@@ -689,16 +760,13 @@ class LevantamentoSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_levantamento'):
             data['arquivo_anexo_levantamento'] = normalize_file_url(data['arquivo_anexo_levantamento'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_levantamento'))
         
         return data
     
-    def validate_arquivo_anexo_levantamento(self, value):
-        """Validação customizada para o campo arquivo_anexo_levantamento"""
-        return validate_file_field(value, 'arquivo_anexo_levantamento')
-    
     class Meta:
         model = Levantamento
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
@@ -716,7 +784,7 @@ class MaterialSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class GmiSerializer(serializers.ModelSerializer):
+class GmiSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para GMI"""
     
     arquivo_anexo_gmi = FlexibleFileField(
@@ -732,20 +800,17 @@ class GmiSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_gmi'):
             data['arquivo_anexo_gmi'] = normalize_file_url(data['arquivo_anexo_gmi'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_gmi'))
         
         return data
     
-    def validate_arquivo_anexo_gmi(self, value):
-        """Validação customizada para o campo arquivo_anexo_gmi"""
-        return validate_file_field(value, 'arquivo_anexo_gmi')
-    
     class Meta:
         model = Gmi
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class GmeSerializer(serializers.ModelSerializer):
+class GmeSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para GME"""
     
     arquivo_anexo_gme = FlexibleFileField(
@@ -761,20 +826,17 @@ class GmeSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_gme'):
             data['arquivo_anexo_gme'] = normalize_file_url(data['arquivo_anexo_gme'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_gme'))
         
         return data
     
-    def validate_arquivo_anexo_gme(self, value):
-        """Validação customizada para o campo arquivo_anexo_gme"""
-        return validate_file_field(value, 'arquivo_anexo_gme')
-    
     class Meta:
         model = Gme
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class RtipSerializer(serializers.ModelSerializer):
+class RtipSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para RTIP"""
     
     arquivo_anexo_rtip = FlexibleFileField(
@@ -790,20 +852,17 @@ class RtipSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_rtip'):
             data['arquivo_anexo_rtip'] = normalize_file_url(data['arquivo_anexo_rtip'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_rtip'))
         
         return data
     
-    def validate_arquivo_anexo_rtip(self, value):
-        """Validação customizada para o campo arquivo_anexo_rtip"""
-        return validate_file_field(value, 'arquivo_anexo_rtip')
-    
     class Meta:
         model = Rtip
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class RtmSerializer(serializers.ModelSerializer):
+class RtmSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para RTM"""
     
     arquivo_anexo_rtm = FlexibleFileField(
@@ -819,16 +878,13 @@ class RtmSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_rtm'):
             data['arquivo_anexo_rtm'] = normalize_file_url(data['arquivo_anexo_rtm'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_rtm'))
         
         return data
     
-    def validate_arquivo_anexo_rtm(self, value):
-        """Validação customizada para o campo arquivo_anexo_rtm"""
-        return validate_file_field(value, 'arquivo_anexo_rtm')
-    
     class Meta:
         model = Rtm
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
@@ -859,7 +915,7 @@ class FrsSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class NfSaidaSerializer(serializers.ModelSerializer):
+class NfSaidaSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para notas fiscais de saída"""
     
     arquivo_anexo_nota_fiscal_remessa_saida = FlexibleFileField(
@@ -875,20 +931,17 @@ class NfSaidaSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_nota_fiscal_remessa_saida'):
             data['arquivo_anexo_nota_fiscal_remessa_saida'] = normalize_file_url(data['arquivo_anexo_nota_fiscal_remessa_saida'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_nota_fiscal_remessa_saida'))
         
         return data
     
-    def validate_arquivo_anexo_nota_fiscal_remessa_saida(self, value):
-        """Validação customizada para o campo arquivo_anexo_nota_fiscal_remessa_saida"""
-        return validate_file_field(value, 'arquivo_anexo_nota_fiscal_remessa_saida')
-    
     class Meta:
         model = NfSaida
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class NfVendaSerializer(serializers.ModelSerializer):
+class NfVendaSerializer(UploadsAnexadosMixin, serializers.ModelSerializer):
     """Serializer para notas fiscais de venda"""
     
     arquivo_anexo_nota_fiscal_venda = FlexibleFileField(
@@ -904,20 +957,17 @@ class NfVendaSerializer(serializers.ModelSerializer):
         # Se há um arquivo, garantir que seja apenas o caminho relativo
         if data.get('arquivo_anexo_nota_fiscal_venda'):
             data['arquivo_anexo_nota_fiscal_venda'] = normalize_file_url(data['arquivo_anexo_nota_fiscal_venda'])
+        data.update(urls_anexo(instance, 'arquivo_anexo_nota_fiscal_venda'))
         
         return data
     
-    def validate_arquivo_anexo_nota_fiscal_venda(self, value):
-        """Validação customizada para o campo arquivo_anexo_nota_fiscal_venda"""
-        return validate_file_field(value, 'arquivo_anexo_nota_fiscal_venda')
-    
     class Meta:
         model = NfVenda
-        fields = '__all__'
+        exclude = ['derivados']
         read_only_fields = ['id', 'created_at']
 
 
-class RegistroOSSerializer(serializers.ModelSerializer):
+class RegistroOSSerializer(UploadsAnexadosMixin, CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer principal para Ordem de Serviço com serialização aninhada
     
     IMPORTANTE: Este serializer aplica validações diferenciadas por grupo de usuário:
@@ -988,9 +1038,29 @@ class RegistroOSSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = [
             'id', 'numero_os', 'os_id', 'data_criacao', 'updated_at',
-            'soma_valores', 'soma_notas_fiscais', 'saldo_final'
+            'soma_valores', 'soma_notas_fiscais', 'saldo_final', 'valor_total'
         ]
     
+    # Grupos sem campos obrigatórios e campos obrigatórios por grupo (aplicados nesta ordem)
+    GRUPOS_TUDO_OPCIONAL = frozenset(['Administrador', 'Superior'])
+    CAMPOS_OBRIGATORIOS_POR_GRUPO = {
+        'Qualidade': [
+            'tipo_cq', 'opcoes_espec_cq', 'nivel_inspecao_cq', 'tipo_ensaio_cq',
+            'percentual_cq', 'quantidade_cq', 'tamanho_cq', 'texto_tamanho_cq'
+        ],
+        'Básico': [
+            'data_solicitacao_os', 'data_emissao_os', 'nome_cliente', 'numero_contrato',
+            'unidade_cliente', 'setor_unidade_cliente', 'prazo_execucao_servico',
+            'status_regime_os', 'nome_diligenciador_os',
+            'nome_solicitante_cliente', 'nome_responsavel_aprovacao_os_cliente',
+            'nome_responsavel_execucao_servico', 'id_demanda', 'descricao_resumida',
+            'existe_orcamento', 'status_os', 'status_levantamento', 'status_producao',
+            'opcoes_dms', 'opcoes_bms', 'opcoes_frs',
+            'data_gmi', 'descricao_gmi', 'arquivo_anexo_gmi', 'data_rtip',
+            'descricao_rtip', 'arquivo_anexo_rtip'
+        ],
+    }
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Obter usuário do contexto após inicialização do serializer
@@ -1000,54 +1070,53 @@ class RegistroOSSerializer(serializers.ModelSerializer):
         if self.user:
             self._apply_user_group_validations()
     
+    def _user_groups(self):
+        """Nomes dos grupos do usuário; com a request no contexto, consultados uma vez por requisição"""
+        request = self.context.get('request') if self.context else None
+        if request is None or getattr(request, 'user', None) is not self.user:
+            return frozenset(self.user.groups.values_list('name', flat=True))
+        if not hasattr(request, '_grupos_usuario'):
+            request._grupos_usuario = frozenset(self.user.groups.values_list('name', flat=True))
+        return request._grupos_usuario
+    
+    @classmethod
+    def _regras_por_grupos(cls, grupos):
+        """(todos os campos opcionais?, campos obrigatórios) de um conjunto de grupos, guardado por classe"""
+        cache = cls.__dict__.get('_cache_regras_grupos')
+        if cache is None:
+            cache = cls._cache_regras_grupos = {}
+        regras = cache.get(grupos)
+        if regras is None:
+            obrigatorios = tuple(
+                campo for grupo, campos in cls.CAMPOS_OBRIGATORIOS_POR_GRUPO.items() if grupo in grupos
+                for campo in campos
+            )
+            regras = cache[grupos] = (bool(grupos & cls.GRUPOS_TUDO_OPCIONAL), obrigatorios)
+        return regras
+    
     def _apply_user_group_validations(self):
         """Aplica validações baseadas no grupo do usuário"""
         if not self.user:
             return
         
-        # Verificar grupos do usuário
-        user_groups = [group.name for group in self.user.groups.all()]
-        is_admin_superior = any(group in user_groups for group in ['Administrador', 'Superior'])
+        tudo_opcional, obrigatorios = self._regras_por_grupos(self._user_groups())
         
         # Para grupos Administrador e Superior, tornar todos os campos opcionais
-        if is_admin_superior:
-            for field_name, field in self.fields.items():
-                if hasattr(field, 'required'):
-                    field.required = False
-                if hasattr(field, 'allow_null'):
-                    field.allow_null = True
-        # Para o grupo Qualidade, tornar campos específicos obrigatórios
-        if 'Qualidade' in user_groups:
-            qualidade_required_fields = [
-                'tipo_cq', 'opcoes_espec_cq', 'nivel_inspecao_cq', 'tipo_ensaio_cq',
-                'percentual_cq', 'quantidade_cq', 'tamanho_cq', 'texto_tamanho_cq'
-            ]
-            for field_name in qualidade_required_fields:
-                if field_name in self.fields:
-                    self.fields[field_name].required = True
-        # Para o grupo Básico, tornar campos específicos obrigatórios
-        if 'Básico' in user_groups:
-            basico_required_fields = [
-                'data_solicitacao_os', 'data_emissao_os', 'nome_cliente', 'numero_contrato',
-                'unidade_cliente', 'setor_unidade_cliente', 'prazo_execucao_servico',
-                'status_regime_os', 'nome_diligenciador_os',
-                'nome_solicitante_cliente', 'nome_responsavel_aprovacao_os_cliente',
-                'nome_responsavel_execucao_servico', 'id_demanda', 'descricao_resumida',
-                'existe_orcamento', 'status_os', 'status_levantamento', 'status_producao',
-                'opcoes_dms', 'opcoes_bms', 'opcoes_frs',
-                'data_gmi', 'descricao_gmi', 'arquivo_anexo_gmi', 'data_rtip',
-                'descricao_rtip', 'arquivo_anexo_rtip'
-            ]
-            for field_name in basico_required_fields:
-                if field_name in self.fields:
-                    self.fields[field_name].required = True
+        if tudo_opcional:
+            for field in self.fields.values():
+                field.required = False
+                field.allow_null = True
+        # Para os grupos Qualidade e Básico, tornar campos específicos obrigatórios
+        for field_name in obrigatorios:
+            if field_name in self.fields:
+                self.fields[field_name].required = True
 
     def validate(self, data):
         """Validações customizadas baseadas nas regras de negócio"""
         if not self.user:
             return data
         
-        user_groups = [group.name for group in self.user.groups.all()]
+        user_groups = self._user_groups()
         
         # Para updates vazios (PATCH sem alterações), permitir
         if hasattr(self, 'instance') and self.instance is not None:
@@ -1359,10 +1428,9 @@ class RegistroOSSerializer(serializers.ModelSerializer):
         # Criar objetos relacionados
         self._create_related_objects(instance, related_data)
         
-        # Recalcular valores
-        instance.calcular_soma_valores()
-        instance.calcular_saldo_final()
-        instance.save()
+        # Totais de NF são mantidos no banco pelo NfVenda; apenas recarregar
+        if related_data.get('notas_fiscais_venda'):
+            instance.refresh_from_db(fields=RegistroOS.CAMPOS_TOTAIS_NF)
         
         return instance
     
@@ -1380,10 +1448,9 @@ class RegistroOSSerializer(serializers.ModelSerializer):
         if related_data:
             self._update_related_objects(instance, related_data)
         
-        # Recalcular valores
-        instance.calcular_soma_valores()
-        instance.calcular_saldo_final()
-        instance.save()
+        # Totais de NF são mantidos no banco pelo NfVenda; apenas recarregar
+        if related_data.get('notas_fiscais_venda'):
+            instance.refresh_from_db(fields=RegistroOS.CAMPOS_TOTAIS_NF)
         
         return instance
     
@@ -1602,13 +1669,13 @@ class RegistroOSSerializer(serializers.ModelSerializer):
                             continue
 
 
-class RegistroOSListSerializer(serializers.ModelSerializer):
+class RegistroOSListSerializer(CamposEmCacheMixin, serializers.ModelSerializer):
     """Serializer simplificado para listagem de OS"""
     
     usuario_nome = serializers.CharField(source='usuario.get_full_name', read_only=True)
     data_criacao = serializers.DateTimeField(source='created_at', read_only=True)
     total_documentos = serializers.SerializerMethodField()
-    valor_total = serializers.SerializerMethodField()
+    valor_total = serializers.FloatField(read_only=True)
     
     # Campos textuais das ForeignKeys
     status_os_nome = serializers.CharField(source='status_os.nome', read_only=True)
@@ -1690,15 +1757,6 @@ class RegistroOSListSerializer(serializers.ModelSerializer):
         total += obj.notas_fiscais_saida.count()
         total += obj.notas_fiscais_venda.count()
         return total
-    
-    def get_valor_total(self, obj):
-        """Retorna o valor total usando saldo_final se disponível, senão soma_valores"""
-        if obj.saldo_final and float(obj.saldo_final) > 0:
-            return float(obj.saldo_final)
-        elif obj.soma_valores:
-            return float(obj.soma_valores)
-        else:
-            return 0.0
 
 
 class CalculosSerializer(serializers.Serializer):
@@ -2018,3 +2076,13 @@ class EnsaioCQSerializer(SimpleModelSerializer):
     class Meta(SimpleModelSerializer.Meta):
         model = EnsaioCQ
 
+
+class AuditoriaOSSerializer(serializers.ModelSerializer):
+    """Entrada do histórico de alterações: {campo: [antes, depois]}"""
+    
+    usuario_nome = serializers.CharField(source='usuario.username', read_only=True, default=None)
+    
+    class Meta:
+        model = AuditoriaOS
+        fields = ['id', 'os_id', 'modelo', 'objeto_id', 'acao', 'alteracoes', 'usuario', 'usuario_nome', 'criado_em']
+        read_only_fields = fields
@@ -0,0 +1,181 @@
+"""
+Armazenamento de anexos endereçado por conteúdo.
+
+Cada arquivo enviado é gravado uma única vez em _blobs/<aa>/<bb>/<sha256> e o
+nome do FileField (ex.: documentos_solicitacao/contrato.pdf) passa a ser um
+hard link para o blob. Assim nomes e URLs continuam iguais (normalize_file_url
+e o nginx não mudam), o número de links do blob é a contagem de referências e
+blobs com um único link (só o próprio blob) podem ser coletados.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+logger = logging.getLogger(__name__)
+
+PASTA_BLOBS = '_blobs'
+TAMANHO_BLOCO = 64 * 1024
+
+
+class ArmazenamentoDeduplicado(FileSystemStorage):
+    """FileSystemStorage que deduplica arquivos por SHA-256 usando hard links"""
+
+    def _save(self, name, content):
+        temporario, digest = self._gravar_temporario(content)
+        blob = self.caminho_blob(digest)
+
+        try:
+            if not os.path.exists(blob):
+                self._armazenar_blob(temporario, blob)
+
+            while True:
+                caminho = self.path(name)
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                try:
+                    self._vincular(blob, caminho, temporario)
+                    break
+                except FileExistsError:
+                    # Nome ocupado entre get_available_name e o link (concorrência)
+                    name = self.get_available_name(name)
+        finally:
+            # O temporário guarda o conteúdo até o nome estar vinculado ao blob
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+        return str(name).replace('\\', '/')
+
+    def _gravar_temporario(self, content):
+        """Copia o conteúdo para um arquivo temporário calculando o SHA-256 no caminho"""
+        hash_conteudo = hashlib.sha256()
+        pasta_temporaria = self.path(os.path.join(PASTA_BLOBS, 'tmp'))
+        os.makedirs(pasta_temporaria, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            # Upload já está em disco: calcular o hash e criar um link, sem
+            # copiar. O original não é movido: quem o criou decide quando
+            # apagá-lo (a sessão de upload só o remove após o commit).
+            origem = content.temporary_file_path()
+            with open(origem, 'rb') as arquivo:
+                for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+                    hash_conteudo.update(bloco)
+            descritor, temporario = tempfile.mkstemp(dir=pasta_temporaria)
+            os.close(descritor)
+            try:
+                os.remove(temporario)
+                os.link(origem, temporario)
+            except OSError:
+                shutil.copyfile(origem, temporario)
+            return temporario, hash_conteudo.hexdigest()
+
+        descritor, temporario = tempfile.mkstemp(dir=pasta_temporaria)
+        try:
+            with os.fdopen(descritor, 'wb') as destino:
+                for bloco in content.chunks():
+                    if isinstance(bloco, str):
+                        bloco = bloco.encode()
+                    hash_conteudo.update(bloco)
+                    destino.write(bloco)
+        except Exception:
+            os.remove(temporario)
+            raise
+        return temporario, hash_conteudo.hexdigest()
+
+    def _armazenar_blob(self, temporario, blob):
+        """
+        Grava o blob como link para o temporário: enquanto o temporário existir
+        o blob tem dois links e coletar_blobs não o remove.
+        """
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(temporario, blob)
+        except FileExistsError:
+            # Mesmo conteúdo gravado por outra requisição
+            return
+        except OSError:
+            shutil.copyfile(temporario, blob)
+        if self.file_permissions_mode is not None:
+            os.chmod(blob, self.file_permissions_mode)
+
+    def _vincular(self, blob, caminho, temporario):
+        try:
+            self._link(blob, caminho)
+        except FileNotFoundError:
+            # Blob sem referências coletado entre a verificação em _save e o link
+            self._armazenar_blob(temporario, blob)
+            self._link(blob, caminho)
+
+    @staticmethod
+    def _link(blob, caminho):
+        try:
+            os.link(blob, caminho)
+        except (FileExistsError, FileNotFoundError):
+            raise
+        except OSError:
+            # Sistema de arquivos sem hard link: cópia simples (sem deduplicação)
+            if os.path.exists(caminho):
+                raise FileExistsError(caminho)
+            shutil.copyfile(blob, caminho)
+
+    def caminho_blob(self, digest):
+        return self.path(os.path.join(PASTA_BLOBS, digest[:2], digest[2:4], digest))
+
+    def referencias(self, digest):
+        """Quantidade de nomes de arquivo que apontam para o blob"""
+        try:
+            return os.stat(self.caminho_blob(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def listar_blobs(self):
+        """Itera (digest, caminho) de todos os blobs armazenados"""
+        raiz = self.path(PASTA_BLOBS)
+        for pasta, subpastas, arquivos in os.walk(raiz):
+            if os.path.relpath(pasta, raiz).split(os.sep)[0] == 'tmp':
+                continue
+            for arquivo in arquivos:
+                yield arquivo, os.path.join(pasta, arquivo)
+
+    def coletar_blobs(self, dry_run=False):
+        """Remove blobs sem nenhuma referência; retorna (quantidade, bytes liberados)"""
+        quantidade = liberados = 0
+        for digest, caminho in self.listar_blobs():
+            info = os.stat(caminho)
+            if info.st_nlink > 1:
+                continue
+            quantidade += 1
+            liberados += info.st_size
+            if not dry_run:
+                os.remove(caminho)
+        return quantidade, liberados
+
+    def deduplicar(self, name, dry_run=False):
+        """Converte um arquivo existente em link para o blob; retorna bytes economizados"""
+        caminho = self.path(name)
+        if not os.path.isfile(caminho):
+            return 0
+
+        hash_conteudo = hashlib.sha256()
+        with open(caminho, 'rb') as arquivo:
+            for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+                hash_conteudo.update(bloco)
+        blob = self.caminho_blob(hash_conteudo.hexdigest())
+
+        if os.path.exists(blob):
+            if os.path.samefile(blob, caminho):
+                return 0
+            economia = os.path.getsize(caminho)
+            if not dry_run:
+                # Trocar o arquivo pelo link de forma atômica
+                temporario = f'{caminho}.dedup'
+                os.link(blob, temporario)
+                os.replace(temporario, caminho)
+            return economia
+
+        if not dry_run:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.link(caminho, blob)
+        return 0
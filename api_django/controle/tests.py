@@ -1,15 +1,20 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import Client, LiveServerTestCase, TestCase, TransactionTestCase
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from django.core.servers.basehttp import WSGIServer
 from django.contrib.auth.models import User, Group
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
 from django.utils import timezone
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.db import transaction
+from django.db import connection, transaction
 from django.core.cache import cache
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 import json
 import logging
+import os
+import unittest
+from decimal import Decimal
 
 from .models import (
     RegistroOS, DocumentoSolicitacao, DataPrevistaEntrega, AcaoSolicitacao,
@@ -20,8 +25,15 @@ from .models import (
     Contrato, UnidadeCliente
 )
 from .serializers import RegistroOSSerializer
+from django.conf import settings
+from django.test import override_settings
 
+# Middlewares de produção (DEBUG desligado): com o cache de página, independente do DEBUG do ambiente
+MIDDLEWARE_PRODUCAO = settings.MIDDLEWARE_BASE[:5] + settings.CACHE_MIDDLEWARE + settings.MIDDLEWARE_BASE[5:]
 
+
+# Nos testes, rota acima do orçamento de consultas falha em vez de só gerar log
+@override_settings(INSTRUMENTACAO_ORCAMENTO_ACAO='erro')
 class BaseTestCase(APITestCase):
     """Classe base para testes da API"""
     
@@ -687,6 +699,29 @@ class PermissionTestCase(BaseTestCase):
         self.assertIn(os_tecnico.id, os_ids)
         # Como o sistema pode permitir acesso a todas as OSs para técnicos, vamos apenas verificar que a OS do técnico está presente
         self.assertIn(os_tecnico.id, os_ids)
+    
+    def test_basico_acessa_detalhe_da_propria_os(self):
+        """Usuário Básico lê o detalhe da própria OS, mas não o de outro usuário"""
+        os_basico = RegistroOS.objects.create(
+            numero_os=100202,
+            nome_cliente=self.cliente_braskem,
+            descricao_resumida='OS Básico',
+            usuario=self.basico_user
+        )
+        os_admin = RegistroOS.objects.create(
+            numero_os=100203,
+            nome_cliente=self.cliente_braskem,
+            descricao_resumida='OS Admin',
+            usuario=self.admin_user
+        )
+        self.authenticate_user(self.basico_user)
+        
+        response = self.client.get(f'{self.os_list_url}{os_basico.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], os_basico.id)
+        
+        response = self.client.get(f'{self.os_list_url}{os_admin.id}/')
+        self.assertIn(response.status_code, [status.HTTP_403_FORBIDDEN, status.HTTP_404_NOT_FOUND])
 
 
 class CacheTestCase(BaseTestCase):
@@ -730,6 +765,27 @@ class CacheTestCase(BaseTestCase):
         # Para este teste, vamos apenas verificar que ambas as requisições funcionam
         self.assertIsInstance(response1.data['results'], list)
         self.assertIsInstance(response2.data['results'], list)
+    
+    @override_settings(DEBUG=False, MIDDLEWARE=MIDDLEWARE_PRODUCAO)
+    def test_cache_de_pagina_separado_por_usuario(self):
+        """O cache de página não entrega a resposta de um usuário a outro (Vary: Authorization)"""
+        os_admin = RegistroOS.objects.create(
+            numero_os=100201,
+            nome_cliente=self.cliente_braskem,
+            descricao_resumida='OS do administrador',
+            usuario=self.admin_user
+        )
+        
+        response_admin = self.client.get(self.os_list_url)
+        self.assertEqual(response_admin.status_code, status.HTTP_200_OK)
+        self.assertIn(os_admin.id, [os['id'] for os in response_admin.json()['results']])
+        self.assertIn('Authorization', response_admin['Vary'])
+        
+        # Mesma URL, outro token, sem limpar o cache
+        self.authenticate_user(self.basico_user)
+        response_basico = self.client.get(self.os_list_url)
+        self.assertEqual(response_basico.status_code, status.HTTP_200_OK)
+        self.assertNotIn(os_admin.id, [os['id'] for os in response_basico.json()['results']])
 
 
 class TransactionTestCase(BaseTestCase):
@@ -1980,3 +2036,2541 @@ class RegistroOSSerializerTest(TestCase):
         # O usuário não deve ter sido alterado
         self.assertEqual(instance.usuario, self.basico_user)
 
+
+
+class ValorTotalTestCase(BaseTestCase):
+    """Testes para o campo calculado valor_total"""
+    
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        self.authenticate_user(self.admin_user)
+    
+    def criar_os(self, **kwargs):
+        return RegistroOS.objects.create(
+            nome_cliente=self.cliente_braskem,
+            usuario=self.admin_user,
+            **kwargs
+        )
+    
+    def test_valor_total_usa_soma_valores_sem_saldo(self):
+        """Sem saldo positivo, valor_total deve ser a soma dos valores"""
+        os_obj = self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('150.50'))
+        self.assertEqual(os_obj.valor_total, Decimal('150.50'))
+    
+    def test_valor_total_usa_saldo_final_positivo(self):
+        """Com saldo final positivo, valor_total deve ser o saldo"""
+        os_obj = self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('100.00'))
+        NfVenda.objects.create(
+            registro=os_obj, numero_nota_fiscal_venda='NF-1',
+            preco_nota_fiscal_venda=Decimal('250.00'), data_nota_fiscal_venda=timezone.now()
+        )
+        os_obj.calcular_saldo_final()
+        os_obj.save()
+        os_obj.refresh_from_db()
+        self.assertEqual(os_obj.saldo_final, Decimal('150.00'))
+        self.assertEqual(os_obj.valor_total, Decimal('150.00'))
+    
+    def test_ordenacao_e_filtro_por_valor_total(self):
+        """Listagem deve ordenar e filtrar por valor_total no banco"""
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('10.00'))
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('30.00'))
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('20.00'))
+        
+        response = self.client.get(self.os_list_url, {'ordering': '-valor_total'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        valores = [item['valor_total'] for item in response.data['results']]
+        self.assertEqual(valores, [30.0, 20.0, 10.0])
+        
+        response = self.client.get(self.os_list_url, {'valor_total_minimo': '15'})
+        self.assertEqual(response.data['count'], 2)
+    
+    def test_relatorio_agrega_valor_total(self):
+        """Relatório deve somar valor_total via agregação"""
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('10.00'))
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('30.00'))
+        
+        response = self.client.get('/api/auth/relatorios/registros/', {'ordering': 'valor_total'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['valor_total_geral'], 40.0)
+        self.assertEqual([r['valor_total'] for r in response.data['registros']], [10.0, 30.0])
+    
+    def test_relatorio_filtro_valor_total_invalido_ignorado(self):
+        """Filtro de valor inválido é ignorado (como as datas), sem erro 500"""
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('10.00'))
+        self.criar_os(havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('30.00'))
+        url = '/api/auth/relatorios/registros/'
+        
+        response = self.client.get(url, {'valor_total_minimo': '20', 'valor_total_maximo': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['valor_total_geral'], 30.0)
+        
+        response = self.client.get(url, {'valor_total_minimo': 'NaN'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['valor_total_geral'], 40.0)
+
+
+class TotaisNotasFiscaisTestCase(BaseTestCase):
+    """Testes para manutenção incremental dos totais de NF de venda"""
+    
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        self.os_obj = RegistroOS.objects.create(
+            nome_cliente=self.cliente_braskem,
+            usuario=self.admin_user,
+            havera_valor_fabricacao='SIM',
+            valor_fabricacao=Decimal('100.00')
+        )
+    
+    def criar_nf(self, preco):
+        return NfVenda.objects.create(
+            registro=self.os_obj, numero_nota_fiscal_venda=f'NF-{preco}',
+            preco_nota_fiscal_venda=Decimal(preco), data_nota_fiscal_venda=timezone.now()
+        )
+    
+    def test_totais_atualizados_ao_criar_alterar_e_remover_nf(self):
+        """Criar, alterar e remover NF deve refletir nos totais da OS"""
+        nf = self.criar_nf('80.00')
+        self.criar_nf('70.00')
+        self.os_obj.refresh_from_db()
+        self.assertEqual(self.os_obj.soma_notas_fiscais, Decimal('150.00'))
+        self.assertEqual(self.os_obj.saldo_final, Decimal('50.00'))
+        self.assertEqual(self.os_obj.valor_total, Decimal('50.00'))
+        
+        nf.preco_nota_fiscal_venda = Decimal('10.00')
+        nf.save()
+        self.os_obj.refresh_from_db()
+        self.assertEqual(self.os_obj.soma_notas_fiscais, Decimal('80.00'))
+        self.assertEqual(self.os_obj.saldo_final, Decimal('-20.00'))
+        self.assertEqual(self.os_obj.valor_total, Decimal('100.00'))
+        
+        nf.delete()
+        self.os_obj.refresh_from_db()
+        self.assertEqual(self.os_obj.soma_notas_fiscais, Decimal('70.00'))
+    
+    def test_calcular_soma_notas_fiscais_usa_agregacao(self):
+        """Soma de NFs deve ser feita com uma única consulta agregada"""
+        self.criar_nf('10.00')
+        self.criar_nf('20.00')
+        with self.assertNumQueries(1):
+            total = self.os_obj.calcular_soma_notas_fiscais()
+        self.assertEqual(total, Decimal('30.00'))
+    
+    def test_comando_recalcular(self):
+        """Comando recalcular deve corrigir totais inconsistentes"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        self.criar_nf('300.00')
+        RegistroOS.objects.filter(pk=self.os_obj.pk).update(
+            soma_notas_fiscais=0, saldo_final=0, valor_total=0
+        )
+        
+        call_command('recalcular', stdout=StringIO())
+        
+        self.os_obj.refresh_from_db()
+        self.assertEqual(self.os_obj.soma_notas_fiscais, Decimal('300.00'))
+        self.assertEqual(self.os_obj.saldo_final, Decimal('200.00'))
+        self.assertEqual(self.os_obj.valor_total, Decimal('200.00'))
+
+
+class RecalculoEmLoteTestCase(BaseTestCase):
+    """Testes para o recálculo em lote dos totais das OS"""
+    
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        self.os_a = RegistroOS.objects.create(
+            nome_cliente=self.cliente_braskem, usuario=self.admin_user,
+            havera_valor_fabricacao='SIM', valor_fabricacao=Decimal('100.00'),
+            havera_valor_montagem='NAO', valor_montagem=Decimal('999.00')
+        )
+        self.os_b = RegistroOS.objects.create(
+            nome_cliente=self.cliente_petrobras, usuario=self.admin_user,
+            havera_valor_inspecao='SIM', valor_inspecao=Decimal('40.00')
+        )
+        NfVenda.objects.create(
+            registro=self.os_a, numero_nota_fiscal_venda='NF-A',
+            preco_nota_fiscal_venda=Decimal('250.00'), data_nota_fiscal_venda=timezone.now()
+        )
+        # Simular dados desatualizados (ex.: regra de preço alterada)
+        RegistroOS.objects.update(soma_valores=0, soma_notas_fiscais=0, saldo_final=0, valor_total=0)
+    
+    def test_recalcular_totais_em_lotes(self):
+        """Recálculo em lote deve seguir a mesma regra de calcular_*"""
+        total = RegistroOS.recalcular_totais(tamanho_lote=1)
+        self.assertEqual(total, 2)
+        
+        self.os_a.refresh_from_db()
+        self.assertEqual(self.os_a.soma_valores, Decimal('100.00'))
+        self.assertEqual(self.os_a.soma_notas_fiscais, Decimal('250.00'))
+        self.assertEqual(self.os_a.saldo_final, Decimal('150.00'))
+        self.assertEqual(self.os_a.valor_total, Decimal('150.00'))
+        
+        self.os_b.refresh_from_db()
+        self.assertEqual(self.os_b.soma_valores, Decimal('40.00'))
+        self.assertEqual(self.os_b.saldo_final, Decimal('-40.00'))
+        self.assertEqual(self.os_b.valor_total, Decimal('40.00'))
+    
+    def test_comando_dry_run_nao_grava(self):
+        """Dry-run deve listar divergências sem alterar o banco"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        saida = StringIO()
+        call_command('recalcular', '--dry-run', stdout=saida)
+        
+        self.assertIn('2 OS com totais divergentes', saida.getvalue())
+        self.assertIn('saldo_final: 0.00 -> 150.00', saida.getvalue())
+        self.os_a.refresh_from_db()
+        self.assertEqual(self.os_a.soma_valores, Decimal('0.00'))
+    
+    def test_comando_com_filtro(self):
+        """Comando deve aceitar os mesmos filtros da API"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        call_command(
+            'recalcular', '--filtro', f'nome_cliente={self.cliente_petrobras.id}', stdout=StringIO()
+        )
+        
+        self.os_a.refresh_from_db()
+        self.os_b.refresh_from_db()
+        self.assertEqual(self.os_a.soma_valores, Decimal('0.00'))
+        self.assertEqual(self.os_b.soma_valores, Decimal('40.00'))
+
+
+class PreviewValoresLoteTestCase(BaseTestCase):
+    """Testes para o preview de valores em lote"""
+    
+    url = '/api/preview-valores/lote/'
+    
+    def setUp(self):
+        super().setUp()
+        self.authenticate_user(self.tecnico_user)
+    
+    def test_preview_lote_com_totais(self):
+        """Deve calcular cada linha com Decimal e somar os totais"""
+        response = self.client.post(self.url, {
+            'registros': [
+                {'id': 10, 'havera_valor_fabricacao': 'SIM', 'valor_fabricacao': '0.10',
+                 'havera_valor_montagem': 'SIM', 'valor_montagem': '0.20', 'soma_notas_fiscais': '1.00'},
+                {'havera_valor_inspecao': 'SIM', 'valor_inspecao': '50.00',
+                 'havera_valor_hh': 'NAO', 'valor_hh': '999.00'},
+                {'havera_valor_fabricacao': 'SIM', 'valor_fabricacao': 'abc'},
+            ]
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        primeira, segunda, terceira = response.data['resultados']
+        self.assertEqual(primeira['id'], 10)
+        self.assertEqual(primeira['soma_valores'], '0.30')
+        self.assertEqual(primeira['saldo_final'], '0.70')
+        self.assertEqual(primeira['valor_total'], '0.70')
+        self.assertEqual(segunda['saldo_final'], '-50.00')
+        self.assertEqual(segunda['valor_total'], '50.00')
+        self.assertIn('error', terceira)
+        
+        totais = response.data['totais']
+        self.assertEqual(totais['soma_valores'], '50.30')
+        self.assertEqual(totais['valor_total'], '50.70')
+        self.assertEqual(totais['quantidade'], 2)
+        self.assertEqual(totais['com_erro'], 1)
+    
+    def test_preview_lote_valor_fora_do_limite(self):
+        """Valores que não cabem nos campos da OS viram erro da linha, sem derrubar o lote"""
+        response = self.client.post(self.url, {
+            'registros': [
+                {'soma_notas_fiscais': '1e40'},
+                {'soma_notas_fiscais': '10000000000000.00'},
+                {'havera_valor_fabricacao': 'SIM', 'valor_fabricacao': '10.00'},
+            ]
+        }, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        primeira, segunda, terceira = response.data['resultados']
+        self.assertIn('error', primeira)
+        self.assertIn('error', segunda)
+        self.assertEqual(terceira['valor_total'], '10.00')
+        self.assertEqual(response.data['totais']['valor_total'], '10.00')
+        self.assertEqual(response.data['totais']['com_erro'], 2)
+    
+    def test_preview_lote_limite_de_registros(self):
+        """Requisições acima do limite devem ser recusadas"""
+        with self.settings(PREVIEW_VALORES_MAX_LINHAS=2):
+            response = self.client.post(self.url, {'registros': [{}, {}, {}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    def test_preview_lote_payload_invalido(self):
+        """Payload sem lista de registros deve retornar 400"""
+        response = self.client.post(self.url, {'registros': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_preview_individual_segue_regra_do_modelo(self):
+        """Preview individual deve usar o mesmo saldo do modelo (NF - valores)"""
+        response = self.client.post('/api/preview-valores/', {
+            'havera_valor_fabricacao': 'SIM', 'valor_fabricacao': '100.00',
+            'soma_notas_fiscais': '150.00'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['soma_valores'], 100.0)
+        self.assertEqual(response.data['saldo_final'], 50.0)
+
+
+class ImportacaoOSTestCase(BaseTestCase):
+    """Testes para a importação de OS em lote"""
+    
+    url = '/api/ordens-servico/importar/'
+    
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        self.status_pendente, _ = StatusOS.objects.get_or_create(nome='PENDENTE')
+        self.contrato = Contrato.objects.create(cliente=self.cliente_braskem, numero='CT-01')
+        self.authenticate_user(self.admin_user)
+    
+    def enviar_csv(self, conteudo, **dados):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        arquivo = SimpleUploadedFile('os.csv', conteudo.encode('utf-8'), content_type='text/csv')
+        return self.client.post(self.url, {'arquivo': arquivo, **dados}, format='multipart')
+    
+    def test_importar_csv_com_relatorio_de_erros(self):
+        """Linhas válidas são gravadas e as inválidas aparecem no relatório"""
+        RegistroOS.objects.create(numero_os=555555, usuario=self.admin_user)
+        conteudo = (
+            'numero_os;nome_cliente;numero_contrato;status_os;havera_valor_fabricacao;valor_fabricacao;ordens_cliente\n'
+            '111111;braskem;CT-01;Pendente;Sim;1.234,56;OC-1|OC-2\n'
+            ';CLIENTE INEXISTENTE;;;;;\n'
+            '555555;BRASKEM;;;;;\n'
+            ';PETROBRAS;;;NAO;abc;\n'
+        )
+        response = self.enviar_csv(conteudo)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_linhas'], 4)
+        self.assertEqual(response.data['importados'], 1)
+        self.assertEqual([erro['linha'] for erro in response.data['erros']], [3, 4, 5])
+        self.assertIn('nome_cliente', response.data['erros'][0]['erros'])
+        self.assertIn('numero_os', response.data['erros'][1]['erros'])
+        self.assertIn('valor_fabricacao', response.data['erros'][2]['erros'])
+        
+        os_obj = RegistroOS.objects.get(numero_os=111111)
+        self.assertEqual(os_obj.nome_cliente, self.cliente_braskem)
+        self.assertEqual(os_obj.numero_contrato, self.contrato)
+        self.assertEqual(os_obj.status_os, self.status_pendente)
+        self.assertEqual(os_obj.usuario, self.admin_user)
+        self.assertEqual(os_obj.soma_valores, Decimal('1234.56'))
+        self.assertEqual(os_obj.valor_total, Decimal('1234.56'))
+        self.assertEqual(
+            sorted(os_obj.ordens_cliente.values_list('numero_ordem', flat=True)), ['OC-1', 'OC-2']
+        )
+    
+    def test_validar_apenas_nao_grava(self):
+        """Com validar_apenas nada deve ser gravado"""
+        response = self.enviar_csv('nome_cliente\nBRASKEM\nPETROBRAS\n', validar_apenas='true')
+        self.assertEqual(response.data['importados'], 2)
+        self.assertEqual(RegistroOS.objects.count(), 0)
+    
+    def test_erro_de_leitura_no_meio_do_arquivo(self):
+        """Lotes gravados antes do erro de leitura são informados e o cache é limpo"""
+        from functools import partial
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .importacao import ImportadorOS
+        
+        linhas = ''.join(f'BRASKEM;{"x" * 300}\n' for _ in range(100))
+        conteudo = f'nome_cliente;descricao_resumida\n{linhas}'.encode('utf-8') + b'BRASKEM;\xff\xfe\n'
+        arquivo = SimpleUploadedFile('os.csv', conteudo, content_type='text/csv')
+        
+        with patch('controle.views.ImportadorOS', partial(ImportadorOS, tamanho_lote=10)), \
+                patch('controle.views.cache') as cache:
+            response = self.client.post(self.url, {'arquivo': arquivo}, format='multipart')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Erro ao ler o arquivo', response.data['error'])
+        self.assertGreater(response.data['importados'], 0)
+        self.assertEqual(response.data['importados'], RegistroOS.objects.count())
+        cache.clear.assert_called_once()
+    
+    def test_importacao_restrita_a_superiores(self):
+        """Usuários básicos não podem importar"""
+        self.authenticate_user(self.basico_user)
+        response = self.enviar_csv('nome_cliente\nBRASKEM\n')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_comando_importar_xlsx(self):
+        """Comando deve importar planilha XLSX gerando números de OS únicos"""
+        import os
+        import tempfile
+        from io import StringIO
+        from openpyxl import Workbook
+        from django.core.management import call_command
+        
+        planilha = Workbook()
+        aba = planilha.active
+        aba.append(['nome_cliente', 'descricao_resumida', 'datas_previstas'])
+        for indice in range(5):
+            aba.append(['PETROBRAS', f'OS importada {indice}', '10/01/2025|20/01/2025'])
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'os.xlsx')
+            planilha.save(caminho)
+            call_command('importar_os', caminho, '--usuario', self.admin_user.username, '--lote', '2', stdout=StringIO())
+        
+        self.assertEqual(RegistroOS.objects.filter(nome_cliente=self.cliente_petrobras).count(), 5)
+        self.assertEqual(len(set(RegistroOS.objects.values_list('numero_os', flat=True))), 5)
+        self.assertEqual(DataPrevistaEntrega.objects.count(), 10)
+
+
+class UploadEmPartesTestCase(BaseTestCase):
+    """Testes para o upload em partes (retomável)"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        self.diretorio = tempfile.TemporaryDirectory()
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(
+            UPLOAD_PARCIAL_DIR=self.diretorio.name, MEDIA_ROOT=self.media.name, UPLOAD_PARTE_TAMANHO_MAX=4
+        )
+        self.config.enable()
+        self.create_test_data()
+        self.authenticate_user(self.admin_user)
+        self.conteudo = b'AC10320123'  # assinatura de DWG
+    
+    def tearDown(self):
+        self.config.disable()
+        self.diretorio.cleanup()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def criar_sessao(self, **dados):
+        import hashlib
+        dados.setdefault('nome_arquivo', 'planta.dwg')
+        dados.setdefault('tamanho_total', len(self.conteudo))
+        dados.setdefault('checksum_sha256', hashlib.sha256(self.conteudo).hexdigest())
+        response = self.client.post('/api/uploads/', dados, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+    
+    def enviar_parte(self, token, offset, dados, **headers):
+        return self.client.put(
+            f'/api/uploads/{token}/', data=dados, content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), **headers
+        )
+    
+    def test_upload_retomavel_e_anexo_por_referencia(self):
+        """Partes são gravadas por offset e o arquivo é anexado pelo token"""
+        import hashlib
+        import os
+        from .models import UploadSessao
+        
+        sessao = self.criar_sessao()
+        token = sessao['token']
+        
+        response = self.enviar_parte(token, 0, self.conteudo[:4])
+        self.assertEqual(response.data['recebido'], 4)
+        
+        # Offset divergente (ex.: parte reenviada) deve indicar onde retomar
+        response = self.enviar_parte(token, 0, self.conteudo[:4])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['recebido'], 4)
+        
+        # Checksum da parte incorreto não avança o upload
+        response = self.enviar_parte(token, 4, self.conteudo[4:8], HTTP_UPLOAD_CHECKSUM='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Parte maior que o limite é recusada
+        response = self.enviar_parte(token, 4, self.conteudo[4:])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        self.enviar_parte(
+            token, 4, self.conteudo[4:8], HTTP_UPLOAD_CHECKSUM=hashlib.sha256(self.conteudo[4:8]).hexdigest()
+        )
+        response = self.enviar_parte(token, 8, self.conteudo[8:])
+        self.assertEqual(response.data['status'], 'CONCLUIDO')
+        
+        response = self.client.get(f'/api/uploads/{token}/')
+        self.assertEqual(response.data['recebido'], len(self.conteudo))
+        
+        # Anexar ao levantamento pela referência
+        os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        serializer = RegistroOSSerializer(
+            os_obj,
+            data={'levantamentos': [{
+                'data_levantamento': '2025-01-10T10:00:00',
+                'descricao_levantamento': 'Levantamento com planta',
+                'arquivo_anexo_levantamento': sessao['referencia'],
+            }]},
+            partial=True,
+            context={'request': Mock(user=self.admin_user)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+            # Só passa a ANEXADO depois do commit
+            self.assertEqual(UploadSessao.objects.get(token=token).status, 'CONCLUIDO')
+        
+        levantamento = Levantamento.objects.get(registro=os_obj)
+        self.assertTrue(levantamento.arquivo_anexo_levantamento.name.startswith('anexos_levantamento/planta'))
+        with levantamento.arquivo_anexo_levantamento.open('rb') as arquivo:
+            self.assertEqual(arquivo.read(), self.conteudo)
+        self.assertEqual(UploadSessao.objects.get(token=token).status, 'ANEXADO')
+        self.assertFalse(os.path.exists(os.path.join(self.diretorio.name, f'{token}.part')))
+    
+    def test_validacao_falha_sessao_sobrevive_a_limpeza(self):
+        """Referência usada numa escrita inválida não marca a sessão nem a expõe ao limpar_uploads"""
+        import io
+        import os
+        from datetime import timedelta
+        from django.core.management import call_command
+        from .models import UploadSessao
+        
+        sessao = self.criar_sessao()
+        token = sessao['token']
+        self.enviar_parte(token, 0, self.conteudo[:4])
+        self.enviar_parte(token, 4, self.conteudo[4:8])
+        self.enviar_parte(token, 8, self.conteudo[8:])
+        
+        os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        dados = {
+            'nome_cliente': 999999,  # cliente inexistente: a escrita falha na validação
+            'levantamentos': [{
+                'data_levantamento': '2025-01-10T10:00:00',
+                'descricao_levantamento': 'Levantamento com planta',
+                'arquivo_anexo_levantamento': sessao['referencia'],
+            }],
+        }
+        serializer = RegistroOSSerializer(
+            os_obj, data=dados, partial=True, context={'request': Mock(user=self.admin_user)}
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertFalse(serializer.is_valid())
+        self.assertIn('nome_cliente', serializer.errors)
+        self.assertEqual(callbacks, [])
+        
+        call_command('limpar_uploads', stdout=io.StringIO())
+        self.assertEqual(UploadSessao.objects.get(token=token).status, 'CONCLUIDO')
+        self.assertTrue(os.path.exists(os.path.join(self.diretorio.name, f'{token}.part')))
+        
+        # A mesma referência continua valendo para uma nova tentativa
+        del dados['nome_cliente']
+        serializer = RegistroOSSerializer(
+            os_obj, data=dados, partial=True, context={'request': Mock(user=self.admin_user)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+        self.assertEqual(UploadSessao.objects.get(token=token).status, 'ANEXADO')
+        
+        # Anexadas só saem depois do limite de idade
+        call_command('limpar_uploads', stdout=io.StringIO())
+        self.assertTrue(UploadSessao.objects.filter(token=token).exists())
+        UploadSessao.objects.filter(token=token).update(updated_at=timezone.now() - timedelta(hours=25))
+        call_command('limpar_uploads', stdout=io.StringIO())
+        self.assertFalse(UploadSessao.objects.filter(token=token).exists())
+    
+    def test_rollback_apos_save_mantem_arquivo_da_sessao(self):
+        """Se a transação é desfeita depois do save, a sessão continua utilizável"""
+        import os
+        from django.db import transaction
+        from .models import UploadSessao
+        
+        sessao = self.criar_sessao()
+        token = sessao['token']
+        self.enviar_parte(token, 0, self.conteudo[:4])
+        self.enviar_parte(token, 4, self.conteudo[4:8])
+        self.enviar_parte(token, 8, self.conteudo[8:])
+        parcial = os.path.join(self.diretorio.name, f'{token}.part')
+        
+        os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        dados = {'levantamentos': [{
+            'data_levantamento': '2025-01-10T10:00:00',
+            'descricao_levantamento': 'Levantamento com planta',
+            'arquivo_anexo_levantamento': sessao['referencia'],
+        }]}
+        serializer = RegistroOSSerializer(
+            os_obj, data=dados, partial=True, context={'request': Mock(user=self.admin_user)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        arquivo = serializer.validated_data['levantamentos'][0]['arquivo_anexo_levantamento']
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    serializer.save()
+                    raise RuntimeError('falha depois do save')
+        
+        self.assertEqual(callbacks, [])
+        self.assertTrue(arquivo.closed)
+        self.assertEqual(UploadSessao.objects.get(token=token).status, 'CONCLUIDO')
+        with open(parcial, 'rb') as conteudo:
+            self.assertEqual(conteudo.read(), self.conteudo)
+        
+        serializer = RegistroOSSerializer(
+            os_obj, data=dados, partial=True, context={'request': Mock(user=self.admin_user)}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+        levantamento = Levantamento.objects.get(registro=os_obj)
+        with levantamento.arquivo_anexo_levantamento.open('rb') as anexo:
+            self.assertEqual(anexo.read(), self.conteudo)
+        self.assertFalse(os.path.exists(parcial))
+    
+    def test_checksum_final_invalido_reinicia_upload(self):
+        """Arquivo montado com checksum divergente deve ser reenviado"""
+        sessao = self.criar_sessao(checksum_sha256='a' * 64, tamanho_total=4)
+        response = self.enviar_parte(sessao['token'], 0, self.conteudo[:4])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"/api/uploads/{sessao['token']}/").data['recebido'], 0)
+    
+    def test_sessao_de_outro_usuario(self):
+        """Usuário não pode acessar sessão de upload de outro usuário"""
+        sessao = self.criar_sessao()
+        self.authenticate_user(self.basico_user)
+        response = self.client.get(f"/api/uploads/{sessao['token']}/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_limite_de_tamanho_total(self):
+        """Sessões acima do tamanho máximo devem ser recusadas"""
+        with self.settings(UPLOAD_TAMANHO_MAX=5):
+            response = self.client.post('/api/uploads/', {'nome_arquivo': 'a.pdf', 'tamanho_total': 6}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+
+class ArmazenamentoDeduplicadoTestCase(TestCase):
+    """Testes para o armazenamento de anexos deduplicado por conteúdo"""
+    
+    def setUp(self):
+        import tempfile
+        from .storage import ArmazenamentoDeduplicado
+        self.media = tempfile.TemporaryDirectory()
+        self.storage = ArmazenamentoDeduplicado(location=self.media.name)
+    
+    def tearDown(self):
+        self.media.cleanup()
+    
+    def test_conteudo_igual_e_gravado_uma_vez(self):
+        """Arquivos iguais compartilham o mesmo blob e mantêm nomes distintos"""
+        import hashlib
+        import os
+        from django.core.files.base import ContentFile
+        
+        conteudo = b'%PDF-1.4 contrato'
+        digest = hashlib.sha256(conteudo).hexdigest()
+        nome_a = self.storage.save('documentos_solicitacao/contrato.pdf', ContentFile(conteudo))
+        nome_b = self.storage.save('documentos_entrada/contrato.pdf', ContentFile(conteudo))
+        nome_c = self.storage.save('documentos_entrada/contrato.pdf', ContentFile(b'outro'))
+        
+        self.assertEqual(nome_a, 'documentos_solicitacao/contrato.pdf')
+        self.assertNotEqual(nome_c, nome_b)
+        self.assertTrue(os.path.samefile(self.storage.path(nome_a), self.storage.path(nome_b)))
+        self.assertEqual(self.storage.referencias(digest), 2)
+        with self.storage.open(nome_b) as arquivo:
+            self.assertEqual(arquivo.read(), conteudo)
+        
+        self.storage.delete(nome_a)
+        self.assertEqual(self.storage.referencias(digest), 1)
+        self.assertEqual(self.storage.coletar_blobs(), (0, 0))
+        
+        self.storage.delete(nome_b)
+        self.assertEqual(self.storage.coletar_blobs(), (1, len(conteudo)))
+        self.assertEqual(self.storage.referencias(digest), 0)
+    
+    def test_blob_coletado_entre_a_verificacao_e_o_link(self):
+        """Se coletar_blobs remove o blob antes do link, o conteúdo recebido grava o blob de novo"""
+        import hashlib
+        import os
+        from django.core.files.base import ContentFile
+        
+        conteudo = b'%PDF-1.4 proposta'
+        digest = hashlib.sha256(conteudo).hexdigest()
+        self.storage.delete(self.storage.save('anexos_gmi/proposta.pdf', ContentFile(conteudo)))
+        self.assertTrue(os.path.exists(self.storage.caminho_blob(digest)))  # aguardando a coleta
+        
+        vincular = self.storage._vincular
+        
+        def coletar_antes_do_link(blob, caminho, temporario):
+            self.assertEqual(self.storage.coletar_blobs(), (1, len(conteudo)))
+            return vincular(blob, caminho, temporario)
+        
+        with patch.object(self.storage, '_vincular', side_effect=coletar_antes_do_link):
+            nome = self.storage.save('anexos_gme/proposta.pdf', ContentFile(conteudo))
+        
+        with self.storage.open(nome) as arquivo:
+            self.assertEqual(arquivo.read(), conteudo)
+        self.assertEqual(self.storage.referencias(digest), 1)
+        self.assertEqual(os.listdir(self.storage.path('_blobs/tmp')), [])
+        # O blob regravado está referenciado pelo novo nome
+        self.assertEqual(self.storage.coletar_blobs(), (0, 0))
+    
+    def test_deduplicar_arquivos_existentes(self):
+        """Arquivos gravados antes da deduplicação viram links para o blob"""
+        import os
+        
+        for nome in ['anexos_gmi/a.pdf', 'anexos_gme/b.pdf']:
+            caminho = self.storage.path(nome)
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            with open(caminho, 'wb') as arquivo:
+                arquivo.write(b'mesmo conteudo')
+        
+        self.assertEqual(self.storage.deduplicar('anexos_gmi/a.pdf', dry_run=True), 0)
+        self.assertEqual(self.storage.deduplicar('anexos_gmi/a.pdf'), 0)
+        self.assertEqual(self.storage.deduplicar('anexos_gme/b.pdf', dry_run=True), 14)
+        self.assertEqual(self.storage.deduplicar('anexos_gme/b.pdf'), 14)
+        self.assertTrue(os.path.samefile(
+            self.storage.path('anexos_gmi/a.pdf'), self.storage.path('anexos_gme/b.pdf')
+        ))
+
+
+class MiniaturasAnexosTestCase(BaseTestCase):
+    """Testes para miniaturas e previews de anexos"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name, MINIATURAS_ASSINCRONO=False)
+        self.config.enable()
+        self.create_test_data()
+        self.os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def imagem_png(self, tamanho=(1600, 900)):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.base import ContentFile
+        buffer = BytesIO()
+        Image.new('RGB', tamanho, 'blue').save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='scan.png')
+    
+    def test_miniatura_gerada_apos_salvar_anexo(self):
+        """Após o commit, o anexo deve ganhar miniatura e preview expostos no serializer"""
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.storage import default_storage
+        from .serializers import DocumentoSolicitacaoNestedSerializer
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            documento = DocumentoSolicitacao.objects.create(
+                registro=self.os_obj, documento_solicitacao=self.imagem_png()
+            )
+        
+        documento.refresh_from_db()
+        nomes = documento.derivados
+        self.assertEqual(nomes['original'], documento.documento_solicitacao.name)
+        self.assertTrue(nomes['miniatura'].startswith('documentos_solicitacao/_previews/'))
+        with default_storage.open(nomes['miniatura']) as arquivo:
+            self.assertLessEqual(max(Image.open(arquivo).size), 200)
+        
+        # A representação usa os nomes gravados, sem consultar o disco
+        with patch('controle.miniaturas.os.stat') as stat, patch.object(default_storage, 'exists') as exists:
+            data = DocumentoSolicitacaoNestedSerializer(documento).data
+        stat.assert_not_called()
+        exists.assert_not_called()
+        url = f'/api/anexos/documentos-solicitacao/{documento.pk}/download/'
+        self.assertEqual(data['documento_solicitacao_url'], url)
+        self.assertEqual(data['documento_solicitacao_miniatura'], f'{url}?derivado=miniatura&inline=1')
+        
+        # Os derivados saem pela rota protegida, com a mesma checagem do anexo
+        self.authenticate_user(self.admin_user)
+        response = self.client.get(data['documento_solicitacao_preview'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(Image.open(BytesIO(b''.join(response.streaming_content))).size, (1024, 576))
+    
+    def test_derivados_de_arquivo_substituido_sao_ignorados(self):
+        """Trocar o arquivo invalida os nomes gravados até a nova geração"""
+        from .miniaturas import derivados_atuais
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            documento = DocumentoSolicitacao.objects.create(
+                registro=self.os_obj, documento_solicitacao=self.imagem_png()
+            )
+        documento.refresh_from_db()
+        self.assertIn('preview', derivados_atuais(documento, 'documento_solicitacao'))
+        
+        antigos = documento.derivados
+        documento.documento_solicitacao = self.imagem_png((300, 300))
+        with self.captureOnCommitCallbacks(execute=True):
+            documento.save()
+            self.assertEqual(derivados_atuais(documento, 'documento_solicitacao'), {})
+        
+        documento.refresh_from_db()
+        self.assertEqual(documento.derivados['original'], documento.documento_solicitacao.name)
+        self.assertNotEqual(documento.derivados['preview'], antigos['preview'])
+    
+    def test_sem_derivados_antes_da_geracao(self):
+        """Enquanto não gerados, os campos de miniatura ficam nulos"""
+        from .serializers import DocumentoSolicitacaoNestedSerializer
+        
+        documento = DocumentoSolicitacao.objects.create(
+            registro=self.os_obj, documento_solicitacao=self.imagem_png()
+        )
+        data = DocumentoSolicitacaoNestedSerializer(documento).data
+        self.assertIsNone(data['documento_solicitacao_miniatura'])
+        self.assertIsNone(data['documento_solicitacao_preview'])
+
+
+class DownloadAnexoTestCase(BaseTestCase):
+    """Testes para o download protegido de anexos"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        from django.core.files.base import ContentFile
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name, DOWNLOAD_X_ACCEL=False)
+        self.config.enable()
+        self.create_test_data()
+        
+        self.conteudo = bytes(range(256)) * 40
+        self.os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.basico_user)
+        self.levantamento = Levantamento.objects.create(
+            registro=self.os_obj,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Desenho',
+            arquivo_anexo_levantamento=ContentFile(self.conteudo, name='planta.dwg'),
+        )
+        self.url = f'/api/anexos/levantamentos/{self.levantamento.pk}/download/'
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def baixar(self, response):
+        return b''.join(response.streaming_content)
+    
+    def test_dono_baixa_arquivo_completo(self):
+        """O dono da OS recebe o arquivo inteiro com ETag e Accept-Ranges"""
+        self.authenticate_user(self.basico_user)
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.baixar(response), self.conteudo)
+        self.assertEqual(response['Content-Length'], str(len(self.conteudo)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(response['ETag'])
+    
+    def test_usuario_sem_acesso_a_os(self):
+        """Usuário básico não baixa anexos de OS de outro usuário; técnicos podem"""
+        self.os_obj.usuario = self.admin_user
+        self.os_obj.save(update_fields=['usuario'])
+        
+        self.authenticate_user(self.basico_user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        
+        self.authenticate_user(self.tecnico_user)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+    
+    def test_tipo_ou_anexo_inexistente(self):
+        self.authenticate_user(self.admin_user)
+        self.assertEqual(
+            self.client.get(f'/api/anexos/materiais/{self.levantamento.pk}/download/').status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+        self.assertEqual(
+            self.client.get('/api/anexos/levantamentos/999999/download/').status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+    
+    def test_range(self):
+        """Intervalos simples, sufixo e intervalo inválido"""
+        self.authenticate_user(self.basico_user)
+        tamanho = len(self.conteudo)
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{tamanho}')
+        self.assertEqual(self.baixar(response), self.conteudo[100:200])
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-50')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(self.baixar(response), self.conteudo[-50:])
+        
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={tamanho}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{tamanho}')
+    
+    def test_requisicoes_condicionais(self):
+        """If-None-Match devolve 304 e If-Range desatualizado envia o arquivo inteiro"""
+        self.authenticate_user(self.basico_user)
+        etag = self.client.get(self.url)['ETag']
+        
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outro"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.baixar(response), self.conteudo)
+    
+    def test_x_accel_redirect(self):
+        """Com DOWNLOAD_X_ACCEL o corpo fica vazio e o nginx recebe o caminho interno"""
+        self.authenticate_user(self.basico_user)
+        with self.settings(DOWNLOAD_X_ACCEL=True, DOWNLOAD_X_ACCEL_PREFIX='/media-protegida/'):
+            response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            f'/media-protegida/{self.levantamento.arquivo_anexo_levantamento.name}'
+        )
+        self.assertEqual(response.content, b'')
+    
+    def test_serializer_aponta_para_rota_protegida(self):
+        """O serializer expõe a URL de download protegida, não o caminho em /media/"""
+        from .serializers import LevantamentoSerializer
+        
+        data = LevantamentoSerializer(self.levantamento).data
+        self.assertEqual(data['arquivo_anexo_levantamento_url'], self.url)
+        self.assertIsNone(data['arquivo_anexo_levantamento_miniatura'])
+        
+        self.levantamento.arquivo_anexo_levantamento = None
+        self.levantamento.save()
+        data = LevantamentoSerializer(self.levantamento).data
+        self.assertIsNone(data['arquivo_anexo_levantamento_url'])
+    
+    def test_derivado_invalido(self):
+        self.authenticate_user(self.basico_user)
+        response = self.client.get(self.url, {'derivado': 'original'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PacoteAnexosTestCase(BaseTestCase):
+    """Testes para o pacote ZIP de anexos gerado em streaming"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        from django.core.files.base import ContentFile
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name)
+        self.config.enable()
+        self.create_test_data()
+        
+        self.os_1 = RegistroOS.objects.create(
+            nome_cliente=self.cliente_braskem, usuario=self.basico_user, numero_os=100
+        )
+        self.os_2 = RegistroOS.objects.create(
+            nome_cliente=self.cliente_petrobras, usuario=self.admin_user, numero_os=200
+        )
+        self.documento = DocumentoSolicitacao.objects.create(
+            registro=self.os_1, documento_solicitacao=ContentFile(b'%PDF-1.4 pedido', name='pedido.pdf')
+        )
+        self.levantamento = Levantamento.objects.create(
+            registro=self.os_1,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Desenho',
+            arquivo_anexo_levantamento=ContentFile(b'x' * 200000, name='planta.dwg'),
+        )
+        self.levantamento_os_2 = Levantamento.objects.create(
+            registro=self.os_2,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Desenho',
+            arquivo_anexo_levantamento=ContentFile(b'outro', name='planta.dwg'),
+        )
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def abrir_zip(self, response):
+        import io
+        import zipfile
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+    
+    def test_pacote_de_uma_os(self):
+        """ZIP da OS com uma pasta por tipo de anexo"""
+        self.authenticate_user(self.basico_user)
+        pacote = self.abrir_zip(self.client.get(f'/api/ordens-servico/{self.os_1.pk}/anexos-zip/'))
+        
+        self.assertEqual(pacote.namelist(), [
+            f'OS-100/documentos-solicitacao/{self.documento.pk}-pedido.pdf',
+            f'OS-100/levantamentos/{self.levantamento.pk}-planta.dwg',
+        ])
+        self.assertIsNone(pacote.testzip())
+        self.assertEqual(pacote.read(pacote.namelist()[1]), b'x' * 200000)
+    
+    def test_pacote_sem_permissao(self):
+        self.authenticate_user(self.basico_user)
+        response = self.client.get(f'/api/ordens-servico/{self.os_2.pk}/anexos-zip/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_pacote_filtrado_e_arquivo_ausente(self):
+        """O pacote em lote usa os filtros da listagem e lista anexos sem arquivo no disco"""
+        import os
+        os.remove(self.levantamento_os_2.arquivo_anexo_levantamento.path)
+        self.authenticate_user(self.admin_user)
+        
+        pacote = self.abrir_zip(self.client.get('/api/ordens-servico/anexos-zip/', {'numero_os': 200}))
+        self.assertEqual(pacote.namelist(), ['arquivos_ausentes.txt'])
+        
+        pacote = self.abrir_zip(self.client.get('/api/ordens-servico/anexos-zip/'))
+        self.assertEqual(len(pacote.namelist()), 3)
+    
+    def test_limite_de_os(self):
+        self.authenticate_user(self.admin_user)
+        with self.settings(PACOTE_ANEXOS_MAX_OS=1):
+            response = self.client.get('/api/ordens-servico/anexos-zip/')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    def test_comando_gerar_pacote(self):
+        import io
+        import os
+        import zipfile
+        from django.core.management import call_command
+        
+        saida = os.path.join(self.media.name, 'pacote.zip')
+        call_command('gerar_pacote_anexos', saida, '--os', str(self.os_2.pk), stdout=io.StringIO())
+        with zipfile.ZipFile(saida) as pacote:
+            self.assertEqual(pacote.namelist(), [
+                f'OS-200/levantamentos/{self.levantamento_os_2.pk}-'
+                f'{os.path.basename(self.levantamento_os_2.arquivo_anexo_levantamento.name)}'
+            ])
+
+
+class PoliticaAnexosTestCase(BaseTestCase):
+    """Testes para a política de anexos (assinatura e tamanho por tipo)"""
+    
+    PDF = b'%PDF-1.7\n' + b'0' * 4000
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name)
+        self.config.enable()
+        self.create_test_data()
+        self.authenticate_user(self.admin_user)
+        self.os_obj = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        self.url = f'/api/ordens-servico/{self.os_obj.pk}/levantamentos/'
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def enviar(self, nome, conteudo):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.client.post(self.url, {
+            'registro': self.os_obj.pk,
+            'data_levantamento': '2025-01-10T10:00:00',
+            'descricao_levantamento': 'Planta',
+            'arquivo_anexo_levantamento': SimpleUploadedFile(nome, conteudo),
+        }, format='multipart')
+    
+    def test_arquivo_valido(self):
+        response = self.enviar('planta.pdf', self.PDF)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+    
+    def test_conteudo_diferente_da_extensao(self):
+        """Executável renomeado para .pdf é barrado pela assinatura"""
+        response = self.enviar('planta.pdf', b'MZ\x90\x00' + b'0' * 100)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('não corresponde', str(response.data['arquivo_anexo_levantamento']))
+        self.assertFalse(Levantamento.objects.exists())
+    
+    def test_extensao_e_tamanho(self):
+        response = self.enviar('planta.exe', self.PDF)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        with self.settings(ANEXO_TAMANHO_MAX=1024):
+            response = self.enviar('planta.pdf', self.PDF)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('limite', str(response.data['arquivo_anexo_levantamento']))
+    
+    def test_handler_interrompe_no_primeiro_bloco(self):
+        """O upload é interrompido no primeiro bloco inválido, sem ler o restante"""
+        from django.core.files.uploadhandler import StopUpload
+        from django.test import RequestFactory
+        from .anexos import PoliticaAnexoUploadHandler
+        
+        request = RequestFactory().post('/')
+        handler = PoliticaAnexoUploadHandler(request)
+        handler.new_file('gmis[0][arquivo_anexo_gmi]', 'laudo.pdf', 'application/pdf', None)
+        with self.assertRaises(StopUpload):
+            handler.receive_data_chunk(b'nao e pdf', 0)
+        self.assertIn('gmis[0][arquivo_anexo_gmi]', request.anexos_rejeitados)
+        
+        # Campos fora do registro (ex.: planilha de importação) não são afetados
+        handler.new_file('arquivo', 'os.csv', 'text/csv', None)
+        self.assertEqual(handler.receive_data_chunk(b'numero_os\n', 0), b'numero_os\n')
+    
+    def test_handler_so_no_parser_do_drf(self):
+        """FILE_UPLOAD_HANDLERS fica no padrão do Django; o handler da política entra só pelo parser"""
+        from django.conf import global_settings
+        from django.test import RequestFactory
+        from .anexos import PoliticaAnexoUploadHandler
+        
+        self.assertEqual(settings.FILE_UPLOAD_HANDLERS, global_settings.FILE_UPLOAD_HANDLERS)
+        request = RequestFactory().post('/')
+        self.assertFalse(any(isinstance(handler, PoliticaAnexoUploadHandler) for handler in request.upload_handlers))
+        
+        response = self.enviar('planta.pdf', b'MZ\x90\x00' + b'0' * 100)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        handlers = response.wsgi_request.upload_handlers
+        self.assertIsInstance(handlers[0], PoliticaAnexoUploadHandler)
+        self.assertEqual(len(handlers), len(global_settings.FILE_UPLOAD_HANDLERS) + 1)
+    
+    def test_politicas_por_campo(self):
+        from .anexos import MB, politica_do_campo
+        self.assertEqual(politica_do_campo(NfVenda, 'arquivo_anexo_nota_fiscal_venda').limite('pdf'), 20 * MB)
+        self.assertEqual(politica_do_campo(Levantamento, 'arquivo_anexo_levantamento').limite('dwg'), 500 * MB)
+        self.assertIn('dwg', politica_do_campo(Levantamento, 'arquivo_anexo_levantamento').extensoes)
+        self.assertNotIn('dwg', politica_do_campo(Gmi, 'arquivo_anexo_gmi').extensoes)
+    
+    def test_serializer_aplica_politica(self):
+        """Arquivos que não passam pelo multipart também são validados no serializer"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        serializer = RegistroOSSerializer(
+            self.os_obj,
+            data={'levantamentos': [{
+                'data_levantamento': '2025-01-10T10:00:00',
+                'descricao_levantamento': 'Planta',
+                'arquivo_anexo_levantamento': SimpleUploadedFile('planta.png', b'GIF89a' + b'0' * 10),
+            }]},
+            partial=True,
+            context={'request': Mock(user=self.admin_user)}
+        )
+        self.assertFalse(serializer.is_valid())
+
+
+class IndiceArquivosTestCase(BaseTestCase):
+    """Testes para o índice de arquivos, a limpeza de órfãos e o relatório de uso"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        self.media = tempfile.TemporaryDirectory()
+        self.quarentena = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name, ARQUIVOS_QUARENTENA_DIR=self.quarentena.name)
+        self.config.enable()
+        self.create_test_data()
+        self.os_1 = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        self.os_2 = RegistroOS.objects.create(nome_cliente=self.cliente_petrobras, usuario=self.admin_user)
+        self.levantamento_1 = self.criar_levantamento(self.os_1, b'a' * 300)
+        self.levantamento_2 = self.criar_levantamento(self.os_2, b'b' * 100)
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        self.quarentena.cleanup()
+        super().tearDown()
+    
+    def criar_levantamento(self, registro, conteudo):
+        from django.core.files.base import ContentFile
+        return Levantamento.objects.create(
+            registro=registro,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Planta',
+            arquivo_anexo_levantamento=ContentFile(conteudo, name='planta.dwg'),
+        )
+    
+    def orfaos(self):
+        from .indice_arquivos import arquivos_orfaos
+        return sorted(nome for nome, _, _ in arquivos_orfaos(idade_minima=0, tamanho_lote=2))
+    
+    def test_indice_acompanha_anexos(self):
+        from .models import ArquivoArmazenado
+        
+        indice = ArquivoArmazenado.objects.get(objeto_id=self.levantamento_1.pk, modelo='controle.levantamento')
+        self.assertEqual(indice.nome, self.levantamento_1.arquivo_anexo_levantamento.name)
+        self.assertEqual(indice.tamanho, 300)
+        self.assertEqual(indice.registro, self.os_1)
+        
+        # Exclusão em cascata da OS remove o índice e deixa o arquivo órfão no disco
+        nome = self.levantamento_1.arquivo_anexo_levantamento.name
+        self.os_1.delete()
+        self.assertFalse(ArquivoArmazenado.objects.filter(nome=nome).exists())
+        self.assertEqual(self.orfaos(), [nome])
+    
+    def test_limpeza_confere_modelos_e_derivados(self):
+        """Índice desatualizado não causa remoção; miniaturas seguem o anexo de origem"""
+        import os
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+        from .models import ArquivoArmazenado
+        
+        ArquivoArmazenado.objects.all().delete()
+        self.assertEqual(self.orfaos(), [])
+        
+        avulso = default_storage.save('anexos_levantamento/avulso.pdf', ContentFile(b'%PDF-1.4'))
+        preview_avulso = default_storage.save(
+            f'anexos_levantamento/_previews/avulso.pdf.{"0" * 12}.thumb.jpg', ContentFile(b'jpg')
+        )
+        preview_valido = default_storage.save(
+            f'anexos_levantamento/_previews/{os.path.basename(self.levantamento_2.arquivo_anexo_levantamento.name)}'
+            f'.{"0" * 12}.thumb.jpg', ContentFile(b'jpg')
+        )
+        self.assertEqual(self.orfaos(), sorted([avulso, preview_avulso]))
+        self.assertTrue(default_storage.exists(preview_valido))
+    
+    def test_comando_limpeza_com_quarentena(self):
+        import io
+        import os
+        from django.core.management import call_command
+        
+        nome = self.levantamento_1.arquivo_anexo_levantamento.name
+        Levantamento.objects.filter(pk=self.levantamento_1.pk).delete()
+        
+        saida = io.StringIO()
+        call_command('limpar_arquivos_orfaos', '--dry-run', '--idade-minima', '0', stdout=saida)
+        self.assertIn(nome, saida.getvalue())
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, nome)))
+        
+        call_command('limpar_arquivos_orfaos', '--quarentena', '--idade-minima', '0', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(os.path.join(self.media.name, nome)))
+        self.assertTrue(os.path.exists(os.path.join(self.quarentena.name, nome)))
+        self.assertTrue(os.path.exists(self.levantamento_2.arquivo_anexo_levantamento.path))
+        
+        # Arquivos recentes são preservados pela idade mínima
+        self.criar_levantamento(self.os_2, b'c')
+        Levantamento.objects.filter(registro=self.os_2).delete()
+        call_command('limpar_arquivos_orfaos', stdout=io.StringIO())
+        self.assertEqual(len(self.orfaos()), 2)
+    
+    def test_relatorio_de_uso(self):
+        import io
+        from django.core.management import call_command
+        
+        self.authenticate_user(self.admin_user)
+        response = self.client.get('/api/armazenamento/uso/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_bytes'], 400)
+        self.assertEqual(
+            [(linha['cliente'], linha['bytes']) for linha in response.data['resultados']],
+            [(self.cliente_braskem.nome, 300), (self.cliente_petrobras.nome, 100)]
+        )
+        
+        response = self.client.get('/api/armazenamento/uso/', {'por': 'os', 'limite': 1})
+        self.assertEqual([linha['id'] for linha in response.data['resultados']], [self.os_1.pk])
+        
+        saida = io.StringIO()
+        call_command('uso_armazenamento', '--reindexar', '--por', 'os', stdout=saida)
+        self.assertIn('2 arquivo(s) indexado(s)', saida.getvalue())
+        
+        self.authenticate_user(self.basico_user)
+        self.assertEqual(self.client.get('/api/armazenamento/uso/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BackupIncrementalTestCase(BaseTestCase):
+    """Testes para o backup incremental e a restauração"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        self.media = tempfile.TemporaryDirectory()
+        self.backups = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name, BACKUP_DIR=self.backups.name)
+        self.config.enable()
+        self.create_test_data()
+        self.registro = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        self.levantamento_1 = self.criar_levantamento(b'AC1032' + b'a' * 300)
+        self.levantamento_2 = self.criar_levantamento(b'AC1032' + b'b' * 100)
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        self.backups.cleanup()
+        super().tearDown()
+    
+    def criar_levantamento(self, conteudo):
+        from django.core.files.base import ContentFile
+        return Levantamento.objects.create(
+            registro=self.registro,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Planta',
+            arquivo_anexo_levantamento=ContentFile(conteudo, name='planta.dwg'),
+        )
+    
+    def backup(self, *argumentos):
+        import io
+        from django.core.management import call_command
+        saida = io.StringIO()
+        call_command('backup_incremental', *argumentos, stdout=saida)
+        return saida.getvalue()
+    
+    def test_backup_reaproveita_arquivos_sem_alteracao(self):
+        import os
+        from .backup import listar_backups, ler_manifesto
+        
+        saida = self.backup('--manter', '0')
+        self.assertIn('2 arquivo(s), 0 sem alteração, 2 lido(s), 2 objeto(s) novo(s)', saida)
+        
+        saida = self.backup('--manter', '0')
+        self.assertIn('2 arquivo(s), 2 sem alteração, 0 lido(s), 0 objeto(s) novo(s)', saida)
+        
+        caminho = self.levantamento_1.arquivo_anexo_levantamento.path
+        with open(caminho, 'ab') as arquivo:
+            arquivo.write(b'c')
+        saida = self.backup('--manter', '0', '--sem-banco')
+        self.assertIn('2 arquivo(s), 1 sem alteração, 1 lido(s), 1 objeto(s) novo(s)', saida)
+        
+        backups = listar_backups(self.backups.name)
+        self.assertEqual(len(backups), 3)
+        nome = self.levantamento_1.arquivo_anexo_levantamento.name
+        self.assertNotEqual(
+            ler_manifesto(self.backups.name, backups[0])['media'][nome]['sha256'],
+            ler_manifesto(self.backups.name, backups[2])['media'][nome]['sha256'],
+        )
+        self.assertIsNone(ler_manifesto(self.backups.name, backups[2])['banco'])
+        
+        # Poda mantém os mais novos e remove objetos que só os antigos usavam
+        saida = self.backup('--manter', '1', '--sem-banco')
+        self.assertIn('3 backup(s) antigo(s) e 1 objeto(s) removido(s)', saida)
+        self.assertEqual(len(listar_backups(self.backups.name)), 1)
+        self.assertEqual(
+            sum(len(arquivos) for _, _, arquivos in os.walk(os.path.join(self.backups.name, 'objetos'))), 2
+        )
+    
+    def test_restaurar_banco_e_media(self):
+        import io
+        import os
+        from django.core.management import call_command
+        
+        self.backup()
+        caminhos = {
+            self.levantamento_1.arquivo_anexo_levantamento.path: b'AC1032' + b'a' * 300,
+            self.levantamento_2.arquivo_anexo_levantamento.path: b'AC1032' + b'b' * 100,
+        }
+        
+        registro_id = self.registro.pk
+        self.registro.delete()
+        for caminho in caminhos:
+            os.remove(caminho)
+        
+        saida = io.StringIO()
+        call_command('restaurar_backup', stdout=saida)
+        self.assertIn('2 arquivo(s) de mídia', saida.getvalue())
+        
+        self.assertTrue(RegistroOS.objects.filter(pk=registro_id).exists())
+        self.assertEqual(Levantamento.objects.filter(registro_id=registro_id).count(), 2)
+        for caminho, conteudo in caminhos.items():
+            with open(caminho, 'rb') as arquivo:
+                self.assertEqual(arquivo.read(), conteudo)
+    
+    def test_verificar_detecta_objeto_corrompido(self):
+        import gzip
+        import io
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .backup import caminho_objeto, listar_backups, ler_manifesto
+        
+        self.backup()
+        nome_backup = listar_backups(self.backups.name)[-1]
+        saida = io.StringIO()
+        call_command('restaurar_backup', nome_backup, '--verificar', stdout=saida)
+        self.assertIn('íntegro', saida.getvalue())
+        
+        entrada = ler_manifesto(self.backups.name, nome_backup)['media'][self.levantamento_1.arquivo_anexo_levantamento.name]
+        with gzip.open(caminho_objeto(self.backups.name, entrada['sha256']), 'wb') as objeto:
+            objeto.write(b'outro conteudo')
+        
+        with self.assertRaises(CommandError):
+            call_command('restaurar_backup', '--verificar', stdout=io.StringIO(), stderr=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('restaurar_backup', 'inexistente', stdout=io.StringIO())
+
+
+class ArquivamentoOSTestCase(BaseTestCase):
+    """Testes para o arquivamento de OS concluídas/canceladas e a leitura com include_archived"""
+    
+    def setUp(self):
+        super().setUp()
+        import tempfile
+        from datetime import timedelta
+        from django.core.files.base import ContentFile
+        from .models import StatusOS
+        self.media = tempfile.TemporaryDirectory()
+        self.config = self.settings(MEDIA_ROOT=self.media.name)
+        self.config.enable()
+        self.create_test_data()
+        
+        concluido = StatusOS.objects.create(nome='CONCLUIDO')
+        aberta = StatusOS.objects.create(nome='ABERTA')
+        antigo = timezone.now() - timedelta(days=800)
+        
+        self.os_antiga = RegistroOS.objects.create(
+            nome_cliente=self.cliente_braskem, usuario=self.admin_user, status_os=concluido, descricao_resumida='Antiga'
+        )
+        self.levantamento = Levantamento.objects.create(
+            registro=self.os_antiga,
+            data_levantamento=timezone.now(),
+            descricao_levantamento='Planta',
+            arquivo_anexo_levantamento=ContentFile(b'AC1032' + b'a' * 100, name='planta.dwg'),
+        )
+        Material.objects.create(registro=self.os_antiga)
+        self.os_recente = RegistroOS.objects.create(
+            nome_cliente=self.cliente_petrobras, usuario=self.admin_user, status_os=concluido
+        )
+        self.os_aberta = RegistroOS.objects.create(
+            nome_cliente=self.cliente_petrobras, usuario=self.admin_user, status_os=aberta
+        )
+        RegistroOS.objects.filter(pk=self.os_antiga.pk).update(created_at=antigo, updated_at=antigo)
+        RegistroOS.objects.filter(pk=self.os_aberta.pk).update(
+            created_at=antigo + timedelta(days=1), updated_at=antigo
+        )
+    
+    def tearDown(self):
+        self.config.disable()
+        self.media.cleanup()
+        super().tearDown()
+    
+    def test_arquivar_e_desarquivar(self):
+        import io
+        import os
+        from django.core.management import call_command
+        from .indice_arquivos import arquivos_orfaos, indexar_arquivos
+        from .models import ArquivoArmazenado, RegistroOSArquivado
+        
+        saida = io.StringIO()
+        call_command('arquivar_os', '--dry-run', stdout=saida)
+        self.assertIn('1 OS seriam arquivadas', saida.getvalue())
+        
+        saida = io.StringIO()
+        call_command('arquivar_os', stdout=saida)
+        self.assertIn('1 OS arquivada(s)', saida.getvalue())
+        
+        numero = self.os_antiga.numero_os
+        nome = self.levantamento.arquivo_anexo_levantamento.name
+        self.assertFalse(RegistroOS.objects.filter(pk=self.os_antiga.pk).exists())
+        self.assertFalse(Levantamento.objects.filter(pk=self.levantamento.pk).exists())
+        self.assertFalse(Material.objects.filter(registro_id=self.os_antiga.pk).exists())
+        self.assertEqual(RegistroOS.objects.count(), 2)
+        
+        arquivado = RegistroOSArquivado.objects.get(pk=self.os_antiga.pk)
+        self.assertEqual(arquivado.numero_os, numero)
+        self.assertEqual(len(arquivado.dados['levantamentos']), 1)
+        self.assertEqual(len(arquivado.dados['materiais']), 1)
+        
+        # Anexo continua no disco, protegido pelo índice mesmo após reconstruí-lo
+        self.assertTrue(os.path.exists(os.path.join(self.media.name, nome)))
+        indexar_arquivos()
+        self.assertEqual(ArquivoArmazenado.objects.get(nome=nome).arquivado, arquivado)
+        self.assertEqual(list(arquivos_orfaos(idade_minima=0)), [])
+        
+        call_command('arquivar_os', '--desarquivar', str(numero), stdout=io.StringIO())
+        self.assertFalse(RegistroOSArquivado.objects.exists())
+        registro = RegistroOS.objects.get(pk=self.os_antiga.pk)
+        self.assertEqual(registro.numero_os, numero)
+        self.assertEqual(registro.levantamentos.get().arquivo_anexo_levantamento.name, nome)
+        self.assertEqual(registro.materiais.count(), 1)
+        indice = ArquivoArmazenado.objects.get(nome=nome)
+        self.assertIsNone(indice.arquivado)
+        self.assertEqual(indice.registro, registro)
+    
+    def test_api_include_archived(self):
+        from .arquivamento import arquivar_os
+        
+        arquivar_os(self.os_antiga)
+        self.authenticate_user(self.admin_user)
+        url = '/api/ordens-servico/'
+        
+        response = self.client.get(url)
+        self.assertEqual(response.data['count'], 2)
+        
+        response = self.client.get(url, {'include_archived': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(
+            [(item['id'], item['arquivada']) for item in response.data['results']],
+            [(self.os_recente.pk, False), (self.os_aberta.pk, False), (self.os_antiga.pk, True)]
+        )
+        
+        response = self.client.get(url, {'include_archived': 'true', 'ordering': 'created_at'})
+        self.assertEqual(response.data['results'][0]['id'], self.os_antiga.pk)
+        
+        response = self.client.get(url, {'include_archived': 'true', 'nome_cliente': self.cliente_braskem.pk})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.os_antiga.pk])
+        
+        response = self.client.get(url, {'include_archived': 'true', 'tem_levantamentos': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        detalhe = f'{url}{self.os_antiga.pk}/'
+        self.assertEqual(self.client.get(detalhe).status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(detalhe, {'include_archived': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['arquivada'])
+        self.assertEqual(response.data['numero_os'], self.os_antiga.numero_os)
+        self.assertEqual(len(response.data['levantamentos']), 1)
+        
+        # Somente leitura e restrita ao dono
+        response = self.client.patch(f'{detalhe}?include_archived=true', {'descricao_resumida': 'x'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.authenticate_user(self.basico_user)
+        self.assertEqual(self.client.get(detalhe, {'include_archived': 'true'}).status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_lista_intercalada_e_estatisticas(self):
+        from .arquivamento import ListaComArquivadas, arquivar_os
+        from .models import RegistroOSArquivado
+        
+        arquivar_os(self.os_antiga)
+        lista = ListaComArquivadas(RegistroOS.objects.all(), RegistroOSArquivado.objects.all(), 'created_at')
+        self.assertEqual(lista.count(), 3)
+        self.assertEqual([item.pk for item in lista[0:2]], [self.os_antiga.pk, self.os_aberta.pk])
+        self.assertEqual([item.pk for item in lista[2:3]], [self.os_recente.pk])
+        
+        self.authenticate_user(self.admin_user)
+        response = self.client.get('/api/estatisticas/')
+        self.assertEqual((response.data['total_os'], response.data['os_concluidas']), (2, 1))
+        response = self.client.get('/api/estatisticas/', {'include_archived': 'true'})
+        self.assertEqual((response.data['total_os'], response.data['os_concluidas']), (3, 2))
+        self.assertEqual(response.data['os_por_status']['CONCLUIDO'], 2)
+
+
+class ParticionamentoTestCase(BaseTestCase):
+    """Testes para o particionamento por created_at (as consultas só rodam em PostgreSQL)"""
+    
+    def test_periodos_e_nomes(self):
+        from datetime import datetime
+        from .particionamento import nome_particao, periodos
+        
+        inicio = timezone.make_aware(datetime(2024, 11, 15))
+        fim = timezone.make_aware(datetime(2025, 2, 1))
+        self.assertEqual(
+            [nome_particao('controle_material', data, 'mes') for data in periodos(inicio, fim, 'mes')],
+            ['controle_material_p202411', 'controle_material_p202412', 'controle_material_p202501', 'controle_material_p202502']
+        )
+        self.assertEqual(
+            [nome_particao('controle_material', data, 'ano') for data in periodos(inicio, fim, 'ano')],
+            ['controle_material_p2024', 'controle_material_p2025']
+        )
+    
+    @unittest.skipIf(connection.vendor == 'postgresql', 'Somente fora do PostgreSQL')
+    def test_comando_exige_postgresql(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        
+        with self.assertRaises(CommandError):
+            call_command('particoes')
+    
+    def test_conversao_exige_confirmacao(self):
+        """Converter/reverter recriam tabelas: só com --confirmar (migrate não converte)"""
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        
+        for opcoes in ({'converter': 'ano'}, {'reverter': True}):
+            with self.assertRaisesMessage(CommandError, '--confirmar'):
+                call_command('particoes', **opcoes)
+    
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Particionamento requer PostgreSQL')
+    def test_consulta_com_intervalo_poda_particoes(self):
+        from datetime import datetime
+        from .particionamento import desparticionar, listar_particoes, particionar
+        
+        self.create_test_data()
+        registro = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        antigo = Material.objects.create(registro=registro)
+        Material.objects.create(registro=registro)
+        Material.objects.filter(pk=antigo.pk).update(created_at=timezone.make_aware(datetime(2023, 6, 1)))
+        
+        self.assertTrue(particionar(connection, 'controle_material', 'ano', antecedencia=1))
+        with connection.cursor() as cursor:
+            nomes = [nome for nome, _, _ in listar_particoes(cursor, 'controle_material')]
+        self.assertIn('controle_material_p2023', nomes)
+        self.assertIn('controle_material_padrao', nomes)
+        
+        plano = Material.objects.filter(
+            created_at__gte=timezone.make_aware(datetime(2023, 1, 1)),
+            created_at__lt=timezone.make_aware(datetime(2024, 1, 1)),
+        ).explain()
+        self.assertIn('controle_material_p2023', plano)
+        for nome in nomes:
+            if nome != 'controle_material_p2023':
+                self.assertNotIn(nome, plano)
+        
+        # Dados, ORM e sequência continuam funcionando
+        self.assertEqual(Material.objects.filter(registro=registro).count(), 2)
+        novo = Material.objects.create(registro=registro)
+        self.assertGreater(novo.pk, antigo.pk)
+        self.assertTrue(desparticionar(connection, 'controle_material'))
+        self.assertEqual(Material.objects.filter(registro=registro).count(), 3)
+
+
+class InstrumentacaoTestCase(BaseTestCase):
+    """Testes do middleware de instrumentação (consultas, tempos e orçamentos por rota)"""
+    
+    def setUp(self):
+        super().setUp()
+        from .instrumentacao import zerar_rotas
+        
+        self.create_test_data()
+        zerar_rotas()
+        self.addCleanup(zerar_rotas)
+        self.authenticate_user(self.admin_user)
+    
+    def criar_os(self, quantidade):
+        for i in range(quantidade):
+            RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+    
+    def test_server_timing_em_desenvolvimento(self):
+        from django.test import override_settings
+        
+        self.criar_os(3)
+        with override_settings(INSTRUMENTACAO_SERVER_TIMING=True):
+            response = self.client.get('/api/ordens-servico/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('ser;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        
+        with override_settings(INSTRUMENTACAO_SERVER_TIMING=False):
+            response = self.client.get('/api/perfil/')
+        self.assertNotIn('Server-Timing', response)
+    
+    def test_histograma_por_rota(self):
+        from .instrumentacao import resumo_rotas
+        
+        self.criar_os(2)
+        for _ in range(3):
+            self.client.get('/api/ordens-servico/')
+        self.client.get('/api/perfil/')
+        
+        rotas = resumo_rotas()
+        self.assertEqual(rotas['GET registroos-list']['requisicoes'], 3)
+        self.assertEqual(rotas['GET registroos-list']['tempo_ms']['faixas']['+Inf'], 3)
+        self.assertGreater(rotas['GET registroos-list']['consultas']['soma'], 0)
+        self.assertGreater(rotas['GET registroos-list']['bytes'], 0)
+        self.assertEqual(rotas['GET perfil']['requisicoes'], 1)
+    
+    def test_orcamento_excedido(self):
+        from django.test import override_settings
+        from .instrumentacao import OrcamentoConsultasExcedido, resumo_rotas
+        
+        self.criar_os(2)
+        orcamentos = {'GET registroos-list': 1}
+        with override_settings(INSTRUMENTACAO_ORCAMENTOS=orcamentos, INSTRUMENTACAO_ORCAMENTO_ACAO='erro'):
+            with self.assertRaises(OrcamentoConsultasExcedido):
+                self.client.get('/api/ordens-servico/')
+        
+        cache.clear()
+        with override_settings(INSTRUMENTACAO_ORCAMENTOS=orcamentos, INSTRUMENTACAO_ORCAMENTO_ACAO='log'):
+            with self.assertLogs('controle.instrumentacao', level='WARNING') as logs:
+                response = self.client.get('/api/ordens-servico/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('orçamento 1', logs.output[0])
+        self.assertEqual(resumo_rotas()['GET registroos-list']['orcamento_excedido'], 2)
+    
+    def test_consultas_repetidas(self):
+        from .instrumentacao import Medicao, assinatura
+        
+        self.assertEqual(
+            assinatura('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            assinatura('SELECT *  FROM t WHERE id IN (%s,%s)'),
+        )
+        medicao = Medicao()
+        with connection.execute_wrapper(medicao.registrar_consulta):
+            for cliente in Cliente.objects.all():
+                list(RegistroOS.objects.filter(nome_cliente=cliente))
+        self.assertEqual(medicao.consultas, 3)
+        self.assertEqual(len(medicao.repetidas()), 1)
+        self.assertEqual(medicao.repetidas()[0][1], 2)
+    
+    def test_listagem_de_usuarios_sem_n_mais_1(self):
+        from .instrumentacao import resumo_rotas
+        
+        for i in range(5):
+            usuario = User.objects.create_user(username=f'instrumentado{i}', password='senha123')
+            usuario.groups.add(self.tecnico_group)
+        
+        response = self.client.get('/api/auth/configuracoes/usuarios/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get('/api/auth/usuarios/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rotas = resumo_rotas()
+        self.assertLessEqual(rotas['GET authentication:configuracoes_listar_usuarios']['consultas']['soma'], 5)
+        self.assertLessEqual(rotas['GET authentication:listar_usuarios']['consultas']['soma'], 5)
+    
+    def test_resumo_somente_administrador(self):
+        self.client.get('/api/perfil/')
+        response = self.client.get('/api/instrumentacao/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('GET perfil', response.data['rotas'])
+        
+        self.authenticate_user(self.tecnico_user)
+        response = self.client.get('/api/instrumentacao/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class BenchmarkTestCase(BaseTestCase):
+    """Testes da base sintética e dos cenários de benchmark"""
+    
+    def setUp(self):
+        super().setUp()
+        from datetime import datetime
+        self.referencia = timezone.make_aware(datetime(2025, 3, 1))
+    
+    def assinatura_base(self):
+        from .benchmark.dados import modelos_filhos
+        
+        registros = RegistroOS.objects.filter(nome_cliente__nome__startswith='BENCH ').order_by('numero_os')
+        return [
+            (
+                registro.numero_os, registro.nome_cliente.nome, registro.status_os.nome, registro.created_at,
+                registro.valor_total, str(registro.os_id),
+                [modelo.objects.filter(registro=registro).count() for modelo in modelos_filhos()],
+            )
+            for registro in registros
+        ]
+    
+    def test_geracao_reproduzivel(self):
+        from .benchmark.dados import gerar_dados, limpar_dados, modelos_filhos
+        
+        criados = gerar_dados(12, clientes=2, filhos=1, semente=7, tamanho_lote=5, referencia=self.referencia)
+        self.assertEqual(criados['registros_os'], 12)
+        self.assertEqual(len(modelos_filhos()), 17)
+        for modelo in modelos_filhos():
+            self.assertEqual(
+                modelo.objects.count(), criados['filhos'][modelo._meta.model_name], modelo.__name__
+            )
+            self.assertGreater(modelo.objects.count(), 0, modelo.__name__)
+        
+        registro = RegistroOS.objects.filter(nome_cliente__nome__startswith='BENCH ').first()
+        self.assertEqual(registro.numero_contrato.cliente_id, registro.nome_cliente_id)
+        self.assertEqual(registro.setor_unidade_cliente.unidade_id, registro.unidade_cliente_id)
+        self.assertLessEqual(registro.created_at, self.referencia)
+        # Totais gravados seguem a mesma regra do save()
+        self.assertEqual(RegistroOS.diferencas_totais(), [])
+        
+        primeira = self.assinatura_base()
+        self.assertEqual(limpar_dados(), 12)
+        self.assertEqual(Material.objects.count(), 0)
+        gerar_dados(12, clientes=2, filhos=1, semente=7, tamanho_lote=5, referencia=self.referencia)
+        self.assertEqual(self.assinatura_base(), primeira)
+    
+    def test_cenarios_e_comparacao(self):
+        import copy
+        from .benchmark.cenarios import CENARIOS, comparar, executar
+        from .benchmark.dados import gerar_dados
+        
+        # Período curto: a exportação (últimos 7 dias) encontra OS
+        gerar_dados(15, clientes=2, filhos=1, anos=0.01, semente=3)
+        total = RegistroOS.objects.count()
+        resultado = executar(iteracoes=2, aquecimento=0, semente=3)
+        
+        json.dumps(resultado)
+        self.assertEqual(set(resultado['cenarios']), {cenario.nome for cenario in CENARIOS})
+        for nome, resumo in resultado['cenarios'].items():
+            self.assertEqual(resumo['erros'], 0, f'{nome}: {resumo["status"]}')
+            self.assertGreater(resumo['consultas'], 0, nome)
+            self.assertLessEqual(resumo['min_ms'], resumo['mediana_ms'])
+        # Cenários que alteram dados são desfeitos
+        self.assertEqual(RegistroOS.objects.count(), total)
+        
+        self.assertEqual(comparar(resultado, resultado), [])
+        base = copy.deepcopy(resultado)
+        base['cenarios']['detalhe']['consultas'] -= 1
+        base['cenarios']['listagem']['mediana_ms'] = resultado['cenarios']['listagem']['mediana_ms'] / 10 - 5
+        regressoes = comparar(resultado, base)
+        self.assertEqual(len(regressoes), 2)
+        self.assertTrue(any(regressao.startswith('detalhe: consultas') for regressao in regressoes))
+        self.assertTrue(any(regressao.startswith('listagem: mediana') for regressao in regressoes))
+    
+    def test_comando_falha_com_regressao(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from .benchmark.dados import gerar_dados
+        
+        gerar_dados(5, clientes=1, filhos=1, semente=5)
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = os.path.join(pasta, 'base.json')
+            call_command('benchmark', '--cenarios', 'detalhe', '--iteracoes', '1', '--saida', saida, stdout=StringIO())
+            with open(saida, encoding='utf-8') as arquivo:
+                base = json.load(arquivo)
+            self.assertIn('detalhe', base['cenarios'])
+            
+            base['cenarios']['detalhe']['consultas'] = 1
+            with open(saida, 'w', encoding='utf-8') as arquivo:
+                json.dump(base, arquivo)
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark', '--cenarios', 'detalhe', '--iteracoes', '1', '--comparar', saida,
+                    '--saida', os.path.join(pasta, 'atual.json'), stdout=StringIO()
+                )
+        
+        with self.assertRaises(CommandError):
+            call_command('gerar_dados_benchmark', '--os', '1', stdout=StringIO())
+
+
+class ConsultasPorRotaTestCase(BaseTestCase):
+    """A quantidade de consultas de cada rota GET não cresce com os dados nem passa da baseline"""
+    
+    def setUp(self):
+        super().setUp()
+        from .benchmark.dados import gerar_dados
+        
+        from .models import AuditoriaOS
+        
+        gerar_dados(10, clientes=2, filhos=1, semente=11)
+        # gerar_dados usa bulk_create, que não passa pela auditoria
+        AuditoriaOS.objects.create(
+            os_id=RegistroOS.objects.order_by('pk').first().pk, modelo='registroos', acao=AuditoriaOS.ALTERADO,
+            usuario=self.admin_user
+        )
+        self.anexar_arquivo()
+        self.authenticate_user(self.admin_user)
+        self.client.raise_request_exception = False
+    
+    def anexar_arquivo(self):
+        """Arquivo real no levantamento usado por download_anexo (gerar_dados não grava anexos)"""
+        import tempfile
+        from django.core.files.base import ContentFile
+        
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        config = self.settings(MEDIA_ROOT=media.name)
+        config.enable()
+        self.addCleanup(config.disable)
+        levantamento = Levantamento.objects.order_by('pk').first()
+        levantamento.arquivo_anexo_levantamento.save('planta.pdf', ContentFile(b'%PDF-1.4 planta'))
+    
+    def parametros(self):
+        from .models import UploadSessao
+        
+        registro = RegistroOS.objects.order_by('pk').first()
+        sessao, _ = UploadSessao.objects.get_or_create(
+            usuario=self.admin_user, nome_arquivo='planta.pdf', defaults={'tamanho_total': 10}
+        )
+        return {
+            'registroos-detail': {'pk': registro.pk},
+            'registroos-anexos-zip': {'pk': registro.pk},
+            'registroos-historico': {'pk': registro.pk},
+            'dados_cliente': {'cliente_nome': registro.nome_cliente.nome},
+            'download_anexo': {'tipo': 'levantamentos', 'pk': Levantamento.objects.order_by('pk').first().pk},
+            'upload_sessao_detalhe': {'token': sessao.token},
+        }
+    
+    def test_consultas_por_rota(self):
+        import os
+        from .benchmark.dados import gerar_dados
+        from .consultas_por_rota import comparar_baseline, gravar_baseline, ler_baseline, medir_rotas
+        
+        pequena, sem_parametros = medir_rotas(self.client, self.parametros())
+        self.assertEqual(sem_parametros, [], 'Informe os parâmetros dessas rotas em parametros()')
+        self.assertGreater(len(pequena), 40)
+        
+        gerar_dados(90, clientes=4, filhos=1, semente=12)
+        self.assertEqual(RegistroOS.objects.count(), 100)
+        grande, _ = medir_rotas(self.client, self.parametros())
+        
+        erros = {nome: medicao['status'] for nome, medicao in grande.items() if medicao['status'] >= 500}
+        self.assertEqual(erros, {})
+        # O download mede o caminho completo (arquivo servido), não o 404
+        self.assertEqual(grande['download_anexo']['status'], 200)
+        crescimento = {
+            nome: (pequena[nome]['consultas'], medicao['consultas'])
+            for nome, medicao in grande.items() if medicao['consultas'] > pequena[nome]['consultas']
+        }
+        self.assertEqual(crescimento, {}, 'Consultas crescem com o número de linhas (N+1)')
+        
+        if os.environ.get('ATUALIZAR_BASELINE_CONSULTAS'):
+            gravar_baseline(grande)
+        self.assertEqual(comparar_baseline(grande, ler_baseline()), [])
+
+
+class ConsultasLentasTestCase(BaseTestCase):
+    """Log de consultas lentas (execute_wrapper) e o comando consultas_lentas"""
+    
+    def setUp(self):
+        super().setUp()
+        from . import consultas_lentas
+        
+        self.create_test_data()
+        self.authenticate_user(self.admin_user)
+        cache.clear()
+        consultas_lentas._explicadas.clear()
+    
+    def registros(self, logs):
+        return [json.loads(mensagem.split(':', 2)[2]) for mensagem in logs.output]
+    
+    def test_registra_consultas_acima_do_limite_com_plano(self):
+        with self.settings(CONSULTAS_LENTAS_LIMITE_MS=0, CONSULTAS_LENTAS_AMOSTRAGEM=1.0):
+            with self.assertLogs('controle.consultas_lentas', 'INFO') as logs:
+                response = self.client.get(f'{self.os_list_url}?numero_os=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        registros = self.registros(logs)
+        listagem = [r for r in registros if 'controle_registroos' in r['sql'] and r['rota'] == 'GET registroos-list']
+        self.assertTrue(listagem)
+        self.assertEqual(len(listagem[0]['impressao']), 16)
+        self.assertNotIn("'1'", listagem[0]['sql'])
+        self.assertIsInstance(listagem[0]['parametros'], list)
+        # Plano só na primeira ocorrência de cada impressão
+        self.assertTrue(any(r.get('plano') for r in registros))
+        impressoes = [r['impressao'] for r in registros if 'plano' in r]
+        self.assertEqual(len(impressoes), len(set(impressoes)))
+    
+    def test_ignora_consultas_rapidas_e_amostragem_zero(self):
+        with self.settings(CONSULTAS_LENTAS_LIMITE_MS=60000):
+            with self.assertNoLogs('controle.consultas_lentas', 'INFO'):
+                self.client.get(self.os_list_url)
+        with self.settings(CONSULTAS_LENTAS_LIMITE_MS=0, CONSULTAS_LENTAS_AMOSTRAGEM=0):
+            with self.assertNoLogs('controle.consultas_lentas', 'INFO'):
+                self.client.get(self.os_list_url)
+    
+    def test_explain_com_erro_nao_quebra_a_transacao(self):
+        from .consultas_lentas import explicar
+        
+        total = Cliente.objects.count()
+        with transaction.atomic():
+            self.assertIsNone(explicar(connection, 'SELECT * FROM tabela_que_nao_existe', None))
+            plano = explicar(connection, 'SELECT id FROM controle_cliente WHERE id = %s', [1])
+            self.assertTrue(plano)
+            self.assertEqual(Cliente.objects.count(), total)
+    
+    def test_formato_parametros_nao_expoe_valores(self):
+        from .consultas_lentas import formato_parametros
+        
+        self.assertEqual(formato_parametros(('segredo', 10, None)), ['str', 'int', 'NoneType'])
+        self.assertEqual(formato_parametros([(1, 'a'), (2, 'b')], many=True), {'linhas': 2, 'formato': ['int', 'str']})
+        self.assertIsNone(formato_parametros(None))
+    
+    def test_comando_resume_piores_consultas(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        
+        linhas = [
+            {'em': '2024-05-01T10:00:00', 'impressao': 'a', 'ms': 300.0, 'rota': 'GET registroos-list', 'sql': 'SELECT A'},
+            {'em': '2024-05-02T10:00:00', 'impressao': 'a', 'ms': 500.0, 'rota': 'GET estatisticas', 'sql': 'SELECT A',
+             'plano': ['SCAN controle_registroos']},
+            {'em': '2024-05-02T11:00:00', 'impressao': 'b', 'ms': 900.0, 'rota': 'GET registroos-list', 'sql': 'SELECT B'},
+        ]
+        with tempfile.TemporaryDirectory() as diretorio:
+            arquivo = os.path.join(diretorio, 'consultas_lentas.log')
+            with open(f'{arquivo}.1', 'w', encoding='utf-8') as saida:
+                saida.write(json.dumps(linhas[0]) + '\n')
+            with open(arquivo, 'w', encoding='utf-8') as saida:
+                saida.write('\n'.join(json.dumps(linha) for linha in linhas[1:]) + '\nlinha quebrada\n')
+            
+            saida = StringIO()
+            call_command('consultas_lentas', arquivo=arquivo, json=True, stdout=saida)
+            grupos = json.loads(saida.getvalue())
+            self.assertEqual([g['impressao'] for g in grupos], ['b', 'a'])
+            self.assertEqual(grupos[1]['quantidade'], 2)
+            self.assertEqual(grupos[1]['max_ms'], 500.0)
+            self.assertEqual(grupos[1]['plano'], ['SCAN controle_registroos'])
+            
+            saida = StringIO()
+            call_command('consultas_lentas', arquivo=arquivo, ordenar='quantidade', top=1, planos=True, stdout=saida)
+            self.assertIn('SELECT A', saida.getvalue())
+            self.assertIn('| SCAN controle_registroos', saida.getvalue())
+            self.assertNotIn('SELECT B', saida.getvalue())
+            
+            saida = StringIO()
+            call_command('consultas_lentas', arquivo=arquivo, desde='2024-05-02', rota='estatisticas', json=True, stdout=saida)
+            grupos = json.loads(saida.getvalue())
+            self.assertEqual([(g['impressao'], g['quantidade']) for g in grupos], [('a', 1)])
+
+
+@override_settings(METRICAS_TOKEN='segredo')
+class MetricasTestCase(BaseTestCase):
+    """/health, /ready e /metrics (Prometheus), com agregação entre workers"""
+    
+    def setUp(self):
+        super().setUp()
+        from . import metricas
+        from .instrumentacao import zerar_rotas
+        
+        zerar_rotas()
+        metricas.zerar()
+        cache.clear()
+        self.create_test_data()
+    
+    def metricas(self):
+        # Client simples: as credenciais JWT do APIClient sobrescreveriam o Authorization do scrape
+        response = Client().get('/metrics', HTTP_AUTHORIZATION='Bearer segredo')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+    
+    def test_health_e_ready(self):
+        for caminho in ('/health', '/health/'):
+            response = self.client.get(caminho)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), {'status': 'ok'})
+        
+        response = self.client.get('/ready')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['verificacoes'], {'banco': 'ok', 'cache': 'ok'})
+        
+        with patch('controle.views.cache.set', side_effect=ConnectionError('redis fora')):
+            response = self.client.get('/ready/')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.json()['verificacoes'], {'banco': 'ok', 'cache': 'erro'})
+    
+    @override_settings(DEBUG=False, MIDDLEWARE=MIDDLEWARE_PRODUCAO)
+    def test_metricas_de_requisicao_cache_e_webhook(self):
+        from . import webhooks
+        
+        self.authenticate_user(self.admin_user)
+        self.client.get(self.os_list_url)
+        self.client.get(self.os_list_url)
+        webhooks.webhook_teste('os_aprovada')
+        
+        texto = self.metricas()
+        self.assertIn('# TYPE controle_requisicao_duracao_segundos histogram', texto)
+        self.assertIn('controle_requisicao_duracao_segundos_bucket{rota="GET registroos-list",le="0.005"}', texto)
+        self.assertIn('controle_requisicao_duracao_segundos_count{rota="GET registroos-list"} 2', texto)
+        self.assertIn('controle_requisicao_consultas_bucket{rota="GET registroos-list",le="+Inf"} 2', texto)
+        self.assertIn('controle_cache_consultas_total{familia="pagina_cabecalho",resultado="miss"}', texto)
+        self.assertIn('controle_cache_consultas_total{familia="pagina",resultado="hit"} 1', texto)
+        self.assertIn('controle_webhooks_total{evento="teste",resultado="ok"} 1', texto)
+        self.assertIn('controle_webhook_duracao_segundos_count{evento="teste"} 1', texto)
+        self.assertIn('controle_metricas_processos 1', texto)
+    
+    def test_duracao_das_exportacoes(self):
+        from .benchmark.dados import gerar_dados
+        
+        gerar_dados(3, clientes=1, filhos=1, semente=3)
+        self.authenticate_user(self.admin_user)
+        response = self.client.get('/api/auth/relatorios/exportar-excel/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.assertIn('controle_exportacao_duracao_segundos_count{tipo="excel"} 1', self.metricas())
+    
+    def test_token_de_metricas(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer errado')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.metricas()
+    
+    def test_sem_token_metricas_fechadas(self):
+        with self.settings(METRICAS_TOKEN=''):
+            for autorizacao in ('', 'Bearer '):
+                response = self.client.get('/metrics', HTTP_AUTHORIZATION=autorizacao)
+                self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_agrega_retratos_dos_workers(self):
+        import os
+        import tempfile
+        from . import metricas
+        
+        metricas.incrementar('controle_webhooks_total', evento='teste', resultado='ok')
+        vivo = {'rotas': {}, 'contadores': [['controle_webhooks_total', {'evento': 'teste', 'resultado': 'ok'}, 2]],
+                'histogramas': []}
+        encerrado = {'rotas': {}, 'contadores': [['controle_webhooks_total', {'evento': 'teste', 'resultado': 'ok'}, 4]],
+                     'histogramas': []}
+        with tempfile.TemporaryDirectory() as diretorio, self.settings(METRICAS_DIRETORIO=diretorio):
+            # Worker vivo (o processo pai) e um que já saiu (pid inexistente)
+            with open(os.path.join(diretorio, f'{os.getppid()}-1.json'), 'w') as saida:
+                json.dump(vivo, saida)
+            with open(os.path.join(diretorio, '999999999-1.json'), 'w') as saida:
+                json.dump(encerrado, saida)
+            
+            texto = self.metricas()
+            self.assertIn('controle_webhooks_total{evento="teste",resultado="ok"} 7', texto)
+            self.assertIn('controle_metricas_processos 2', texto)
+            # O retrato deste processo é gravado no fim da requisição
+            self.assertEqual(
+                sorted(nome for nome in os.listdir(diretorio) if nome.endswith('.json')),
+                sorted([f'{os.getppid()}-1.json', f'{metricas._identificador()}.json', metricas.ENCERRADOS])
+            )
+            
+            # ... e não é somado em dobro com o estado em memória
+            metricas.gravar_estado(forcar=True)
+            texto = self.metricas()
+            self.assertIn('controle_webhooks_total{evento="teste",resultado="ok"} 7', texto)
+            self.assertIn('controle_metricas_processos 2', texto)
+
+
+class LogsAssincronosTestCase(BaseTestCase):
+    """Logging em fila (QueueHandler/QueueListener), JSON e amostragem"""
+    
+    def setUp(self):
+        super().setUp()
+        from io import StringIO
+        
+        self.saida = StringIO()
+        self.handler = logging.StreamHandler(self.saida)
+        self.logger = logging.getLogger('controle.tests.logs_assincronos')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.addCleanup(self.limpar_logger)
+    
+    def limpar_logger(self):
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        self.logger.filters.clear()
+    
+    def test_arquivos_com_rotacao_externa(self):
+        """Workers no mesmo arquivo: a rotação (rename externo) não perde registros de nenhum deles"""
+        import os
+        import tempfile
+        from logging.handlers import WatchedFileHandler
+        
+        for nome in ('file', 'os_file', 'webhook_file', 'consultas_lentas_file'):
+            self.assertEqual(settings.LOGGING['handlers'][nome]['class'], 'logging.handlers.WatchedFileHandler')
+        
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, 'os_operations.log')
+            workers = [WatchedFileHandler(caminho) for _ in range(2)]
+            registros = [logging.makeLogRecord({'msg': f'r{indice}'}) for indice in range(4)]
+            workers[0].emit(registros[0])
+            workers[1].emit(registros[1])
+            os.rename(caminho, f'{caminho}.1')  # logrotate
+            workers[1].emit(registros[2])
+            workers[0].emit(registros[3])
+            for worker in workers:
+                worker.close()
+            
+            with open(f'{caminho}.1', encoding='utf-8') as arquivo:
+                self.assertEqual(arquivo.read().split(), ['r0', 'r1'])
+            with open(caminho, encoding='utf-8') as arquivo:
+                self.assertEqual(arquivo.read().split(), ['r2', 'r3'])
+    
+    def test_settings_colocam_os_loggers_atras_de_filas(self):
+        from .logs import FilaHandler
+        
+        for nome in ('controle', 'controle.views', 'controle.webhooks', 'django'):
+            handlers = logging.getLogger(nome).handlers
+            self.assertEqual(len(handlers), 1)
+            self.assertIsInstance(handlers[0], FilaHandler)
+    
+    def test_fila_grava_em_json_na_thread_do_listener(self):
+        from .logs import FormatadorJSON, _listeners, instalar_filas
+        
+        self.handler.setFormatter(FormatadorJSON())
+        self.logger.addHandler(self.handler)
+        listeners = instalar_filas([self.logger.name], tamanho=100)
+        self.assertEqual(len(listeners), 1)
+        
+        dados = {'pk': 1}
+        self.logger.info('OS %s criada', dados, extra={'os_id': 7, 'usuario': 'admin'})
+        dados['pk'] = 2  # A mensagem já foi montada ao enfileirar
+        try:
+            raise ValueError('falhou')
+        except ValueError:
+            self.logger.exception('Erro na OS %s', 7)
+        _listeners.remove(listeners[0])
+        listeners[0].stop()
+        
+        linhas = [json.loads(linha) for linha in self.saida.getvalue().splitlines()]
+        self.assertEqual(linhas[0]['mensagem'], "OS {'pk': 1} criada")
+        self.assertEqual(linhas[0]['nivel'], 'INFO')
+        self.assertEqual((linhas[0]['os_id'], linhas[0]['usuario']), (7, 'admin'))
+        self.assertEqual(linhas[0]['logger'], self.logger.name)
+        self.assertIn('ValueError: falhou', linhas[1]['excecao'])
+    
+    def test_fila_cheia_descarta_sem_bloquear(self):
+        import queue
+        from .logs import FilaHandler, descartados
+        
+        antes = descartados()
+        self.logger.addHandler(FilaHandler(queue.Queue(1)))
+        self.logger.info('primeiro')
+        self.logger.info('segundo')
+        self.assertEqual(descartados(), antes + 1)
+    
+    def test_amostragem_so_afeta_info(self):
+        from .logs import FiltroAmostragem
+        
+        self.logger.addHandler(self.handler)
+        self.logger.addFilter(FiltroAmostragem(taxa=0))
+        self.logger.info('descartado')
+        self.logger.warning('mantido')
+        self.assertEqual(self.saida.getvalue(), 'mantido\n')
+    
+    def test_log_os_operation_nao_consulta_grupos(self):
+        from .views import log_os_operation
+        
+        with self.assertNumQueries(0), self.assertLogs('controle.views', 'INFO') as logs:
+            log_os_operation('CRIADA', self.admin_user, Mock(id=5), {'materiais': 2})
+        self.assertEqual(logs.records[0].os_id, 5)
+        self.assertEqual(logs.records[0].operacao, 'CRIADA')
+        self.assertIn("OS CRIADA - ID: 5, Usuário: admin", logs.output[0])
+
+
+class AuditoriaTestCase(BaseTestCase):
+    """Trilha de auditoria: diferenças por campo gravadas no commit e o histórico na API"""
+    
+    def setUp(self):
+        super().setUp()
+        self.create_test_data()
+        self.aberta = StatusOS.objects.create(nome='ABERTA')
+        self.aprovada = StatusOS.objects.create(nome='APROVADA')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.registro = RegistroOS.objects.create(
+                nome_cliente=self.cliente_braskem, usuario=self.admin_user,
+                status_os=self.aberta, descricao_resumida='Original'
+            )
+    
+    def test_diferencas_por_campo(self):
+        from .models import AuditoriaOS
+        
+        criacao = AuditoriaOS.objects.get(os_id=self.registro.pk, acao=AuditoriaOS.CRIADO)
+        self.assertEqual(criacao.modelo, 'registroos')
+        self.assertEqual(criacao.alteracoes['descricao_resumida'], [None, 'Original'])
+        
+        registro = RegistroOS.objects.get(pk=self.registro.pk)
+        registro.descricao_resumida = 'Alterada'
+        registro.status_os = self.aprovada
+        with self.captureOnCommitCallbacks(execute=True):
+            registro.save()
+            registro.save()  # Sem mudanças: nenhuma entrada nova
+        
+        alteracao = AuditoriaOS.objects.get(os_id=self.registro.pk, acao=AuditoriaOS.ALTERADO)
+        self.assertEqual(alteracao.alteracoes['descricao_resumida'], ['Original', 'Alterada'])
+        self.assertEqual(alteracao.alteracoes['status_os'], [self.aberta.pk, self.aprovada.pk])
+        self.assertNotIn('updated_at', alteracao.alteracoes)
+        self.assertNotIn('nome_cliente', alteracao.alteracoes)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Levantamento.objects.create(registro=registro, data_levantamento=timezone.now(), descricao_levantamento='Planta')
+            registro.delete()
+        acoes = set(AuditoriaOS.objects.filter(os_id=self.registro.pk).values_list('modelo', 'acao'))
+        self.assertIn(('levantamento', AuditoriaOS.CRIADO), acoes)
+        self.assertIn(('registroos', AuditoriaOS.EXCLUIDO), acoes)
+        # Filhos apagados em cascata não geram entradas próprias
+        self.assertNotIn(('levantamento', AuditoriaOS.EXCLUIDO), acoes)
+    
+    def test_lote_gravado_no_commit_com_um_insert(self):
+        from django.test.utils import CaptureQueriesContext
+        from .auditoria import em_lote
+        from .models import AuditoriaOS
+        
+        antes = AuditoriaOS.objects.count()
+        with self.captureOnCommitCallbacks() as callbacks:
+            with em_lote():
+                for indice in range(3):
+                    Levantamento.objects.create(
+                        registro=self.registro, data_levantamento=timezone.now(), descricao_levantamento=f'L{indice}'
+                    )
+                try:
+                    with transaction.atomic():
+                        Material.objects.create(registro=self.registro)
+                        raise ValueError
+                except ValueError:
+                    pass
+                Material.objects.create(registro=self.registro)
+            self.assertEqual(AuditoriaOS.objects.count(), antes)
+        
+        with CaptureQueriesContext(connection) as consultas:
+            for callback in callbacks:
+                callback()
+        insercoes = [consulta for consulta in consultas.captured_queries if 'INSERT' in consulta['sql']]
+        self.assertEqual(len(insercoes), 1)
+        # O Material do savepoint desfeito fica de fora
+        self.assertEqual(AuditoriaOS.objects.count(), antes + 4)
+        self.assertEqual(AuditoriaOS.objects.filter(modelo='material').count(), 1)
+    
+    def test_carregar_nao_guarda_valores(self):
+        """Os valores anteriores são lidos só no save: carregar OS não passa pela auditoria"""
+        from django.db.models.signals import post_init
+        
+        self.assertFalse(post_init.has_listeners(RegistroOS))
+        registro = RegistroOS.objects.get(pk=self.registro.pk)
+        self.assertNotIn('_auditoria_original', registro.__dict__)
+        # Uma consulta para os valores anteriores e uma para o UPDATE
+        registro.descricao_resumida = 'Alterada'
+        with self.assertNumQueries(2):
+            registro.save(update_fields=['descricao_resumida'])
+    
+    def test_rollback_descarta_o_buffer(self):
+        from .models import AuditoriaOS
+        
+        antes = AuditoriaOS.objects.count()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Levantamento.objects.create(
+                        registro=self.registro, data_levantamento=timezone.now(), descricao_levantamento='Desfeito'
+                    )
+                    raise ValueError
+            except ValueError:
+                pass
+            with transaction.atomic():
+                Material.objects.create(registro=self.registro)
+        
+        self.assertEqual(AuditoriaOS.objects.count(), antes + 1)
+        self.assertFalse(AuditoriaOS.objects.filter(modelo='levantamento').exists())
+        self.assertTrue(AuditoriaOS.objects.filter(modelo='material').exists())
+    
+    def test_historico_por_os_e_por_usuario(self):
+        from .models import AuditoriaOS
+        
+        self.authenticate_user(self.admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'{self.os_list_url}{self.registro.pk}/', {'descricao_resumida': 'Pela API'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        alteracao = AuditoriaOS.objects.get(os_id=self.registro.pk, acao=AuditoriaOS.ALTERADO, modelo='registroos')
+        self.assertEqual(alteracao.usuario, self.admin_user)
+        
+        response = self.client.get(f'{self.os_list_url}{self.registro.pk}/historico/', {'acao': 'alterado'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        entrada = response.data['results'][0]
+        self.assertEqual(entrada['usuario_nome'], 'admin_test')
+        self.assertEqual(entrada['alteracoes']['descricao_resumida'], ['Original', 'Pela API'])
+        
+        response = self.client.get('/api/auditoria/', {'usuario': self.admin_user.pk, 'os': self.registro.pk})
+        self.assertEqual(response.data['count'], 1)
+        response = self.client.get('/api/auditoria/', {'desde': 'amanhã'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        # Os demais usuários só veem as próprias alterações e o histórico das próprias OS
+        self.authenticate_user(self.tecnico_user)
+        self.assertEqual(self.client.get('/api/auditoria/').data['count'], 0)
+        response = self.client.get(f'{self.os_list_url}{self.registro.pk}/historico/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_status_anterior_sem_consultar_historico(self):
+        from . import webhooks
+        from .auditoria import status_anterior
+        
+        registro = RegistroOS.objects.get(pk=self.registro.pk)
+        self.assertEqual(status_anterior(registro), 'ABERTA')
+        registro.status_os = self.aprovada
+        registro.save()
+        registro.descricao_resumida = 'Depois da aprovação'
+        registro.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(status_anterior(registro), 'ABERTA')
+        with patch('builtins.print'):
+            self.assertEqual(webhooks.webhook_os_aprovada(registro)['status_anterior'], 'ABERTA')
+    
+    def test_arquivamento_e_um_unico_evento(self):
+        from .arquivamento import arquivar_os, desarquivar_os
+        from .models import AuditoriaOS
+        
+        Material.objects.create(registro=self.registro)
+        with self.captureOnCommitCallbacks(execute=True):
+            arquivado = arquivar_os(self.registro)
+        with self.captureOnCommitCallbacks(execute=True):
+            desarquivar_os(arquivado)
+        
+        acoes = list(
+            AuditoriaOS.objects.filter(os_id=self.registro.pk).exclude(acao=AuditoriaOS.CRIADO)
+            .order_by('pk').values_list('acao', flat=True)
+        )
+        self.assertEqual(acoes, [AuditoriaOS.ARQUIVADO, AuditoriaOS.DESARQUIVADO])
+
+
+class ServidorUmaThread(LiveServerThread):
+    """Servidor de teste sem uma thread por requisição: o SQLite em memória é uma conexão só"""
+    
+    def _create_server(self, connections_override=None):
+        return WSGIServer((self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address=False)
+
+
+class DistribuicaoCargaTestCase(unittest.TestCase):
+    """Divisão dos usuários virtuais do teste de carga entre os grupos"""
+    
+    def test_distribuicao_dos_usuarios_por_grupo(self):
+        from .benchmark.carga import MIX_GRUPOS, distribuir
+        
+        self.assertEqual(
+            distribuir(10, MIX_GRUPOS), {'Administrador': 1, 'Superior': 1, 'Qualidade': 1, 'Tecnico': 4, 'Básico': 3}
+        )
+        self.assertEqual(sum(distribuir(7, MIX_GRUPOS).values()), 7)
+        self.assertEqual(distribuir(3, {'Tecnico': 1, 'Básico': 0}), {'Tecnico': 3})
+
+
+@unittest.skipUnless(os.environ.get('TESTE_CARGA'), 'Teste de carga (~5 s): rode com TESTE_CARGA=1')
+class TesteCargaTestCase(LiveServerTestCase):
+    """Teste de carga por HTTP contra o servidor de teste"""
+    
+    server_thread_class = ServidorUmaThread
+    
+    def test_usuarios_virtuais_percorrem_as_jornadas(self):
+        from .benchmark.carga import PREFIXO_USUARIO, executar, limpar_carga
+        from .benchmark.dados import gerar_dados
+        
+        gerar_dados(30, clientes=2, filhos=1, semente=5)
+        resultado = executar(
+            self.live_server_url, usuarios=5, duracao=4, rampa=0, pausa=0, semente=3, intervalo_painel=1,
+            mix={'Administrador': 1, 'Superior': 1, 'Qualidade': 1, 'Tecnico': 1, 'Básico': 1},
+        )
+        
+        self.assertEqual(set(resultado['por_grupo']), {'Administrador', 'Superior', 'Qualidade', 'Tecnico', 'Básico'})
+        self.assertEqual(resultado['endpoints']['login']['requisicoes'], 5)
+        for endpoint in ('login', 'estatisticas', 'os_detalhe', 'os_criacao', 'os_atualizacao', 'opcoes'):
+            self.assertIn(endpoint, resultado['endpoints'])
+        falhas = {nome: resumo['falhas'] for nome, resumo in resultado['endpoints'].items() if resumo['erros']}
+        self.assertEqual(falhas, {})
+        total = resultado['total']
+        self.assertLessEqual(total['p50_ms'], total['p95_ms'])
+        self.assertLessEqual(total['p95_ms'], total['p99_ms'])
+        self.assertGreater(total['vazao_rps'], 0)
+        
+        criadas = RegistroOS.objects.filter(usuario__username__startswith=PREFIXO_USUARIO).count()
+        self.assertGreater(criadas, 0)
+        self.assertEqual(limpar_carga(), criadas)
+
+
+class PerfilamentoTestCase(BaseTestCase):
+    """Perfilamento por amostragem (X-Perfilar e PERFILAMENTO_AMOSTRAGEM) e o comando flamegraph"""
+    
+    def setUp(self):
+        import shutil
+        import tempfile
+        
+        super().setUp()
+        self.create_test_data()
+        cache.clear()
+        self.diretorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.diretorio, True)
+    
+    def listar_devagar(self, **extra):
+        """Listagem com 50 ms de CPU na view, para a amostragem pegar a pilha"""
+        import time
+        from .views import RegistroOSViewSet
+        
+        original = RegistroOSViewSet.list
+        
+        def listagem_lenta(viewset, request, *args, **kwargs):
+            fim = time.perf_counter() + 0.05
+            while time.perf_counter() < fim:
+                pass
+            return original(viewset, request, *args, **kwargs)
+        
+        with patch.object(RegistroOSViewSet, 'list', listagem_lenta):
+            with self.settings(PERFILAMENTO_DIRETORIO=self.diretorio, PERFILAMENTO_INTERVALO_MS=1):
+                return self.client.get(self.os_list_url, **extra)
+    
+    def test_cabecalho_de_administrador_grava_o_perfil_da_rota(self):
+        import os
+        from .perfilamento import ler_perfil
+        
+        self.authenticate_user(self.admin_user)
+        response = self.listar_devagar(HTTP_X_PERFILAR='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        self.assertTrue(response['X-Perfil'].startswith('GET_registroos-list/'))
+        pilhas = ler_perfil(os.path.join(self.diretorio, response['X-Perfil']))
+        self.assertTrue(any('controle.tests:PerfilamentoTestCase.listar_devagar.<locals>.listagem_lenta' in pilha for pilha in pilhas))
+        self.assertTrue(all(';' in pilha and quantidade > 0 for pilha, quantidade in pilhas.items()))
+    
+    def test_cabecalho_ignorado_para_nao_administradores_e_amostragem(self):
+        import os
+        
+        self.authenticate_user(self.tecnico_user)
+        response = self.listar_devagar(HTTP_X_PERFILAR='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Perfil', response)
+        self.assertEqual(os.listdir(self.diretorio), [])
+        
+        cache.clear()
+        with self.settings(PERFILAMENTO_AMOSTRAGEM=1.0):
+            response = self.listar_devagar()
+        self.assertNotIn('X-Perfil', response)
+        self.assertEqual(os.listdir(self.diretorio), ['GET_registroos-list'])
+    
+    def test_comando_flamegraph_junta_os_perfis_por_rota(self):
+        import os
+        from io import StringIO
+        from django.core.management import call_command
+        from .perfilamento import ler_perfil
+        
+        perfis = {
+            'GET_registroos-list/20240501T100000-1-1.folded': 'django:handler;controle.views:lista 3\ndjango:handler 1\n',
+            'GET_registroos-list/20240502T100000-1-2.folded': 'django:handler;controle.views:lista 2\n',
+            'GET_estatisticas/20240502T110000-1-3.folded': 'django:handler;controle.views:estatisticas 5\n',
+        }
+        for nome, conteudo in perfis.items():
+            os.makedirs(os.path.join(self.diretorio, os.path.dirname(nome)), exist_ok=True)
+            with open(os.path.join(self.diretorio, nome), 'w', encoding='utf-8') as arquivo:
+                arquivo.write(conteudo)
+        saida_dir = os.path.join(self.diretorio, 'saida')
+        
+        saida = StringIO()
+        call_command('flamegraph', diretorio=self.diretorio, saida=saida_dir, stdout=saida)
+        self.assertEqual(
+            ler_perfil(os.path.join(saida_dir, 'GET_registroos-list.folded')),
+            {'django:handler;controle.views:lista': 5, 'django:handler': 1},
+        )
+        with open(os.path.join(saida_dir, 'GET_estatisticas.svg'), encoding='utf-8') as arquivo:
+            svg = arquivo.read()
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('controle.views:estatisticas (5 amostras, 100.00%)', svg)
+        self.assertIn('GET_registroos-list: 2 perfil(is), 6 amostras', saida.getvalue())
+        self.assertIn('83.3% próprio', saida.getvalue())
+        
+        saida = StringIO()
+        call_command('flamegraph', diretorio=self.diretorio, saida=saida_dir, rota='registroos', desde='20240502',
+                     juntas=True, stdout=saida)
+        self.assertEqual(ler_perfil(os.path.join(saida_dir, 'todas.folded')), {'django:handler;controle.views:lista': 2})
+
+
+class SerializacaoTestCase(BaseTestCase):
+    """Cache do mapa de campos dos serializers, regras por grupo, medição de construção e o benchmark de vazão"""
+    
+    def test_campos_em_cache_sao_novos_em_cada_serializer(self):
+        primeiro = RegistroOSSerializer(context={'user': self.admin_user})
+        segundo = RegistroOSSerializer(context={'user': self.basico_user})
+        
+        self.assertEqual(list(primeiro.fields), list(segundo.fields))
+        self.assertIsNot(primeiro.fields['nome_cliente'], segundo.fields['nome_cliente'])
+        self.assertIsNot(primeiro.fields['materiais'].child, segundo.fields['materiais'].child)
+        self.assertIs(segundo.fields['materiais'].child.parent, segundo.fields['materiais'])
+        # Regras de um grupo não vazam para o outro
+        self.assertFalse(primeiro.fields['nome_cliente'].required)
+        self.assertTrue(segundo.fields['nome_cliente'].required)
+        self.assertTrue(RegistroOSSerializer(context={'user': self.basico_user}).fields['nome_cliente'].required)
+        self.assertFalse(RegistroOSSerializer(context={}).fields['data_emissao_os'].required)
+    
+    def test_grupos_consultados_uma_vez_por_requisicao(self):
+        from rest_framework.request import Request
+        from rest_framework.test import APIRequestFactory
+        
+        request = Request(APIRequestFactory().get('/api/ordens-servico/'))
+        request.user = self.basico_user
+        contexto = {'request': request, 'user': self.basico_user}
+        with self.assertNumQueries(1):
+            serializer = RegistroOSSerializer(context=contexto)
+            RegistroOSSerializer(context=contexto)
+            serializer._user_groups()
+        self.assertEqual(request._grupos_usuario, frozenset(['Básico']))
+    
+    def test_server_timing_separa_construcao_e_representacao(self):
+        import re
+        from django.test import override_settings
+        
+        self.create_test_data()
+        self.authenticate_user(self.admin_user)
+        registro = RegistroOS.objects.create(nome_cliente=self.cliente_braskem, usuario=self.admin_user)
+        cache.clear()
+        with override_settings(INSTRUMENTACAO_SERVER_TIMING=True):
+            response = self.client.get(f'{self.os_list_url}{registro.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tempos = {
+            nome: float(duracao) for nome, duracao in re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])
+        }
+        self.assertGreater(tempos['ser_construcao'], 0)
+        self.assertGreater(tempos['ser_representacao'], 0)
+        self.assertLessEqual(tempos['ser_representacao'], tempos['ser'])
+    
+    def test_benchmark_de_vazao(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .benchmark.dados import gerar_dados
+        from .serializers import CamposEmCacheMixin
+        
+        gerar_dados(8, clientes=1, filhos=1, semente=3)
+        saida = StringIO()
+        call_command('benchmark_serializacao', quantidade=5, iteracoes=1, aquecimento=0, stdout=saida)
+        
+        self.assertTrue(CamposEmCacheMixin.cache_campos)
+        texto = saida.getvalue()
+        self.assertIn('5 OS', texto)
+        for medida in ('construcao_admin', 'construcao_tecnico', 'detalhe', 'listagem'):
+            self.assertIn(medida, texto)
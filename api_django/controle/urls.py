@@ -15,6 +15,7 @@ router.register(r'setores-unidade-cliente', views.SetorUnidadeClienteViewSet, ba
 router.register(r'aprovadores-cliente', views.AprovadorClienteViewSet, basename='aprovadorcliente')
 router.register(r'solicitantes-cliente', views.SolicitanteClienteViewSet, basename='solicitantecliente')
 router.register(r'opcoes-espec-cq', views.OpcaoEspecCQViewSet, basename='opcaoespeccq')
+router.register(r'auditoria', views.AuditoriaViewSet, basename='auditoria')
 
 # Routers aninhados para objetos relacionados
 os_router = routers.NestedDefaultRouter(router, r'ordens-servico', lookup='registro')
@@ -41,6 +42,18 @@ urlpatterns = [
     path('webhooks/teste/', views.webhook_test_view, name='webhook-test'),
     
     path('preview-valores/', views.preview_valores_view, name='preview_valores'),
+    path('preview-valores/lote/', views.preview_valores_lote_view, name='preview_valores_lote'),
+    
+    # Upload em partes (retomável) para anexos grandes
+    path('uploads/', views.upload_sessoes_view, name='upload_sessoes'),
+    path('uploads/<uuid:token>/', views.upload_sessao_detalhe_view, name='upload_sessao_detalhe'),
+    
+    # Download protegido de anexos (X-Accel-Redirect no nginx)
+    path('anexos/<str:tipo>/<int:pk>/download/', views.download_anexo_view, name='download_anexo'),
+    path('armazenamento/uso/', views.uso_armazenamento_view, name='uso_armazenamento'),
+
+    # Tempos e consultas por rota (InstrumentacaoMiddleware)
+    path('instrumentacao/', views.instrumentacao_view, name='instrumentacao'),
 
 ]
 
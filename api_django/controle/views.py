@@ -9,9 +9,16 @@ from django.db.models import Q, Count, Sum
 from django.shortcuts import get_object_or_404
 from django.views.decorators.cache import cache_page, never_cache
 from django.utils.decorators import method_decorator
+from django.utils.cache import patch_cache_control
+from django.http import Http404, HttpResponse, JsonResponse
 from django.core.cache import cache
-from django.db import transaction
+from django.db import DatabaseError, connection, transaction
+from django.conf import settings
+from decimal import Decimal, InvalidOperation
+import hmac
+import io
 import logging
+import os
 
 from .models import (
     RegistroOS, DocumentoSolicitacao, DataPrevistaEntrega, AcaoSolicitacao,
@@ -25,7 +32,7 @@ from .models import (
     ResponsavelMaterial,
     Contrato, UnidadeCliente, SetorUnidadeCliente, AprovadorCliente, SolicitanteCliente, OpcaoEspecCQ,
     RegimeOS, StatusOS, StatusOSManual, StatusOSEletronica, StatusLevantamento, StatusProducao, StatusMaterial, TipoDocumentoSolicitacao,
-    StatusDMS, StatusBMS, StatusFRS,
+    StatusDMS, StatusBMS, StatusFRS, UploadSessao, ArquivoArmazenado, RegistroOSArquivado, AuditoriaOS,
 )
 from .serializers import (
     RegistroOSSerializer, RegistroOSListSerializer,
@@ -37,17 +44,32 @@ from .serializers import (
     DmsSerializer, BmsSerializer, FrsSerializer,
     NfSaidaSerializer, NfVendaSerializer,
     ClienteSerializer, ContratoSerializer, UnidadeClienteSerializer, SetorUnidadeClienteSerializer, AprovadorClienteSerializer, SolicitanteClienteSerializer, OpcaoEspecCQSerializer,
+    AuditoriaOSSerializer,
 )
 from .permissions import (
     RegistroOSPermission, IsOwnerOrReadOnly, IsAdminOrReadOnly, 
-    CanDeleteRegistro, CanEditFinancialFields, SuperiorPermission
+    CanDeleteRegistro, CanEditFinancialFields, SuperiorPermission, IsOwnerOrAdmin
 )
-from .filters import RegistroOSFilter
-from . import webhooks
+from .filters import AuditoriaOSFilter, RegistroOSFilter
+from .importacao import ImportadorOS, PlanilhaInvalida, ler_planilha
+from .downloads import MODELOS_ANEXO, DERIVADOS, servir_anexo, pasta_os, resposta_pacote
+from .indice_arquivos import uso_armazenamento
+from .arquivamento import (
+    ORDENACOES_ARQUIVADAS, ListaComArquivadas, filtrar_arquivadas, incluir_arquivadas, representar_arquivada,
+)
+from .miniaturas import campos_arquivo, derivados_atuais
+from .instrumentacao import resumo_rotas
+from .metricas import texto_prometheus
+from . import auditoria, webhooks
 
 # Configurar logger
 logger = logging.getLogger(__name__)
 
+CENTAVOS = Decimal('0.01')
+# Limite dos campos de valor da OS (max_digits=15, decimal_places=2)
+_campo_valor = RegistroOS._meta.get_field('valor_total')
+VALOR_MAXIMO = Decimal(10) ** (_campo_valor.max_digits - _campo_valor.decimal_places)
+
 
 def get_user_groups(user):
     """Retorna lista de grupos do usuário"""
@@ -55,15 +77,12 @@ def get_user_groups(user):
 
 
 def log_os_operation(operation, user, os_obj, details=None):
-    """Log detalhado para operações de OS"""
-    user_groups = get_user_groups(user)
-    log_message = f"OS {operation} - ID: {os_obj.id if os_obj else 'N/A'}, " \
-                  f"Usuário: {user.username}, Grupos: {user_groups}"
-    
-    if details:
-        log_message += f", Detalhes: {details}"
-    
-    logger.info(log_message)
+    """Log estruturado de operações de OS (campos em extra, sem consultar os grupos)"""
+    os_id = os_obj.id if os_obj else None
+    logger.info(
+        'OS %s - ID: %s, Usuário: %s, Detalhes: %s', operation, os_id or 'N/A', user.username, details,
+        extra={'operacao': operation, 'os_id': os_id, 'usuario': user.username, 'detalhes': details}
+    )
 
 
 class RegistroOSViewSet(ModelViewSet):
@@ -73,12 +92,12 @@ class RegistroOSViewSet(ModelViewSet):
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = RegistroOSFilter
     search_fields = [
-        'numero_os', 'numero_contrato', 'descricao_resumida', 'descricao_detalhada',
+        'numero_os', 'numero_contrato__numero', 'descricao_resumida', 'descricao_detalhada',
         'nome_cliente__nome', 'nome_solicitante_cliente__nome', 
         'nome_responsavel_aprovacao_os_cliente__nome', 'nome_responsavel_execucao_servico__nome',
         'status_os__nome', 'observacao'
     ]
-    ordering_fields = ['created_at', 'nome_cliente', 'status_os']
+    ordering_fields = ['created_at', 'nome_cliente', 'status_os', 'valor_total']
     ordering = ['-created_at']
     
     def get_queryset(self):
@@ -131,16 +150,27 @@ class RegistroOSViewSet(ModelViewSet):
         if not user.is_authenticated:
             return RegistroOS.objects.none()
         
-        # Verificar grupos do usuário
-        user_groups = list(user.groups.values_list('name', flat=True))
-        
         # Administradores, Superiores e Qualidade veem todas as OS
-        if any(group in user_groups for group in ['Administrador', 'Superior', 'Qualidade']):
+        if self.ve_todas_os():
             return queryset
         
         # Outros usuários veem apenas suas próprias OS
         return queryset.filter(usuario=user)
     
+    def ve_todas_os(self):
+        """Usuário vê todas as OS; consulta os grupos uma vez por requisição"""
+        if not hasattr(self, '_ve_todas_os'):
+            user_groups = list(self.request.user.groups.values_list('name', flat=True))
+            self._ve_todas_os = any(group in user_groups for group in ['Administrador', 'Superior', 'Qualidade'])
+        return self._ve_todas_os
+    
+    def get_queryset_arquivadas(self):
+        """OS arquivadas visíveis ao usuário (mesma regra de get_queryset)"""
+        queryset = RegistroOSArquivado.objects.select_related('nome_cliente', 'status_os')
+        if self.ve_todas_os():
+            return queryset
+        return queryset.filter(usuario=self.request.user)
+    
     def get_serializer_class(self):
         """Retorna serializer apropriado para a ação"""
         if self.action == 'list':
@@ -156,21 +186,55 @@ class RegistroOSViewSet(ModelViewSet):
     # @method_decorator(cache_page(60), name='dispatch')
     def list(self, request, *args, **kwargs):
         """Listagem SEM cache para garantir dados atualizados"""
+        if incluir_arquivadas(request):
+            return self._listar_com_arquivadas(request)
         return super().list(request, *args, **kwargs)
     
     # @method_decorator(cache_page(60), name='dispatch')
     def retrieve(self, request, *args, **kwargs):
         """Detalhe SEM cache para garantir dados atualizados"""
-        return super().retrieve(request, *args, **kwargs)
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not incluir_arquivadas(request):
+                raise
+        
+        arquivado = generics.get_object_or_404(self.get_queryset_arquivadas(), pk=kwargs['pk'])
+        response = Response(representar_arquivada(arquivado, detalhe=True))
+        patch_cache_control(response, private=True)
+        return response
+    
+    def _listar_com_arquivadas(self, request):
+        """Listagem das OS ativas e arquivadas (somente leitura) intercaladas na mesma ordenação"""
+        ordem = request.query_params.get('ordering') or '-created_at'
+        if ordem.lstrip('-') not in ORDENACOES_ARQUIVADAS:
+            return Response(
+                {'error': f"Com include_archived a ordenação deve ser por: {', '.join(ORDENACOES_ARQUIVADAS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            arquivadas = filtrar_arquivadas(self.get_queryset_arquivadas(), request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        ativas = self.filter_queryset(self.get_queryset())
+        pagina = self.paginate_queryset(ListaComArquivadas(ativas, arquivadas, ordem))
+        contexto = self.get_serializer_context()
+        resultados = [
+            dict(RegistroOSListSerializer(item, context=contexto).data, arquivada=False)
+            if isinstance(item, RegistroOS) else representar_arquivada(item)
+            for item in pagina
+        ]
+        response = self.get_paginated_response(resultados)
+        # A mesma URL tem resultados diferentes por usuário
+        patch_cache_control(response, private=True)
+        return response
     
     @method_decorator(never_cache, name='dispatch')
-    @transaction.atomic
+    @auditoria.em_lote()
     def create(self, request, *args, **kwargs):
         """Criação com logging detalhado"""
-        user_groups = get_user_groups(request.user)
-        
-        logger.info(f"Iniciando criação de OS - Usuário: {request.user.username}, "
-                   f"Grupos: {user_groups}")
+        logger.info('Iniciando criação de OS - Usuário: %s', request.user.username)
         
         try:
             serializer = self.get_serializer(data=request.data)
@@ -184,7 +248,7 @@ class RegistroOSViewSet(ModelViewSet):
             log_os_operation("CRIADA", request.user, os_obj, {
                 "cliente": os_obj.nome_cliente,
                 "contrato": os_obj.numero_contrato,
-                "objetos_relacionados": self._count_related_objects(os_obj)
+                "objetos_relacionados": self._count_related_objects(request.data)
             })
             
             # Limpar cache após criação
@@ -197,8 +261,7 @@ class RegistroOSViewSet(ModelViewSet):
             return response
             
         except Exception as e:
-            logger.error(f"Erro na criação de OS - Usuário: {request.user.username}, "
-                        f"Erro: {str(e)}")
+            logger.error('Erro na criação de OS - Usuário: %s, Erro: %s', request.user.username, e)
             raise
     
     def perform_create(self, serializer):
@@ -206,16 +269,13 @@ class RegistroOSViewSet(ModelViewSet):
         serializer.save(usuario=self.request.user)
     
     @method_decorator(never_cache, name='dispatch')
-    @transaction.atomic
+    @auditoria.em_lote()
     def update(self, request, *args, **kwargs):
         """Atualização com logging detalhado"""
         instance = self.get_object()
         old_status = instance.status_os
         
-        user_groups = get_user_groups(request.user)
-        
-        logger.info(f"Iniciando atualização de OS {instance.id} - "
-                   f"Usuário: {request.user.username}, Grupos: {user_groups}")
+        logger.info('Iniciando atualização de OS %s - Usuário: %s', instance.id, request.user.username)
         
         try:
             response = super().update(request, *args, **kwargs)
@@ -244,8 +304,7 @@ class RegistroOSViewSet(ModelViewSet):
             return response
             
         except Exception as e:
-            logger.error(f"Erro na atualização de OS {instance.id} - "
-                        f"Usuário: {request.user.username}, Erro: {str(e)}")
+            logger.error('Erro na atualização de OS %s - Usuário: %s, Erro: %s', instance.id, request.user.username, e)
             raise
     
     @method_decorator(never_cache, name='dispatch')
@@ -255,8 +314,7 @@ class RegistroOSViewSet(ModelViewSet):
         
         # Verificar permissão de exclusão
         if not request.user.groups.filter(name='Administrador').exists():
-            logger.warning(f"Tentativa de exclusão negada - OS {instance.id}, "
-                          f"Usuário: {request.user.username}")
+            logger.warning('Tentativa de exclusão negada - OS %s, Usuário: %s', instance.id, request.user.username)
             return Response(
                 {'detail': 'Apenas administradores podem excluir OS.'},
                 status=status.HTTP_403_FORBIDDEN
@@ -272,14 +330,10 @@ class RegistroOSViewSet(ModelViewSet):
         
         return super().destroy(request, *args, **kwargs)
     
-    def _count_related_objects(self, os_obj):
-        """Conta objetos relacionados para logging"""
-        return {
-            'documentos_solicitacao': os_obj.documentos_solicitacao.count(),
-            'materiais': os_obj.materiais.count(),
-            'levantamentos': os_obj.levantamentos.count(),
-            'controles_qualidade': os_obj.controles_qualidade.count(),
-        }
+    def _count_related_objects(self, dados):
+        """Conta os objetos relacionados enviados na requisição, para logging (sem consultas)"""
+        campos = ['documentos_solicitacao', 'materiais', 'levantamentos', 'controles_qualidade']
+        return {campo: len(dados.get(campo) or []) for campo in campos}
     
     def _check_material_webhooks(self, os_obj, materiais_data):
         """Verifica se algum material foi entregue para disparar webhook"""
@@ -297,18 +351,103 @@ class RegistroOSViewSet(ModelViewSet):
         """Recalcula valores da OS"""
         os_obj = self.get_object()
         
-        logger.info(f"Recálculo solicitado para OS {os_obj.id} - "
-                   f"Usuário: {request.user.username}")
+        logger.info('Recálculo solicitado para OS %s - Usuário: %s', os_obj.id, request.user.username)
         
         os_obj.calcular_soma_valores()
         os_obj.calcular_saldo_final()
-        os_obj.save()
+        os_obj.save(update_fields=['soma_valores'] + RegistroOS.CAMPOS_TOTAIS_NF)
         
         return Response({
             'message': 'Valores recalculados com sucesso',
             'soma_valores': os_obj.soma_valores,
             'saldo_final': os_obj.saldo_final
         })
+    
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated, SuperiorPermission])
+    def importar(self, request):
+        """Importa OS em lote a partir de uma planilha CSV/XLSX enviada em 'arquivo'"""
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            return Response({'error': 'Envie o arquivo no campo "arquivo"'}, status=status.HTTP_400_BAD_REQUEST)
+        if not arquivo.name.lower().endswith(('.csv', '.xlsx')):
+            return Response({'error': 'Formato não suportado. Use CSV ou XLSX'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        validar_apenas = str(request.data.get('validar_apenas', '')).lower() in ('1', 'true', 'sim')
+        importador = ImportadorOS(usuario=request.user, validar_apenas=validar_apenas)
+        
+        resultado = importador.resultado
+        try:
+            importador.importar(ler_planilha(arquivo.file, arquivo.name))
+        except PlanilhaInvalida as e:
+            # Os lotes anteriores ao erro já foram gravados: informar quantos
+            logger.error(f"Erro na importação de OS ({arquivo.name}) após {resultado['total_linhas']} linha(s): {str(e)}")
+            return Response(
+                {**resultado, 'error': f"Erro ao ler o arquivo após {resultado['total_linhas']} linha(s)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        finally:
+            if resultado['importados'] and not validar_apenas:
+                cache.clear()
+        
+        logger.info(f"Importação de OS - Usuário: {request.user.username}, Arquivo: {arquivo.name}, "
+                    f"Importadas: {resultado['importados']}, Erros: {len(resultado['erros'])}")
+        
+        return Response(resultado)
+    
+    @action(detail=True, methods=['get'], url_path='anexos-zip')
+    def anexos_zip(self, request, pk=None):
+        """ZIP (gerado em streaming) com todos os anexos da OS"""
+        os_obj = get_object_or_404(RegistroOS.objects.only('pk', 'numero_os', 'usuario'), pk=pk)
+        if not IsOwnerOrAdmin().has_object_permission(request, self, os_obj):
+            return Response(
+                {'error': 'Você não tem permissão para acessar os anexos desta OS'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        logger.info('Pacote de anexos - OS %s, Usuário: %s', os_obj.id, request.user.username)
+        return resposta_pacote([(os_obj.pk, os_obj.numero_os)], f'{pasta_os(os_obj.pk, os_obj.numero_os)}.zip')
+    
+    @action(detail=False, methods=['get'], url_path='anexos-zip')
+    def anexos_zip_lote(self, request):
+        """ZIP com os anexos das OS que atendem aos mesmos filtros da listagem"""
+        limite = settings.PACOTE_ANEXOS_MAX_OS
+        registros = list(
+            self.filter_queryset(self.get_queryset())
+            .select_related(None).prefetch_related(None)
+            .values_list('pk', 'numero_os')[:limite + 1]
+        )
+        if not registros:
+            return Response({'error': 'Nenhuma OS encontrada para os filtros informados'}, status=status.HTTP_404_NOT_FOUND)
+        if len(registros) > limite:
+            return Response(
+                {'error': f'A seleção passa de {limite} OS. Refine os filtros ou gere o pacote com o comando gerar_pacote_anexos'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        
+        logger.info(f"Pacote de anexos - {len(registros)} OS, Usuário: {request.user.username}")
+        return resposta_pacote(registros, 'anexos-os.zip')
+    
+    @action(detail=True, methods=['get'])
+    def historico(self, request, pk=None):
+        """Histórico de alterações da OS e das tabelas filhas (também de OS arquivada)"""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise Http404
+        ativas = self.get_queryset().select_related(None).prefetch_related(None)
+        if not (ativas.filter(pk=pk).exists() or self.get_queryset_arquivadas().filter(pk=pk).exists()):
+            raise Http404
+        
+        filtro = AuditoriaOSFilter(
+            request.query_params, queryset=AuditoriaOS.objects.filter(os_id=pk).select_related('usuario')
+        )
+        if not filtro.is_valid():
+            return Response({'error': filtro.errors}, status=status.HTTP_400_BAD_REQUEST)
+        
+        page = self.paginate_queryset(filtro.qs)
+        if page is not None:
+            return self.get_paginated_response(AuditoriaOSSerializer(page, many=True).data)
+        return Response(AuditoriaOSSerializer(filtro.qs, many=True).data)
 
 
 class RegistroOSDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -324,6 +463,21 @@ class RegistroOSDetailView(generics.RetrieveUpdateDestroyAPIView):
         return context
 
 
+class AuditoriaViewSet(ReadOnlyModelViewSet):
+    """Histórico de alterações das OS; Administrador e Superior veem tudo, os demais só as próprias alterações"""
+    
+    serializer_class = AuditoriaOSSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = AuditoriaOSFilter
+    
+    def get_queryset(self):
+        queryset = AuditoriaOS.objects.select_related('usuario')
+        if self.request.user.groups.filter(name__in=['Administrador', 'Superior']).exists():
+            return queryset
+        return queryset.filter(usuario=self.request.user)
+
+
 # Views para objetos relacionados
 class DocumentoSolicitacaoViewSet(ModelViewSet):
     serializer_class = DocumentoSolicitacaoSerializer
@@ -516,8 +670,10 @@ def estatisticas_view(request):
         # Administradores, Superiores e Qualidade veem todas as OS
         if any(group in user_groups for group in ['Administrador', 'Superior', 'Qualidade']):
             queryset = RegistroOS.objects.all()
+            arquivadas = RegistroOSArquivado.objects.all()
         else:
             queryset = RegistroOS.objects.filter(usuario=user)
+            arquivadas = RegistroOSArquivado.objects.filter(usuario=user)
         
         # Estatísticas básicas
         total_os = queryset.count()
@@ -609,27 +765,10 @@ def estatisticas_view(request):
         # Contadores por status com lógica flexível
         from django.db.models import Q
         
-        # Status que indicam "concluída" (considerando variações)
-        status_concluida = [
-            'CONCLUIDO', 'CONCLUÍDO', 'CONCLUIDA', 'CONCLUÍDA',
-            'FINALIZADO', 'FINALIZADA', 'FINALIZADO', 'FINALIZADA',
-            'concluido', 'concluído', 'concluida', 'concluída',
-            'finalizado', 'finalizada', 'finalizado', 'finalizada'
-        ]
-        
-        # Status que indicam "em andamento" (considerando variações)
-        status_em_andamento = [
-            'APROVADA', 'APROVADO', 'APROVADA', 'APROVADO', 'Aprovada', 'Aprovado',
-            'EM ANDAMENTO', 'EM_ANDAMENTO', 'EMANDAMENTO', 'Em Andamento',
-            'aprovada', 'aprovado', 'aprovada', 'aprovado',
-            'em andamento', 'em_andamento', 'emandamento'
-        ]
-        
-        # Status que indicam "cancelada" (considerando variações)
-        status_cancelada = [
-            'CANCELADA', 'CANCELADO', 'Cancelada', 'Cancelado',
-            'cancelada', 'cancelado'
-        ]
+        # Status que indicam cada situação (considerando variações)
+        status_concluida = RegistroOS.STATUS_CONCLUIDA
+        status_em_andamento = RegistroOS.STATUS_EM_ANDAMENTO
+        status_cancelada = RegistroOS.STATUS_CANCELADA
         
         # OS Abertas: todas exceto as concluídas, em andamento e canceladas
         os_abertas = queryset.exclude(
@@ -651,6 +790,14 @@ def estatisticas_view(request):
             status_os__nome__in=status_cancelada
         ).count()
         
+        # OS arquivadas (sempre concluídas ou canceladas) só entram quando pedidas
+        if incluir_arquivadas(request):
+            total_os += arquivadas.count()
+            for nome, quantidade in arquivadas.values_list('status_os__nome').annotate(count=Count('id')):
+                os_por_status[nome] = os_por_status.get(nome, 0) + quantidade
+            os_concluidas += arquivadas.filter(status_os__nome__in=status_concluida).count()
+            os_canceladas += arquivadas.filter(status_os__nome__in=status_cancelada).count()
+        
         stats = {
             'total_os': total_os,
             'os_abertas': os_abertas,
@@ -738,9 +885,11 @@ def webhook_test_view(request):
 def test_file_upload_view(request):
     """Endpoint para testar upload de arquivos de forma isolada"""
     try:
-        # Log dos dados recebidos
-        logger.info(f"Teste de upload - Dados recebidos: {dict(request.data)}")
-        logger.info(f"Teste de upload - Arquivos recebidos: {dict(request.FILES)}")
+        # Só os nomes dos campos: o conteúdo pode ser grande ou sensível
+        logger.info(
+            'Teste de upload - Campos recebidos: %s, Arquivos: %s',
+            list(request.data.keys()), list(request.FILES.keys())
+        )
         
         # Verificar se há arquivos
         if not request.FILES:
@@ -762,7 +911,7 @@ def test_file_upload_view(request):
             uploaded_files.append(file_info)
             
             # Log detalhado do arquivo
-            logger.info(f"Arquivo processado: {file_info}")
+            logger.info('Arquivo processado: %s', file_info['file_name'], extra={'arquivo': file_info})
         
         return Response({
             'success': True,
@@ -772,7 +921,7 @@ def test_file_upload_view(request):
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
-        logger.error(f"Erro no teste de upload: {e}")
+        logger.error('Erro no teste de upload: %s', e)
         return Response({
             'error': str(e),
             'type': 'upload_test_error'
@@ -858,46 +1007,23 @@ def preview_valores_view(request):
     """Endpoint para calcular preview dos valores baseado nos campos 'havera_valor'"""
     try:
         data = request.data
-        total = 0
-
-        # Campos de valor e seus respectivos campos "havera" (consistente com o modelo)
-        campos = [
-            ('havera_valor_fabricacao', 'valor_fabricacao'),
-            ('havera_valor_levantamento', 'valor_levantamento'),
-            ('havera_valor_material_fabricacao', 'valor_material_fabricacao'),
-            ('havera_valor_material_pintura', 'valor_material_pintura'),
-            ('havera_valor_servico_pintura_revestimento', 'valor_servico_pintura_revestimento'),
-            ('havera_valor_montagem', 'valor_montagem'),
-            ('havera_valor_material_montagem', 'valor_material_montagem'),
-            ('havera_valor_inspecao', 'valor_inspecao'),
-            ('havera_valor_hh', 'valor_hh'),  # Campo incluído para consistência
-            ('havera_valor_manutencao_valvula', 'valor_manutencao_valvula'),
-            ('havera_valor_servico_terceiros', 'valor_servico_terceiros'),
-        ]
-
-        # Soma apenas os valores dos campos que têm "havera_valor" = "SIM"
-        for flag, campo in campos:
-            if data.get(flag) == 'SIM':
-                valor = data.get(campo, 0)
-                # Garantir que o valor seja numérico
-                try:
-                    total += float(valor) if valor else 0
-                except (ValueError, TypeError):
-                    total += 0
-
-        # Soma das notas fiscais
-        soma_nf = 0
-        try:
-            soma_nf = float(data.get('soma_notas_fiscais') or 0)
-        except (ValueError, TypeError):
-            soma_nf = 0
-
-        saldo = total - soma_nf
-
+        
+        def obter(campo):
+            # Valores não numéricos contam como zero (comportamento do formulário)
+            valor = data.get(campo)
+            if campo.startswith('havera_'):
+                return valor
+            try:
+                return Decimal(str(valor)) if valor else 0
+            except InvalidOperation:
+                return 0
+        
+        totais = calcular_preview_valores(obter, obter('soma_notas_fiscais'))
+        
         return Response({
-            'soma_valores': total,
-            'soma_notas_fiscais': soma_nf,
-            'saldo_final': saldo
+            'soma_valores': float(totais['soma_valores']),
+            'soma_notas_fiscais': float(totais['soma_notas_fiscais']),
+            'saldo_final': float(totais['saldo_final'])
         })
     except Exception as e:
         logger.error(f"Erro no preview de valores: {str(e)}")
@@ -909,6 +1035,316 @@ def preview_valores_view(request):
         }, status=500)
 
 
+def calcular_preview_valores(obter, soma_notas_fiscais):
+    """Calcula os totais de uma OS com a mesma regra Decimal do modelo"""
+    soma_valores = RegistroOS.somar_valores(obter)
+    soma_notas_fiscais = Decimal(str(soma_notas_fiscais or 0))
+    if not (soma_valores.is_finite() and soma_notas_fiscais.is_finite()):
+        raise ValueError('valores devem ser numéricos')
+    saldo_final, valor_total = RegistroOS.calcular_saldo_e_valor_total(soma_valores, soma_notas_fiscais)
+    return {
+        'soma_valores': soma_valores,
+        'soma_notas_fiscais': soma_notas_fiscais,
+        'saldo_final': saldo_final,
+        'valor_total': valor_total,
+    }
+
+
+# Endpoint para preview de várias OS de uma vez (edição em lote)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def preview_valores_lote_view(request):
+    """Calcula o preview de valores de uma lista de OS, por linha e no total"""
+    registros = request.data.get('registros') if isinstance(request.data, dict) else request.data
+    if not isinstance(registros, list):
+        return Response(
+            {'error': 'Envie uma lista de registros em "registros"'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    limite = settings.PREVIEW_VALORES_MAX_LINHAS
+    if len(registros) > limite:
+        return Response(
+            {'error': f'Máximo de {limite} registros por requisição'},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    
+    campos_totais = ['soma_valores', 'soma_notas_fiscais', 'saldo_final', 'valor_total']
+    totais = dict.fromkeys(campos_totais, Decimal('0'))
+    resultados = []
+    com_erro = 0
+    
+    for indice, dados in enumerate(registros):
+        resultado = {'indice': indice}
+        if isinstance(dados, dict) and 'id' in dados:
+            resultado['id'] = dados['id']
+        
+        try:
+            if not isinstance(dados, dict):
+                raise ValueError('registro deve ser um objeto')
+            linha = calcular_preview_valores(dados.get, dados.get('soma_notas_fiscais'))
+            valores = {campo: linha[campo].quantize(CENTAVOS) for campo in campos_totais}
+            if any(abs(valor) >= VALOR_MAXIMO for valor in valores.values()):
+                raise ValueError('valor acima do limite do campo')
+        except (ValueError, TypeError, InvalidOperation):
+            resultado['error'] = 'Valores inválidos'
+            resultados.append(resultado)
+            com_erro += 1
+            continue
+        
+        for campo, valor in valores.items():
+            totais[campo] += valor
+            resultado[campo] = str(valor)
+        resultados.append(resultado)
+    
+    return Response({
+        'resultados': resultados,
+        'totais': {
+            **{campo: str(valor.quantize(CENTAVOS)) for campo, valor in totais.items()},
+            'quantidade': len(registros) - com_erro,
+            'com_erro': com_erro,
+        }
+    })
+
+
+# Upload em partes (retomável) para anexos grandes
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def upload_sessoes_view(request):
+    """Cria uma sessão de upload; o token é usado depois como 'upload:<token>' no campo de arquivo"""
+    nome_arquivo = os.path.basename(str(request.data.get('nome_arquivo', '')).strip())
+    checksum = str(request.data.get('checksum_sha256', '') or '').strip().lower()
+    try:
+        tamanho_total = int(request.data.get('tamanho_total'))
+    except (TypeError, ValueError):
+        tamanho_total = 0
+    
+    if not nome_arquivo or tamanho_total <= 0:
+        return Response(
+            {'error': 'Informe nome_arquivo e tamanho_total'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if tamanho_total > settings.UPLOAD_TAMANHO_MAX:
+        return Response(
+            {'error': f'Arquivo maior que o limite de {settings.UPLOAD_TAMANHO_MAX} bytes'},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    if checksum and len(checksum) != 64:
+        return Response({'error': 'checksum_sha256 inválido'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    sessao = UploadSessao.objects.create(
+        usuario=request.user,
+        nome_arquivo=nome_arquivo,
+        tamanho_total=tamanho_total,
+        checksum_sha256=checksum,
+    )
+    sessao.criar_arquivo()
+    logger.info(f"Upload iniciado - Token: {sessao.token}, Arquivo: {nome_arquivo}, "
+                f"Tamanho: {tamanho_total}, Usuário: {request.user.username}")
+    
+    return Response(
+        dict(serializar_upload_sessao(sessao), tamanho_parte_max=settings.UPLOAD_PARTE_TAMANHO_MAX),
+        status=status.HTTP_201_CREATED
+    )
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_sessao_detalhe_view(request, token):
+    """Consulta o progresso (GET), envia uma parte (PUT) ou cancela (DELETE) um upload"""
+    sessao = get_object_or_404(UploadSessao, token=token, usuario=request.user)
+    
+    if request.method == 'GET':
+        return Response(serializar_upload_sessao(sessao))
+    
+    if request.method == 'DELETE':
+        sessao.remover_arquivo()
+        sessao.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    # PUT: corpo bruto com a parte; o offset vem no cabeçalho Upload-Offset
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return Response({'error': 'Cabeçalho Upload-Offset obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    with transaction.atomic():
+        sessao = UploadSessao.objects.select_for_update().get(pk=sessao.pk)
+        if sessao.status != 'PENDENTE':
+            return Response(
+                dict(serializar_upload_sessao(sessao), error='Upload já concluído'),
+                status=status.HTTP_409_CONFLICT
+            )
+        if offset != sessao.recebido:
+            # Cliente deve retomar a partir do que o servidor já recebeu
+            return Response(
+                dict(serializar_upload_sessao(sessao), error='Offset não confere com o recebido'),
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            sessao.gravar_parte(
+                offset,
+                request.stream or io.BytesIO(),
+                settings.UPLOAD_PARTE_TAMANHO_MAX,
+                checksum=request.headers.get('Upload-Checksum'),
+            )
+        except ValueError as e:
+            return Response(
+                dict(serializar_upload_sessao(sessao), error=str(e)),
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    if sessao.status == 'CONCLUIDO':
+        logger.info(f"Upload concluído - Token: {sessao.token}, Arquivo: {sessao.nome_arquivo}")
+    
+    return Response(serializar_upload_sessao(sessao))
+
+
+def serializar_upload_sessao(sessao):
+    """Representação de uma sessão de upload"""
+    return {
+        'token': str(sessao.token),
+        'referencia': f'{UploadSessao.PREFIXO_REFERENCIA}{sessao.token}',
+        'nome_arquivo': sessao.nome_arquivo,
+        'tamanho_total': sessao.tamanho_total,
+        'recebido': sessao.recebido,
+        'status': sessao.status,
+    }
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def download_anexo_view(request, tipo, pk):
+    """
+    Download de um anexo após checar o acesso à OS dona (IsOwnerOrAdmin).
+    Em produção o envio é delegado ao nginx via X-Accel-Redirect.
+    Use ?inline=1 para abrir no navegador em vez de baixar e
+    ?derivado=miniatura|preview para as imagens geradas do anexo.
+    """
+    modelo = MODELOS_ANEXO.get(tipo)
+    if modelo is None:
+        return Response({'error': f'Tipo de anexo inválido: {tipo}'}, status=status.HTTP_404_NOT_FOUND)
+
+    anexo = get_object_or_404(modelo.objects.select_related('registro'), pk=pk)
+    if not IsOwnerOrAdmin().has_object_permission(request, None, anexo.registro):
+        return Response(
+            {'error': 'Você não tem permissão para acessar este anexo'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    campo = campos_arquivo(modelo)[0]
+    arquivo = getattr(anexo, campo)
+    nome = arquivo.name if arquivo else None
+    derivado = request.query_params.get('derivado')
+    if nome and derivado:
+        if derivado not in DERIVADOS:
+            return Response({'error': f'Derivado inválido: {derivado}'}, status=status.HTTP_400_BAD_REQUEST)
+        nome = derivados_atuais(anexo, campo).get(derivado)
+    response = servir_anexo(request, nome, inline=request.query_params.get('inline') == '1') if nome else None
+    if response is None:
+        return Response({'error': 'Arquivo não encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    return response
+
+
+@never_cache
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def uso_armazenamento_view(request):
+    """Uso de armazenamento dos anexos por cliente (padrão) ou por OS (?por=os)"""
+    user_groups = get_user_groups(request.user)
+    if not any(group in user_groups for group in ['Administrador', 'Superior']):
+        return Response({
+            'error': 'Acesso negado. Apenas administradores e superiores podem acessar esta funcionalidade.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    agrupar = request.query_params.get('por', 'cliente')
+    if agrupar not in ('cliente', 'os'):
+        return Response({'error': 'Parâmetro "por" deve ser cliente ou os'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limite = int(request.query_params.get('limite', 50))
+    except ValueError:
+        return Response({'error': 'Parâmetro "limite" inválido'}, status=status.HTTP_400_BAD_REQUEST)
+
+    linhas = uso_armazenamento(agrupar, limite if limite > 0 else None)
+    return Response({
+        'por': agrupar,
+        'total_bytes': ArquivoArmazenado.objects.aggregate(total=Sum('tamanho'))['total'] or 0,
+        'resultados': [
+            {
+                'id': linha['os'] if agrupar == 'os' else linha['cliente_id'],
+                'numero_os': linha.get('numero_os'),
+                'cliente': linha['cliente'],
+                'arquivos': linha['arquivos'],
+                'bytes': linha['bytes'] or 0,
+            }
+            for linha in linhas
+        ],
+    })
+
+
+@never_cache
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def instrumentacao_view(request):
+    """Histogramas de tempo e de consultas por rota, deste processo"""
+    if 'Administrador' not in get_user_groups(request.user):
+        return Response({
+            'error': 'Acesso negado. Apenas administradores podem acessar esta funcionalidade.'
+        }, status=status.HTTP_403_FORBIDDEN)
+
+    return Response({
+        'ativa': settings.INSTRUMENTACAO,
+        'orcamentos': settings.INSTRUMENTACAO_ORCAMENTOS,
+        'rotas': resumo_rotas(),
+    })
+
+
+@never_cache
+def health_view(request):
+    """Liveness: o processo responde (sem tocar no banco nem no cache)"""
+    return JsonResponse({'status': 'ok'})
+
+
+@never_cache
+def ready_view(request):
+    """Readiness: SELECT 1 no banco e escrita/leitura no cache; 503 se algum falhar"""
+    verificacoes = {}
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        verificacoes['banco'] = 'ok'
+    except DatabaseError as e:
+        logger.error(f"Readiness: banco indisponível - {e}")
+        verificacoes['banco'] = 'erro'
+
+    try:
+        cache.set('saude:ready', 'ok', 5)
+        verificacoes['cache'] = 'ok' if cache.get('saude:ready') == 'ok' else 'erro'
+    except Exception as e:
+        logger.error(f"Readiness: cache indisponível - {e}")
+        verificacoes['cache'] = 'erro'
+
+    pronto = all(valor == 'ok' for valor in verificacoes.values())
+    return JsonResponse(
+        {'status': 'ok' if pronto else 'erro', 'verificacoes': verificacoes},
+        status=200 if pronto else 503
+    )
+
+
+@never_cache
+def metricas_view(request):
+    """Métricas no formato texto do Prometheus, somadas entre os workers"""
+    # Sem token configurado, /metrics fica fechado (a porta 8000 é publicada em alguns compose)
+    if not settings.METRICAS_TOKEN:
+        return JsonResponse({'error': 'Métricas desabilitadas: defina METRICAS_TOKEN'}, status=403)
+    esperado = f'Bearer {settings.METRICAS_TOKEN}'
+    if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), esperado):
+        return JsonResponse({'error': 'Token de métricas inválido'}, status=401)
+    return HttpResponse(texto_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # ViewSet para Cliente
 from .serializers import ClienteSerializer
 from .models import Cliente
@@ -955,7 +1391,7 @@ class ClienteViewSet(ModelViewSet):
 # ViewSets para os novos modelos relacionais
 class ContratoViewSet(ModelViewSet):
     """ViewSet para gerenciar contratos"""
-    queryset = Contrato.objects.filter(ativo=True)
+    queryset = Contrato.objects.filter(ativo=True).select_related('cliente')
     serializer_class = ContratoSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
@@ -989,7 +1425,7 @@ class ContratoViewSet(ModelViewSet):
 
 class UnidadeClienteViewSet(ModelViewSet):
     """ViewSet para gerenciar unidades do cliente"""
-    queryset = UnidadeCliente.objects.filter(ativo=True)
+    queryset = UnidadeCliente.objects.filter(ativo=True).select_related('cliente')
     serializer_class = UnidadeClienteSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
@@ -1023,7 +1459,7 @@ class UnidadeClienteViewSet(ModelViewSet):
 
 class SetorUnidadeClienteViewSet(ModelViewSet):
     """ViewSet para gerenciar setores das unidades"""
-    queryset = SetorUnidadeCliente.objects.filter(ativo=True)
+    queryset = SetorUnidadeCliente.objects.filter(ativo=True).select_related('unidade__cliente')
     serializer_class = SetorUnidadeClienteSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
@@ -1062,7 +1498,7 @@ class SetorUnidadeClienteViewSet(ModelViewSet):
 
 class AprovadorClienteViewSet(ModelViewSet):
     """ViewSet para gerenciar aprovadores do cliente"""
-    queryset = AprovadorCliente.objects.filter(ativo=True)
+    queryset = AprovadorCliente.objects.filter(ativo=True).select_related('cliente')
     serializer_class = AprovadorClienteSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
@@ -1096,7 +1532,7 @@ class AprovadorClienteViewSet(ModelViewSet):
 
 class SolicitanteClienteViewSet(ModelViewSet):
     """ViewSet para gerenciar solicitantes do cliente"""
-    queryset = SolicitanteCliente.objects.filter(ativo=True)
+    queryset = SolicitanteCliente.objects.filter(ativo=True).select_related('cliente')
     serializer_class = SolicitanteClienteSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
@@ -1130,7 +1566,7 @@ class SolicitanteClienteViewSet(ModelViewSet):
 
 class OpcaoEspecCQViewSet(ModelViewSet):
     """ViewSet para gerenciar opções específicas de CQ"""
-    queryset = OpcaoEspecCQ.objects.filter(ativo=True)
+    queryset = OpcaoEspecCQ.objects.filter(ativo=True).select_related('cliente')
     serializer_class = OpcaoEspecCQSerializer
     permission_classes = [IsAuthenticated, SuperiorPermission]
     
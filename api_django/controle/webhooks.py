@@ -5,6 +5,11 @@ import logging
 import json
 from datetime import datetime
 from django.conf import settings
+
+from .auditoria import status_anterior
+from .metricas import medir_webhook
+
+
 def serialize_django_object(obj):
     """Serializar objetos Django para JSON"""
     if hasattr(obj, 'pk'):
@@ -20,6 +25,7 @@ def serialize_django_object(obj):
 logger = logging.getLogger('controle.webhooks')
 
 
+@medir_webhook('os_aprovada')
 def webhook_os_aprovada(os_obj):
     """
     Webhook disparado quando uma OS é aprovada
@@ -33,11 +39,11 @@ def webhook_os_aprovada(os_obj):
         'os_id': os_obj.id,
         'numero_contrato': os_obj.numero_contrato,
         'nome_cliente': os_obj.nome_cliente,
-        'status_anterior': 'PENDENTE',
+        'status_anterior': status_anterior(os_obj) or 'PENDENTE',
         'status_atual': os_obj.status_os,
         'usuario_aprovacao': os_obj.usuario.username if os_obj.usuario else None,
         'data_aprovacao': datetime.now().isoformat(),
-        'valor_total': float(os_obj.saldo_final) if os_obj.saldo_final and float(os_obj.saldo_final) > 0 else float(os_obj.soma_valores) if os_obj.soma_valores else 0.0,
+        'valor_total': float(os_obj.valor_total or 0),
         'descricao': os_obj.descricao_resumida
     }
     
@@ -61,6 +67,7 @@ def webhook_os_aprovada(os_obj):
     return webhook_data
 
 
+@medir_webhook('material_aprovado')
 def webhook_material_aprovado(material_obj):
     """
     Webhook disparado quando um material é aprovado
@@ -77,7 +84,7 @@ def webhook_material_aprovado(material_obj):
         'tipo_material': material_obj.tipo_material,
         'quantidade': float(material_obj.quantidade) if material_obj.quantidade else 0.0,
         'unidade': material_obj.unidade,
-        'status_anterior': 'SOLICITADO',
+        'status_anterior': status_anterior(material_obj, 'status_material') or 'SOLICITADO',
         'status_atual': material_obj.status_material,
         'responsavel': material_obj.responsavel_material,
         'observacoes': material_obj.observacoes,
@@ -98,6 +105,7 @@ def webhook_material_aprovado(material_obj):
     return webhook_data
 
 
+@medir_webhook('os_concluida')
 def webhook_os_concluida(os_obj):
     """
     Webhook disparado quando uma OS é concluída
@@ -111,7 +119,7 @@ def webhook_os_concluida(os_obj):
         'os_id': os_obj.id,
         'numero_contrato': os_obj.numero_contrato,
         'nome_cliente': os_obj.nome_cliente,
-        'status_anterior': 'EM_EXECUCAO',
+        'status_anterior': status_anterior(os_obj) or 'EM_EXECUCAO',
         'status_atual': os_obj.status_os,
         'data_conclusao': datetime.now().isoformat(),
         'valor_final': float(os_obj.saldo_final) if os_obj.saldo_final else 0.0,
@@ -137,6 +145,7 @@ def webhook_os_concluida(os_obj):
     return webhook_data
 
 
+@medir_webhook('os_cancelada')
 def webhook_os_cancelada(os_obj, motivo=None):
     """
     Webhook disparado quando uma OS é cancelada
@@ -151,7 +160,7 @@ def webhook_os_cancelada(os_obj, motivo=None):
         'os_id': os_obj.id,
         'numero_contrato': os_obj.numero_contrato,
         'nome_cliente': os_obj.nome_cliente,
-        'status_anterior': 'PENDENTE',
+        'status_anterior': status_anterior(os_obj) or 'PENDENTE',
         'status_atual': os_obj.status_os,
         'motivo_cancelamento': motivo,
         'data_cancelamento': datetime.now().isoformat(),
@@ -171,6 +180,7 @@ def webhook_os_cancelada(os_obj, motivo=None):
     return webhook_data
 
 
+@medir_webhook('material_rejeitado')
 def webhook_material_rejeitado(material_obj, motivo=None):
     """
     Webhook disparado quando um material é rejeitado
@@ -188,7 +198,7 @@ def webhook_material_rejeitado(material_obj, motivo=None):
         'tipo_material': material_obj.tipo_material,
         'quantidade': float(material_obj.quantidade) if material_obj.quantidade else 0.0,
         'unidade': material_obj.unidade,
-        'status_anterior': 'SOLICITADO',
+        'status_anterior': status_anterior(material_obj, 'status_material') or 'SOLICITADO',
         'status_atual': 'REJEITADO',
         'motivo_rejeicao': motivo,
         'data_rejeicao': datetime.now().isoformat()
@@ -207,6 +217,7 @@ def webhook_material_rejeitado(material_obj, motivo=None):
     return webhook_data
 
 
+@medir_webhook('teste')
 def webhook_teste(tipo_evento, dados_teste=None):
     """
     Função para testar webhooks manualmente
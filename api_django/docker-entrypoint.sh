@@ -31,6 +31,30 @@ collect_static() {
     python manage.py collectstatic --noinput
 }
 
+# Função para limpar os retratos de métricas dos workers da execução anterior
+reset_metrics() {
+    export METRICAS_DIRETORIO="${METRICAS_DIRETORIO:-/tmp/controle_os_metricas}"
+    echo "Limpando métricas em $METRICAS_DIRETORIO..."
+    rm -rf "$METRICAS_DIRETORIO"
+    mkdir -p "$METRICAS_DIRETORIO"
+}
+
+# Função para rotacionar os logs da API em segundo plano (scripts/logrotate-controle-os.conf)
+start_logrotate() {
+    local intervalo="${LOGROTATE_INTERVALO:-3600}"
+    if [ "$intervalo" = "0" ]; then
+        echo "Rotação de logs desativada (LOGROTATE_INTERVALO=0)"
+        return
+    fi
+    echo "Rotação de logs a cada ${intervalo}s..."
+    (
+        while sleep "$intervalo"; do
+            logrotate -s /app/logrotate.status /app/scripts/logrotate-controle-os.conf \
+                || echo "Falha na rotação de logs" >&2
+        done
+    ) &
+}
+
 # Função principal
 main() {
     # Aguardar banco de dados
@@ -45,6 +69,12 @@ main() {
     # Coletar arquivos estáticos
     collect_static
     
+    # Métricas agregadas entre os workers do gunicorn
+    reset_metrics
+    
+    # Rotação dos arquivos de log (os workers só reabrem o arquivo)
+    start_logrotate
+    
     # Iniciar servidor
     echo "Iniciando servidor Django..."
     exec gunicorn setup.wsgi:application \
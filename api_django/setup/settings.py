@@ -60,6 +60,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # Middlewares base
 MIDDLEWARE_BASE = [
     'corsheaders.middleware.CorsMiddleware',
+    'controle.instrumentacao.InstrumentacaoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -68,6 +69,11 @@ MIDDLEWARE_BASE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'controle.consultas_lentas.ConsultasLentasMiddleware',
+    'controle.metricas.MetricasMiddleware',
+    'controle.auditoria.AuditoriaMiddleware',
+    'controle.cache.CachePorUsuarioMiddleware',
+    'controle.perfilamento.PerfilamentoMiddleware',
 ]
 
 # Middlewares de cache (APENAS para GET em produção)
@@ -78,7 +84,7 @@ CACHE_MIDDLEWARE = [
 
 # Configurar MIDDLEWARE baseado no ambiente
 if not DEBUG:  # Produção
-    MIDDLEWARE = MIDDLEWARE_BASE[:4] + CACHE_MIDDLEWARE + MIDDLEWARE_BASE[4:]
+    MIDDLEWARE = MIDDLEWARE_BASE[:5] + CACHE_MIDDLEWARE + MIDDLEWARE_BASE[5:]
 else:  # Desenvolvimento
     MIDDLEWARE = MIDDLEWARE_BASE
 
@@ -222,14 +228,26 @@ TIME_INPUT_FORMATS = [
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
-# Para produção no Render
-STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
-
-
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Anexos deduplicados por conteúdo (hard links para media/_blobs)
+ARMAZENAMENTO_DEDUPLICADO = config('ARMAZENAMENTO_DEDUPLICADO', cast=bool, default=True)
+
+STORAGES = {
+    'default': {
+        'BACKEND': (
+            'controle.storage.ArmazenamentoDeduplicado' if ARMAZENAMENTO_DEDUPLICADO
+            else 'django.core.files.storage.FileSystemStorage'
+        ),
+    },
+    # Para produção no Render
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -250,6 +268,11 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'controle.anexos.MultiPartPoliticaParser',
+    ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DATETIME_FORMAT': '%Y-%m-%dT%H:%M:%S.%fZ',
     'DATETIME_INPUT_FORMATS': [
@@ -379,7 +402,103 @@ CACHE_MIDDLEWARE_SECONDS_DELETE = 0  # SEM cache para DELETE
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Política de anexos (controle/anexos.py), aplicada durante a leitura do upload pelo
+# MultiPartPoliticaParser do DRF; FILE_UPLOAD_HANDLERS fica no padrão do Django
+ANEXO_TAMANHO_MAX = config('ANEXO_TAMANHO_MAX', cast=int, default=500 * 1024 * 1024)  # teto geral; cada tipo tem o seu
+
+# Upload em partes (retomável) para anexos grandes
+# Cada parte cabe no limite de corpo do nginx; o arquivo parcial fica fora do MEDIA_ROOT
+UPLOAD_PARCIAL_DIR = config('UPLOAD_PARCIAL_DIR', default=os.path.join(BASE_DIR, 'uploads_parciais'))
+UPLOAD_PARTE_TAMANHO_MAX = config('UPLOAD_PARTE_TAMANHO_MAX', cast=int, default=5 * 1024 * 1024)  # 5MB
+UPLOAD_TAMANHO_MAX = config('UPLOAD_TAMANHO_MAX', cast=int, default=2 * 1024 * 1024 * 1024)  # 2GB
+
+# Destino padrão do backup_incremental / restaurar_backup
+BACKUP_DIR = config('BACKUP_DIR', default=os.path.join(BASE_DIR, 'backups'))
+
+# Arquivos órfãos movidos pelo limpar_arquivos_orfaos --quarentena (fora do MEDIA_ROOT)
+ARQUIVOS_QUARENTENA_DIR = config('ARQUIVOS_QUARENTENA_DIR', default=os.path.join(BASE_DIR, 'quarentena'))
+
+# Miniaturas/previews de anexos gerados em segundo plano
+MINIATURAS_ASSINCRONO = config('MINIATURAS_ASSINCRONO', cast=bool, default=True)
+MINIATURAS_WORKERS = config('MINIATURAS_WORKERS', cast=int, default=2)
+
+# Download protegido de anexos: com X-Accel-Redirect o Django só autoriza e o
+# nginx envia o arquivo (location internal em DOWNLOAD_X_ACCEL_PREFIX)
+DOWNLOAD_X_ACCEL = config('DOWNLOAD_X_ACCEL', cast=bool, default=False)
+DOWNLOAD_X_ACCEL_PREFIX = config('DOWNLOAD_X_ACCEL_PREFIX', default='/media-protegida/')
+
+# Máximo de OS por pacote ZIP de anexos via API (seleções maiores: comando gerar_pacote_anexos)
+PACOTE_ANEXOS_MAX_OS = config('PACOTE_ANEXOS_MAX_OS', cast=int, default=200)
+
+# OS concluídas/canceladas sem alteração há mais meses que isso vão para o arquivo (comando arquivar_os)
+ARQUIVAMENTO_MESES = config('ARQUIVAMENTO_MESES', cast=int, default=24)
+
+# Particionamento por created_at das tabelas filhas de maior volume (só PostgreSQL): a conversão é
+# manual (particoes --converter ano|mes --confirmar); o comando particoes (cron) cria as partições
+# dos próximos PARTICIONAMENTO_ANTECEDENCIA períodos das tabelas já convertidas
+PARTICIONAMENTO_ANTECEDENCIA = config('PARTICIONAMENTO_ANTECEDENCIA', cast=int, default=3)
+
+# Instrumentação por requisição (consultas SQL, tempos, tamanho da resposta)
+# Server-Timing só em desenvolvimento; em produção, histogramas por rota em /api/instrumentacao/
+INSTRUMENTACAO = config('INSTRUMENTACAO', cast=bool, default=True)
+INSTRUMENTACAO_SERVER_TIMING = config('INSTRUMENTACAO_SERVER_TIMING', cast=bool, default=DEBUG)
+# Máximo de consultas por rota ('MÉTODO nome-da-url' ou 'nome-da-url'); acima disso: log ou erro
+INSTRUMENTACAO_ORCAMENTOS = {
+    'GET registroos-list': 25,
+    'GET registroos-detail': 40,
+    'estatisticas': 20,
+    'perfil': 10,
+    'authentication:configuracoes_listar_usuarios': 5,
+    'authentication:listar_usuarios': 5,
+}
+INSTRUMENTACAO_ORCAMENTO_PADRAO = None
+INSTRUMENTACAO_ORCAMENTO_ACAO = config('INSTRUMENTACAO_ORCAMENTO_ACAO', default='log')  # 'erro' nos testes (BaseTestCase)
+
+# Log de consultas lentas (linhas JSON em arquivo rotativo; resumo: comando consultas_lentas)
+# AMOSTRAGEM é a fração das consultas lentas registradas; EXPLAIN grava o plano da primeira ocorrência
+CONSULTAS_LENTAS = config('CONSULTAS_LENTAS', cast=bool, default=True)
+CONSULTAS_LENTAS_LIMITE_MS = config('CONSULTAS_LENTAS_LIMITE_MS', cast=float, default=200)
+CONSULTAS_LENTAS_AMOSTRAGEM = config('CONSULTAS_LENTAS_AMOSTRAGEM', cast=float, default=1.0)
+CONSULTAS_LENTAS_EXPLAIN = config('CONSULTAS_LENTAS_EXPLAIN', cast=bool, default=True)
+CONSULTAS_LENTAS_ARQUIVO = config('CONSULTAS_LENTAS_ARQUIVO', default=os.path.join(BASE_DIR, 'consultas_lentas.log'))
+
+# Métricas Prometheus em /metrics. Com vários workers do gunicorn, cada um grava um retrato em
+# METRICAS_DIRETORIO e /metrics soma todos; vazio = só o processo que atende. /metrics exige
+# 'Authorization: Bearer <METRICAS_TOKEN>'; sem token configurado responde 403
+METRICAS = config('METRICAS', cast=bool, default=True)
+METRICAS_DIRETORIO = config('METRICAS_DIRETORIO', default='')
+METRICAS_INTERVALO_GRAVACAO = config('METRICAS_INTERVALO_GRAVACAO', cast=float, default=5)
+METRICAS_TOKEN = config('METRICAS_TOKEN', default='')
+# Rotas de exportação (nome da URL -> tipo) com duração medida até o fim do download
+METRICAS_EXPORTACOES = {
+    'authentication:relatorios_exportar_excel': 'excel',
+    'authentication:relatorios_exportar_pdf': 'pdf',
+    'registroos-anexos-zip': 'zip_os',
+    'registroos-anexos-zip-lote': 'zip_lote',
+}
+
+# Perfilamento por amostragem (controle/perfilamento.py; flamegraphs: comando flamegraph). Administradores
+# pedem com o cabeçalho 'X-Perfilar: 1'; AMOSTRAGEM é a fração de todas as requisições perfiladas
+PERFILAMENTO = config('PERFILAMENTO', cast=bool, default=True)
+PERFILAMENTO_AMOSTRAGEM = config('PERFILAMENTO_AMOSTRAGEM', cast=float, default=0.0)
+PERFILAMENTO_INTERVALO_MS = config('PERFILAMENTO_INTERVALO_MS', cast=float, default=5)
+PERFILAMENTO_DIRETORIO = config('PERFILAMENTO_DIRETORIO', default=os.path.join(BASE_DIR, 'perfis'))
+
+# Limite de linhas por requisição no preview de valores em lote
+PREVIEW_VALORES_MAX_LINHAS = config('PREVIEW_VALORES_MAX_LINHAS', cast=int, default=500)
+
 # Logging configuration
+# Arquivos em JSON (uma linha por registro). Com LOG_ASSINCRONO, os loggers de LOGGING['fila'] só
+# enfileiram; um QueueListener por processo grava em disco (controle/logs.py). Os workers do gunicorn
+# gravam nos mesmos arquivos em modo append, então a rotação é externa (scripts/logrotate-controle-os.conf):
+# o WatchedFileHandler reabre o arquivo quando ele é renomeado; uma rotação dentro de cada processo
+# renomearia o arquivo em que os outros ainda gravam.
+# LOG_AMOSTRAGEM_INFO é a fração dos INFO de controle/controle.views mantida (WARNING+ sempre)
+LOG_ASSINCRONO = config('LOG_ASSINCRONO', cast=bool, default=True)
+LOG_AMOSTRAGEM_INFO = config('LOG_AMOSTRAGEM_INFO', cast=float, default=1.0)
+LOG_TAMANHO_FILA = config('LOG_TAMANHO_FILA', cast=int, default=10000)
+
+LOGGING_CONFIG = 'controle.logs.configurar_logging'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -388,6 +507,10 @@ LOGGING = {
             'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
             'style': '{',
         },
+        'mensagem': {
+            'format': '{message}',
+            'style': '{',
+        },
         'simple': {
             'format': '{levelname} {message}',
             'style': '{',
@@ -397,11 +520,18 @@ LOGGING = {
             'style': '{',
             'datefmt': '%Y-%m-%d %H:%M:%S',
         },
+        'json': {
+            '()': 'controle.logs.FormatadorJSON',
+        },
     },
     'filters': {
         'require_debug_true': {
             '()': 'django.utils.log.RequireDebugTrue',
         },
+        'amostragem_info': {
+            '()': 'controle.logs.FiltroAmostragem',
+            'taxa': LOG_AMOSTRAGEM_INFO,
+        },
     },
     'handlers': {
         'console': {
@@ -412,21 +542,27 @@ LOGGING = {
         },
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'logging.handlers.WatchedFileHandler',
             'filename': os.path.join(BASE_DIR, 'django.log'),
-            'formatter': 'detailed',
+            'formatter': 'json',
         },
         'os_file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'logging.handlers.WatchedFileHandler',
             'filename': os.path.join(BASE_DIR, 'os_operations.log'),
-            'formatter': 'detailed',
+            'formatter': 'json',
         },
         'webhook_file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'logging.handlers.WatchedFileHandler',
             'filename': os.path.join(BASE_DIR, 'webhooks.log'),
-            'formatter': 'detailed',
+            'formatter': 'json',
+        },
+        'consultas_lentas_file': {
+            'level': 'INFO',
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': CONSULTAS_LENTAS_ARQUIVO,
+            'formatter': 'mensagem',
         },
     },
     'loggers': {
@@ -436,6 +572,7 @@ LOGGING = {
         },
         'controle': {
             'handlers': ['console', 'os_file'],
+            'filters': ['amostragem_info'],
             'level': 'INFO',
             'propagate': False,
         },
@@ -444,8 +581,14 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'controle.consultas_lentas': {
+            'handlers': ['consultas_lentas_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'controle.views': {
             'handlers': ['console', 'os_file'],
+            'filters': ['amostragem_info'],
             'level': 'INFO',
             'propagate': False,
         },
@@ -454,5 +597,11 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'WARNING',
     },
+    # Lido por controle.logs.configurar_logging (não faz parte do dictConfig)
+    'fila': {
+        'ativa': LOG_ASSINCRONO,
+        'tamanho': LOG_TAMANHO_FILA,
+        'loggers': ['', 'django', 'controle', 'controle.webhooks', 'controle.views', 'controle.consultas_lentas'],
+    },
 }
 
@@ -1,13 +1,20 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 
+from controle.views import health_view, metricas_view, ready_view
+
 urlpatterns = [
     # Admin
     path('admin/', admin.site.urls),
     
+    # Saúde e métricas (com ou sem barra final: usados por scripts e pelo Prometheus)
+    re_path(r'^health/?$', health_view, name='health'),
+    re_path(r'^ready/?$', ready_view, name='ready'),
+    re_path(r'^metrics/?$', metricas_view, name='metrics'),
+    
     # API v1
     path('api/auth/', include('authentication.urls')),
     path('api/', include('controle.urls')),
@@ -408,7 +408,11 @@ export default function AccordionFormset({
                          onClick={() => {
                            // O backend retorna caminhos relativos, adicionar /media/ para formar URL completa
                            let fullUrl;
-                           if (fieldValue.startsWith('http')) {
+                           const downloadUrl = item[`${field.name}_url`];
+                           if (downloadUrl) {
+                             // Rota protegida de download (o /media/ não é público)
+                             fullUrl = new URL(downloadUrl, import.meta.env.VITE_API_URL).href;
+                           } else if (fieldValue.startsWith('http')) {
                              fullUrl = fieldValue;
                            } else if (fieldValue.startsWith('/media/')) {
                              // Corrigido: agora utiliza a variável de ambiente para montar a URL absoluta
@@ -55,55 +55,28 @@ check_docker() {
 # Criar diretório de backup se não existir
 create_backup_dir() {
     print_message "Criando diretório de backup..."
-    mkdir -p backups
+    mkdir -p backups/incremental
     print_message "Diretório de backup criado!"
 }
 
-# Backup do banco de dados
-backup_database() {
-    print_message "Fazendo backup do banco de dados..."
-    
-    if docker-compose -f docker-compose.vps.yml ps db | grep -q "Up"; then
-        BACKUP_FILE="backup_db_$(date +%Y%m%d_%H%M%S).sql"
-        BACKUP_PATH="backups/$BACKUP_FILE"
-        
-        docker-compose -f docker-compose.vps.yml exec -T db pg_dump -U postgres controle_registro_prod > "$BACKUP_PATH"
-        
-        if [ $? -eq 0 ]; then
-            print_message "✅ Backup do banco salvo em: $BACKUP_PATH"
-            
-            # Comprimir backup
-            gzip "$BACKUP_PATH"
-            print_message "✅ Backup comprimido: ${BACKUP_PATH}.gz"
-        else
-            print_error "❌ Erro ao fazer backup do banco"
-            return 1
-        fi
-    else
-        print_error "❌ Banco de dados não está rodando"
-        return 1
-    fi
-}
-
-# Backup dos arquivos de mídia
-backup_media() {
-    print_message "Fazendo backup dos arquivos de mídia..."
+# Backup do banco (pg_dump paralelo) e da mídia (incremental)
+# Arquivos de mídia sem alteração desde o último backup não são lidos de novo
+backup_incremental() {
+    print_message "Fazendo backup incremental do banco e da mídia..."
     
     if docker-compose -f docker-compose.vps.yml ps backend | grep -q "Up"; then
-        MEDIA_BACKUP_FILE="backup_media_$(date +%Y%m%d_%H%M%S).tar.gz"
-        MEDIA_BACKUP_PATH="backups/$MEDIA_BACKUP_FILE"
-        
-        docker-compose -f docker-compose.vps.yml exec -T backend tar -czf /tmp/media_backup.tar.gz -C /app media/
-        docker cp $(docker-compose -f docker-compose.vps.yml ps -q backend):/tmp/media_backup.tar.gz "$MEDIA_BACKUP_PATH"
+        docker-compose -f docker-compose.vps.yml exec -T backend \
+            python manage.py backup_incremental --destino /app/backups --workers "${BACKUP_WORKERS:-4}"
         
         if [ $? -eq 0 ]; then
-            print_message "✅ Backup de mídia salvo em: $MEDIA_BACKUP_PATH"
+            print_message "✅ Backup incremental salvo em: backups/incremental"
         else
-            print_error "❌ Erro ao fazer backup de mídia"
+            print_error "❌ Erro no backup incremental"
             return 1
         fi
     else
-        print_warning "⚠️ Backend não está rodando, pulando backup de mídia"
+        print_error "❌ Backend não está rodando"
+        return 1
     fi
 }
 
@@ -194,13 +167,11 @@ show_backup_info() {
     echo ""
     
     # Contar backups por tipo
-    DB_BACKUPS=$(find backups/ -name "backup_db_*.sql.gz" | wc -l)
-    MEDIA_BACKUPS=$(find backups/ -name "backup_media_*.tar.gz" | wc -l)
+    INCREMENTAL_BACKUPS=$(find backups/incremental/ -mindepth 2 -maxdepth 2 -name "manifesto.json" | wc -l)
     STATIC_BACKUPS=$(find backups/ -name "backup_static_*.tar.gz" | wc -l)
     CONFIG_BACKUPS=$(find backups/ -name "backup_config_*.tar.gz" | wc -l)
     
-    echo "  📊 Backups de banco: $DB_BACKUPS"
-    echo "  📁 Backups de mídia: $MEDIA_BACKUPS"
+    echo "  📊 Backups incrementais (banco + mídia): $INCREMENTAL_BACKUPS"
     echo "  🎨 Backups de estáticos: $STATIC_BACKUPS"
     echo "  ⚙️ Backups de configuração: $CONFIG_BACKUPS"
     echo ""
@@ -226,8 +197,7 @@ main() {
     create_backup_dir
     
     # Fazer backups
-    backup_database
-    backup_media
+    backup_incremental
     backup_static
     backup_config
     